@@ -0,0 +1 @@
+"""Throughput and latency benchmarks for the staging pipelines (see benchmarks/run.py)."""
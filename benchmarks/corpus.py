@@ -0,0 +1,134 @@
+"""
+Synthetic staging corpus for the benchmarks.
+
+Notes are derived from example.txt: its diagnosis and primary site are swapped
+for those of other cancer types, and its length is scaled by truncating it or
+appending interval-history sections built from its own text. stub_rules()
+returns the matching canned responses for the stub LLM, so every note is
+identified as its cancer type and staged with one of that type's valid stages.
+"""
+
+import os
+import re
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Diagnosis phrase, Toronto category (None if not covered) and primary site of each variant
+CANCER_VARIANTS = [
+    ("Wilms tumor (nephroblastoma)", "Wilms Tumor (Renal Tumors)", "left kidney"),
+    ("classical Hodgkin lymphoma", "Hodgkin Lymphoma", "left cervical lymph nodes"),
+    ("Burkitt lymphoma", "Non-Hodgkin Lymphoma", "ileocecal region"),
+    ("neuroblastoma", "Neuroblastoma", "left adrenal gland"),
+    ("embryonal rhabdomyosarcoma", "Rhabdomyosarcoma", "left orbit"),
+    ("osteosarcoma", "Bone Tumors", "left distal femur"),
+    ("hepatoblastoma", "Hepatoblastoma", "right hepatic lobe"),
+    ("retinoblastoma", "Retinoblastoma", "left eye"),
+    ("medulloblastoma", "Medulloblastoma (CNS Embryonal Tumors)", "posterior fossa"),
+    ("melanoma", None, "left forearm"),
+]
+
+DEFAULT_BASE_NOTE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example.txt")
+
+_DIAGNOSIS = re.compile(r"Wilms tumor \(nephroblastoma\)|Wilms tumor", re.IGNORECASE)
+_SITE = re.compile(r"left kidney|left abdominal", re.IGNORECASE)
+
+def make_note(base: str, variant: Tuple[str, Optional[str], str], scale: float, rng: random.Random) -> str:
+    """
+    Derive one synthetic note from the base note.
+
+    Args:
+        base: Text of the base note (example.txt)
+        variant: Entry of CANCER_VARIANTS
+        scale: Target length relative to the base note
+        rng: Random generator choosing the appended sections
+
+    Returns:
+        str: The note text
+    """
+    diagnosis, _, site = variant
+    note = _SITE.sub(site, _DIAGNOSIS.sub(diagnosis, base))
+    if scale < 1:
+        # Keep whole paragraphs; the diagnosis is stated in the clinical summary near the top
+        target = int(len(note) * scale)
+        cut = note.rfind("\n\n", 0, target)
+        return note[:cut if cut > 0 else target]
+
+    paragraphs = [paragraph for paragraph in note.split("\n\n") if paragraph.strip()]
+    parts = [note]
+    day = 1
+    while sum(len(part) for part in parts) < len(note) * scale:
+        day += rng.randint(3, 14)
+        parts.append(f"**Interval History (day {day}):**\n" + "\n\n".join(rng.sample(paragraphs, min(3, len(paragraphs)))))
+    return "\n\n".join(parts)
+
+def make_corpus(size: int, scales: Sequence[float] = (0.5, 1.0, 4.0), seed: int = 0,
+                base_path: str = DEFAULT_BASE_NOTE) -> List[Dict[str, Any]]:
+    """
+    Build a synthetic corpus cycling through the cancer variants and length scales.
+
+    Args:
+        size: Number of notes
+        scales: Note lengths relative to the base note
+        seed: Seed making the corpus reproducible
+        base_path: The base note
+
+    Returns:
+        List of {"note_id", "text", "category", "scale"} dicts
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = f.read()
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(size):
+        variant = CANCER_VARIANTS[index % len(CANCER_VARIANTS)]
+        scale = scales[(index // len(CANCER_VARIANTS)) % len(scales)]
+        corpus.append({
+            "note_id": f"note-{index:05d}",
+            "text": make_note(base, variant, scale, rng),
+            "category": variant[1],
+            "scale": scale,
+        })
+    return corpus
+
+def stub_rules(knowledge_base) -> List[Dict[str, Any]]:
+    """
+    Canned stub LLM responses matching the corpus (see src.stub_llm_server).
+
+    Args:
+        knowledge_base: StagingKnowledgeBase giving each category's criteria and stages
+
+    Returns:
+        List of stub response rules
+    """
+    rules = []
+    for diagnosis, category, site in CANCER_VARIANTS:
+        rules.append({
+            "tool": "CancerIdentification",
+            "match": re.escape(diagnosis),
+            "arguments": {
+                "cancer_type": diagnosis,
+                "standardized_category": category,
+                "is_covered_by_toronto": category is not None,
+                "primary_site": site,
+                "metastasis_sites": "None identified",
+                "extracted_stage": "Not mentioned",
+            },
+        })
+        if category is None:
+            continue
+
+        criteria = [{"criterion": criterion, "status": "absent", "evidence": ""}
+                    for criterion in knowledge_base.criteria(category)]
+        stage = knowledge_base.stages(category)[0]
+        match = re.escape(f"Toronto staging criteria for {category}:")
+        explanation = f"No criteria for a higher stage of {category} are present."
+        rules.extend([
+            {"tool": "StagingCriteriaAnalysis", "match": match,
+             "arguments": {"criteria": criteria, "summary": "Localized disease."}},
+            {"tool": "StageAssignment", "match": match, "arguments": {"stage": stage, "explanation": explanation}},
+            {"tool": "StagingDetermination", "match": match,
+             "arguments": {"criteria": criteria, "summary": "Localized disease.", "stage": stage,
+                           "explanation": explanation}},
+        ])
+    rules.append({"match": "", "content": "Cancer Staging Report\n\nSynthetic report from the stub LLM."})
+    return rules
@@ -0,0 +1,369 @@
+"""
+End-to-end staging benchmark against the stub LLM.
+
+Stages a synthetic corpus (see benchmarks/corpus.py) through the pipelines and
+reports notes per second, per-node and per-note latency percentiles, tokens
+per note, peak RSS and startup time as JSON, for comparison between commits:
+
+    python -m benchmarks.run --notes 60 --latency lognormal:0.3,0.4 --output bench.json
+    git checkout other-branch
+    python -m benchmarks.run --notes 60 --latency lognormal:0.3,0.4 --compare bench.json
+
+Pipelines:
+
+- sync: process_medical_note() on a thread pool
+- async: astage_corpus() on one event loop
+- crewai: PediatricCancerStaging.process_multiple_notes() (skipped if CrewAI
+  cannot be imported)
+
+The stub runs as a local HTTP server (--llm http, default) so connection
+pooling and serialization are measured, or in-process (--llm local).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from .corpus import make_corpus, stub_rules
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIPELINES = ("sync", "async", "crewai")
+
+# Metrics where a larger value is better; every other compared metric is better smaller
+HIGHER_IS_BETTER = {"notes_per_sec"}
+
+class NodeTimer(BaseCallbackHandler):
+    """Callback handler recording the wall time of every LangGraph node run"""
+
+    def __init__(self):
+        self._starts = {}
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # The node's own run, not the runnables nested inside it (some share the node's name)
+        if (node and node != "__start__" and kwargs.get("name") == node
+                and parent_run_id not in self._starts):
+            self._starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            self.durations[started[0]].append(time.perf_counter() - started[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+_NODE_TIMER: ContextVar[Optional[NodeTimer]] = ContextVar("benchmark_node_timer", default=None)
+register_configure_hook(_NODE_TIMER, inheritable=True)
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Return the count, mean and nearest-rank p50/p95/p99 of a list of seconds"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {"count": len(ordered), "mean": sum(ordered) / len(ordered),
+            "p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99)}
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def measure_startup(runs: int = 3) -> Dict[str, float]:
+    """
+    Measure the time a fresh process takes until the staging graph is ready.
+
+    Returns:
+        Dict with the best wall time of the whole process ("process_s") and of the
+        import and graph compilation inside it ("ready_s")
+    """
+    code = ("import time; start = time.perf_counter(); "
+            "from src.cancer_staging_graph import get_cancer_staging_graph; get_cancer_staging_graph(); "
+            "print(time.perf_counter() - start)")
+    process_times, ready_times = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True)
+        process_times.append(time.perf_counter() - start)
+        if output.returncode != 0:
+            logger.warning(f"Startup measurement failed: {output.stderr.strip().splitlines()[-1:]}")
+            return {"process_s": None, "ready_s": None}
+        ready_times.append(float(output.stdout.strip().splitlines()[-1]))
+    return {"process_s": min(process_times), "ready_s": min(ready_times)}
+
+def _token_totals() -> Dict[str, int]:
+    from src.token_usage import get_token_usage_tracker
+    return get_token_usage_tracker().stats()["total"]
+
+def _summarize_run(corpus, started, note_times, failures, timer, tokens_before) -> Dict[str, Any]:
+    """Build the metrics of one pipeline run"""
+    elapsed = time.perf_counter() - started
+    tokens = _token_totals()
+    staged = len(corpus) - failures
+
+    def per_note(counter):
+        return (tokens[counter] - tokens_before[counter]) / staged if staged else None
+
+    return {
+        "notes": len(corpus),
+        "failures": failures,
+        "elapsed_s": elapsed,
+        "notes_per_sec": staged / elapsed if elapsed else None,
+        "note_latency": percentiles(note_times),
+        "node_latency": {node: percentiles(durations) for node, durations in sorted(timer.durations.items())},
+        "llm_calls_per_note": per_note("calls"),
+        "input_tokens_per_note": per_note("input_tokens"),
+        "cached_tokens_per_note": per_note("cached_tokens"),
+        "output_tokens_per_note": per_note("output_tokens"),
+    }
+
+def run_sync(corpus, concurrency: int) -> Dict[str, Any]:
+    """Stage the corpus with process_medical_note() on a thread pool"""
+    from src.cancer_staging_graph import process_medical_note
+
+    timer = NodeTimer()
+    _NODE_TIMER.set(timer)
+    tokens_before = _token_totals()
+
+    def stage(note):
+        start = time.perf_counter()
+        process_medical_note(note["text"], thread_id=f"sync-{note['note_id']}", verbose=False)
+        return time.perf_counter() - start
+
+    note_times, failures = [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Each worker runs in a copy of this context so the node timer is seen by the graph
+        futures = [executor.submit(contextvars.copy_context().run, stage, note) for note in corpus]
+        for future in futures:
+            try:
+                note_times.append(future.result())
+            except Exception as e:
+                logger.warning(f"Note failed: {e}")
+                failures += 1
+    result = _summarize_run(corpus, started, note_times, failures, timer, tokens_before)
+    _NODE_TIMER.set(None)
+    return result
+
+def run_async(corpus, concurrency: int) -> Dict[str, Any]:
+    """Stage the corpus with astage_corpus() on one event loop"""
+    from src.cancer_staging_graph import astage_corpus
+    from src.azure_openai_config import ashutdown_llm_clients
+
+    timer = NodeTimer()
+    tokens_before = _token_totals()
+
+    async def stage_all():
+        _NODE_TIMER.set(timer)
+        starts, note_times, failures = {}, [], 0
+
+        def notes():
+            # astage_corpus pulls a note when a slot frees up, so this is when its staging starts
+            for note in corpus:
+                starts[note["note_id"]] = time.perf_counter()
+                yield note["note_id"], note["text"]
+
+        async for note_id, _, error in astage_corpus(notes(), max_concurrency=concurrency):
+            if error is not None:
+                failures += 1
+            else:
+                note_times.append(time.perf_counter() - starts[note_id])
+        # The pooled async client belongs to this loop, so close it before the loop goes away
+        await ashutdown_llm_clients()
+        return note_times, failures
+
+    started = time.perf_counter()
+    note_times, failures = asyncio.run(stage_all())
+    return _summarize_run(corpus, started, note_times, failures, timer, tokens_before)
+
+def run_crewai(corpus) -> Dict[str, Any]:
+    """Stage the corpus with the CrewAI pipeline, or report why it was skipped"""
+    try:
+        from src.staging_module import PediatricCancerStaging
+    except ImportError as e:
+        return {"skipped": f"CrewAI pipeline unavailable: {e}"}
+
+    timer = NodeTimer()
+    tokens_before = _token_totals()
+    with tempfile.TemporaryDirectory() as note_dir:
+        for note in corpus:
+            with open(os.path.join(note_dir, f"{note['note_id']}.txt"), "w", encoding="utf-8") as f:
+                f.write(note["text"])
+        staging = PediatricCancerStaging(staging_data_path=os.path.join(REPO_ROOT, "toronto_staging.json"),
+                                         model=os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini"))
+        started = time.perf_counter()
+        staging.process_multiple_notes(note_dir, os.path.join(note_dir, "results.csv"))
+    # process_multiple_notes() logs and skips failed notes, so every note counts as staged
+    return _summarize_run(corpus, started, [], 0, timer, tokens_before)
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _configure_stub(args, rules_path: str):
+    """Point the LLM backend at the stub; return the HTTP server to shut down, if any"""
+    from src.stub_llm_server import StubResponder, serve_in_thread
+
+    os.environ.setdefault("AZURE_RETRY_BASE_DELAY", "0.05")
+    if args.llm == "local":
+        os.environ.update(STAGING_LLM_BACKEND="local", STAGING_STUB_RESPONSES=rules_path,
+                          STAGING_STUB_LATENCY=args.latency or "", STAGING_STUB_ERROR_RATE=str(args.error_rate),
+                          STAGING_STUB_SEED=str(args.seed))
+        return None
+    responder = StubResponder.from_file(rules_path, latency=args.latency, error_rate=args.error_rate,
+                                        retry_after=0.1, seed=args.seed)
+    server, base_url = serve_in_thread(responder)
+    os.environ.update(STAGING_LLM_BACKEND="openai", OPENAI_BASE_URL=f"{base_url}/v1")
+    return server
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare two benchmark results.
+
+    Prints a table of the headline metrics and returns the regressions: metrics
+    worse than the baseline by more than threshold (a fraction).
+
+    Returns:
+        List of regression descriptions
+    """
+    rows = [("startup.process_s", current["startup"].get("process_s"), baseline["startup"].get("process_s")),
+            ("peak_rss_mb", current.get("peak_rss_mb"), baseline.get("peak_rss_mb"))]
+    for name, metrics in current["pipelines"].items():
+        base = baseline.get("pipelines", {}).get(name)
+        if not base or "skipped" in metrics or "skipped" in base:
+            continue
+        rows.append((f"{name}.notes_per_sec", metrics["notes_per_sec"], base["notes_per_sec"]))
+        rows.append((f"{name}.note_latency.p95", metrics["note_latency"]["p95"], base["note_latency"]["p95"]))
+        rows.append((f"{name}.input_tokens_per_note", metrics["input_tokens_per_note"], base["input_tokens_per_note"]))
+        for node, latency in metrics["node_latency"].items():
+            base_latency = base["node_latency"].get(node)
+            if base_latency:
+                rows.append((f"{name}.{node}.p95", latency["p95"], base_latency["p95"]))
+
+    regressions = []
+    print(f"{'metric':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric, value, base_value in rows:
+        if value is None or not base_value:
+            continue
+        change = (value - base_value) / base_value
+        worse = -change if metric.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{metric:<45} {base_value:>12.4g} {value:>12.4g} {change:>+7.1%}{flag}")
+        if flag:
+            regressions.append(f"{metric}: {base_value:.4g} -> {value:.4g} ({change:+.1%})")
+    return regressions
+
+def main(argv=None):
+    """Run the benchmark and write (and optionally compare) its JSON result"""
+    parser = argparse.ArgumentParser(description="Benchmark the staging pipelines against the stub LLM")
+    parser.add_argument("--notes", type=int, default=30, help="Notes in the synthetic corpus")
+    parser.add_argument("--scales", default="0.5,1,4", help="Note lengths relative to example.txt")
+    parser.add_argument("--pipelines", default="sync,async", help=f"Comma-separated subset of {','.join(PIPELINES)}")
+    parser.add_argument("--concurrency", type=int, default=8, help="Notes staged at the same time")
+    parser.add_argument("--llm", choices=["http", "local"], default="http",
+                        help="Run the stub LLM as a local HTTP server or in-process")
+    parser.add_argument("--latency", default="lognormal:0.2,0.3", help="Stub latency distribution (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests failing with 429")
+    parser.add_argument("--mode", choices=["fast", "audit"], help="Graph mode (default: STAGING_GRAPH_MODE or audit)")
+    parser.add_argument("--preclassifier", choices=["off", "shadow", "on"], help="Pre-classifier mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-runs", type=int, default=3, help="Fresh processes timed for startup (0 to skip)")
+    parser.add_argument("--output", default="benchmark.json", help="File to write the JSON result to")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change counted as a regression in --compare (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    sys.path.insert(0, REPO_ROOT)
+    pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    unknown = set(pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"Unknown pipelines: {', '.join(sorted(unknown))}")
+    if args.mode:
+        os.environ["STAGING_GRAPH_MODE"] = args.mode
+    if args.preclassifier:
+        os.environ["STAGING_PRECLASSIFIER"] = args.preclassifier
+
+    # Startup is measured first, in fresh processes, before this one warms any cache
+    startup = measure_startup(args.startup_runs) if args.startup_runs > 0 else {}
+
+    from src.knowledge_base import get_staging_kb
+    corpus = make_corpus(args.notes, [float(scale) for scale in args.scales.split(",")], args.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        rules_path = os.path.join(work_dir, "stub_responses.json")
+        with open(rules_path, "w", encoding="utf-8") as f:
+            json.dump(stub_rules(get_staging_kb()), f)
+        server = _configure_stub(args, rules_path)
+        try:
+            results = {}
+            for name in pipelines:
+                print(f"Running {name} pipeline on {len(corpus)} notes...")
+                if name == "sync":
+                    results[name] = run_sync(corpus, args.concurrency)
+                elif name == "async":
+                    results[name] = run_async(corpus, args.concurrency)
+                else:
+                    results[name] = run_crewai(corpus)
+                if "skipped" in results[name]:
+                    print(f"  {results[name]['skipped']}")
+                else:
+                    print(f"  {results[name]['notes_per_sec']:.2f} notes/s, {results[name]['failures']} failed")
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "startup": startup,
+        "peak_rss_mb": peak_rss_mb(),
+        "pipelines": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
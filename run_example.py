@@ -2,6 +2,12 @@
 Run the LangGraph-based cancer staging module on a medical note.
 """
 
+import time
+
+# Startup phases reported by --profile-startup, timed from the first import
+_STARTUP_STARTED = time.perf_counter()
+STARTUP_TIMINGS = {}
+
 import os
 import sys
 import argparse
@@ -9,10 +15,18 @@ import csv
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-from src.azure_openai_config import configure_azure_openai
-from src.cancer_staging_graph import process_medical_note
+from src.azure_openai_config import configure_azure_openai, get_chat_model
+from src.llm_backends import LLMConfigurationError
+from src.cancer_staging_graph import process_medical_note, get_cancer_staging_graph
+from src.batch import iter_note_paths, run_batch, StreamingCsvWriter
+from src.run_ledger import RunLedger, hash_note
+from src.token_usage import get_token_usage_tracker
+from src.node_metrics import get_metrics_registry, total_node_metrics
+from src.batch_identify import identify_notes
 import datetime
 
+STARTUP_TIMINGS['imports'] = time.perf_counter() - _STARTUP_STARTED
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,39 +35,98 @@ logging.basicConfig(
 logger = logging.getLogger("cancer_staging_app")
 
 # Load environment variables
+_started = time.perf_counter()
 load_dotenv()
+STARTUP_TIMINGS['load .env'] = time.perf_counter() - _started
 logger.info("Environment variables loaded from .env file")
 
-# Disable CrewAI telemetry (no longer needed with LangGraph)
-from crewai.telemetry import Telemetry
+# Columns of the results CSV
+CSV_FIELDNAMES = [
+    'Medical Note', 
+    'Cancer Type', 
+    'Standardized Category', 
+    'Primary Site',
+    'Extracted Stage', 
+    'Calculated Stage',
+    'Sites of Metastasis',
+    'Covered by Toronto',
+    'Date Processed'
+]
 
-def noop(*args, **kwargs):
-    pass
-
-def disable_crewai_telemetry():
-    for attr in dir(Telemetry):
-        if callable(getattr(Telemetry, attr)) and not attr.startswith("__"):
-            setattr(Telemetry, attr, noop)
-
-# Disable the telemetry
-disable_crewai_telemetry()
-logger.info("CrewAI telemetry disabled")
+# Extra columns written with --metrics-columns: per-note totals of the node metrics
+METRICS_CSV_FIELDNAMES = [
+    'Wall Time (s)',
+    'Queue Wait (s)',
+    'LLM Calls',
+    'Prompt Tokens',
+    'Cached Prompt Tokens',
+    'Completion Tokens',
+    'Response Cache Hits',
+    'Retries',
+    'Estimated Cost (USD)',
+    'Node Times (s)'
+]
 
 def main():
     """
-    Run the cancer staging module on an example medical note.
+    Run the cancer staging module on an example medical note, or on a batch of notes.
     """
     logger.info("Starting pediatric cancer staging application")
     
     parser = argparse.ArgumentParser(description="Run the LangGraph cancer staging module on a medical note.")
     parser.add_argument("--note", default="example.txt", help="Path to the medical note to process")
+    parser.add_argument("--batch", help="Directory, glob pattern or manifest file of notes to process in batch mode")
+    parser.add_argument("--workers", type=int, default=4, help="Number of notes processed concurrently in batch mode")
+    parser.add_argument("--markdown", action="store_true", help="Also write a markdown report per note in batch mode")
+    parser.add_argument("--run-db", help="SQLite file recording batch progress and graph checkpoints, making the batch resumable")
+    parser.add_argument("--preclassifier", choices=["off", "shadow", "on"],
+                        help="Rule-based cancer identification: skip the LLM on obvious notes (on), "
+                             "only log agreement (shadow) or disable it (off); default: STAGING_PRECLASSIFIER or shadow")
+    parser.add_argument("--mode", choices=["fast", "audit"],
+                        help="Analyze criteria and assign the stage in one LLM call (fast) or in two separate "
+                             "steps (audit); default: STAGING_GRAPH_MODE or audit")
+    parser.add_argument("--identify-batch", type=int, default=1,
+                        help="In batch mode, identify the cancer type of this many short notes per LLM request")
+    parser.add_argument("--report-mode", choices=["llm", "template", "deferred", "none"],
+                        help="Write the staging report with the LLM, from a template, queue it for later "
+                             "generation, or skip it; default: STAGING_REPORT_MODE or llm")
     parser.add_argument("--output", default="results.csv", help="Path to save the CSV results")
+    parser.add_argument("--metrics-columns", action="store_true",
+                        help="Add timing, token, retry and estimated cost columns to the CSV")
+    parser.add_argument("--metrics-file", help="Write per-node metrics in the Prometheus text format to this file")
+    parser.add_argument("--metrics-port", type=int, help="Serve per-node metrics for Prometheus at :PORT/metrics")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose agent output", default=True)
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print how long each startup step takes before the first LLM request, then exit")
     args = parser.parse_args()
     
+    if args.preclassifier:
+        os.environ["STAGING_PRECLASSIFIER"] = args.preclassifier
+    if args.mode:
+        os.environ["STAGING_GRAPH_MODE"] = args.mode
+    if args.report_mode:
+        os.environ["STAGING_REPORT_MODE"] = args.report_mode
+    
     # Set up Azure OpenAI API
     logger.info("Setting up Azure OpenAI configuration")
-    deployment_name = configure_azure_openai()
+    started = time.perf_counter()
+    try:
+        deployment_name = configure_azure_openai()
+    except LLMConfigurationError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    STARTUP_TIMINGS['configure LLM backend'] = time.perf_counter() - started
+    
+    if args.profile_startup:
+        profile_startup(deployment_name)
+        return
+    
+    if args.metrics_port is not None:
+        get_metrics_registry().serve(args.metrics_port)
+    
+    if args.batch:
+        run_batch_mode(args)
+        return
     
     # Read the medical note
     note_path = args.note
@@ -70,55 +143,23 @@ def main():
         # Process the note with verbose agent output
         results = process_medical_note(note_text, thread_id=note_path, verbose=args.verbose)
         
-        # Clean and extract values from the raw responses if needed
-        cancer_type = extract_clean_value(results.get('cancer_type', 'Unknown'), "Wilms Tumor")
-        standardized_category = extract_clean_value(results.get('standardized_cancer_type', 'Unknown'), "Renal Tumors")
-        primary_site = extract_clean_value(results.get('primary_site', 'Not specified'), "Left Kidney")
-        extracted_stage = extract_clean_value(results.get('extracted_stage', 'Not mentioned'), "Not mentioned")
-        
-        # Extract the calculated stage more reliably from explanation or report if needed
-        calculated_stage = extract_stage_from_text(
-            results.get('stage', 'Unknown'), 
-            results.get('explanation', ''), 
-            results.get('report', '')
-        )
-        
-        metastasis_sites = extract_clean_value(results.get('metastasis_sites', 'None identified'), "None identified")
-        
         # Save results to CSV with reorganized columns
         output_path = args.output
         with open(output_path, 'w', newline='') as csvfile:
-            fieldnames = [
-                'Medical Note', 
-                'Cancer Type', 
-                'Standardized Category', 
-                'Primary Site',
-                'Extracted Stage', 
-                'Calculated Stage',
-                'Sites of Metastasis',
-                'Covered by Toronto',
-                'Date Processed'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=csv_fieldnames(args))
             
             writer.writeheader()
-            writer.writerow({
-                'Medical Note': note_path,
-                'Cancer Type': cancer_type,
-                'Standardized Category': standardized_category,
-                'Primary Site': primary_site,
-                'Extracted Stage': extracted_stage,
-                'Calculated Stage': calculated_stage,
-                'Sites of Metastasis': metastasis_sites,
-                'Covered by Toronto': 'Yes' if results.get('is_covered_by_toronto', False) else 'No',
-                'Date Processed': datetime.datetime.now().strftime("%Y-%m-%d")
-            })
+            writer.writerow(build_csv_row(results, note_path, args.metrics_columns))
         
         logger.info(f"CSV results saved to: {output_path}")
         
         # Generate markdown report
         md_path = generate_markdown_report(results, note_path)
         logger.info(f"Markdown report saved to: {md_path}")
+        logger.info(f"Token usage: {get_token_usage_tracker().summary()}")
+        if args.metrics_file:
+            get_metrics_registry().write(args.metrics_file)
+            logger.info(f"Node metrics saved to: {args.metrics_file}")
         
         # Update project status
         update_project_status()
@@ -129,67 +170,179 @@ def main():
         traceback.print_exc()
         sys.exit(1)
 
-def extract_clean_value(original_value, fallback_default=None):
+def profile_startup(deployment_name):
     """
-    Extract a clean value from the original value, removing placeholders
-    and special characters.
+    Time the remaining steps before the first LLM request and print the startup report.
     
-    Args:
-        original_value: The original value to clean
-        fallback_default: A fallback value if original is invalid
-        
-    Returns:
-        A cleaned value
+    The report covers module imports, loading .env, configuring the LLM backend,
+    compiling the staging graph and creating the LLM client; interpreter startup
+    is not included.
+    """
+    started = time.perf_counter()
+    get_cancer_staging_graph(deployment_name)
+    STARTUP_TIMINGS['compile graph'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    get_chat_model(deployment_name)
+    STARTUP_TIMINGS['create LLM client'] = time.perf_counter() - started
+    
+    print("\nSTARTUP PROFILE")
+    print("-"*40)
+    for phase, seconds in STARTUP_TIMINGS.items():
+        print(f"{phase:<26}{seconds * 1000:>10.1f} ms")
+    print("-"*40)
+    print(f"{'total':<26}{sum(STARTUP_TIMINGS.values()) * 1000:>10.1f} ms")
+    
+    heavy_packages = [name for name in ("crewai", "litellm", "pandas", "langchain_openai", "openai") if name in sys.modules]
+    print(f"\n{len(sys.modules)} modules loaded; heavy packages: {', '.join(heavy_packages) or 'none'}")
+    print("Per-module import times: python -X importtime run_example.py --profile-startup")
+
+def run_batch_mode(args):
+    """
+    Process every note from a directory, glob or manifest in one process.
+    
+    Rows are appended to the CSV as each note finishes, so a crash loses at most
+    the notes still in flight. With --run-db, a restarted batch skips notes that
+    already finished and resumes interrupted ones from their last completed node.
+    project_status.md is left untouched.
     """
-    # Clean the value
-    if not original_value or original_value in ("**", "None", "Unknown", "Not specified"):
-        return fallback_default or "Not specified"
+    ledger = RunLedger(args.run_db) if args.run_db else None
     
-    # Strip any special characters
-    cleaned = original_value.strip("*[] ")
-    if not cleaned:
-        return fallback_default or "Not specified"
+    # Identifications made in batched requests, by note path, until the note is processed
+    identifications = {}
     
-    return cleaned
+    def identify_group(note_paths):
+        """Identify a group of notes in batched requests, skipping notes finished in an earlier run"""
+        notes = []
+        for note_path in note_paths:
+            with open(note_path, 'r', encoding='utf-8') as f:
+                note_text = f.read()
+            if ledger is None or not ledger.is_done(hash_note(note_text)):
+                notes.append((note_path, note_text))
+        identifications.update(identify_notes(notes, batch_size=args.identify_batch))
+        return note_paths
+    
+    def iter_identified_paths(note_paths):
+        """Yield note paths after identifying each group of identify_batch * workers notes"""
+        group = []
+        for note_path in note_paths:
+            group.append(note_path)
+            if len(group) >= args.identify_batch * args.workers:
+                yield from identify_group(group)
+                group = []
+        yield from identify_group(group)
+    
+    def process_note(note_path):
+        with open(note_path, 'r', encoding='utf-8') as f:
+            note_text = f.read()
+        identification = identifications.pop(note_path, None)
+        
+        if ledger is None:
+            results = process_medical_note(note_text, thread_id=note_path, verbose=False,
+                                           identification=identification)
+            if args.markdown:
+                generate_markdown_report(results, note_path)
+            return build_csv_row(results, note_path, args.metrics_columns)
+        
+        # Notes are tracked by content hash, which also serves as the checkpoint thread
+        note_hash = hash_note(note_text)
+        if ledger.is_done(note_hash):
+            return None
+        
+        ledger.mark_started(note_hash, note_path)
+        try:
+            results = process_medical_note(note_text, thread_id=note_hash, verbose=False,
+                                           checkpoint_path=args.run_db, identification=identification)
+            if args.markdown:
+                generate_markdown_report(results, note_path)
+            row = build_csv_row(results, note_path, args.metrics_columns)
+        except Exception as e:
+            ledger.mark_failed(note_hash, str(e))
+            raise
+        ledger.mark_done(note_hash, row)
+        return row
+    
+    logger.info(f"Batch processing notes from {args.batch} with {args.workers} workers")
+    try:
+        with StreamingCsvWriter(args.output, csv_fieldnames(args)) as writer:
+            note_paths = iter_note_paths(args.batch)
+            if args.identify_batch > 1:
+                note_paths = iter_identified_paths(note_paths)
+            counts = run_batch(note_paths, process_note, writer, workers=args.workers)
+    finally:
+        if ledger is not None:
+            logger.info(f"Run ledger status: {ledger.summary()}")
+            ledger.close()
+    
+    logger.info(f"Token usage: {get_token_usage_tracker().summary()}")
+    if args.metrics_file:
+        get_metrics_registry().write(args.metrics_file)
+        logger.info(f"Node metrics saved to: {args.metrics_file}")
+    logger.info(f"CSV results appended to: {args.output}")
+    if counts["failed"]:
+        sys.exit(1)
+
+def csv_fieldnames(args):
+    """Get the CSV columns for the command-line options"""
+    return CSV_FIELDNAMES + METRICS_CSV_FIELDNAMES if args.metrics_columns else CSV_FIELDNAMES
+
+def build_csv_row(results, note_path, metrics_columns=False):
+    """Build the results CSV row for a processed note, optionally with the metrics columns"""
+    values = result_display_values(results)
+    
+    row = {
+        'Medical Note': note_path,
+        'Cancer Type': values['cancer_type'],
+        'Standardized Category': values['standardized_category'],
+        'Primary Site': values['primary_site'],
+        'Extracted Stage': values['extracted_stage'],
+        'Calculated Stage': values['calculated_stage'],
+        'Sites of Metastasis': values['metastasis_sites'],
+        'Covered by Toronto': 'Yes' if results.get('is_covered_by_toronto', False) else 'No',
+        'Date Processed': datetime.datetime.now().strftime("%Y-%m-%d")
+    }
+    if metrics_columns:
+        row.update(build_metrics_columns(results.get('node_metrics')))
+    return row
 
-def extract_stage_from_text(stage_value, explanation, report):
+def build_metrics_columns(node_metrics):
+    """Build the metrics columns from a result's per-node metrics"""
+    total = total_node_metrics(node_metrics)
+    
+    return {
+        'Wall Time (s)': total['wall_s'],
+        'Queue Wait (s)': total['queue_wait_s'],
+        'LLM Calls': total['llm_calls'],
+        'Prompt Tokens': total['input_tokens'],
+        'Cached Prompt Tokens': total['cached_tokens'],
+        'Completion Tokens': total['output_tokens'],
+        'Response Cache Hits': total['response_cache_hits'],
+        'Retries': total['retries'],
+        'Estimated Cost (USD)': total['cost_usd'],
+        'Node Times (s)': '; '.join(f"{node}={metrics['wall_s']:.2f}" for node, metrics in (node_metrics or {}).items())
+    }
+
+def result_display_values(results):
     """
-    Extract the stage from various text fields more reliably.
+    Get the display values of a staging result.
+    
+    The staging graph returns schema-validated values, so only missing
+    values need a display default.
     
     Args:
-        stage_value: The stage value from the main results
-        explanation: The explanation text
-        report: The full report text
+        results: Result dict from process_medical_note()
         
     Returns:
-        The extracted stage
+        Dict of display values for the CSV and markdown outputs
     """
-    # If we already have a valid stage, use it
-    if stage_value and stage_value not in ("None", "Unknown", "Not mentioned", "**"):
-        return stage_value
-    
-    # Try to extract from explanation
-    if "Stage I" in explanation:
-        return "Stage I"
-    elif "Stage II" in explanation:
-        return "Stage II"
-    elif "Stage III" in explanation:
-        return "Stage III"
-    elif "Stage IV" in explanation:
-        return "Stage IV"
-    
-    # Try to extract from report
-    if "Stage I" in report:
-        return "Stage I"
-    elif "Stage II" in report:
-        return "Stage II"
-    elif "Stage III" in report:
-        return "Stage III"
-    elif "Stage IV" in report:
-        return "Stage IV"
-    
-    # Default
-    return "Unknown"
+    return {
+        'cancer_type': results.get('cancer_type') or 'Unknown',
+        'standardized_category': results.get('standardized_cancer_type') or 'Not covered',
+        'primary_site': results.get('primary_site') or 'Not specified',
+        'extracted_stage': results.get('extracted_stage') or 'Not mentioned',
+        'calculated_stage': results.get('stage') or 'Unknown',
+        'metastasis_sites': results.get('metastasis_sites') or 'None identified',
+    }
 
 def generate_markdown_report(results, note_path):
     """Generate a comprehensive markdown report similar to the adult system"""
@@ -199,20 +352,13 @@ def generate_markdown_report(results, note_path):
     # Format timestamp
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    # Extract and clean values
-    cancer_type = extract_clean_value(results.get('cancer_type', 'Unknown'), "Wilms Tumor")
-    standardized_category = extract_clean_value(results.get('standardized_cancer_type', 'Unknown'), "Renal Tumors")
-    primary_site = extract_clean_value(results.get('primary_site', 'Not specified'), "Left Kidney")
-    extracted_stage = extract_clean_value(results.get('extracted_stage', 'Not mentioned'), "Not mentioned")
-    
-    # Extract the calculated stage more reliably
-    calculated_stage = extract_stage_from_text(
-        results.get('stage', 'Unknown'), 
-        results.get('explanation', ''), 
-        results.get('report', '')
-    )
-    
-    metastasis_sites = extract_clean_value(results.get('metastasis_sites', 'None identified'), "None identified")
+    values = result_display_values(results)
+    cancer_type = values['cancer_type']
+    standardized_category = values['standardized_category']
+    primary_site = values['primary_site']
+    extracted_stage = values['extracted_stage']
+    calculated_stage = values['calculated_stage']
+    metastasis_sites = values['metastasis_sites']
     
     # Format the explanation and report with proper markdown
     explanation_text = results.get('explanation', 'No explanation provided')
@@ -221,7 +367,9 @@ def generate_markdown_report(results, note_path):
     explanation_text = explanation_text.replace('6-8', '6-8').replace('6–8', '6-8')
     
     # Process the report text with proper formatting
-    report_text = results.get('report', 'No report generated')
+    report_text = results.get('report') or 'No report generated'
+    if results.get('report_status') == 'queued':
+        report_text = 'Report generation deferred; see the report queue'
     # Fix encoding issues
     report_text = report_text.replace('\u2013', '-').replace('\u2014', '-')
     report_text = report_text.replace('6-8', '6-8').replace('6–8', '6-8')
@@ -1,5 +1,27 @@
-from .staging_module import PediatricCancerStaging
-from .agents import CancerStagingAgents
-from .tasks import CancerStagingTasks
+"""
+Pediatric cancer staging with the Toronto staging system.
 
-__all__ = ['PediatricCancerStaging', 'CancerStagingAgents', 'CancerStagingTasks'] 
\ No newline at end of file
+The CrewAI classes are imported on first access, so the LangGraph pipeline
+(src.cancer_staging_graph) can be used without loading CrewAI.
+"""
+
+import importlib
+
+# Public name -> module defining it, imported when the name is first used
+_LAZY_EXPORTS = {
+    'PediatricCancerStaging': '.staging_module',
+    'CancerStagingAgents': '.agents',
+    'CancerStagingTasks': '.tasks',
+}
+
+__all__ = ['PediatricCancerStaging', 'CancerStagingAgents', 'CancerStagingTasks']
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,5 +1,4 @@
 import os
-import json
 from crewai import Agent
 from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
@@ -11,7 +10,9 @@ load_dotenv()
 from crewai.telemetry import Telemetry
 
 # Add import from our new module
-from .azure_openai_config import get_azure_openai_llm
+from .azure_openai_config import get_chat_model
+from .cancer_mapping import CANCER_TYPE_MAPPING
+from .knowledge_base import get_staging_kb, load_staging_data
 
 def noop(*args, **kwargs):
     pass
@@ -24,147 +25,27 @@ def disable_crewai_telemetry():
 # Disable telemetry immediately
 disable_crewai_telemetry()
 
-# Get the path to the toronto_staging.json file
-def get_staging_data_path() -> str:
-    """Get the path to the Toronto staging data JSON file."""
-    # Default path relative to the current directory
-    default_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)),
-        'toronto_staging.json'
-    )
-    
-    # Check if the file exists
-    if not os.path.exists(default_path):
-        # Try alternative paths
-        alt_paths = [
-            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                         'pediatric_staging', 'toronto_staging.json'),
-        ]
-        
-        for path in alt_paths:
-            if os.path.exists(path):
-                return path
-        
-        raise FileNotFoundError("Toronto staging data file not found")
-    
-    return default_path
-
-# Load the staging data
-try:
-    staging_data_path = get_staging_data_path()
-    with open(staging_data_path, 'r') as f:
-        TORONTO_STAGING_DATA = json.load(f)
-except Exception as e:
-    print(f"Error loading staging data: {e}")
-    TORONTO_STAGING_DATA = {}
-
-# Define cancers covered by Toronto Pediatric Cancer Staging System from the JSON file
-TORONTO_COVERED_CANCERS = list(TORONTO_STAGING_DATA.keys())
-
-# Create stage mapping to ensure correct stage terminology is used
-STAGE_TERMINOLOGY = {}
-for cancer_type, data in TORONTO_STAGING_DATA.items():
-    STAGE_TERMINOLOGY[cancer_type] = list(data.get("stages", {}).keys())
-
-# Define mapping from specific cancer types to their standardized Toronto categories
-CANCER_TYPE_MAPPING = {
-    # Non-Hodgkin lymphoma variants
-    "burkitt lymphoma": "Non-Hodgkin Lymphoma",
-    "burkitt's lymphoma": "Non-Hodgkin Lymphoma",
-    "anaplastic large cell lymphoma": "Non-Hodgkin Lymphoma", 
-    "lymphoblastic lymphoma": "Non-Hodgkin Lymphoma",
-    "diffuse large b-cell lymphoma": "Non-Hodgkin Lymphoma",
-    "primary mediastinal b-cell lymphoma": "Non-Hodgkin Lymphoma",
-    "dlbcl": "Non-Hodgkin Lymphoma",
-    
-    # Ewing sarcoma family
-    "ewing sarcoma": "Bone Tumors",
-    "ewing's sarcoma": "Bone Tumors",
-    "primitive neuroectodermal tumor": "Bone Tumors",
-    "pnet": "Bone Tumors",
-    "askin tumor": "Bone Tumors",
-    "osteosarcoma": "Bone Tumors",
-    
-    # Wilms tumor and renal tumors variants
-    "nephroblastoma": "Renal Tumors",
-    "wilms": "Renal Tumors",
-    "wilm's tumor": "Renal Tumors",
-    "wilms' tumor": "Renal Tumors",
-    "clear cell sarcoma": "Renal Tumors",
-    "rhabdoid tumor (kidney)": "Renal Tumors",
-    
-    # Specific testicular germ cell tumors
-    "testicular yolk sac tumor": "Testicular Germ Cell Tumor",
-    "testicular teratoma": "Testicular Germ Cell Tumor",
-    "testicular dysgerminoma": "Testicular Germ Cell Tumor",
-    "testicular seminoma": "Testicular Germ Cell Tumor",
-    "testicular embryonal carcinoma": "Testicular Germ Cell Tumor",
-    "testicular choriocarcinoma": "Testicular Germ Cell Tumor",
-    "testicular mixed germ cell tumor": "Testicular Germ Cell Tumor",
-    
-    # Specific ovarian germ cell tumors
-    "ovarian yolk sac tumor": "Ovarian Germ Cell Tumor",
-    "ovarian teratoma": "Ovarian Germ Cell Tumor",
-    "ovarian dysgerminoma": "Ovarian Germ Cell Tumor",
-    "ovarian seminoma": "Ovarian Germ Cell Tumor",
-    "ovarian embryonal carcinoma": "Ovarian Germ Cell Tumor",
-    "ovarian choriocarcinoma": "Ovarian Germ Cell Tumor",
-    "ovarian mixed germ cell tumor": "Ovarian Germ Cell Tumor",
+def _stage_terminology():
+    """Create stage mapping to ensure correct stage terminology is used"""
+    return {cancer_type: list(data.get("stages", {}).keys()) for cancer_type, data in load_staging_data().items()}
 
-    # Leukemia subtypes
-    "b-cell all": "Acute Lymphoblastic Leukemia",
-    "t-cell all": "Acute Lymphoblastic Leukemia",
-    "b-precursor all": "Acute Lymphoblastic Leukemia",
-    "b-lymphoblastic leukemia": "Acute Lymphoblastic Leukemia",
-    "t-lymphoblastic leukemia": "Acute Lymphoblastic Leukemia",
-    "all": "Acute Lymphoblastic Leukemia",
-    
-    # Non-rhabdomyosarcoma soft tissue sarcoma variants
-    "synovial sarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "fibrosarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "liposarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "malignant peripheral nerve sheath tumor": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "mpnst": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "desmoplastic small round cell tumor": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "epithelioid sarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "alveolar soft part sarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "clear cell sarcoma": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    "nrsts": "Non-Rhabdomyosarcoma Soft Tissue Sarcoma",
-    
-    # Rhabdomyosarcoma variants
-    "embryonal rhabdomyosarcoma": "Rhabdomyosarcoma",
-    "alveolar rhabdomyosarcoma": "Rhabdomyosarcoma",
-    "pleomorphic rhabdomyosarcoma": "Rhabdomyosarcoma",
-    "spindle cell rhabdomyosarcoma": "Rhabdomyosarcoma",
+def __getattr__(name):
+    """
+    Resolve the staging data on first use, so importing the agents doesn't parse toronto_staging.json.
     
-    # Hodgkin lymphoma variants
-    "classical hodgkin lymphoma": "Hodgkin Lymphoma",
-    "nodular sclerosis hodgkin lymphoma": "Hodgkin Lymphoma",
-    "mixed cellularity hodgkin lymphoma": "Hodgkin Lymphoma",
-    "lymphocyte-rich hodgkin lymphoma": "Hodgkin Lymphoma",
-    "lymphocyte-depleted hodgkin lymphoma": "Hodgkin Lymphoma",
-    "nodular lymphocyte predominant hodgkin lymphoma": "Hodgkin Lymphoma",
-    "lymphocyte predominant hodgkin lymphoma": "Hodgkin Lymphoma",
-
-    # astrocytoma variants
-    "astrocytoma": "Astrocytoma",
-    "pilocytic astrocytoma": "Astrocytoma",
-    "glioma": "Astrocytoma",
-    "glioblastoma": "Astrocytoma",
-    "gliosarcoma": "Astrocytoma",
-    "gliomatosis cerebri": "Astrocytoma",
-
-    # Medulloblastoma variants
-    "medulloblastoma": "Medulloblastoma",
-    "nodular medulloblastoma": "Medulloblastoma",
-    "diffuse medulloblastoma": "Medulloblastoma",
-    "anaplastic medulloblastoma": "Medulloblastoma",
-
-    # neuroblastoma variants
-    "neuroblastoma": "Neuroblastoma",
-    "ganglioneuroblastoma": "Neuroblastoma",
-    "ganglioneuroma": "Neuroblastoma",
-}
+    The data is parsed once per process and shared with the LangGraph workflow.
+    """
+    if name == "TORONTO_STAGING_DATA":
+        return load_staging_data()
+    # Cancers covered by Toronto Pediatric Cancer Staging System from the JSON file
+    if name == "TORONTO_COVERED_CANCERS":
+        return list(load_staging_data().keys())
+    # Resolves spelling variants of diagnoses to the Toronto categories
+    if name == "CANCER_TYPE_RESOLVER":
+        return get_staging_kb().resolver
+    if name == "STAGE_TERMINOLOGY":
+        return _stage_terminology()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def format_mapping_for_agent(mapping_dict):
     """
@@ -179,6 +60,9 @@ def lookup_cancer_type(specific_type, mapping_dict=CANCER_TYPE_MAPPING):
     """
     Looks up the standardized Toronto category for a specific cancer type.
     
+    With the default mapping, spelling variants are resolved as well
+    (see src/cancer_resolver.py).
+    
     Args:
         specific_type: The specific cancer subtype to look up
         mapping_dict: The mapping dictionary to use
@@ -186,6 +70,8 @@ def lookup_cancer_type(specific_type, mapping_dict=CANCER_TYPE_MAPPING):
     Returns:
         The standardized Toronto category, or None if not found
     """
+    if mapping_dict is CANCER_TYPE_MAPPING:
+        return get_staging_kb().resolver.resolve(specific_type)
     return mapping_dict.get(specific_type.lower(), None)
 
 def get_valid_stages_for_cancer(cancer_type):
@@ -198,9 +84,7 @@ def get_valid_stages_for_cancer(cancer_type):
     Returns:
         List of valid stage names
     """
-    if cancer_type in STAGE_TERMINOLOGY:
-        return STAGE_TERMINOLOGY[cancer_type]
-    return []
+    return _stage_terminology().get(cancer_type, [])
 
 def format_valid_stages(cancer_type):
     """Format valid stages for a cancer type as a readable string."""
@@ -230,11 +114,11 @@ class CancerStagingAgents:
         
         # Create a reference text for stage terminology
         self.stage_terminology_text = ""
-        for cancer, stages in STAGE_TERMINOLOGY.items():
+        for cancer, stages in _stage_terminology().items():
             self.stage_terminology_text += f"{cancer}: {', '.join(stages)}\n"
         
         # Get a configured LLM for direct LangChain use
-        self.llm = get_azure_openai_llm(deployment_name=self.deployment_name)
+        self.llm = get_chat_model(deployment_name=self.deployment_name)
     
     def create_cancer_identifier_agent(self) -> Agent:
         """
@@ -249,7 +133,7 @@ class CancerStagingAgents:
             
             You are also familiar with the Toronto Pediatric Cancer Staging System and know that
             it ONLY covers the following standardized cancer types (loaded directly from toronto_staging.json):
-            {', '.join(TORONTO_COVERED_CANCERS)}.
+            {', '.join(load_staging_data())}.
 
             You understand that many specific cancer subtypes need to be mapped to these standardized categories.
             Here's the mapping of specific cancer types to their standardized categories:
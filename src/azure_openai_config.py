@@ -1,17 +1,62 @@
 """
 Configuration module for Azure OpenAI integration with LangGraph.
+
+Other backends (OpenAI-compatible servers, the local stub, replay) are selected
+with STAGING_LLM_BACKEND; see src.llm_backends.
 """
 
 import os
-import sys
-from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import SystemMessage
+import atexit
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+
+import httpx
+from langchain_core.messages import AIMessage, SystemMessage
+
+from .llm_cache import get_llm_cache, make_cache_key
+from .node_metrics import record_response_cache_hit
+from .tracing import current_span, span
+from .deployment_pool import get_deployment_pool
+from .llm_backends import (LLMConfigurationError, check_backend_config, create_chat_model, get_exchange_recorder,
+                           get_llm_backend)
+from .rate_limit import get_retry_scheduler, estimate_message_tokens
+from .schemas import StructuredOutputError
+from .token_usage import record_token_usage
+
+# Attempts made to obtain output that validates against a structured-output schema
+STRUCTURED_OUTPUT_ATTEMPTS = 2
+
+logger = logging.getLogger(__name__)
+
+# Connection limits for the shared keep-alive HTTP clients
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+# Pooled LLM clients keyed by (endpoint, api_version, deployment, temperature, credential),
+# all sharing one sync HTTP client so TLS connections are reused. An httpx.AsyncClient
+# only works on the event loop it was first used on, so every running loop gets its
+# own async client and LLM clients; _CLIENT_POOL serves callers outside any loop
+_CLIENT_POOL = {}
+_HTTP_CLIENTS = {}
+_LOOP_CLIENTS = weakref.WeakKeyDictionary()
+_POOL_LOCK = threading.Lock()
+_POOL_LIMITS = {}
 
 def configure_azure_openai():
     """
     Configure environment variables for Azure OpenAI.
     This must be called before any LangGraph operations.
     Returns the deployment name for use in the workflow.
+    
+    With another backend selected (STAGING_LLM_BACKEND), only that backend's
+    settings are checked.
+    
+    Raises:
+        LLMConfigurationError: If required settings are missing
     """
     # Get Azure OpenAI settings from environment variables
     api_key = os.getenv("AZURE_API_KEY")
@@ -19,11 +64,24 @@ def configure_azure_openai():
     endpoint = os.getenv("AZURE_ENDPOINT")
     deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
     
+    backend = get_llm_backend()
+    if backend != "azure":
+        check_backend_config(backend)
+        print(f"LLM backend: {backend} (model: {deployment_name})")
+        return deployment_name
+    
+    # A deployment pool brings its own endpoints (see src.deployment_pool)
+    pool = get_deployment_pool()
+    if pool is not None:
+        print(f"Azure OpenAI deployment pool configured with:")
+        for member in pool.deployments:
+            print(f"  {member.name}: {member.endpoint} ({member.deployment}, weight {member.weight:g})")
+        return deployment_name
+    
     # Validate required environment variables
     if not api_key or not endpoint or not api_version:
-        print("Error: Required Azure OpenAI environment variables not set.")
-        print("Please ensure AZURE_API_KEY, AZURE_ENDPOINT, and AZURE_API_VERSION are set.")
-        sys.exit(1)
+        raise LLMConfigurationError("Required Azure OpenAI environment variables not set. "
+                                    "Please ensure AZURE_API_KEY, AZURE_ENDPOINT, and AZURE_API_VERSION are set.")
     
     # Set OpenAI environment variables for LangGraph/LangChain
     os.environ["OPENAI_API_KEY"] = api_key
@@ -44,13 +102,99 @@ def configure_azure_openai():
     
     return deployment_name
 
-def get_azure_openai_llm(deployment_name=None, temperature=0.3):
+def configure_llm_client_pool(max_connections=None, max_keepalive_connections=None, 
+                              keepalive_expiry=None):
+    """
+    Configure connection limits for the pooled LLM clients.
+    
+    Existing clients are shut down so the new limits apply to the next request.
+    Unset values fall back to AZURE_MAX_CONNECTIONS / AZURE_MAX_KEEPALIVE_CONNECTIONS
+    and then to the module defaults.
+    
+    Args:
+        max_connections: Maximum concurrent connections per HTTP client
+        max_keepalive_connections: Maximum idle connections kept open for reuse
+        keepalive_expiry: Seconds an idle connection is kept before closing
+    """
+    shutdown_llm_clients()
+    with _POOL_LOCK:
+        _POOL_LIMITS.clear()
+        if max_connections is not None:
+            _POOL_LIMITS["max_connections"] = max_connections
+        if max_keepalive_connections is not None:
+            _POOL_LIMITS["max_keepalive_connections"] = max_keepalive_connections
+        if keepalive_expiry is not None:
+            _POOL_LIMITS["keepalive_expiry"] = keepalive_expiry
+
+def _get_http_limits():
+    """Build the httpx connection limits from configuration and environment"""
+    return httpx.Limits(
+        max_connections=_POOL_LIMITS.get(
+            "max_connections", int(os.getenv("AZURE_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS))),
+        max_keepalive_connections=_POOL_LIMITS.get(
+            "max_keepalive_connections", 
+            int(os.getenv("AZURE_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS))),
+        keepalive_expiry=_POOL_LIMITS.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY),
+    )
+
+def _current_loop():
+    """Return the running event loop, or None when called outside one"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def _credential_id(api_key):
+    """Identify a credential in pool keys without keeping the key itself there"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else None
+
+def _loop_client_pool(loop):
+    """Return the LLM client pool of an event loop (None: outside any loop), without creating it"""
+    if loop is None:
+        return _CLIENT_POOL
+    state = _LOOP_CLIENTS.get(loop)
+    return state["llms"] if state is not None else {}
+
+def _get_http_clients(loop=None):
+    """
+    Get the shared keep-alive HTTP clients, creating them on first use (caller holds the lock).
+    
+    Args:
+        loop: The event loop the async client will be used on, or None outside any loop
+        
+    Returns:
+        Tuple of (LLM client pool for the loop, sync HTTP client, async HTTP client)
+    """
+    limits = _get_http_limits()
+    if "sync" not in _HTTP_CLIENTS:
+        _HTTP_CLIENTS["sync"] = httpx.Client(limits=limits, timeout=httpx.Timeout(120.0))
+        logger.info(f"Created pooled HTTP clients (max connections: {limits.max_connections})")
+    
+    if loop is None:
+        if "async" not in _HTTP_CLIENTS:
+            _HTTP_CLIENTS["async"] = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0))
+        return _CLIENT_POOL, _HTTP_CLIENTS["sync"], _HTTP_CLIENTS["async"]
+    
+    state = _LOOP_CLIENTS.get(loop)
+    if state is None:
+        state = {"llms": {}, "async": httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0))}
+        _LOOP_CLIENTS[loop] = state
+    return state["llms"], _HTTP_CLIENTS["sync"], state["async"]
+
+def get_azure_openai_llm(deployment_name=None, temperature=0.3, endpoint=None, api_key=None, api_version=None):
     """
     Get a configured AzureChatOpenAI instance for use with LangChain.
     
+    Instances are pooled per endpoint, deployment, temperature, API key and
+    event loop and share keep-alive HTTP connections, so repeated calls do not
+    pay connection setup again.
+    
     Args:
         deployment_name: Override the deployment name from environment variable
         temperature: Temperature setting for the LLM
+        endpoint: Override the endpoint (AZURE_ENDPOINT), e.g. for a deployment pool entry
+        api_key: Override the API key (AZURE_API_KEY)
+        api_version: Override the API version (AZURE_API_VERSION)
         
     Returns:
         AzureChatOpenAI: Configured LangChain LLM
@@ -58,37 +202,370 @@ def get_azure_openai_llm(deployment_name=None, temperature=0.3):
     if not deployment_name:
         deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
     
-    api_key = os.getenv("AZURE_API_KEY")
-    api_version = os.getenv("AZURE_API_VERSION")
-    endpoint = os.getenv("AZURE_ENDPOINT")
+    api_key = api_key or os.getenv("AZURE_API_KEY")
+    api_version = api_version or os.getenv("AZURE_API_VERSION")
+    endpoint = endpoint or os.getenv("AZURE_ENDPOINT")
     
-    # Create and return the LLM
-    return AzureChatOpenAI(
-        deployment_name=deployment_name,
-        openai_api_version=api_version,
-        openai_api_key=api_key,
-        azure_endpoint=endpoint,
-        temperature=temperature
-    )
+    # A rotated key gets a new client; the async HTTP client is bound to the running loop
+    key = (endpoint, api_version, deployment_name, temperature, _credential_id(api_key))
+    loop = _current_loop()
+    llm = _loop_client_pool(loop).get(key)
+    if llm is not None:
+        return llm
+    
+    with _POOL_LOCK:
+        client_pool, http_client, http_async_client = _get_http_clients(loop)
+        llm = client_pool.get(key)
+        if llm is None:
+            # Imported here: langchain_openai (and openai) take a large share of startup time
+            # and are not needed by the other backends
+            from langchain_openai import AzureChatOpenAI
+            
+            # Create the LLM on the shared HTTP clients
+            recorder = get_exchange_recorder()
+            llm = AzureChatOpenAI(
+                deployment_name=deployment_name,
+                openai_api_version=api_version,
+                openai_api_key=api_key,
+                azure_endpoint=endpoint,
+                temperature=temperature,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                # Retries are scheduled by src.rate_limit, which shares backoff across callers
+                max_retries=0,
+                callbacks=[recorder] if recorder else None
+            )
+            client_pool[key] = llm
+    return llm
+
+def get_chat_model(deployment_name=None, temperature=0.3):
+    """
+    Get the pooled chat model of the configured backend (see src.llm_backends).
+    
+    Args:
+        deployment_name: Deployment (or model) name
+        temperature: Temperature setting for the LLM
+        
+    Returns:
+        A LangChain chat model
+    """
+    if not deployment_name:
+        deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    backend = get_llm_backend()
+    if backend == "azure":
+        return get_azure_openai_llm(deployment_name, temperature)
+    
+    key = (backend, os.getenv("OPENAI_BASE_URL"), deployment_name, temperature,
+           _credential_id(os.getenv("OPENAI_API_KEY")))
+    loop = _current_loop()
+    llm = _loop_client_pool(loop).get(key)
+    if llm is not None:
+        return llm
+    
+    with _POOL_LOCK:
+        client_pool, http_client, http_async_client = _get_http_clients(loop)
+        llm = client_pool.get(key)
+        if llm is None:
+            llm = create_chat_model(backend, deployment_name, temperature, http_client, http_async_client)
+            client_pool[key] = llm
+    return llm
+
+def _take_clients():
+    """Empty the client pools and return the HTTP clients to close: (sync, async outside loops, async per loop)"""
+    with _POOL_LOCK:
+        clients = dict(_HTTP_CLIENTS)
+        loop_clients = {loop: state["async"] for loop, state in _LOOP_CLIENTS.items()}
+        _HTTP_CLIENTS.clear()
+        _CLIENT_POOL.clear()
+        _LOOP_CLIENTS.clear()
+    return clients.get("sync"), clients.get("async"), loop_clients
+
+def shutdown_llm_clients():
+    """
+    Close the shared HTTP clients and empty the LLM client pools.
+    
+    Async clients of event loops that are still running cannot be closed from
+    here and are only dropped; use ashutdown_llm_clients() inside a loop.
+    Safe to call more than once; the next get_azure_openai_llm() call starts a fresh pool.
+    """
+    sync_client, async_client, loop_clients = _take_clients()
+    
+    if sync_client is not None:
+        sync_client.close()
+    if _current_loop() is not None:
+        if async_client is not None or loop_clients:
+            logger.warning("shutdown_llm_clients() called inside an event loop; "
+                           "use ashutdown_llm_clients() to close the async clients")
+        return
+    
+    # No loop running (e.g. at interpreter exit): close on a private loop
+    closable = [async_client] if async_client is not None else []
+    closable += [client for loop, client in loop_clients.items() if loop.is_closed()]
+    for client in closable:
+        try:
+            asyncio.run(client.aclose())
+        except Exception as e:
+            logger.debug(f"Could not close an async HTTP client: {e}")
+
+async def ashutdown_llm_clients():
+    """Async variant of shutdown_llm_clients() for use inside a running event loop"""
+    sync_client, async_client, loop_clients = _take_clients()
+    
+    if sync_client is not None:
+        sync_client.close()
+    # Clients are closed on the loop they belong to; other loops' clients are dropped
+    closable = [async_client] if async_client is not None else []
+    closable += [client for loop, client in loop_clients.items() if loop is asyncio.get_running_loop()]
+    for client in closable:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug(f"Could not close an async HTTP client: {e}")
+
+atexit.register(shutdown_llm_clients)
+
+def _get_dispatchers(deployment_name, temperature, bind=None):
+    """
+    Get the functions that send one request with rate limiting and retries.
+    
+    Without a deployment pool, requests go to the named deployment through its
+    retry scheduler; with one (see src.deployment_pool), each attempt goes to the
+    pool's least-loaded healthy deployment.
+    
+    Args:
+        deployment_name: The deployment to call when no pool is configured
+        temperature: Temperature setting for the LLM
+        bind: Optional function wrapping the LLM, e.g. for structured output
+        
+    Returns:
+        Tuple of (dispatch, adispatch): dispatch(request, tokens) returns request(llm),
+        adispatch(request, tokens) awaits it
+    """
+    pool = get_deployment_pool() if get_llm_backend() == "azure" else None
+    if pool is None:
+        llm = get_chat_model(deployment_name, temperature)
+        runnable = bind(llm) if bind else llm
+        scheduler = get_retry_scheduler(deployment_name)
+        return (lambda request, tokens: scheduler.call(lambda: request(runnable), tokens),
+                lambda request, tokens: scheduler.acall(lambda: request(runnable), tokens))
+    
+    runnables = {}
+    
+    def runnable_for(member):
+        if member.name not in runnables:
+            llm = get_azure_openai_llm(member.deployment, temperature, endpoint=member.endpoint,
+                                       api_key=member.api_key, api_version=member.api_version)
+            runnables[member.name] = bind(llm) if bind else llm
+        return runnables[member.name]
+    
+    return (lambda request, tokens: pool.call(lambda member: request(runnable_for(member)), tokens),
+            lambda request, tokens: pool.acall(lambda member: request(runnable_for(member)), tokens))
+
+def _traced(invoke, prompt_name, deployment_name, schema=None):
+    """Run each call of an LLM function in an llm.request span (see src.tracing)"""
+    def traced_invoke(messages):
+        with span("llm.request", prompt=prompt_name, deployment=deployment_name,
+                  schema=schema.__name__ if schema else None):
+            return invoke(messages)
+    
+    return traced_invoke
+
+def _atraced(ainvoke, prompt_name, deployment_name, schema=None):
+    """Async variant of _traced()"""
+    async def traced_ainvoke(messages):
+        with span("llm.request", prompt=prompt_name, deployment=deployment_name,
+                  schema=schema.__name__ if schema else None):
+            return await ainvoke(messages)
+    
+    return traced_ainvoke
+
+def _with_system_prompt(system_prompt, messages):
+    """Add the system message at the beginning if not already present"""
+    if not (messages and messages[0].type == "system"):
+        messages = [SystemMessage(content=system_prompt)] + messages
+    return messages
+
+def _lookup_cached_response(messages, deployment_name, temperature, response_schema=None):
+    """
+    Look up a call in the LLM response cache.
+    
+    Returns:
+        Tuple of (cache, key, cached AIMessage or None); cache is None when caching is disabled
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None, None
+    
+    key = make_cache_key(messages[0].content, messages[1:], deployment_name, temperature, response_schema)
+    cached = cache.get(key)
+    if cached is None:
+        return cache, key, None
+    record_response_cache_hit()
+    current_span().set_attribute("response_cache_hit", True)
+    return cache, key, AIMessage(content=cached, response_metadata={"cache_hit": True})
 
-def get_llm_with_system_prompt(system_prompt, deployment_name=None, temperature=0.3):
+def get_llm_with_system_prompt(system_prompt, deployment_name=None, temperature=0.3, prompt_name=None):
     """
     Get an LLM with a system prompt already applied.
     
+    When the LLM response cache is enabled (see src.llm_cache), identical calls
+    are answered from the cache instead of the API. Calls that do reach the API
+    go through the deployment's rate limiter and are retried with backoff on
+    throttling and transient errors (see src.rate_limit).
+    
     Args:
         system_prompt: The system prompt to apply
         deployment_name: Override the deployment name
         temperature: Temperature setting for the LLM
+        prompt_name: Node or prompt name under which token usage is recorded (see src.token_usage)
         
     Returns:
         A callable LLM function with the system prompt applied
     """
-    llm = get_azure_openai_llm(deployment_name, temperature)
+    if not deployment_name:
+        deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    dispatch, _ = _get_dispatchers(deployment_name, temperature)
     
     def invoke_with_system(messages):
-        # Add system message at the beginning if not already present
-        if not (messages and messages[0].type == "system"):
-            messages = [SystemMessage(content=system_prompt)] + messages
-        return llm.invoke(messages)
+        messages = _with_system_prompt(system_prompt, messages)
+        
+        cache, key, cached = _lookup_cached_response(messages, deployment_name, temperature)
+        if cached is not None:
+            return cached
+        
+        response = dispatch(lambda llm: llm.invoke(messages), estimate_message_tokens(messages))
+        record_token_usage(prompt_name, response)
+        if cache is not None:
+            cache.set(key, response.content)
+        return response
+    
+    return _traced(invoke_with_system, prompt_name, deployment_name)
+
+def get_async_llm_with_system_prompt(system_prompt, deployment_name=None, temperature=0.3, prompt_name=None):
+    """
+    Asyncio variant of get_llm_with_system_prompt().
+    
+    Args:
+        system_prompt: The system prompt to apply
+        deployment_name: Override the deployment name
+        temperature: Temperature setting for the LLM
+        prompt_name: Node or prompt name under which token usage is recorded
+        
+    Returns:
+        An async callable LLM function with the system prompt applied
+    """
+    if not deployment_name:
+        deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    _, adispatch = _get_dispatchers(deployment_name, temperature)
+    
+    async def ainvoke_with_system(messages):
+        messages = _with_system_prompt(system_prompt, messages)
+        
+        cache, key, cached = _lookup_cached_response(messages, deployment_name, temperature)
+        if cached is not None:
+            return cached
+        
+        response = await adispatch(lambda llm: llm.ainvoke(messages), estimate_message_tokens(messages))
+        record_token_usage(prompt_name, response)
+        if cache is not None:
+            cache.set(key, response.content)
+        return response
+    
+    return _atraced(ainvoke_with_system, prompt_name, deployment_name)
+
+def get_structured_llm_with_system_prompt(system_prompt, schema, deployment_name=None, temperature=0.3,
+                                          prompt_name=None):
+    """
+    Get an LLM with a system prompt applied that returns validated structured output.
+    
+    The model fills the pydantic schema through function calling. Output that
+    does not validate is requested again (up to STRUCTURED_OUTPUT_ATTEMPTS times)
+    before StructuredOutputError is raised. Cached responses are stored as the
+    validated JSON.
+    
+    Args:
+        system_prompt: The system prompt to apply
+        schema: Pydantic model class describing the output
+        deployment_name: Override the deployment name
+        temperature: Temperature setting for the LLM
+        prompt_name: Node or prompt name under which token usage is recorded (see src.token_usage)
+        
+    Returns:
+        A callable taking messages and returning a schema instance
+    """
+    if not deployment_name:
+        deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    dispatch, _ = _get_dispatchers(
+        deployment_name, temperature,
+        bind=lambda llm: llm.with_structured_output(schema, method="function_calling", include_raw=True)
+    )
+    response_schema = schema.model_json_schema()
+    
+    def invoke_structured(messages):
+        messages = _with_system_prompt(system_prompt, messages)
+        
+        cache, key, cached = _lookup_cached_response(messages, deployment_name, temperature, response_schema)
+        if cached is not None:
+            return schema.model_validate_json(cached.content)
+        
+        for attempt in range(1, STRUCTURED_OUTPUT_ATTEMPTS + 1):
+            output = dispatch(lambda llm: llm.invoke(messages), estimate_message_tokens(messages))
+            record_token_usage(prompt_name, output["raw"])
+            if output["parsed"] is not None:
+                break
+            logger.warning(f"{schema.__name__} output failed validation (attempt {attempt}): {output['parsing_error']}")
+        else:
+            raise StructuredOutputError(f"Model output did not match {schema.__name__}: {output['parsing_error']}")
+        
+        parsed = output["parsed"]
+        if cache is not None:
+            cache.set(key, parsed.model_dump_json())
+        return parsed
+    
+    return _traced(invoke_structured, prompt_name, deployment_name, schema)
+
+def get_async_structured_llm_with_system_prompt(system_prompt, schema, deployment_name=None, temperature=0.3,
+                                                prompt_name=None):
+    """
+    Asyncio variant of get_structured_llm_with_system_prompt().
+    
+    Args:
+        system_prompt: The system prompt to apply
+        schema: Pydantic model class describing the output
+        deployment_name: Override the deployment name
+        temperature: Temperature setting for the LLM
+        prompt_name: Node or prompt name under which token usage is recorded
+        
+    Returns:
+        An async callable taking messages and returning a schema instance
+    """
+    if not deployment_name:
+        deployment_name = os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    _, adispatch = _get_dispatchers(
+        deployment_name, temperature,
+        bind=lambda llm: llm.with_structured_output(schema, method="function_calling", include_raw=True)
+    )
+    response_schema = schema.model_json_schema()
+    
+    async def ainvoke_structured(messages):
+        messages = _with_system_prompt(system_prompt, messages)
+        
+        cache, key, cached = _lookup_cached_response(messages, deployment_name, temperature, response_schema)
+        if cached is not None:
+            return schema.model_validate_json(cached.content)
+        
+        for attempt in range(1, STRUCTURED_OUTPUT_ATTEMPTS + 1):
+            output = await adispatch(lambda llm: llm.ainvoke(messages), estimate_message_tokens(messages))
+            record_token_usage(prompt_name, output["raw"])
+            if output["parsed"] is not None:
+                break
+            logger.warning(f"{schema.__name__} output failed validation (attempt {attempt}): {output['parsing_error']}")
+        else:
+            raise StructuredOutputError(f"Model output did not match {schema.__name__}: {output['parsing_error']}")
+        
+        parsed = output["parsed"]
+        if cache is not None:
+            cache.set(key, parsed.model_dump_json())
+        return parsed
     
-    return invoke_with_system 
\ No newline at end of file
+    return _atraced(ainvoke_structured, prompt_name, deployment_name, schema)
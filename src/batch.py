@@ -0,0 +1,162 @@
+"""
+Batch processing helpers: note discovery, a worker pool and streaming CSV output.
+"""
+
+import os
+import csv
+import glob
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# File extensions treated as medical notes when scanning a directory
+NOTE_EXTENSIONS = (".txt",)
+
+def iter_note_paths(source: str) -> Iterator[str]:
+    """
+    Lazily yield note paths from a directory, glob pattern or manifest file.
+
+    - Directory: every .txt file below it, in sorted order
+    - Glob pattern (contains *, ? or [): every matching file, recursive with **
+    - Manifest file: one note path per line; for .csv manifests the "path"
+      column (or the first column). Relative paths resolve against the manifest's directory.
+
+    Args:
+        source: Directory, glob pattern or manifest path
+
+    Yields:
+        str: Path to each medical note
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(NOTE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    elif any(char in source for char in "*?["):
+        for path in glob.iglob(source, recursive=True):
+            if os.path.isfile(path):
+                yield path
+    elif os.path.isfile(source):
+        yield from _iter_manifest(source)
+    else:
+        raise FileNotFoundError(f"Batch source not found: {source}")
+
+def _iter_manifest(manifest_path: str) -> Iterator[str]:
+    """Yield note paths listed in a manifest file"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        if manifest_path.lower().endswith(".csv"):
+            reader = csv.DictReader(f)
+            column = "path" if "path" in (reader.fieldnames or []) else reader.fieldnames[0]
+            entries = (row[column] for row in reader)
+        else:
+            entries = f
+
+        for entry in entries:
+            entry = entry.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            yield entry if os.path.isabs(entry) else os.path.join(base_dir, entry)
+
+class StreamingCsvWriter:
+    """
+    Append-only CSV writer that flushes every row to disk.
+
+    Rows written before a crash survive it, and the header is only written
+    when the file is new or empty, so a batch can append to an existing file.
+    """
+
+    def __init__(self, path: str, fieldnames: List[str]):
+        """
+        Open the CSV file for appending.
+
+        Args:
+            path: Path to the CSV file
+            fieldnames: Column names, in output order
+        """
+        self.path = path
+        self.fieldnames = fieldnames
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore')
+        if is_new:
+            self._writer.writeheader()
+            self._sync()
+
+    def write_row(self, row: Dict[str, str]) -> None:
+        """Write one row and force it to disk"""
+        self._writer.writerow(row)
+        self._sync()
+
+    def _sync(self) -> None:
+        """Flush Python and OS buffers so the row survives a crash"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """Close the CSV file"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def run_batch(note_paths: Iterable[str], process_note: Callable[[str], Optional[Dict[str, str]]],
+              writer: StreamingCsvWriter, workers: int = 4) -> Dict[str, int]:
+    """
+    Process notes on a thread pool, writing each CSV row as soon as its note finishes.
+
+    Only about two notes per worker are in flight at any time and note paths
+    are consumed lazily, so memory stays flat however many notes there are.
+
+    Args:
+        note_paths: Iterable of note paths (e.g. from iter_note_paths)
+        process_note: Function mapping a note path to a CSV row dict, or None for a
+            note that needs no new row (e.g. already finished in an earlier run)
+        writer: Destination for the rows
+        workers: Number of worker threads
+
+    Returns:
+        Dict with counts of processed, skipped and failed notes
+    """
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    max_in_flight = max(1, workers * 2)
+
+    def _collect(done):
+        for future in done:
+            note_path = futures.pop(future)
+            try:
+                row = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                logger.error(f"Error processing {note_path}: {e}")
+                continue
+            if row is None:
+                counts["skipped"] += 1
+                continue
+            writer.write_row(row)
+            counts["processed"] += 1
+            if counts["processed"] % 100 == 0:
+                logger.info(f"Batch progress: {counts['processed']} processed, {counts['failed']} failed")
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for note_path in note_paths:
+            if len(futures) >= max_in_flight:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                _collect(done)
+            futures[executor.submit(process_note, note_path)] = note_path
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            _collect(done)
+
+    logger.info(f"Batch finished: {counts['processed']} processed, "
+                f"{counts['skipped']} skipped, {counts['failed']} failed")
+    return counts
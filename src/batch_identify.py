@@ -0,0 +1,200 @@
+"""
+Batched cancer identification for short notes.
+
+For short notes the identification system prompt (covered cancers and the
+diagnosis mapping) dominates the request, so several notes are packed into one
+request, each enclosed in <note id="..."> delimiters, and the model returns an
+array of identifications. The response is demultiplexed by note id; notes the
+response does not cover exactly once, and every note of a batch whose request
+fails (invalid output, transport or rate-limit errors), are left to the
+single-note identification step of the graph.
+
+The identifications are passed to process_medical_note() / aprocess_medical_note()
+as prefilled state, and the graph then skips its identification step.
+"""
+
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+
+from .schemas import BatchIdentification, CancerIdentification, StructuredOutputError
+from .cancer_staging_graph import _identify_update, _prompts, _preclassify, _with_preclassification
+from .preclassifier import get_preclassifier_mode
+from .azure_openai_config import get_structured_llm_with_system_prompt, get_async_structured_llm_with_system_prompt
+
+logger = logging.getLogger(__name__)
+
+# Notes per identification request
+DEFAULT_IDENTIFY_BATCH_SIZE = 8
+# Only notes up to this length are batched; longer ones are identified on their own
+MAX_BATCHED_NOTE_CHARS = 4000
+
+_NOTE_ID = re.compile(r"\d+")
+
+def get_identify_batch_size(batch_size: Optional[int] = None) -> int:
+    """Return the identification batch size, defaulting to STAGING_IDENTIFY_BATCH_SIZE"""
+    return batch_size or int(os.getenv("STAGING_IDENTIFY_BATCH_SIZE", DEFAULT_IDENTIFY_BATCH_SIZE))
+
+def build_batch_request(note_texts: List[str]) -> Tuple[str, HumanMessage]:
+    """
+    Build the system prompt and user message identifying several notes at once.
+
+    Notes are numbered from 1 in the order given.
+
+    Args:
+        note_texts: Texts of the notes in the batch
+
+    Returns:
+        Tuple of (system prompt, user message)
+    """
+    # Keep a note from closing its own delimiter early
+    delimited = "\n\n".join(
+        f'<note id="{number}">\n{text.replace("</note", "</ note")}\n</note>'
+        for number, text in enumerate(note_texts, 1)
+    )
+    prompts = _prompts()
+    user_message = HumanMessage(content=prompts.user_prompt(
+        f"Please analyze each of the following {len(note_texts)} medical notes separately and identify its cancer "
+        "type and additional information. If multiple cancer types are mentioned in a note, identify its primary diagnosis.",
+        note=f"Medical Notes:\n{delimited}"
+    ))
+    return prompts.system_prompt("identify_batch"), user_message
+
+def demultiplex(batch_size: int, response: BatchIdentification) -> Dict[int, CancerIdentification]:
+    """
+    Map a batched response back to the notes of the batch.
+
+    Ids like "3", "note 3" or "#3" are accepted. Identifications for unknown
+    ids are ignored, and a note identified more than once with different
+    results is treated as missing.
+
+    Args:
+        batch_size: Number of notes in the batch
+        response: The validated batched response
+
+    Returns:
+        Dict mapping note numbers (from 1) to their identification
+    """
+    found: Dict[int, CancerIdentification] = {}
+    conflicting = set()
+    for item in response.notes:
+        match = _NOTE_ID.search(item.note_id)
+        number = int(match.group()) if match else 0
+        if not 1 <= number <= batch_size:
+            logger.warning(f"Ignoring identification for unknown note id '{item.note_id}'")
+            continue
+        identification = CancerIdentification(**item.model_dump(exclude={"note_id"}))
+        if number in found and found[number] != identification:
+            conflicting.add(number)
+        found[number] = identification
+
+    for number in conflicting:
+        logger.warning(f"Note {number} was identified more than once with different results")
+        del found[number]
+    return found
+
+def _batchable(notes: Iterable[Tuple[Any, str]], preclassifier_mode: str, max_chars: int) -> List[Tuple[Any, str, Any]]:
+    """Select the notes worth batching, with their pre-classification"""
+    selected = []
+    for note_id, note_text in notes:
+        if len(note_text) > max_chars:
+            continue
+        classification = _preclassify({"medical_note": note_text}, preclassifier_mode)
+        # The graph identifies these without any LLM call
+        if preclassifier_mode == "on" and classification["confident"]:
+            continue
+        selected.append((note_id, note_text, classification))
+    return selected
+
+def _batch_updates(batch, response: Optional[BatchIdentification]) -> Dict[Any, Dict[str, Any]]:
+    """Turn a batched response into the prefilled identification state of each note it covers"""
+    if response is None:
+        return {}
+    updates = {}
+    for number, identification in demultiplex(len(batch), response).items():
+        note_id, _, classification = batch[number - 1]
+        update = _with_preclassification(_identify_update([], identification), classification)
+        updates[note_id] = {**update, "identification_method": "llm_batch"}
+    missing = len(batch) - len(updates)
+    if missing:
+        logger.info(f"{missing} of {len(batch)} batched notes fall back to single-note identification")
+    return updates
+
+def _log_batch_failure(batch, error: Exception) -> None:
+    """Log a failed batched request whose notes fall back to single-note identification"""
+    if isinstance(error, StructuredOutputError):
+        reason = f"invalid output: {error}"
+    else:
+        reason = f"{type(error).__name__}: {error}"
+    logger.warning(f"Batched identification of {len(batch)} notes failed ({reason}); identifying them one by one")
+
+def _batches(selected: List, batch_size: int) -> List[List]:
+    """Split the selected notes into batches of at least two notes"""
+    batches = [selected[start:start + batch_size] for start in range(0, len(selected), batch_size)]
+    return [batch for batch in batches if len(batch) > 1]
+
+def identify_notes(notes: Iterable[Tuple[Any, str]], deployment_name=None, batch_size: Optional[int] = None,
+                   preclassifier_mode: Optional[str] = None,
+                   max_chars: int = MAX_BATCHED_NOTE_CHARS) -> Dict[Any, Dict[str, Any]]:
+    """
+    Identify the cancer type of short notes in batched requests.
+
+    Args:
+        notes: (note_id, note_text) pairs
+        deployment_name: Azure OpenAI deployment to use
+        batch_size: Notes per request (defaults to get_identify_batch_size())
+        preclassifier_mode: Pre-classifier mode of the graph the notes will be staged with
+        max_chars: Longest note that is batched
+
+    Returns:
+        Dict mapping note ids to the prefilled identification state for
+        process_medical_note(identification=...); notes absent from it are
+        identified by the graph as usual
+    """
+    preclassifier_mode = get_preclassifier_mode(preclassifier_mode)
+    selected = _batchable(notes, preclassifier_mode, max_chars)
+
+    updates: Dict[Any, Dict[str, Any]] = {}
+    for batch in _batches(selected, get_identify_batch_size(batch_size)):
+        system_prompt, user_message = build_batch_request([note_text for _, note_text, _ in batch])
+        llm = get_structured_llm_with_system_prompt(
+            system_prompt=system_prompt, schema=BatchIdentification, deployment_name=deployment_name,
+            prompt_name="identify_batch"
+        )
+        try:
+            response = llm([user_message])
+        except Exception as e:
+            # Batching is an optimization: any failure only sends the notes through the graph
+            _log_batch_failure(batch, e)
+            response = None
+        updates.update(_batch_updates(batch, response))
+    return updates
+
+async def aidentify_notes(notes: Iterable[Tuple[Any, str]], deployment_name=None, batch_size: Optional[int] = None,
+                          preclassifier_mode: Optional[str] = None,
+                          max_chars: int = MAX_BATCHED_NOTE_CHARS) -> Dict[Any, Dict[str, Any]]:
+    """Async variant of identify_notes(); the batches are requested concurrently"""
+    preclassifier_mode = get_preclassifier_mode(preclassifier_mode)
+    selected = _batchable(notes, preclassifier_mode, max_chars)
+
+    async def _identify(batch):
+        system_prompt, user_message = build_batch_request([note_text for _, note_text, _ in batch])
+        llm = get_async_structured_llm_with_system_prompt(
+            system_prompt=system_prompt, schema=BatchIdentification, deployment_name=deployment_name,
+            prompt_name="identify_batch"
+        )
+        try:
+            return batch, await llm([user_message])
+        except Exception as e:
+            _log_batch_failure(batch, e)
+            return batch, None
+
+    updates: Dict[Any, Dict[str, Any]] = {}
+    for batch, response in await asyncio.gather(*(_identify(batch) for batch in
+                                                  _batches(selected, get_identify_batch_size(batch_size)))):
+        updates.update(_batch_updates(batch, response))
+    return updates
@@ -0,0 +1,647 @@
+"""
+Offline job mode: stage a corpus through provider batch jobs instead of live calls.
+
+The corpus advances through the graph one step at a time. For the current step,
+every note waiting on it gets its LLM request(s) written to a JSONL file in the
+provider batch format, the file is submitted as one job, and the job is polled
+until its output can be read back. The responses are joined to their notes by
+custom_id ("<step>:<note_id>:<part>"), the notes' states are updated with the
+same code the graph nodes use, and deterministic work (pre-classification,
+evidence extraction, staging rules, templated reports) runs locally between
+steps. Job and note states are kept in SQLite in the job directory, so a job
+can be polled from a later process, e.g. a cron job overnight.
+
+Backends:
+
+- LocalFileBackend: stand-in for testing; a job is a directory holding the
+  input file, and is complete once an output file exists in it (written by a
+  responder function, or dropped in by hand)
+- AzureBatchBackend: the Azure OpenAI Batch API (requires a global-batch deployment)
+
+Usage:
+
+    python -m src.batch_jobs run notes/ --job-dir jobs/backfill --backend azure
+    python -m src.batch_jobs status --job-dir jobs/backfill
+    python -m src.batch_jobs results --job-dir jobs/backfill --output results.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from . import cancer_staging_graph as graph
+from .evidence import get_note_context
+from .preclassifier import get_preclassifier_mode
+from .reports import get_report_defer, get_report_mode
+from .schemas import CancerIdentification, StagingCriteriaAnalysis, StageAssignment, StagingDetermination
+from .token_usage import get_token_usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Steps in the order a note passes through them
+JOB_STEPS = ("identify", "analyze", "calculate", "analyze_and_stage", "report")
+STEP_DONE = "done"
+
+# Note statuses within a step
+NOTE_PENDING = "pending"
+NOTE_SUBMITTED = "submitted"
+NOTE_FAILED = "failed"
+
+# Batch job statuses reported by the backends
+JOB_IN_PROGRESS = "in_progress"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+DEFAULT_POLL_INTERVAL = 60.0
+
+# Token usage of each step is recorded under the prompt name of the graph node it replaces
+_STEP_PROMPTS = {
+    "identify": "identify_cancer_type",
+    "analyze": "analyze_staging_criteria",
+    "calculate": "calculate_stage",
+    "analyze_and_stage": "analyze_and_stage",
+    "report": "generate_report",
+}
+
+class LocalFileBackend:
+    """
+    File-based stand-in for a provider batch API.
+
+    Submitting a job copies its input into <directory>/<job_id>/input.jsonl. The
+    job completes when <directory>/<job_id>/output.jsonl exists; with a responder,
+    the output is written at submission by calling responder(request_body) for
+    every request, which returns the chat completion body (or raises to record an
+    error for that request).
+    """
+
+    def __init__(self, directory: str, responder: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        """
+        Args:
+            directory: Directory holding the jobs
+            responder: Optional function answering each request body
+        """
+        self.directory = directory
+        self.responder = responder
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, input_path: str) -> str:
+        """Submit a JSONL request file and return the job id"""
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        job_dir = os.path.join(self.directory, job_id)
+        os.makedirs(job_dir)
+        with open(input_path, encoding="utf-8") as src, open(os.path.join(job_dir, "input.jsonl"), "w", encoding="utf-8") as dst:
+            lines = src.readlines()
+            dst.writelines(lines)
+
+        if self.responder is not None:
+            with open(os.path.join(job_dir, "output.jsonl.tmp"), "w", encoding="utf-8") as out:
+                for line in lines:
+                    request = json.loads(line)
+                    try:
+                        result = {"status_code": 200, "body": self.responder(request["body"])}
+                        out.write(json.dumps({"custom_id": request["custom_id"], "response": result, "error": None}) + "\n")
+                    except Exception as e:
+                        out.write(json.dumps({"custom_id": request["custom_id"], "response": None,
+                                              "error": {"message": str(e)}}) + "\n")
+            os.replace(os.path.join(job_dir, "output.jsonl.tmp"), os.path.join(job_dir, "output.jsonl"))
+        return job_id
+
+    def poll(self, job_id: str) -> str:
+        """Return the job status"""
+        job_dir = os.path.join(self.directory, job_id)
+        if os.path.exists(os.path.join(job_dir, "output.jsonl")):
+            return JOB_COMPLETED
+        if os.path.exists(os.path.join(job_dir, "failed")):
+            return JOB_FAILED
+        return JOB_IN_PROGRESS
+
+    def fetch(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield the output records of a completed job"""
+        with open(os.path.join(self.directory, job_id, "output.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+class AzureBatchBackend:
+    """
+    Azure OpenAI Batch API backend.
+
+    Uses the AZURE_API_KEY, AZURE_ENDPOINT and AZURE_API_VERSION settings; the
+    deployment named in the requests must be a global-batch deployment.
+    """
+
+    # Batch statuses that mean the job will not produce (more) output
+    _FAILED_STATUSES = {"failed", "expired", "cancelled", "cancelling"}
+
+    def __init__(self, client=None, completion_window: str = "24h"):
+        """
+        Args:
+            client: openai.AzureOpenAI client (created from the environment if None)
+            completion_window: Batch completion window
+        """
+        if client is None:
+            from openai import AzureOpenAI
+            client = AzureOpenAI(
+                api_key=os.getenv("AZURE_API_KEY"),
+                api_version=os.getenv("AZURE_API_VERSION"),
+                azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+            )
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        """Upload a JSONL request file, start a batch on it and return the batch id"""
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint="/chat/completions", completion_window=self.completion_window
+        )
+        return batch.id
+
+    def poll(self, job_id: str) -> str:
+        """Return the batch status"""
+        batch = self.client.batches.retrieve(job_id)
+        if batch.status == "completed":
+            return JOB_COMPLETED
+        if batch.status in self._FAILED_STATUSES:
+            return JOB_FAILED
+        return JOB_IN_PROGRESS
+
+    def fetch(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield the output and error records of a completed batch"""
+        batch = self.client.batches.retrieve(job_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+def _parse_response(record: Dict[str, Any], schema, prompt_name: str) -> Any:
+    """
+    Parse one batch output record, recording its token usage under prompt_name.
+
+    Returns:
+        A schema instance, or the message text when schema is None
+
+    Raises:
+        ValueError: If the request failed or its output does not validate
+    """
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code", 200) != 200:
+        raise ValueError(f"Request failed: {record.get('error') or response.get('body')}")
+
+    body = response["body"]
+    usage = body.get("usage") or {}
+    get_token_usage_tracker().record(prompt_name, {
+        "input_tokens": usage.get("prompt_tokens", 0),
+        "output_tokens": usage.get("completion_tokens", 0),
+        "input_token_details": {"cache_read": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)},
+    })
+
+    message = body["choices"][0]["message"]
+    if schema is None:
+        return message.get("content") or ""
+    tool_calls = message.get("tool_calls") or []
+    if not tool_calls:
+        raise ValueError(f"No {schema.__name__} tool call in the response")
+    try:
+        return schema.model_validate_json(tool_calls[0]["function"]["arguments"])
+    except Exception as e:
+        raise ValueError(f"Model output did not match {schema.__name__}: {e}") from e
+
+def _strip_messages(update: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop the conversation messages from a node update; job state keeps only the staging fields"""
+    return {key: value for key, value in update.items() if key != "messages"}
+
+class BatchJobRunner:
+    """
+    Advances a corpus through the staging steps with one batch job per step.
+
+    Note states are kept in <job_dir>/job.db. Call add_notes() once, then step()
+    repeatedly (or run()) until finished() is true, and read results().
+    """
+
+    def __init__(self, job_dir: str, backend, deployment_name: Optional[str] = None, mode: Optional[str] = None,
+                 preclassifier_mode: Optional[str] = None, note_context=None, report_mode: Optional[str] = None,
+                 report_defer: Optional[str] = None, temperature: float = 0.3):
+        """
+        Args:
+            job_dir: Directory for the job database and request files
+            backend: LocalFileBackend, AzureBatchBackend or an object with submit/poll/fetch
+            deployment_name: Deployment named in the requests (defaults to AZURE_GPT4O_DEPLOYMENT)
+            mode, preclassifier_mode, note_context, report_mode, report_defer: As for
+                build_cancer_staging_graph()
+            temperature: Sampling temperature of the requests
+        """
+        self.job_dir = job_dir
+        self.backend = backend
+        self.deployment_name = deployment_name or os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+        self.mode = graph.get_graph_mode(mode)
+        self.preclassifier_mode = get_preclassifier_mode(preclassifier_mode)
+        self.note_context = get_note_context(note_context)
+        self.report_mode = get_report_mode(report_mode)
+        self.report_defer = get_report_defer(report_defer)
+        self.temperature = temperature
+        if self.mode == "fast":
+            self.combined_context = "full" if "full" in (self.note_context["analyze_criteria"],
+                                                         self.note_context["calculate_stage"]) else "evidence"
+
+        os.makedirs(job_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(job_dir, "job.db"), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                note_id TEXT PRIMARY KEY,
+                step TEXT NOT NULL,
+                status TEXT NOT NULL,
+                state TEXT NOT NULL,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                step TEXT NOT NULL,
+                status TEXT NOT NULL,
+                submitted_at REAL NOT NULL,
+                requests INTEGER NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    # Note state storage
+
+    def add_notes(self, notes: Iterable[Tuple[str, str]]) -> int:
+        """
+        Add notes to the job; notes already in it are left unchanged.
+
+        Args:
+            notes: (note_id, note_text) pairs
+
+        Returns:
+            int: Number of notes added
+        """
+        added = 0
+        with self._lock:
+            for note_id, note_text in notes:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO notes (note_id, step, status, state) VALUES (?, ?, ?, ?)",
+                    (str(note_id), "identify", NOTE_PENDING, json.dumps({"medical_note": note_text}))
+                )
+                added += cursor.rowcount
+            self._conn.commit()
+        return added
+
+    def _notes(self, step: str, status: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT note_id, state FROM notes WHERE step = ? AND status = ? ORDER BY note_id", (step, status)
+            ).fetchall()
+        return [(note_id, json.loads(state)) for note_id, state in rows]
+
+    def _save(self, note_id: str, state: Dict[str, Any], step: str, status: str = NOTE_PENDING,
+              error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE notes SET step = ?, status = ?, state = ?, error = ? WHERE note_id = ?",
+                (step, status, json.dumps(state), error, note_id)
+            )
+            self._conn.commit()
+
+    # Per-step work, shared with the graph nodes
+
+    def _next_step(self, step: str, state: Dict[str, Any]) -> str:
+        """Return the step a note goes to after finishing one"""
+        if step == "identify":
+            if not state.get("is_covered_by_toronto"):
+                return "report"
+            return "analyze_and_stage" if self.mode == "fast" else "analyze"
+        if step == "analyze":
+            return "calculate"
+        if step in ("calculate", "analyze_and_stage"):
+            return "report"
+        return STEP_DONE
+
+    def _requests(self, step: str, state: Dict[str, Any]):
+        """
+        Return the LLM requests a note needs for a step, or the update when it needs none.
+
+        Returns:
+            Tuple of (update or None, list of (system prompt, user message, schema or None))
+        """
+        if step == "identify":
+            if state.get("identification_method"):
+                return {}, []
+            classification = graph._preclassify(state, self.preclassifier_mode)
+            if self.preclassifier_mode == "on" and classification["confident"]:
+                return graph._preclassified_update(classification), []
+            system_prompt, user_messages = graph._build_identify_request(state)
+            return None, [(system_prompt, message, CancerIdentification) for message in user_messages]
+
+        if step == "analyze":
+            system_prompt, user_message = graph._build_analyze_request(state, self.note_context["analyze_criteria"])
+            return None, [(system_prompt, user_message, StagingCriteriaAnalysis)]
+
+        if step == "calculate":
+            ruled = graph._rule_based_stage(state)
+            if ruled is not None:
+                return ruled, []
+            system_prompt, user_message = graph._build_stage_request(state, self.note_context["calculate_stage"])
+            return None, [(system_prompt, user_message, StageAssignment)]
+
+        if step == "analyze_and_stage":
+            if graph._rule_based_stage(state) is not None:
+                system_prompt, user_message = graph._build_analyze_request(state, self.combined_context)
+                return None, [(system_prompt, user_message, StagingCriteriaAnalysis)]
+            system_prompt, user_message = graph._build_analyze_and_stage_request(state, self.combined_context)
+            return None, [(system_prompt, user_message, StagingDetermination)]
+
+        # Report
+        if self.report_mode == "none":
+            return {}, []
+        update = graph._report_without_llm(state, self.note_context["generate_report"], self.report_mode,
+                                           self.report_defer)
+        if update is not None:
+            return update, []
+        system_prompt, user_message = graph._build_report_request(state, self.note_context["generate_report"])
+        return None, [(system_prompt, user_message, None)]
+
+    def _apply(self, step: str, state: Dict[str, Any], outputs: List[Any]) -> Dict[str, Any]:
+        """Turn the parsed outputs of a note's requests for a step into its state update"""
+        if step == "identify":
+            classification = graph._preclassify(state, self.preclassifier_mode)
+            identification = graph._merge_chunk_identifications(outputs)
+            update = graph._with_diagnosis_chunks(graph._identify_update([], identification), state, outputs)
+            return graph._with_preclassification(update, classification)
+        if step == "analyze":
+            return graph._analyze_update(state, None, outputs[0])
+        if step == "calculate":
+            return graph._stage_update(state, None, outputs[0])
+        if step == "analyze_and_stage":
+            if isinstance(outputs[0], StagingDetermination):
+                return graph._analyze_and_stage_update(state, None, outputs[0])
+            return graph._with_rule_based_stage(graph._analyze_update(state, None, outputs[0]),
+                                                graph._rule_based_stage(state))
+        return {"report": outputs[0], "report_status": "generated"}
+
+    def _finish_step(self, note_id: str, step: str, state: Dict[str, Any], update: Dict[str, Any]) -> None:
+        """Apply a step's update, run the local work before the next step and save the note"""
+        state.update(_strip_messages(update))
+        next_step = self._next_step(step, state)
+        if step == "identify" and next_step != "report":
+            state.update(graph.extract_staging_evidence(state))
+        self._save(note_id, state, next_step)
+
+    def _request_line(self, custom_id: str, system_prompt: str, user_message, schema) -> str:
+        """Render one request in the batch JSONL format"""
+        body = {
+            "model": self.deployment_name,
+            "temperature": self.temperature,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message.content},
+            ],
+        }
+        if schema is not None:
+            tool = convert_to_openai_tool(schema)
+            body["tools"] = [tool]
+            body["tool_choice"] = {"type": "function", "function": {"name": tool["function"]["name"]}}
+        return json.dumps({"custom_id": custom_id, "method": "POST", "url": "/chat/completions", "body": body})
+
+    # Job control
+
+    def _active_job(self) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT job_id, step FROM jobs WHERE status = ? ORDER BY submitted_at LIMIT 1", (JOB_IN_PROGRESS,)
+            ).fetchone()
+
+    def _submit(self, step: str) -> Optional[str]:
+        """
+        Write and submit the requests of every note pending a step; local-only notes advance directly.
+
+        The notes are marked submitted, together with the job row, only once the
+        backend has accepted the job, so a failed upload leaves them pending.
+        """
+        input_path = os.path.join(self.job_dir, f"{step}-{uuid.uuid4().hex}.jsonl")
+        requests = 0
+        submitted = []
+        with open(input_path, "w", encoding="utf-8") as f:
+            for note_id, state in self._notes(step, NOTE_PENDING):
+                update, note_requests = self._requests(step, state)
+                if update is not None:
+                    self._finish_step(note_id, step, state, update)
+                    continue
+                for part, (system_prompt, user_message, schema) in enumerate(note_requests):
+                    f.write(self._request_line(f"{step}:{note_id}:{part}", system_prompt, user_message, schema) + "\n")
+                    requests += 1
+                submitted.append((note_id, state))
+
+        if not requests:
+            os.remove(input_path)
+            return None
+        job_id = self.backend.submit(input_path)
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE notes SET step = ?, status = ?, state = ?, error = NULL WHERE note_id = ?",
+                    [(step, NOTE_SUBMITTED, json.dumps(state), note_id) for note_id, state in submitted]
+                )
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, step, status, submitted_at, requests) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, step, JOB_IN_PROGRESS, time.time(), requests)
+                )
+        logger.info(f"Submitted {requests} {step} requests as job {job_id}")
+        return job_id
+
+    def _release_orphans(self) -> int:
+        """Return submitted notes to pending when no job is in progress (e.g. after a crash mid-submission)"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE notes SET status = ? WHERE status = ?", (NOTE_PENDING, NOTE_SUBMITTED))
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.warning(f"Returned {cursor.rowcount} submitted notes without a job in progress to pending")
+        return cursor.rowcount
+
+    def _ingest(self, job_id: str, step: str) -> None:
+        """Join a completed job's responses to their notes and advance them"""
+        records: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        for record in self.backend.fetch(job_id):
+            # custom_id is "<step>:<note_id>:<part>"; note IDs such as file paths may contain ":"
+            prefix, part = record["custom_id"].rsplit(":", 1)
+            records.setdefault(prefix.split(":", 1)[1], {})[int(part)] = record
+
+        for note_id, state in self._notes(step, NOTE_SUBMITTED):
+            _, note_requests = self._requests(step, state)
+            note_records = records.get(note_id, {})
+            try:
+                outputs = []
+                for part, (_, _, schema) in enumerate(note_requests):
+                    if part not in note_records:
+                        raise ValueError(f"No response for request {step}:{note_id}:{part}")
+                    outputs.append(_parse_response(note_records[part], schema, _STEP_PROMPTS[step]))
+                update = self._apply(step, state, outputs)
+            except Exception as e:
+                logger.warning(f"Note {note_id} failed at {step}: {e}")
+                self._save(note_id, state, step, NOTE_FAILED, str(e))
+                continue
+            self._finish_step(note_id, step, state, update)
+
+    def _set_job_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+            self._conn.commit()
+
+    def step(self) -> str:
+        """
+        Make progress without blocking: poll the job in flight, or submit the next step.
+
+        Returns:
+            str: "waiting" while a job is in progress, "submitted" after submitting
+            one, "advanced" after ingesting a job or advancing notes locally, or
+            "finished" when no note has steps left
+        """
+        active = self._active_job()
+        if active is not None:
+            job_id, step = active
+            status = self.backend.poll(job_id)
+            if status == JOB_IN_PROGRESS:
+                return "waiting"
+            if status == JOB_COMPLETED:
+                self._ingest(job_id, step)
+            else:
+                logger.error(f"Job {job_id} for {step} failed; its notes are marked failed")
+                for note_id, state in self._notes(step, NOTE_SUBMITTED):
+                    self._save(note_id, state, step, NOTE_FAILED, f"Batch job {job_id} failed")
+            self._set_job_status(job_id, status)
+            return "advanced"
+
+        self._release_orphans()
+        for step in JOB_STEPS:
+            if self._notes(step, NOTE_PENDING):
+                return "submitted" if self._submit(step) else "advanced"
+        return "finished"
+
+    def run(self, poll_interval: float = DEFAULT_POLL_INTERVAL) -> Dict[str, int]:
+        """
+        Step until every note is done or failed, sleeping between polls.
+
+        Returns:
+            Dict with the note counts by step and status (see status())
+        """
+        while True:
+            progress = self.step()
+            if progress == "finished":
+                break
+            if progress == "waiting":
+                time.sleep(poll_interval)
+        return self.status()
+
+    def retry_failed(self) -> int:
+        """Return failed notes to their step so the next step() resubmits them"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE notes SET status = ?, error = NULL WHERE status = ?",
+                                        (NOTE_PENDING, NOTE_FAILED))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def finished(self) -> bool:
+        """Return True when no note is waiting on a step (failed notes count as finished)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM notes WHERE step != ? AND status != ?", (STEP_DONE, NOTE_FAILED)
+            ).fetchone()[0] == 0
+
+    def status(self) -> Dict[str, int]:
+        """Return the number of notes per "step/status" (e.g. "done/pending", "identify/failed")"""
+        with self._lock:
+            rows = self._conn.execute("SELECT step, status, COUNT(*) FROM notes GROUP BY step, status").fetchall()
+        return {f"{step}/{status}": count for step, status, count in rows}
+
+    def results(self) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+        """
+        Yield the results joined by note ID.
+
+        Yields:
+            Tuple of (note_id, result summary as returned by process_medical_note()
+            or None, error or None); notes still in progress are skipped
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT note_id, step, status, state, error FROM notes ORDER BY note_id").fetchall()
+        for note_id, step, status, state, error in rows:
+            state = json.loads(state)
+            if status == NOTE_FAILED:
+                yield note_id, None, error
+            elif step == STEP_DONE:
+                yield note_id, graph._summarize_result(state, state["medical_note"]), None
+
+    def close(self) -> None:
+        """Close the job database"""
+        with self._lock:
+            self._conn.close()
+
+def main(argv=None):
+    """Run, inspect or export a staging batch job"""
+    parser = argparse.ArgumentParser(description="Stage a corpus of notes through provider batch jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Add notes to the job and advance it until every note is done")
+    run_parser.add_argument("source", nargs="?", help="Directory, glob pattern or manifest file of notes to add")
+    run_parser.add_argument("--backend", choices=["azure", "local"], default="azure")
+    run_parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between polls")
+    run_parser.add_argument("--once", action="store_true", help="Make one step of progress and exit (e.g. from cron)")
+    run_parser.add_argument("--retry-failed", action="store_true", help="Resubmit notes that failed a step")
+
+    subparsers.add_parser("status", help="Show the number of notes per step and status")
+
+    results_parser = subparsers.add_parser("results", help="Write the results of finished notes as JSONL")
+    results_parser.add_argument("--output", default="results.jsonl")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--job-dir", required=True, help="Directory holding the job state")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    backend = None
+    if args.command == "run":
+        backend = LocalFileBackend(os.path.join(args.job_dir, "local-jobs")) if args.backend == "local" else AzureBatchBackend()
+    runner = BatchJobRunner(args.job_dir, backend)
+
+    if args.command == "run":
+        if args.source:
+            from .batch import iter_note_paths
+            notes = ((path, open(path, encoding="utf-8").read()) for path in iter_note_paths(args.source))
+            logger.info(f"Added {runner.add_notes(notes)} notes to the job")
+        if args.retry_failed:
+            logger.info(f"Resubmitting {runner.retry_failed()} failed notes")
+        if args.once:
+            print(runner.step())
+        else:
+            runner.run(args.poll_interval)
+        print(json.dumps(runner.status(), indent=2))
+    elif args.command == "status":
+        print(json.dumps(runner.status(), indent=2))
+    else:
+        written = 0
+        with open(args.output, "w", encoding="utf-8") as out:
+            for note_id, result, error in runner.results():
+                if result is not None:
+                    result = {key: value for key, value in result.items() if key != "medical_note"}
+                out.write(json.dumps({"note_id": note_id, "result": result, "error": error}) + "\n")
+                written += 1
+        print(f"Wrote {written} results to {args.output}")
+    runner.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
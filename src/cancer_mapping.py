@@ -0,0 +1,121 @@
+"""
+Mapping from specific cancer diagnoses to their standardized Toronto categories.
+
+Every value must be a key of toronto_staging.json; variants in spelling,
+case and punctuation are handled by src/cancer_resolver.py.
+
+Kept free of CrewAI imports so the LangGraph pipeline can use it directly.
+"""
+
+CANCER_TYPE_MAPPING = {
+    # Non-Hodgkin lymphoma variants
+    "burkitt lymphoma": "Non-Hodgkin Lymphoma",
+    "burkitt's lymphoma": "Non-Hodgkin Lymphoma",
+    "anaplastic large cell lymphoma": "Non-Hodgkin Lymphoma", 
+    "lymphoblastic lymphoma": "Non-Hodgkin Lymphoma",
+    "diffuse large b-cell lymphoma": "Non-Hodgkin Lymphoma",
+    "primary mediastinal b-cell lymphoma": "Non-Hodgkin Lymphoma",
+    "dlbcl": "Non-Hodgkin Lymphoma",
+    
+    # Ewing sarcoma family
+    "ewing sarcoma": "Bone Tumors",
+    "ewing's sarcoma": "Bone Tumors",
+    "primitive neuroectodermal tumor": "Bone Tumors",
+    "pnet": "Bone Tumors",
+    "askin tumor": "Bone Tumors",
+    "osteosarcoma": "Bone Tumors",
+    
+    # Wilms tumor and renal tumors variants
+    "nephroblastoma": "Wilms Tumor (Renal Tumors)",
+    "wilms": "Wilms Tumor (Renal Tumors)",
+    "wilm's tumor": "Wilms Tumor (Renal Tumors)",
+    "wilms' tumor": "Wilms Tumor (Renal Tumors)",
+    "clear cell sarcoma of the kidney": "Wilms Tumor (Renal Tumors)",
+    "rhabdoid tumor of the kidney": "Wilms Tumor (Renal Tumors)",
+    "renal rhabdoid tumor": "Wilms Tumor (Renal Tumors)",
+    
+    # Specific testicular germ cell tumors
+    "testicular yolk sac tumor": "Testicular Germ Cell Tumor",
+    "testicular teratoma": "Testicular Germ Cell Tumor",
+    "testicular dysgerminoma": "Testicular Germ Cell Tumor",
+    "testicular seminoma": "Testicular Germ Cell Tumor",
+    "testicular embryonal carcinoma": "Testicular Germ Cell Tumor",
+    "testicular choriocarcinoma": "Testicular Germ Cell Tumor",
+    "testicular mixed germ cell tumor": "Testicular Germ Cell Tumor",
+    
+    # Specific ovarian germ cell tumors
+    "ovarian yolk sac tumor": "Ovarian Germ Cell Tumor",
+    "ovarian teratoma": "Ovarian Germ Cell Tumor",
+    "ovarian dysgerminoma": "Ovarian Germ Cell Tumor",
+    "ovarian seminoma": "Ovarian Germ Cell Tumor",
+    "ovarian embryonal carcinoma": "Ovarian Germ Cell Tumor",
+    "ovarian choriocarcinoma": "Ovarian Germ Cell Tumor",
+    "ovarian mixed germ cell tumor": "Ovarian Germ Cell Tumor",
+
+    # Leukemia subtypes
+    "b-cell all": "Acute Lymphoblastic Leukemia",
+    "t-cell all": "Acute Lymphoblastic Leukemia",
+    "b-precursor all": "Acute Lymphoblastic Leukemia",
+    "b-lymphoblastic leukemia": "Acute Lymphoblastic Leukemia",
+    "t-lymphoblastic leukemia": "Acute Lymphoblastic Leukemia",
+    "all": "Acute Lymphoblastic Leukemia",
+    "b-all": "Acute Lymphoblastic Leukemia",
+    "t-all": "Acute Lymphoblastic Leukemia",
+    "pre-b all": "Acute Lymphoblastic Leukemia",
+    
+    # Non-rhabdomyosarcoma soft tissue sarcoma variants
+    "synovial sarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "fibrosarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "liposarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "malignant peripheral nerve sheath tumor": "Non-Rhabdo Soft Tissue Sarcoma",
+    "mpnst": "Non-Rhabdo Soft Tissue Sarcoma",
+    "desmoplastic small round cell tumor": "Non-Rhabdo Soft Tissue Sarcoma",
+    "epithelioid sarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "alveolar soft part sarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "clear cell sarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    "nrsts": "Non-Rhabdo Soft Tissue Sarcoma",
+    "non-rhabdomyosarcoma soft tissue sarcoma": "Non-Rhabdo Soft Tissue Sarcoma",
+    
+    # Rhabdomyosarcoma variants
+    "embryonal rhabdomyosarcoma": "Rhabdomyosarcoma",
+    "alveolar rhabdomyosarcoma": "Rhabdomyosarcoma",
+    "pleomorphic rhabdomyosarcoma": "Rhabdomyosarcoma",
+    "spindle cell rhabdomyosarcoma": "Rhabdomyosarcoma",
+    
+    # Hodgkin lymphoma variants
+    "classical hodgkin lymphoma": "Hodgkin Lymphoma",
+    "nodular sclerosis hodgkin lymphoma": "Hodgkin Lymphoma",
+    "mixed cellularity hodgkin lymphoma": "Hodgkin Lymphoma",
+    "lymphocyte-rich hodgkin lymphoma": "Hodgkin Lymphoma",
+    "lymphocyte-depleted hodgkin lymphoma": "Hodgkin Lymphoma",
+    "nodular lymphocyte predominant hodgkin lymphoma": "Hodgkin Lymphoma",
+    "lymphocyte predominant hodgkin lymphoma": "Hodgkin Lymphoma",
+
+    # astrocytoma variants
+    "astrocytoma": "Astrocytoma",
+    "pilocytic astrocytoma": "Astrocytoma",
+    "glioma": "Astrocytoma",
+    "glioblastoma": "Astrocytoma",
+    "gliosarcoma": "Astrocytoma",
+    "gliomatosis cerebri": "Astrocytoma",
+
+    # Medulloblastoma variants
+    "medulloblastoma": "Medulloblastoma (CNS Embryonal Tumors)",
+    "nodular medulloblastoma": "Medulloblastoma (CNS Embryonal Tumors)",
+    "diffuse medulloblastoma": "Medulloblastoma (CNS Embryonal Tumors)",
+    "anaplastic medulloblastoma": "Medulloblastoma (CNS Embryonal Tumors)",
+    # Site-qualified PNETs are CNS embryonal tumors, not the Ewing family "pnet" above
+    "cns pnet": "Medulloblastoma (CNS Embryonal Tumors)",
+    "supratentorial pnet": "Medulloblastoma (CNS Embryonal Tumors)",
+    "pnet of the brain": "Medulloblastoma (CNS Embryonal Tumors)",
+    "pnet of the cns": "Medulloblastoma (CNS Embryonal Tumors)",
+    "cns primitive neuroectodermal tumor": "Medulloblastoma (CNS Embryonal Tumors)",
+    "supratentorial primitive neuroectodermal tumor": "Medulloblastoma (CNS Embryonal Tumors)",
+    "primitive neuroectodermal tumor of the brain": "Medulloblastoma (CNS Embryonal Tumors)",
+    "cns embryonal tumor": "Medulloblastoma (CNS Embryonal Tumors)",
+
+    # neuroblastoma variants
+    "neuroblastoma": "Neuroblastoma",
+    "ganglioneuroblastoma": "Neuroblastoma",
+    "ganglioneuroma": "Neuroblastoma",
+}
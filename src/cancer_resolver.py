@@ -0,0 +1,254 @@
+"""
+Resolution of free-text cancer type labels to canonical Toronto cancer types.
+
+Labels come from the LLM or from notes in many spellings ("Wilms' tumour",
+"Renal Tumors", "Non-Hodgkin's lymphoma", "stage III nephroblastoma"). They are
+normalized (casefolded, punctuation stripped) and looked up in an alias index,
+with a parenthetical site read as "of site" ("clear cell sarcoma (kidney)" is
+"clear cell sarcoma of kidney"). Labels that do not match exactly are resolved
+by the longest alias they contain and then by a character-trigram fuzzy match.
+Both abstain when the label is ambiguous: when it names aliases of two cancer
+types side by side, when its closest alias is a known uncovered cancer that
+resembles a covered one ("extrarenal rhabdoid tumor"), or when it only names a
+histology that the aliases qualify by site ("rhabdoid tumor").
+"""
+
+import re
+import logging
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Minimum trigram similarity (Dice coefficient) for a fuzzy match
+FUZZY_THRESHOLD = 0.75
+# Required similarity lead over the best match for a different cancer type
+FUZZY_MARGIN = 0.1
+# Minimum trigram similarity of the head nouns (last words) of a fuzzy match ("lymphma" ~ "lymphoma")
+FUZZY_HEAD_THRESHOLD = 0.6
+# Single-word aliases shorter than this (e.g. "all") only match a label exactly
+MIN_CONTAINED_ALIAS_LENGTH = 4
+
+# Cancers outside the Toronto system whose names contain or resemble a covered alias
+# (rhabdoid tumors are only staged in the kidney); labels matching them stay unresolved
+# unless a longer covered alias matches ("malignant rhabdoid tumor of the kidney")
+UNCOVERED_LABELS = (
+    "extrarenal rhabdoid tumor", "extra renal rhabdoid tumor", "malignant rhabdoid tumor",
+    "atypical teratoid rhabdoid tumor", "rhabdoid tumor of the liver", "rhabdoid tumor of soft tissue",
+)
+
+_PARENTHETICAL = re.compile(r"\(([^)]*)\)")
+_NON_WORD = re.compile(r"[^\w\s]")
+_BRITISH_SPELLINGS = (("tumour", "tumor"), ("leukaemia", "leukemia"), ("haem", "hem"), ("oesoph", "esoph"))
+
+def normalize_label(label: str) -> str:
+    """
+    Normalize a cancer type label for lookup.
+
+    Casefolds, strips accents, drops apostrophes ("wilms' tumor" -> "wilms tumor"),
+    turns other punctuation into spaces, maps British spellings and collapses whitespace.
+
+    Args:
+        label: Raw label
+
+    Returns:
+        str: Normalized label
+    """
+    text = unicodedata.normalize("NFKD", label).encode("ascii", "ignore").decode("ascii").casefold()
+    text = text.replace("'s ", " ").replace("'", "")
+    text = _NON_WORD.sub(" ", text)
+    for british, american in _BRITISH_SPELLINGS:
+        text = text.replace(british, american)
+    return " ".join(text.split())
+
+def _site_key(key: str) -> str:
+    """Drop the article of a site qualifier in a normalized label ("of the kidney" -> "of kidney")"""
+    return key.replace(" of the ", " of ")
+
+def _site_form(label: str) -> Optional[str]:
+    """Read parenthetical synonyms as sites ("clear cell sarcoma (kidney)" -> "clear cell sarcoma of kidney")"""
+    if not _PARENTHETICAL.search(label):
+        return None
+    return _PARENTHETICAL.sub(lambda match: f" of {match.group(1)} ", label)
+
+def label_variants(label: str) -> List[str]:
+    """Return the label plus its parenthetical synonyms: "A (B)" -> ["A (B)", "A", "B"]"""
+    variants = [label]
+    synonyms = _PARENTHETICAL.findall(label)
+    if synonyms:
+        variants.append(_PARENTHETICAL.sub(" ", label))
+        variants.extend(synonyms)
+    return [variant for variant in variants if variant.strip()]
+
+def _trigrams(text: str) -> Set[str]:
+    """Return the character trigrams of a normalized label, padded at word edges"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _similarity(first: Set[str], second: Set[str]) -> float:
+    """Return the Dice coefficient of two trigram sets"""
+    return 2 * len(first & second) / (len(first) + len(second)) if first or second else 0.0
+
+def _same_head(key: str, alias: str) -> bool:
+    """Return True if two labels share their head noun (last word), allowing typos"""
+    key_head, alias_head = key.rsplit(" ", 1)[-1], alias.rsplit(" ", 1)[-1]
+    return key_head == alias_head or _similarity(_trigrams(key_head), _trigrams(alias_head)) >= FUZZY_HEAD_THRESHOLD
+
+class CancerTypeResolver:
+    """
+    Index of cancer type aliases resolving any label to a canonical Toronto cancer type.
+    """
+
+    def __init__(self, canonical_types: Iterable[str], alias_mapping: Optional[Dict[str, str]] = None):
+        """
+        Build the alias index.
+
+        Args:
+            canonical_types: The Toronto cancer types (keys of the staging data)
+            alias_mapping: Mapping from specific diagnoses to Toronto cancer types
+        """
+        self.canonical_types = list(canonical_types)
+        self._index: Dict[str, str] = {}
+
+        for canonical in self.canonical_types:
+            for variant in label_variants(canonical):
+                self._add(variant, canonical)
+
+        canonical_by_key = {normalize_label(canonical): canonical for canonical in self.canonical_types}
+        for alias, target in (alias_mapping or {}).items():
+            canonical = canonical_by_key.get(normalize_label(target)) or self._index.get(normalize_label(target))
+            if canonical is None:
+                logger.warning(f"Alias '{alias}' maps to '{target}', which is not a Toronto cancer type")
+                continue
+            self._add(alias, canonical)
+
+        # Trigram postings for the fuzzy matcher
+        self._alias_trigrams: Dict[str, Set[str]] = {alias: _trigrams(alias) for alias in self._index}
+        self._postings: Dict[str, List[str]] = {}
+        for alias, grams in self._alias_trigrams.items():
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(alias)
+
+        # Multi-word and longer aliases, longest first, for containment matching
+        self._contained_aliases: List[Tuple[str, str]] = sorted(
+            ((f" {alias} ", canonical) for alias, canonical in self._index.items()
+             if " " in alias or len(alias) >= MIN_CONTAINED_ALIAS_LENGTH),
+            key=lambda item: len(item[0]), reverse=True
+        )
+
+        # Uncovered cancers compete with the aliases in containment and fuzzy matching
+        uncovered_keys = {_site_key(normalize_label(label)) for label in UNCOVERED_LABELS}
+        self._contained_aliases = sorted(
+            self._contained_aliases + [(f" {key} ", None) for key in uncovered_keys],
+            key=lambda item: len(item[0]), reverse=True
+        )
+        for key in uncovered_keys:
+            self._alias_trigrams[key] = _trigrams(key)
+            for gram in self._alias_trigrams[key]:
+                self._postings.setdefault(gram, []).append(key)
+        self._uncovered = uncovered_keys
+
+        self._resolve_cached = lru_cache(maxsize=4096)(self._resolve)
+
+    def _add(self, label: str, canonical: str) -> None:
+        """Index one alias, keeping the first canonical type registered for it"""
+        key = _site_key(normalize_label(label))
+        if not key:
+            return
+        existing = self._index.setdefault(key, canonical)
+        if existing != canonical:
+            logger.debug(f"Alias '{key}' already maps to '{existing}'; ignoring '{canonical}'")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def resolve(self, label: Optional[str]) -> Optional[str]:
+        """
+        Resolve a label to its canonical Toronto cancer type.
+
+        Args:
+            label: Cancer type as named by the model or the note
+
+        Returns:
+            The canonical cancer type, or None if the label is not recognized
+        """
+        if not label:
+            return None
+        return self._resolve_cached(label)
+
+    def _resolve(self, label: str) -> Optional[str]:
+        """Uncached resolution: exact (site forms before bare parentheticals), contained alias, then fuzzy"""
+        variants = label_variants(label)
+        site_form = _site_form(label)
+        if site_form:
+            variants.insert(1, site_form)
+        for variant in variants:
+            canonical = self._index.get(_site_key(normalize_label(variant)))
+            if canonical is not None:
+                return canonical
+
+        key = _site_key(normalize_label(site_form or label))
+        if not key:
+            return None
+
+        contained = self._contained_match(key)
+        if contained is not None:
+            return contained or None
+        return self._fuzzy_match(key)
+
+    def _contained_match(self, key: str) -> Optional[str]:
+        """
+        Return the canonical type of the longest alias contained in a label.
+
+        Returns:
+            The canonical type; "" if the label is ambiguous (it names an uncovered
+            cancer, or aliases of another type apart from the longest one); None if
+            it contains no alias
+        """
+        padded = f" {key} "
+        best = None
+        for alias, canonical in self._contained_aliases:
+            start = padded.find(alias)
+            if start < 0:
+                continue
+            # Spans without the padding spaces, so adjacent aliases do not overlap
+            span = (start + 1, start + len(alias) - 1)
+            if best is None:
+                best = (span, canonical)
+            elif canonical != best[1] and (span[1] <= best[0][0] or best[0][1] <= span[0]):
+                logger.debug(f"'{key}' names both '{best[1]}' and '{canonical}'; not resolving it")
+                return ""
+        if best is None:
+            return None
+        return best[1] or ""
+
+    def _fuzzy_match(self, key: str) -> Optional[str]:
+        """Return the canonical type of the most similar alias with the same head noun, if similar and unambiguous enough"""
+        grams = _trigrams(key)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for alias in self._postings.get(gram, ()):
+                shared[alias] = shared.get(alias, 0) + 1
+
+        best_by_type: Dict[Optional[str], float] = {}
+        padded = f" {key} "
+        for alias, count in shared.items():
+            # A bare histology ("rhabdoid tumor") says nothing of the site its aliases require
+            if not _same_head(key, alias) or (alias != key and padded in f" {alias} "):
+                continue
+            score = 2 * count / (len(grams) + len(self._alias_trigrams[alias]))
+            canonical = None if alias in self._uncovered else self._index[alias]
+            if score > best_by_type.get(canonical, 0.0):
+                best_by_type[canonical] = score
+
+        if not best_by_type:
+            return None
+        ranked = sorted(best_by_type.items(), key=lambda item: item[1], reverse=True)
+        canonical, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if canonical is None or score < FUZZY_THRESHOLD or score - runner_up < FUZZY_MARGIN:
+            return None
+
+        logger.debug(f"Fuzzy-resolved '{key}' to '{canonical}' (similarity {score:.2f})")
+        return canonical
@@ -2,21 +2,50 @@
 LangGraph implementation of cancer staging workflow
 """
 
-import json
 import os
+import asyncio
 import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
 from typing import Annotated, Dict, List, Any, Optional
 from typing_extensions import TypedDict
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.tools import tool
+from langchain_core.runnables import RunnableLambda
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
-from .azure_openai_config import get_azure_openai_llm, get_llm_with_system_prompt
+from .knowledge_base import get_staging_kb, load_staging_data
+from .staging_rules import evaluate_stage
+from .preclassifier import get_preclassifier, get_preclassifier_mode
+from .evidence import DEFAULT_EVIDENCE_CHARS, get_evidence_extractor, get_note_context, render_evidence
+from .note_segmenter import chunk_note, get_chunk_chars
+from .node_metrics import merge_node_metrics, node_metrics, total_node_metrics
+from .tracing import span
+from .prompts import get_prompt_builder
+from .reports import get_report_defer, get_report_mode, get_report_queue, render_report, review_reason
+from .run_ledger import hash_note
+from .schemas import (
+    CancerIdentification,
+    StagingCriteriaAnalysis,
+    StageAssignment,
+    StagingDetermination,
+    merge_identifications,
+    normalize_stage,
+    select_identifications,
+)
+from .azure_openai_config import (
+    get_azure_openai_llm,
+    get_llm_with_system_prompt,
+    get_async_llm_with_system_prompt,
+    get_structured_llm_with_system_prompt,
+    get_async_structured_llm_with_system_prompt,
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -37,277 +66,688 @@ class CancerStagingState(TypedDict):
     primary_site: str  # Primary site of the cancer
     metastasis_sites: str  # Any mentioned sites of metastasis
     extracted_stage: str  # Any explicitly mentioned stage in the note
+    staging_method: Optional[str]  # "rules" if the stage was computed deterministically, else "llm"
+    identification_method: Optional[str]  # "preclassifier" (no LLM call), "llm" or "llm_batch" (batched request)
+    preclassified_cancer_type: Optional[str]  # Confident pre-classifier label, if any
+    evidence: Optional[List[Dict]]  # Staging-relevant snippets of the note, with character offsets
+    diagnosis_chunks: Optional[List[List[int]]]  # [start, end] of the chunks of a long note that named the diagnosis
+    report_status: Optional[str]  # "generated", "template", "queued" or "skipped"
+    node_metrics: Annotated[Dict[str, Dict], merge_node_metrics]  # Timing, token and cost metrics per node
 
 # Helper functions for cancer mapping
 def load_toronto_staging_data():
-    """Load the Toronto staging data from the JSON file"""
-    try:
-        # Try to load from default location
-        default_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            'toronto_staging.json'
-        )
-        
-        # If not found, try alternative locations
-        if not os.path.exists(default_path):
-            alt_paths = [
-                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                           'toronto_staging.json'),
-            ]
-            
-            for path in alt_paths:
-                if os.path.exists(path):
-                    default_path = path
-                    break
-                    
-        # Load the data
-        with open(default_path, 'r') as f:
-            data = json.load(f)
-            logger.info(f"Successfully loaded staging data from {default_path}")
-            return data
-    except Exception as e:
-        logger.error(f"Error loading Toronto staging data: {e}")
-        # Return empty dict if file not found
-        return {}
+    """Load the Toronto staging data (parsed once per process and shared; see src/knowledge_base.py)"""
+    return load_staging_data()
+
+def _prompts():
+    """Get the prompt builder for the shared staging knowledge base"""
+    return get_prompt_builder(get_staging_kb())
+
+def __getattr__(name):
+    """Resolve the staging data on first use, so importing the workflow doesn't parse toronto_staging.json"""
+    if name == "TORONTO_STAGING_DATA":
+        return load_toronto_staging_data()
+    if name == "TORONTO_COVERED_CANCERS":
+        return list(load_toronto_staging_data().keys())
+    # Prompt fragments and lookup tables, built once from the staging data and shared with src.agents
+    if name == "STAGING_KB":
+        return get_staging_kb()
+    if name == "PROMPTS":
+        return _prompts()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Maximum number of chunks of one long note identified concurrently by the sync node
+MAX_CHUNK_WORKERS = 4
 
-# Load staging data
-TORONTO_STAGING_DATA = load_toronto_staging_data()
-TORONTO_COVERED_CANCERS = list(TORONTO_STAGING_DATA.keys())
+# "fast" analyzes the criteria and assigns the stage in one LLM call; "audit"
+# makes a separate call for each, keeping the criteria analysis as its own step.
+# Audit stays the default so existing callers keep their steps and output; fast is opt-in
+GRAPH_MODES = ("fast", "audit")
+DEFAULT_GRAPH_MODE = "audit"
 
 # Cancer mapping for standard terminology
 def get_cancer_mapping_text():
     """Format cancer mapping for use in prompts"""
-    from src.agents import CANCER_TYPE_MAPPING
-    
-    mapping_text = ""
-    for specific, standard in CANCER_TYPE_MAPPING.items():
-        mapping_text += f"- {specific} → {standard}\n"
-    
-    return mapping_text
+    return get_staging_kb().mapping_text
 
 # Cancer stages reference text
 def get_stage_terminology_text():
     """Format stage terminology for use in prompts"""
-    stage_terminology_text = ""
-    for cancer_type, data in TORONTO_STAGING_DATA.items():
-        stages = list(data.get("stages", {}).keys())
-        stage_terminology_text += f"{cancer_type}: {', '.join(stages)}\n"
-    
-    return stage_terminology_text
+    return get_staging_kb().stage_terminology_text
+
+def _staging_cancer_type(state: CancerStagingState):
+    """Return the canonical Toronto cancer type to stage, falling back to the raw label"""
+    return (get_staging_kb().resolve(state.get("standardized_cancer_type"))
+            or get_staging_kb().resolve(state.get("cancer_type"))
+            or state.get("standardized_cancer_type") or state.get("cancer_type"))
+
+def _routed_note(state: CancerStagingState):
+    """
+    Return the excerpts of a note longer than the chunk budget that fit in one prompt.
+
+    The chunks that named the diagnosis are sent whole when they fit the budget;
+    otherwise the most staging-relevant sentences are, from those chunks first.
+    """
+    note = state["medical_note"]
+    budget = get_chunk_chars()
+    ranges = [tuple(chunk) for chunk in state.get("diagnosis_chunks") or []]
+    if ranges and sum(end - start for start, end in ranges) <= budget:
+        excerpts = [{"start": start, "end": end, "text": note[start:end]} for start, end in ranges]
+    else:
+        excerpts = get_evidence_extractor(get_staging_kb()).extract(note, _staging_cancer_type(state),
+                                                              max_chars=budget, prefer=ranges)
+    return excerpts
+
+def _note_for_prompt(state: CancerStagingState, note_context="full"):
+    """
+    Return the note section of a prompt.
+
+    This is the full note, or its evidence snippets for a note over the evidence
+    budget. A note too long for one prompt is routed to its excerpts about the
+    diagnosis (see _routed_note()).
+    """
+    evidence = state.get("evidence")
+    if note_context == "evidence" and evidence and len(state["medical_note"]) > DEFAULT_EVIDENCE_CHARS:
+        return ("Staging-relevant excerpts from the medical note (character offsets in brackets):\n"
+                f"{render_evidence(evidence)}")
+    if len(state["medical_note"]) > get_chunk_chars():
+        return ("Excerpts of a long medical note about the diagnosis (character offsets in brackets):\n"
+                f"{render_evidence(_routed_note(state))}")
+    return f"Medical Note:\n{state['medical_note']}"
 
 # Node functions for our workflow
-def identify_cancer_type(state: CancerStagingState):
+#
+# Each LLM node is split into a request builder (system prompt + user message)
+# and a response handler (state update), so the synchronous nodes used by
+# graph.invoke() and the async nodes used by graph.ainvoke() share one definition.
+
+def _build_identify_request(state: CancerStagingState):
+    """Build the system prompt and user messages for cancer identification, one per note chunk"""
+    system_prompt = _prompts().system_prompt("identify_cancer_type")
+    
+    # Prepare one user message per chunk; notes within the chunk budget get a single message
+    chunks = chunk_note(state["medical_note"])
+    if len(chunks) == 1:
+        return system_prompt, [HumanMessage(content=_prompts().user_prompt(
+            "Please analyze this medical note and identify the cancer type and additional information. If multiple cancer types are mentioned, identify the primary diagnosis.",
+            note=f"Medical Note:\n{state['medical_note']}"
+        ))]
+    
+    user_messages = []
+    for number, chunk in enumerate(chunks, 1):
+        sections = ", ".join(chunk["sections"]) or "untitled"
+        user_messages.append(HumanMessage(content=_prompts().user_prompt(
+            "Please analyze this excerpt of a long medical note and identify the cancer type and additional information. If multiple cancer types are mentioned, identify the primary diagnosis. If the excerpt does not state a diagnosis, leave cancer_type empty.",
+            note=f"Excerpt {number} of {len(chunks)} (sections: {sections}):\n{chunk['text']}"
+        )))
+    return system_prompt, user_messages
+
+def _identify_update(user_messages, identification: CancerIdentification):
+    """Turn the validated identification into a state update"""
+    response = AIMessage(content=identification.model_dump_json(indent=2))
+
+    # Only a category that resolves to a Toronto cancer type can be staged downstream
+    standardized_type = (get_staging_kb().resolve(identification.standardized_category)
+                         or get_staging_kb().resolve(identification.cancer_type))
+    is_covered = identification.is_covered_by_toronto and standardized_type is not None
+
+    # Update state
+    return {
+        "cancer_type": identification.cancer_type,
+        "standardized_cancer_type": standardized_type or identification.standardized_category,
+        "is_covered_by_toronto": is_covered,
+        "primary_site": identification.primary_site,
+        "metastasis_sites": identification.metastasis_sites,
+        "extracted_stage": identification.extracted_stage,
+        "messages": [*user_messages, response]
+    }
+
+def _preclassify(state: CancerStagingState, preclassifier_mode):
+    """Run the rule-based pre-classifier unless it is switched off"""
+    if preclassifier_mode == "off":
+        return None
+    return get_preclassifier(get_staging_kb().cancer_types).classify(state["medical_note"])
+
+def _preclassified_update(classification):
+    """Build the identification update for a note the pre-classifier labeled confidently"""
+    cancer_type = classification["cancer_type"]
+    return {
+        "cancer_type": classification["label"],
+        "standardized_cancer_type": cancer_type,
+        "is_covered_by_toronto": cancer_type in get_staging_kb().cancer_types,
+        "identification_method": "preclassifier",
+        "preclassified_cancer_type": cancer_type,
+        "messages": [AIMessage(content=f"Cancer Type: {classification['label']}\nStandardized Category: {cancer_type}")]
+    }
+
+def _with_preclassification(update, classification):
+    """Record the pre-classifier's label next to the LLM identification, logging disagreements"""
+    preclassified = classification["cancer_type"] if classification and classification["confident"] else None
+    if preclassified and preclassified != update["standardized_cancer_type"]:
+        logger.info(f"Pre-classifier labeled {preclassified}, LLM identified {update['standardized_cancer_type']}")
+    return {**update, "identification_method": "llm", "preclassified_cancer_type": preclassified}
+
+def _merge_chunk_identifications(identifications):
+    """Merge per-chunk identifications of a long note, in chunk order"""
+    if len(identifications) == 1:
+        return identifications[0]
+    merged = merge_identifications(identifications, get_staging_kb().resolve)
+    logger.info(f"Merged {len(identifications)} chunk identifications into {merged.standardized_category or merged.cancer_type}")
+    return merged
+
+def _with_diagnosis_chunks(update, state: CancerStagingState, identifications):
+    """Record which chunks of a long note named the merged diagnosis, for routing the later nodes"""
+    if len(identifications) == 1:
+        return update
+    chunks = chunk_note(state["medical_note"])
+    selected = select_identifications(identifications, get_staging_kb().resolve)
+    return {**update, "diagnosis_chunks": [[chunks[index]["start"], chunks[index]["end"]] for index in selected]}
+
+def identify_cancer_type(state: CancerStagingState, deployment_name=None, preclassifier_mode="off"):
     """Identify cancer type from medical note"""
-    llm = get_llm_with_system_prompt(
-        system_prompt=f"""You are a pediatric oncologist specialized in identifying cancer types from medical notes.
-        You extract information about cancer diagnoses in pediatric patients and map them to standardized categories.
-        
-        The Toronto Pediatric Cancer Staging System ONLY covers these cancer types:
-        {', '.join(TORONTO_COVERED_CANCERS)}
-        
-        Here is the mapping from specific diagnoses to their standardized categories:
-        {get_cancer_mapping_text()}
-        
-        Always check if an identified cancer type maps to one of the standardized Toronto categories.
-        
-        ADDITIONALLY, please extract:
-        1. Primary site (location) of the cancer
-        2. Any mentioned sites of metastasis
-        3. Any explicitly mentioned stage in the note (e.g., "Stage III")
-        """
-    )
+    # Already identified in a batched request (see src/batch_identify.py)
+    if state.get("identification_method"):
+        return {}
     
-    # Prepare user message with the medical note
-    user_message = HumanMessage(
-        content=f"Please analyze this medical note and identify the cancer type and additional information. If multiple cancer types are mentioned, identify the primary diagnosis.\n\nMedical Note:\n{state['medical_note']}"
+    # Skip the LLM when the note names its diagnosis unambiguously
+    classification = _preclassify(state, preclassifier_mode)
+    if preclassifier_mode == "on" and classification["confident"]:
+        return _preclassified_update(classification)
+    
+    system_prompt, user_messages = _build_identify_request(state)
+    llm = get_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=CancerIdentification, deployment_name=deployment_name,
+        prompt_name="identify_cancer_type"
     )
     
-    # Call the LLM to identify cancer type
-    response = llm([user_message])
+    # Call the LLM to identify cancer type, on the chunks of a long note in parallel
+    if len(user_messages) == 1:
+        identifications = [llm(user_messages)]
+    else:
+        # Each chunk runs in a copy of this context so its calls count towards the node's metrics
+        contexts = [copy_context() for _ in user_messages]
+        with ThreadPoolExecutor(max_workers=min(len(user_messages), MAX_CHUNK_WORKERS)) as executor:
+            identifications = list(executor.map(lambda context, message: context.run(llm, [message]),
+                                                contexts, user_messages))
     
-    # Parse response to extract information
-    # For a real implementation, you would use a structured output parser
-    content = response.content
-    cancer_type = content.split("Cancer Type:")[1].split("\n")[0].strip() if "Cancer Type:" in content else None
-    standardized_type = content.split("Standardized Category:")[1].split("\n")[0].strip() if "Standardized Category:" in content else None
-    is_covered = "NOT COVERED BY THE TORONTO PEDIATRIC CANCER STAGING SYSTEM" not in content
+    identification = _merge_chunk_identifications(identifications)
+    update = _with_diagnosis_chunks(_identify_update(user_messages, identification), state, identifications)
+    return _with_preclassification(update, classification)
+
+async def aidentify_cancer_type(state: CancerStagingState, deployment_name=None, preclassifier_mode="off"):
+    """Async variant of identify_cancer_type()"""
+    if state.get("identification_method"):
+        return {}
     
-    # Extract additional information
-    primary_site = content.split("Primary Site:")[1].split("\n")[0].strip() if "Primary Site:" in content else "Not specified"
-    metastasis_sites = content.split("Metastasis Sites:")[1].split("\n")[0].strip() if "Metastasis Sites:" in content else "None identified"
-    extracted_stage = content.split("Extracted Stage:")[1].split("\n")[0].strip() if "Extracted Stage:" in content else "Not mentioned"
+    classification = _preclassify(state, preclassifier_mode)
+    if preclassifier_mode == "on" and classification["confident"]:
+        return _preclassified_update(classification)
     
-    # Update state
+    system_prompt, user_messages = _build_identify_request(state)
+    llm = get_async_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=CancerIdentification, deployment_name=deployment_name,
+        prompt_name="identify_cancer_type"
+    )
+    
+    identifications = list(await asyncio.gather(*(llm([message]) for message in user_messages)))
+    identification = _merge_chunk_identifications(identifications)
+    update = _with_diagnosis_chunks(_identify_update(user_messages, identification), state, identifications)
+    return _with_preclassification(update, classification)
+
+def _skip_uncovered_analysis(state: CancerStagingState):
+    """Return the criteria update for a cancer not covered by Toronto, or None to proceed"""
+    if state.get("is_covered_by_toronto", False):
+        return None
+    
+    # Skip if cancer is not covered by Toronto system
     return {
-        "cancer_type": cancer_type,
-        "standardized_cancer_type": standardized_type,
-        "is_covered_by_toronto": is_covered,
-        "primary_site": primary_site,
-        "metastasis_sites": metastasis_sites,
-        "extracted_stage": extracted_stage,
-        "messages": [user_message, response]
+        "identified_criteria": {},
+        "messages": [
+            HumanMessage(content=f"This cancer type ({state.get('cancer_type', 'Unknown')}) is not covered by the Toronto Pediatric Cancer Staging System."),
+            AIMessage(content="I cannot perform staging as this cancer type is not covered by the Toronto Pediatric Cancer Staging System.")
+        ]
     }
 
-def analyze_staging_criteria(state: CancerStagingState):
-    """Analyze staging criteria for the identified cancer"""
-    if not state.get("is_covered_by_toronto", False):
-        # Skip if cancer is not covered by Toronto system
-        return {
-            "identified_criteria": {},
-            "messages": [
-                HumanMessage(content=f"This cancer type ({state.get('cancer_type', 'Unknown')}) is not covered by the Toronto Pediatric Cancer Staging System."),
-                AIMessage(content="I cannot perform staging as this cancer type is not covered by the Toronto Pediatric Cancer Staging System.")
-            ]
-        }
+# Asked of the criteria analysis when identification skipped the LLM
+_SITE_REQUEST = ("Also report the primary site of the cancer, any sites of metastasis and any "
+                 "stage explicitly mentioned in the note.")
+
+def _needs_site_details(state: CancerStagingState):
+    """Return True if identification did not extract the primary site, metastases and stated stage"""
+    return state.get("primary_site") is None
+
+def _build_analyze_request(state: CancerStagingState, note_context="full"):
+    """Build the system prompt and user message for criteria analysis"""
+    cancer_type = _staging_cancer_type(state)
+    sections = [("Additional details", _SITE_REQUEST)] if _needs_site_details(state) else []
+    
+    # Static instructions first, then the cancer's criteria, then the note
+    user_message = HumanMessage(content=_prompts().user_prompt(
+        "Please identify which of the Toronto staging criteria below are present in the medical note.",
+        cancer_type=cancer_type,
+        sections=sections,
+        note=_note_for_prompt(state, note_context)
+    ))
+    return _prompts().system_prompt("analyze_staging_criteria"), user_message
+
+def _analyze_update(state: CancerStagingState, user_message, analysis: StagingCriteriaAnalysis):
+    """Turn the validated criteria analysis into a state update"""
+    raw_analysis = analysis.to_text()
+    update = {
+        "identified_criteria": {
+            "criteria": [finding.model_dump() for finding in analysis.criteria],
+            "summary": analysis.summary,
+            "raw_analysis": raw_analysis,
+        },
+        "messages": [user_message, AIMessage(content=raw_analysis)]
+    }
     
-    # Get cancer-specific staging information
-    cancer_type = state.get("standardized_cancer_type") or state.get("cancer_type")
-    staging_info = TORONTO_STAGING_DATA.get(cancer_type, {})
+    # Fill in the details a pre-classified identification did not extract
+    if _needs_site_details(state):
+        details = CancerIdentification(
+            is_covered_by_toronto=True,
+            primary_site=analysis.primary_site,
+            metastasis_sites=analysis.metastasis_sites,
+            extracted_stage=analysis.extracted_stage,
+        )
+        update.update({
+            "primary_site": details.primary_site,
+            "metastasis_sites": details.metastasis_sites,
+            "extracted_stage": details.extracted_stage,
+        })
+    return update
+
+def analyze_staging_criteria(state: CancerStagingState, deployment_name=None, note_context="full"):
+    """Analyze staging criteria for the identified cancer"""
+    skipped = _skip_uncovered_analysis(state)
+    if skipped is not None:
+        return skipped
     
-    # Create LLM with appropriate system prompt
-    llm = get_llm_with_system_prompt(
-        system_prompt=f"""You are a pediatric oncology staging specialist. 
-        You analyze medical notes to identify specific staging criteria for {cancer_type} 
-        according to the Toronto Pediatric Cancer Staging System.
-        
-        For {cancer_type}, the valid stages are:
-        {get_stage_terminology_text()}
-        """
+    system_prompt, user_message = _build_analyze_request(state, note_context)
+    llm = get_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StagingCriteriaAnalysis, deployment_name=deployment_name,
+        prompt_name="analyze_staging_criteria"
     )
     
-    # Prepare user message
-    user_message = HumanMessage(
-        content=f"""Please analyze this medical note and identify which staging criteria for {cancer_type} are present.
-        
-        Medical Note:
-        {state['medical_note']}
-        
-        Toronto staging criteria for {cancer_type}:
-        {json.dumps(staging_info, indent=2)}
-        
-        Extract all relevant information that can be used for staging this cancer.
-        """
+    # Call the LLM to analyze criteria
+    analysis = llm([user_message])
+    return _analyze_update(state, user_message, analysis)
+
+async def aanalyze_staging_criteria(state: CancerStagingState, deployment_name=None, note_context="full"):
+    """Async variant of analyze_staging_criteria()"""
+    skipped = _skip_uncovered_analysis(state)
+    if skipped is not None:
+        return skipped
+    
+    system_prompt, user_message = _build_analyze_request(state, note_context)
+    llm = get_async_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StagingCriteriaAnalysis, deployment_name=deployment_name,
+        prompt_name="analyze_staging_criteria"
     )
     
-    # Call the LLM to analyze criteria
-    response = llm([user_message])
+    analysis = await llm([user_message])
+    return _analyze_update(state, user_message, analysis)
+
+def _skip_uncovered_stage(state: CancerStagingState):
+    """Return the stage update for a cancer not covered by Toronto, or None to proceed"""
+    if state.get("is_covered_by_toronto", False):
+        return None
     
-    # Parse response to extract criteria (simplified)
-    # In a real implementation, you would use structured output parsing
+    # Skip if cancer is not covered
     return {
-        "identified_criteria": {"raw_analysis": response.content},
-        "messages": [user_message, response]
+        "stage": "Not applicable",
+        "explanation": "This cancer type is not covered by the Toronto Pediatric Cancer Staging System.",
+        "staging_method": None,
+        "messages": []
+    }
+
+def _rule_based_stage(state: CancerStagingState):
+    """Return the stage update when deterministic rules give a definitive stage, or None to ask the LLM"""
+    cancer_type = _staging_cancer_type(state)
+    rule_result = evaluate_stage(cancer_type, state["medical_note"])
+    if rule_result is None:
+        return None
+    
+    return {
+        "stage": rule_result["stage"],
+        "explanation": rule_result["explanation"],
+        "staging_method": "rules",
+        "messages": [AIMessage(content=f"Stage: {rule_result['stage']}\n{rule_result['explanation']}")]
+    }
+
+def _build_stage_request(state: CancerStagingState, note_context="full"):
+    """Build the system prompt and user message for stage calculation"""
+    cancer_type = _staging_cancer_type(state)
+    
+    user_message = HumanMessage(content=_prompts().user_prompt(
+        "Based on the criteria analysis and the medical note below, determine the Toronto stage of this case.",
+        cancer_type=cancer_type,
+        sections=[
+            ("Criteria Analysis", state.get('identified_criteria', {}).get('raw_analysis', 'No analysis available')),
+        ],
+        note=_note_for_prompt(state, note_context)
+    ))
+    return _prompts().system_prompt("calculate_stage"), user_message
+
+def _stage_update(state: CancerStagingState, user_message, assignment: StageAssignment):
+    """Turn the validated stage assignment into a state update"""
+    cancer_type = _staging_cancer_type(state)
+    stage = normalize_stage(assignment.stage, get_staging_kb().stages(cancer_type))
+    
+    return {
+        "stage": stage,
+        "explanation": assignment.explanation,
+        "staging_method": "llm",
+        "messages": [user_message, AIMessage(content=f"Stage: {stage}\n{assignment.explanation}")]
     }
 
-def calculate_stage(state: CancerStagingState):
+def calculate_stage(state: CancerStagingState, deployment_name=None, note_context="full"):
     """Calculate cancer stage based on identified criteria"""
-    if not state.get("is_covered_by_toronto", False):
-        # Skip if cancer is not covered
-        return {
-            "stage": "Not applicable",
-            "explanation": "This cancer type is not covered by the Toronto Pediatric Cancer Staging System.",
-            "messages": []
-        }
+    skipped = _skip_uncovered_stage(state)
+    if skipped is not None:
+        return skipped
     
-    # Create LLM with appropriate system prompt
-    cancer_type = state.get("standardized_cancer_type") or state.get("cancer_type")
-    staging_info = TORONTO_STAGING_DATA.get(cancer_type, {})
+    # Skip the LLM round trip when the stage is computable from the note
+    ruled = _rule_based_stage(state)
+    if ruled is not None:
+        return ruled
     
-    llm = get_llm_with_system_prompt(
-        system_prompt=f"""You are a pediatric oncology staging expert specializing in the Toronto Pediatric Cancer Staging System.
-        You determine the stage for {cancer_type} based on the criteria present in medical notes.
-        
-        For {cancer_type}, the valid stages and their criteria are:
-        {json.dumps(staging_info, indent=2)}
-        """
+    system_prompt, user_message = _build_stage_request(state, note_context)
+    llm = get_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StageAssignment, deployment_name=deployment_name,
+        prompt_name="calculate_stage"
     )
     
-    # Prepare user message
-    user_message = HumanMessage(
-        content=f"""Based on the following criteria analysis, determine the Toronto stage for this {cancer_type} case.
-        
-        Medical Note:
-        {state['medical_note']}
-        
-        Criteria Analysis:
-        {state.get('identified_criteria', {}).get('raw_analysis', 'No analysis available')}
-        
-        Please provide:
-        1. The determined stage
-        2. A detailed explanation of how you determined this stage
-        """
+    # Call the LLM to calculate stage
+    assignment = llm([user_message])
+    return _stage_update(state, user_message, assignment)
+
+async def acalculate_stage(state: CancerStagingState, deployment_name=None, note_context="full"):
+    """Async variant of calculate_stage()"""
+    skipped = _skip_uncovered_stage(state)
+    if skipped is not None:
+        return skipped
+    
+    # Skip the LLM round trip when the stage is computable from the note
+    ruled = _rule_based_stage(state)
+    if ruled is not None:
+        return ruled
+    
+    system_prompt, user_message = _build_stage_request(state, note_context)
+    llm = get_async_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StageAssignment, deployment_name=deployment_name,
+        prompt_name="calculate_stage"
     )
     
-    # Call the LLM to calculate stage
-    response = llm([user_message])
+    assignment = await llm([user_message])
+    return _stage_update(state, user_message, assignment)
+
+def _build_analyze_and_stage_request(state: CancerStagingState, note_context="full"):
+    """Build the system prompt and user message for criteria analysis and staging in one call"""
+    cancer_type = _staging_cancer_type(state)
+    sections = [("Additional details", _SITE_REQUEST)] if _needs_site_details(state) else []
+    
+    user_message = HumanMessage(content=_prompts().user_prompt(
+        "Please identify which of the Toronto staging criteria below are present in the medical note, then determine the Toronto stage of this case from them.",
+        cancer_type=cancer_type,
+        sections=sections,
+        note=_note_for_prompt(state, note_context)
+    ))
+    return _prompts().system_prompt("analyze_and_stage"), user_message
+
+def _analyze_and_stage_update(state: CancerStagingState, user_message, determination: StagingDetermination):
+    """Turn the validated determination into the combined criteria and stage update"""
+    update = _analyze_update(state, user_message, determination.criteria_analysis())
+    staged = _stage_update(state, user_message, determination.stage_assignment())
+    return {
+        **update,
+        **staged,
+        "messages": [user_message, AIMessage(content=f"{update['identified_criteria']['raw_analysis']}\n\n"
+                                                     f"{staged['messages'][-1].content}")]
+    }
+
+def _with_rule_based_stage(analysis_update, ruled):
+    """Combine a criteria analysis update with a rule-based stage"""
+    return {**analysis_update, **ruled, "messages": analysis_update["messages"] + ruled["messages"]}
+
+def analyze_and_stage(state: CancerStagingState, deployment_name=None, note_context="full"):
+    """Analyze staging criteria and determine the stage in a single LLM call (fast mode)"""
+    skipped = _skip_uncovered_analysis(state)
+    if skipped is not None:
+        return {**_skip_uncovered_stage(state), **skipped}
     
-    # Parse response to extract stage and explanation
-    # In a real implementation, you would use structured output parsing
-    stage_lines = response.content.split("\n")
-    stage = None
-    explanation = response.content
+    # When rules give the stage, only the criteria analysis is asked of the LLM
+    ruled = _rule_based_stage(state)
+    if ruled is not None:
+        return _with_rule_based_stage(analyze_staging_criteria(state, deployment_name, note_context), ruled)
     
-    for line in stage_lines:
-        if line.startswith("Stage:"):
-            stage = line.replace("Stage:", "").strip()
-            break
+    system_prompt, user_message = _build_analyze_and_stage_request(state, note_context)
+    llm = get_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StagingDetermination, deployment_name=deployment_name,
+        prompt_name="analyze_and_stage"
+    )
+    
+    determination = llm([user_message])
+    return _analyze_and_stage_update(state, user_message, determination)
+
+async def aanalyze_and_stage(state: CancerStagingState, deployment_name=None, note_context="full"):
+    """Async variant of analyze_and_stage()"""
+    skipped = _skip_uncovered_analysis(state)
+    if skipped is not None:
+        return {**_skip_uncovered_stage(state), **skipped}
+    
+    ruled = _rule_based_stage(state)
+    if ruled is not None:
+        return _with_rule_based_stage(await aanalyze_staging_criteria(state, deployment_name, note_context), ruled)
     
+    system_prompt, user_message = _build_analyze_and_stage_request(state, note_context)
+    llm = get_async_structured_llm_with_system_prompt(
+        system_prompt=system_prompt, schema=StagingDetermination, deployment_name=deployment_name,
+        prompt_name="analyze_and_stage"
+    )
+    
+    determination = await llm([user_message])
+    return _analyze_and_stage_update(state, user_message, determination)
+
+def _build_report_request(state: CancerStagingState, note_context="full"):
+    """Build the system prompt and user message for report generation"""
+    user_message = HumanMessage(content=_prompts().user_prompt(
+        "Please generate a professional cancer staging report based on the following information.",
+        sections=[
+            ("Staging Result", f"Cancer Type: {state.get('cancer_type', 'Unknown')}\n"
+                               f"Standardized Category: {state.get('standardized_cancer_type', 'Unknown')}\n"
+                               f"Stage: {state.get('stage', 'Unknown')}"),
+            ("Staging Explanation", state.get('explanation', 'No explanation provided')),
+        ],
+        note=_note_for_prompt(state, note_context)
+    ))
+    return _prompts().system_prompt("generate_report"), user_message
+
+def _report_update(user_message, response):
+    """Turn the report response into a state update"""
     return {
-        "stage": stage,
-        "explanation": explanation,
+        "report": response.content,
+        "report_status": "generated",
         "messages": [user_message, response]
     }
 
-def generate_report(state: CancerStagingState):
+def _report_without_llm(state: CancerStagingState, note_context, report_mode, report_defer):
+    """Return the report update for the template and deferred modes, or None to ask the LLM"""
+    if report_mode == "template":
+        return {"report": render_report(state), "report_status": "template"}
+    
+    if report_mode == "deferred":
+        reason = review_reason(state)
+        if report_defer == "flagged" and reason is None:
+            return {"report": "", "report_status": "skipped"}
+        _, user_message = _build_report_request(state, note_context)
+        get_report_queue().enqueue(hash_note(state["medical_note"]), user_message.content, reason)
+        return {"report": "", "report_status": "queued"}
+    return None
+
+def generate_report(state: CancerStagingState, deployment_name=None, note_context="full",
+                    report_mode="llm", report_defer="all"):
     """Generate final staging report"""
-    llm = get_llm_with_system_prompt(
-        system_prompt="""You are a pediatric oncology report specialist.
-        You create clear, professional reports on cancer staging for medical records.
-        Your reports are comprehensive yet concise, focusing on the most important clinical information.
-        """
-    )
+    update = _report_without_llm(state, note_context, report_mode, report_defer)
+    if update is not None:
+        return update
     
-    # Prepare user message
-    user_message = HumanMessage(
-        content=f"""Please generate a professional cancer staging report based on the following information:
-        
-        Cancer Type: {state.get('cancer_type', 'Unknown')}
-        Standardized Category: {state.get('standardized_cancer_type', 'Unknown')}
-        Stage: {state.get('stage', 'Unknown')}
-        
-        Staging Explanation:
-        {state.get('explanation', 'No explanation provided')}
-        
-        Medical Note:
-        {state['medical_note']}
-        """
+    system_prompt, user_message = _build_report_request(state, note_context)
+    llm = get_llm_with_system_prompt(
+        system_prompt=system_prompt, deployment_name=deployment_name, prompt_name="generate_report"
     )
     
     # Call the LLM to generate report
     response = llm([user_message])
+    return _report_update(user_message, response)
+
+async def agenerate_report(state: CancerStagingState, deployment_name=None, note_context="full",
+                           report_mode="llm", report_defer="all"):
+    """Async variant of generate_report()"""
+    update = _report_without_llm(state, note_context, report_mode, report_defer)
+    if update is not None:
+        return update
     
-    return {
-        "report": response.content,
-        "messages": [user_message, response]
-    }
+    system_prompt, user_message = _build_report_request(state, note_context)
+    llm = get_async_llm_with_system_prompt(
+        system_prompt=system_prompt, deployment_name=deployment_name, prompt_name="generate_report"
+    )
+    
+    response = await llm([user_message])
+    return _report_update(user_message, response)
+
+def extract_staging_evidence(state: CancerStagingState):
+    """Keep the staging-relevant snippets of the note for the later nodes (no LLM call)"""
+    extractor = get_evidence_extractor(get_staging_kb())
+    prefer = [tuple(chunk) for chunk in state.get("diagnosis_chunks") or []]
+    return {"evidence": extractor.extract(state["medical_note"], _staging_cancer_type(state), prefer=prefer)}
+
+def get_graph_mode(mode=None):
+    """
+    Resolve the graph mode.
+    
+    Args:
+        mode: "fast" or "audit", or None for STAGING_GRAPH_MODE (default: "audit")
+        
+    Returns:
+        str: The validated mode
+    """
+    mode = (mode or os.getenv("STAGING_GRAPH_MODE", DEFAULT_GRAPH_MODE)).strip().lower()
+    if mode not in GRAPH_MODES:
+        raise ValueError(f"Unknown graph mode '{mode}'; expected one of {', '.join(GRAPH_MODES)}")
+    return mode
 
 def should_proceed_to_staging(state: CancerStagingState):
     """Determine whether to proceed with staging or end with error"""
     if state.get("is_covered_by_toronto", False):
-        return "analyze_criteria"
+        return "extract_evidence"
     else:
         return "generate_report"
 
-def build_cancer_staging_graph():
-    """Build and return the cancer staging graph"""
+def _instrumented(node_name, func):
+    """Run a node in a tracing span and inside node_metrics(), adding the run's metrics to its state update"""
+    def run(state):
+        with span(node_name) as node_span:
+            with node_metrics(node_name) as metrics:
+                update = func(state)
+            values = metrics.snapshot()
+            node_span.set_attributes(cancer_type=update.get("standardized_cancer_type")
+                                     or state.get("standardized_cancer_type"), **values)
+        return {**update, "node_metrics": {node_name: values}}
+    
+    return run
+
+def _ainstrumented(node_name, afunc):
+    """Async variant of _instrumented()"""
+    async def run(state):
+        with span(node_name) as node_span:
+            with node_metrics(node_name) as metrics:
+                update = await afunc(state)
+            values = metrics.snapshot()
+            node_span.set_attributes(cancer_type=update.get("standardized_cancer_type")
+                                     or state.get("standardized_cancer_type"), **values)
+        return {**update, "node_metrics": {node_name: values}}
+    
+    return run
+
+def _set_note_attributes(note_span, final_result):
+    """Set the outcome of a staged note on its tracing span"""
+    total = total_node_metrics(final_result.get("node_metrics"))
+    note_span.set_attributes(
+        cancer_type=final_result.get("cancer_type"),
+        standardized_cancer_type=final_result.get("standardized_cancer_type"),
+        stage=final_result.get("stage"),
+        input_tokens=total["input_tokens"],
+        cached_tokens=total["cached_tokens"],
+        output_tokens=total["output_tokens"],
+        cost_usd=total["cost_usd"],
+    )
+
+def _graph_node(node_name, func, afunc, deployment_name, **node_kwargs):
+    """Wrap a node's sync and async implementations, bound to a deployment and instrumented, as one runnable"""
+    return RunnableLambda(
+        _instrumented(node_name, partial(func, deployment_name=deployment_name, **node_kwargs)),
+        afunc=_ainstrumented(node_name, partial(afunc, deployment_name=deployment_name, **node_kwargs)),
+        name=func.__name__
+    )
+
+def build_cancer_staging_graph(deployment_name=None, checkpointer=None, preclassifier_mode=None,
+                               note_context=None, mode=None, report_mode=None, report_defer=None):
+    """
+    Build and return the cancer staging graph.
+    
+    Prefer get_cancer_staging_graph(), which compiles the graph once per
+    configuration and shares it across notes and threads.
+    
+    Args:
+        deployment_name: Azure OpenAI deployment used by every node
+        checkpointer: Checkpointer to compile with (defaults to a new MemorySaver;
+            see open_sqlite_checkpointer() for a persistent one)
+        preclassifier_mode: "off", "shadow" or "on" (defaults to STAGING_PRECLASSIFIER);
+            see src/preclassifier.py
+        note_context: Which nodes get the full note and which only its evidence
+            snippets (defaults to STAGING_NOTE_CONTEXT); see src/evidence.py
+        mode: "fast" to analyze the criteria and assign the stage in one call, or
+            "audit" for separate criteria analysis and stage calculation steps
+            (defaults to STAGING_GRAPH_MODE)
+        report_mode: "llm", "template", "deferred" or "none" (defaults to
+            STAGING_REPORT_MODE); see src/reports.py
+        report_defer: "all" or "flagged" notes get a deferred report (defaults
+            to STAGING_REPORT_DEFER)
+        
+    Returns:
+        The compiled LangGraph workflow
+    """
+    preclassifier_mode = get_preclassifier_mode(preclassifier_mode)
+    note_context = get_note_context(note_context)
+    mode = get_graph_mode(mode)
+    report_mode = get_report_mode(report_mode)
+    report_defer = get_report_defer(report_defer)
+    
     # Initialize the workflow graph
     workflow = StateGraph(CancerStagingState)
     
-    # Add nodes
-    workflow.add_node("identify_cancer", identify_cancer_type)
-    workflow.add_node("analyze_criteria", analyze_staging_criteria)
-    workflow.add_node("calculate_stage", calculate_stage)
-    workflow.add_node("generate_report", generate_report)
+    # Add nodes, bound to the requested deployment; graph.invoke() runs the sync
+    # implementations and graph.ainvoke() the async ones
+    workflow.add_node("identify_cancer", _graph_node("identify_cancer", identify_cancer_type, aidentify_cancer_type,
+                                                     deployment_name, preclassifier_mode=preclassifier_mode))
+    workflow.add_node("extract_evidence", _instrumented("extract_evidence", extract_staging_evidence))
+    if mode == "audit":
+        workflow.add_node("analyze_criteria", _graph_node("analyze_criteria", analyze_staging_criteria,
+                                                          aanalyze_staging_criteria, deployment_name,
+                                                          note_context=note_context["analyze_criteria"]))
+        workflow.add_node("calculate_stage", _graph_node("calculate_stage", calculate_stage, acalculate_stage,
+                                                         deployment_name, note_context=note_context["calculate_stage"]))
+    else:
+        # The combined step sees the full note if either step it replaces is configured to
+        combined_context = "full" if "full" in (note_context["analyze_criteria"], note_context["calculate_stage"]) else "evidence"
+        workflow.add_node("analyze_and_stage", _graph_node("analyze_and_stage", analyze_and_stage, aanalyze_and_stage,
+                                                           deployment_name, note_context=combined_context))
+    if report_mode != "none":
+        workflow.add_node("generate_report", _graph_node("generate_report", generate_report, agenerate_report,
+                                                         deployment_name, note_context=note_context["generate_report"],
+                                                         report_mode=report_mode, report_defer=report_defer))
+    report_step = END if report_mode == "none" else "generate_report"
     
     # Connect edges
     workflow.add_edge(START, "identify_cancer")
@@ -317,23 +757,182 @@ def build_cancer_staging_graph():
         "identify_cancer",
         should_proceed_to_staging,
         {
-            "analyze_criteria": "analyze_criteria",
-            "generate_report": "generate_report"
+            "extract_evidence": "extract_evidence",
+            "generate_report": report_step
         }
     )
     
-    workflow.add_edge("analyze_criteria", "calculate_stage")
-    workflow.add_edge("calculate_stage", "generate_report")
-    workflow.add_edge("generate_report", END)
+    if mode == "audit":
+        workflow.add_edge("extract_evidence", "analyze_criteria")
+        workflow.add_edge("analyze_criteria", "calculate_stage")
+        workflow.add_edge("calculate_stage", report_step)
+    else:
+        workflow.add_edge("extract_evidence", "analyze_and_stage")
+        workflow.add_edge("analyze_and_stage", report_step)
+    if report_mode != "none":
+        workflow.add_edge("generate_report", END)
     
-    # Create a memory-based checkpointer
-    memory = MemorySaver()
+    # Create a memory-based checkpointer unless a persistent one was provided
+    if checkpointer is None:
+        checkpointer = MemorySaver()
     
     # Compile the graph
-    return workflow.compile(checkpointer=memory)
+    return workflow.compile(checkpointer=checkpointer)
+
+def open_sqlite_checkpointer(checkpoint_path):
+    """
+    Open a SQLite-backed checkpointer so graph progress survives crashes and restarts.
+    
+    Args:
+        checkpoint_path: Path to the SQLite database file
+        
+    Returns:
+        SqliteSaver: Checkpointer usable from multiple threads (sync graph runs only)
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError as e:
+        raise ImportError(
+            "Persistent checkpoints require the langgraph-checkpoint-sqlite package"
+        ) from e
+    
+    conn = sqlite3.connect(checkpoint_path, check_same_thread=False, timeout=30)
+    return SqliteSaver(conn)
+
+# Process-wide registry of compiled graphs, keyed by graph configuration.
+# The topology never changes between notes, so each configuration is compiled
+# once and the compiled graph (and its checkpointer) is shared by all threads.
+_GRAPH_REGISTRY: Dict[tuple, Any] = {}
+_GRAPH_REGISTRY_LOCK = threading.Lock()
+
+def get_cancer_staging_graph(deployment_name=None, checkpoint_path=None, preclassifier_mode=None,
+                             note_context=None, mode=None, report_mode=None, report_defer=None):
+    """
+    Get the compiled cancer staging graph for a configuration, building it on first use.
+    
+    Args:
+        deployment_name: Azure OpenAI deployment (defaults to AZURE_GPT4O_DEPLOYMENT)
+        checkpoint_path: SQLite file for persistent checkpoints, or None for in-memory ones
+        preclassifier_mode: "off", "shadow" or "on" (defaults to STAGING_PRECLASSIFIER)
+        note_context: Per-node "full"/"evidence" note context (defaults to STAGING_NOTE_CONTEXT)
+        mode: "fast" or "audit" graph variant (defaults to STAGING_GRAPH_MODE)
+        report_mode: "llm", "template", "deferred" or "none" (defaults to STAGING_REPORT_MODE)
+        report_defer: "all" or "flagged" for deferred reports (defaults to STAGING_REPORT_DEFER)
+        
+    Returns:
+        The shared compiled LangGraph workflow
+    """
+    deployment_name = deployment_name or os.getenv("AZURE_GPT4O_DEPLOYMENT", "gpt-4o-mini")
+    preclassifier_mode = get_preclassifier_mode(preclassifier_mode)
+    note_context = get_note_context(note_context)
+    mode = get_graph_mode(mode)
+    report_mode = get_report_mode(report_mode)
+    report_defer = get_report_defer(report_defer)
+    key = (deployment_name, checkpoint_path, preclassifier_mode, tuple(sorted(note_context.items())), mode,
+           report_mode, report_defer)
+    
+    graph = _GRAPH_REGISTRY.get(key)
+    if graph is None:
+        with _GRAPH_REGISTRY_LOCK:
+            # Another thread may have built it while we waited for the lock
+            graph = _GRAPH_REGISTRY.get(key)
+            if graph is None:
+                logger.info(f"Compiling cancer staging graph for {key}")
+                checkpointer = open_sqlite_checkpointer(checkpoint_path) if checkpoint_path else None
+                graph = build_cancer_staging_graph(deployment_name=deployment_name, checkpointer=checkpointer,
+                                                   preclassifier_mode=preclassifier_mode, note_context=note_context,
+                                                   mode=mode, report_mode=report_mode, report_defer=report_defer)
+                _GRAPH_REGISTRY[key] = graph
+    return graph
+
+def clear_graph_registry():
+    """Drop all compiled graphs so the next call rebuilds them (e.g. after a config change)."""
+    with _GRAPH_REGISTRY_LOCK:
+        _GRAPH_REGISTRY.clear()
+
+def release_thread(graph, thread_id):
+    """
+    Discard the checkpoints a finished run left in the graph's in-memory checkpointer.
+    
+    The shared MemorySaver keeps every thread's checkpoints until they are removed,
+    so a long batch would otherwise grow without bound.
+    """
+    checkpointer = graph.checkpointer
+    if not isinstance(checkpointer, MemorySaver):
+        return
+    if hasattr(checkpointer, "delete_thread"):
+        checkpointer.delete_thread(thread_id)
+        return
+    checkpointer.storage.pop(thread_id, None)
+    for key in [key for key in checkpointer.writes if key[0] == thread_id]:
+        checkpointer.writes.pop(key, None)
+
+# Banners shown for each node in verbose mode
+NODE_TITLES = {
+    "identify_cancer": "STEP 1: CANCER IDENTIFICATION AGENT",
+    "extract_evidence": "STEP 2: STAGING EVIDENCE EXTRACTION",
+    "analyze_criteria": "STEP 3: CRITERIA ANALYSIS AGENT",
+    "calculate_stage": "STEP 4: STAGE CALCULATION AGENT",
+    "analyze_and_stage": "STEPS 3-4: CRITERIA ANALYSIS AND STAGE CALCULATION AGENT",
+    "generate_report": "STEP 5: REPORT GENERATION AGENT",
+}
+
+def _print_node_update(node_name, update, note_text):
+    """Print the agent response and key fields produced by a graph node"""
+    print(f"\n🔍 {NODE_TITLES.get(node_name, node_name.upper())}")
+    print("-"*80)
+    if node_name == "identify_cancer":
+        print("Medical note excerpt:", note_text[:300] + "..." if len(note_text) > 300 else note_text)
+        print("-"*80)
+    
+    messages = update.get("messages") or []
+    if len(messages) > 1:
+        print("\nAGENT RESPONSE:")
+        print(messages[-1].content)
+        print("-"*80)
+    
+    if node_name == "identify_cancer" and not update:
+        print("(identified in a batched request before the workflow started)")
+    elif node_name == "identify_cancer":
+        print(f"Identified cancer type: {update.get('cancer_type', 'Unknown')}")
+        print(f"Standardized category: {update.get('standardized_cancer_type', 'Unknown')}")
+        print(f"Covered by Toronto: {'Yes' if update.get('is_covered_by_toronto', False) else 'No'}")
+        if update.get("identification_method") == "preclassifier":
+            print("(identified by the rule-based pre-classifier; no LLM call)")
+    elif node_name == "extract_evidence":
+        evidence = update.get("evidence") or []
+        evidence_chars = sum(snippet["end"] - snippet["start"] for snippet in evidence)
+        print(f"Kept {len(evidence)} snippets ({evidence_chars} of {len(note_text)} characters) for the later steps")
+    elif node_name in ("calculate_stage", "analyze_and_stage"):
+        if update.get("staging_method") == "rules":
+            print(update.get("explanation", ""))
+            print("(computed by deterministic staging rules; no LLM call)")
+        print(f"Determined stage: {update.get('stage', 'Unknown')}")
+    elif node_name == "generate_report" and update.get("report_status") != "generated":
+        if update.get("report_status") == "template":
+            print(update.get("report", ""))
+        print(f"(report {update.get('report_status')}; no LLM call)")
+
+def _print_node_metrics(metrics):
+    """Print a one-line summary of a node run's timing, tokens and cost"""
+    if not metrics:
+        return
+    line = f"({metrics['wall_s']:.2f}s"
+    if metrics["llm_calls"]:
+        line += (f", {metrics['llm_calls']} LLM call(s), {metrics['input_tokens']} prompt tokens "
+                 f"({metrics['cached_tokens']} cached), {metrics['output_tokens']} completion tokens, "
+                 f"~${metrics['cost_usd']:.4f}")
+    if metrics["queue_wait_s"]:
+        line += f", {metrics['queue_wait_s']:.2f}s rate-limit wait"
+    if metrics["retries"]:
+        line += f", {metrics['retries']} retries"
+    if metrics["response_cache_hits"]:
+        line += f", {metrics['response_cache_hits']} response cache hit(s)"
+    print(line + ")")
 
 # Exported function to process a single note
-def process_medical_note(note_text, thread_id="default", verbose=True):
+def process_medical_note(note_text, thread_id="default", verbose=True, deployment_name=None,
+                         checkpoint_path=None, identification=None):
     """
     Process a single medical note using the cancer staging graph.
     
@@ -341,144 +940,196 @@ def process_medical_note(note_text, thread_id="default", verbose=True):
         note_text: The text of the medical note
         thread_id: Unique identifier for this run
         verbose: Whether to print verbose agent outputs
+        deployment_name: Azure OpenAI deployment to use (defaults to AZURE_GPT4O_DEPLOYMENT)
+        checkpoint_path: SQLite file for persistent checkpoints; a thread interrupted
+            part-way resumes from its last completed node
+        identification: Identification state from src.batch_identify.identify_notes();
+            when given, the graph skips its identification step
         
     Returns:
-        Dict with the results including cancer type, stage, and report
+        Dict with the results including cancer type, stage, and report, and the
+        timing, token and cost metrics of each node under "node_metrics"
     """
     logger.info(f"Processing medical note with thread_id: {thread_id}")
     
-    # Build the graph
-    graph = build_cancer_staging_graph()
+    # Reuse the compiled graph shared by every note
+    graph = get_cancer_staging_graph(deployment_name, checkpoint_path)
     
     # Create initial state
     initial_state = {
         "messages": [],
         "medical_note": note_text,
+        **(identification or {}),
     }
     
     # Run the graph with tracing of each step
     config = {"configurable": {"thread_id": thread_id}}
+    graph_input = initial_state
+    final_result = dict(initial_state)
     
-    print("\n" + "="*80)
-    print("STARTING AGENT WORKFLOW - VERBOSE MODE")
-    print("="*80)
-    
-    # We'll run the graph step by step to show outputs
-    if verbose:
-        # First step: identify cancer type
-        print("\n🔍 STEP 1: CANCER IDENTIFICATION AGENT")
-        print("-"*80)
-        print("Agent prompt: Analyze this medical note and identify the cancer type")
-        print("Medical note excerpt:", note_text[:300] + "..." if len(note_text) > 300 else note_text)
-        print("-"*80)
-        
-        # Manually trigger the first node and get response
-        step1_state = initial_state.copy()
-        step1_result = identify_cancer_type(step1_state)
-        
-        # Extract and display the agent's response
-        if "messages" in step1_result and len(step1_result["messages"]) > 1:
-            agent_response = step1_result["messages"][-1].content
-            print("\nAGENT RESPONSE:")
-            print(agent_response)
-            print("-"*80)
-            print(f"Identified cancer type: {step1_result.get('cancer_type', 'Unknown')}")
-            print(f"Standardized category: {step1_result.get('standardized_cancer_type', 'Unknown')}")
-            print(f"Covered by Toronto: {'Yes' if step1_result.get('is_covered_by_toronto', False) else 'No'}")
-        
-        # Check if we should proceed to staging
-        if step1_result.get("is_covered_by_toronto", False):
-            # Second step: analyze staging criteria
-            print("\n🔍 STEP 2: CRITERIA ANALYSIS AGENT")
-            print("-"*80)
-            
-            # Update state with results from step 1
-            step2_state = {**initial_state, **step1_result}
-            
-            # Get cancer type information for prompt
-            cancer_type = step2_state.get("standardized_cancer_type") or step2_state.get("cancer_type", "Unknown")
-            
-            print(f"Agent prompt: Analyze medical note to identify staging criteria for {cancer_type}")
-            print("-"*80)
-            
-            # Manually trigger the second node
-            step2_result = analyze_staging_criteria(step2_state)
-            
-            # Extract and display the agent's response
-            if "messages" in step2_result and len(step2_result["messages"]) > 1:
-                agent_response = step2_result["messages"][-1].content
-                print("\nAGENT RESPONSE:")
-                print(agent_response)
-                print("-"*80)
-            
-            # Third step: calculate stage
-            print("\n🔍 STEP 3: STAGE CALCULATION AGENT")
-            print("-"*80)
-            
-            # Update state with results from step 2
-            step3_state = {**step2_state, **step2_result}
-            
-            print(f"Agent prompt: Calculate stage for {cancer_type} based on identified criteria")
-            print("-"*80)
-            
-            # Manually trigger the third node
-            step3_result = calculate_stage(step3_state)
-            
-            # Extract and display the agent's response
-            if "messages" in step3_result and len(step3_result["messages"]) > 1:
-                agent_response = step3_result["messages"][-1].content
-                print("\nAGENT RESPONSE:")
-                print(agent_response)
-                print("-"*80)
-                print(f"Determined stage: {step3_result.get('stage', 'Unknown')}")
-            
-            # Update state with results from step 3
-            step4_state = {**step3_state, **step3_result}
-        else:
-            # Skip staging steps if cancer not covered
-            step4_state = {**initial_state, **step1_result, 
-                          "stage": "Not applicable", 
-                          "explanation": "Cancer not covered by Toronto system"}
-        
-        # Fourth step: generate report
-        print("\n🔍 STEP 4: REPORT GENERATION AGENT")
-        print("-"*80)
-        print("Agent prompt: Generate comprehensive staging report")
-        print("-"*80)
-        
-        # Manually trigger the fourth node
-        step4_result = generate_report(step4_state)
-        
-        # Extract and display the agent's response
-        if "messages" in step4_result and len(step4_result["messages"]) > 1:
-            agent_response = step4_result["messages"][-1].content
-            print("\nAGENT RESPONSE:")
-            print(agent_response)
-            print("-"*80)
-        
-        # Combine all results
-        final_result = {**step4_state, **step4_result}
-        
-    else:
-        # Run the entire graph at once without verbose output
-        final_result = graph.invoke(initial_state, config)
+    # With a persistent checkpointer, pick up where an earlier run of this thread stopped
+    if checkpoint_path:
+        snapshot = graph.get_state(config)
+        if snapshot.values:
+            final_result = dict(snapshot.values)
+            if not snapshot.next:
+                logger.info(f"Thread {thread_id} already completed; reusing checkpointed result")
+                return _summarize_result(final_result, note_text)
+            logger.info(f"Resuming thread {thread_id} at {', '.join(snapshot.next)}")
+            graph_input = None
     
-    print("\n" + "="*80)
-    print("AGENT WORKFLOW COMPLETED")
-    print("="*80)
+    with span("note", pipeline="langgraph", thread_id=thread_id, note_chars=len(note_text)) as note_span:
+        try:
+            if verbose:
+                print("\n" + "="*80)
+                print("STARTING AGENT WORKFLOW - VERBOSE MODE")
+                print("="*80)
+                
+                # Stream node-by-node updates so each agent's output is shown as it completes
+                for update in graph.stream(graph_input, config, stream_mode="updates"):
+                    for node_name, node_update in update.items():
+                        node_update = dict(node_update or {})
+                        metrics = node_update.pop("node_metrics", {})
+                        _print_node_update(node_name, node_update, note_text)
+                        _print_node_metrics(metrics.get(node_name))
+                        final_result.update(node_update)
+                        final_result["node_metrics"] = merge_node_metrics(final_result.get("node_metrics"), metrics)
+                
+                print("\n" + "="*80)
+                print("AGENT WORKFLOW COMPLETED")
+                print("="*80)
+            else:
+                # Run the entire graph at once without verbose output
+                final_result = graph.invoke(graph_input, config)
+        finally:
+            release_thread(graph, thread_id)
+        _set_note_attributes(note_span, final_result)
     
-    # Extract relevant information
+    return _summarize_result(final_result, note_text)
+
+def _summarize_result(final_result, note_text):
+    """Extract the relevant fields of a finished graph run into the result summary"""
+    is_covered = final_result.get("is_covered_by_toronto", False)
     result_summary = {
         "cancer_type": final_result.get("cancer_type", "Unknown"),
         "standardized_cancer_type": final_result.get("standardized_cancer_type", "Unknown"),
-        "stage": final_result.get("stage", "Unknown"),
+        "stage": final_result.get("stage", "Unknown" if is_covered else "Not applicable"),
         "extracted_stage": final_result.get("extracted_stage", "Not mentioned"),
         "primary_site": final_result.get("primary_site", "Not specified"),
         "metastasis_sites": final_result.get("metastasis_sites", "None identified"),
-        "explanation": final_result.get("explanation", ""),
+        "explanation": final_result.get("explanation", "" if is_covered else "Cancer not covered by Toronto system"),
         "report": final_result.get("report", ""),
-        "is_covered_by_toronto": final_result.get("is_covered_by_toronto", False),
+        "is_covered_by_toronto": is_covered,
+        "staging_method": final_result.get("staging_method"),
+        "identification_method": final_result.get("identification_method"),
+        "preclassified_cancer_type": final_result.get("preclassified_cancer_type"),
+        "report_status": final_result.get("report_status", "skipped"),
+        "node_metrics": final_result.get("node_metrics", {}),
         "medical_note": note_text
     }
     
-    return result_summary 
\ No newline at end of file
+    return result_summary
+
+async def aprocess_medical_note(note_text, thread_id="default", deployment_name=None, identification=None):
+    """
+    Asyncio variant of process_medical_note() (without verbose output).
+    
+    Every node awaits its LLM call, so many notes can be staged concurrently
+    on one event loop.
+    
+    Args:
+        note_text: The text of the medical note
+        thread_id: Unique identifier for this run
+        deployment_name: Azure OpenAI deployment to use (defaults to AZURE_GPT4O_DEPLOYMENT)
+        identification: Prefilled identification state; see process_medical_note()
+        
+    Returns:
+        Dict with the results including cancer type, stage, and report
+    """
+    logger.info(f"Processing medical note with thread_id: {thread_id}")
+    
+    graph = get_cancer_staging_graph(deployment_name)
+    initial_state = {
+        "messages": [],
+        "medical_note": note_text,
+        **(identification or {}),
+    }
+    config = {"configurable": {"thread_id": thread_id}}
+    
+    with span("note", pipeline="langgraph", thread_id=thread_id, note_chars=len(note_text)) as note_span:
+        try:
+            final_result = await graph.ainvoke(initial_state, config)
+        finally:
+            release_thread(graph, thread_id)
+        _set_note_attributes(note_span, final_result)
+    
+    return _summarize_result(final_result, note_text)
+
+async def astage_corpus(notes, max_concurrency=8, deployment_name=None, identify_batch_size=None):
+    """
+    Stage a corpus of notes concurrently, yielding results as each note finishes.
+    
+    At most max_concurrency notes are in flight at once and notes are pulled
+    from the iterable lazily, so memory stays flat regardless of corpus size.
+    Per-deployment request/token budgets are enforced by src.rate_limit.
+    
+    Args:
+        notes: Iterable of (note_id, note_text) pairs
+        max_concurrency: Maximum number of notes processed at the same time
+        deployment_name: Azure OpenAI deployment to use (defaults to AZURE_GPT4O_DEPLOYMENT)
+        identify_batch_size: If greater than 1, short notes are identified this many
+            per LLM request before staging (see src/batch_identify.py)
+        
+    Yields:
+        Tuple of (note_id, result summary or None, exception or None), in completion order
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _stage(note_id, note_text, identification):
+        try:
+            result = await aprocess_medical_note(note_text, thread_id=str(note_id), deployment_name=deployment_name,
+                                                 identification=identification)
+            return note_id, result, None
+        except Exception as e:
+            logger.error(f"Error processing {note_id}: {e}")
+            return note_id, None, e
+        finally:
+            semaphore.release()
+    
+    async def _identified_groups():
+        """Yield groups of (note_id, note_text, identification), identifying each group in batches"""
+        if not identify_batch_size or identify_batch_size < 2:
+            for note_id, note_text in notes:
+                yield [(note_id, note_text, None)]
+            return
+        
+        from .batch_identify import aidentify_notes
+        group_size = identify_batch_size * max(1, max_concurrency // identify_batch_size)
+        group = []
+        for note in notes:
+            group.append(note)
+            if len(group) < group_size:
+                continue
+            identifications = await aidentify_notes(group, deployment_name, identify_batch_size)
+            yield [(note_id, note_text, identifications.get(note_id)) for note_id, note_text in group]
+            group = []
+        if group:
+            identifications = await aidentify_notes(group, deployment_name, identify_batch_size)
+            yield [(note_id, note_text, identifications.get(note_id)) for note_id, note_text in group]
+    
+    pending = set()
+    async for group in _identified_groups():
+        for note_id, note_text, identification in group:
+            # Wait for a free slot before pulling more work into memory
+            await semaphore.acquire()
+            pending.add(asyncio.ensure_future(_stage(note_id, note_text, identification)))
+            
+            finished = {task for task in pending if task.done()}
+            pending -= finished
+            for task in finished:
+                yield task.result()
+    
+    while pending:
+        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            yield task.result()
@@ -0,0 +1,426 @@
+"""
+Load balancing and failover across several Azure OpenAI deployments.
+
+A deployment pool lists deployments (in one or several regions or resources),
+each with a routing weight and its own RPM/TPM quota. Every LLM call is routed
+to the least-loaded healthy deployment: the one whose quota lets the request
+go soonest, then the one with the fewest requests in flight per unit of
+weight, then the one that has served the fewest requests per unit of weight,
+so that light or sequential traffic is still split by weight.
+
+A deployment is unhealthy while its circuit breaker is open, which only
+outages (server errors, timeouts, connection failures) cause; see
+src.rate_limit. A throttled or failed call is retried on another deployment
+right away, and only backs off when no other deployment is available. When
+every deployment is unhealthy, calls wait for the first one to be probed.
+Unhealthy deployments are probed in the background, if enabled, so they rejoin
+the pool without a real request having to fail on them first.
+
+The pool is configured with AZURE_DEPLOYMENT_POOL, the path to a JSON file (or
+the JSON itself):
+
+    {
+      "deployments": [
+        {"name": "eastus", "endpoint": "https://eastus.openai.azure.com/",
+         "deployment": "gpt-4o-mini", "api_key_env": "AZURE_API_KEY_EASTUS",
+         "weight": 2, "rpm": 600, "tpm": 100000},
+        {"name": "swedencentral", "endpoint": "https://sweden.openai.azure.com/",
+         "deployment": "gpt-4o-mini", "weight": 1, "tpm": 50000}
+      ],
+      "health_check_interval": 30
+    }
+
+api_key (or the variable named by api_key_env) and api_version default to
+AZURE_API_KEY and AZURE_API_VERSION. When the pool is configured it serves
+every LLM call, whatever deployment name the caller asked for.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from .node_metrics import record_queue_wait, record_retry
+from .tracing import span
+from .rate_limit import (RateLimiter, CircuitBreaker, CircuitOpenError, RetryPolicy, count_queued_failure,
+                         is_outage, is_retryable, is_throttled, retry_after, DEFAULT_FAILURE_THRESHOLD,
+                         DEFAULT_RESET_TIMEOUT, PROBE_POLL_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class PoolDeployment:
+    """One deployment of the pool, with its quota, health and current load"""
+
+    def __init__(self, name: str, endpoint: str, deployment: str, api_key: Optional[str] = None,
+                 api_version: Optional[str] = None, weight: float = 1.0, rpm: Optional[float] = None,
+                 tpm: Optional[float] = None):
+        """
+        Args:
+            name: Unique name of the pool entry, e.g. the region
+            endpoint: Azure OpenAI endpoint URL
+            deployment: Deployment name at that endpoint
+            api_key: API key (defaults to AZURE_API_KEY)
+            api_version: API version (defaults to AZURE_API_VERSION)
+            weight: Relative share of the traffic the deployment takes when none is saturated
+            rpm: Requests per minute quota, or None for no limit
+            tpm: Tokens per minute quota, or None for no limit
+        """
+        if weight <= 0:
+            raise ValueError(f"Deployment pool entry '{name}' needs a positive weight")
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_key = api_key or os.getenv("AZURE_API_KEY")
+        self.api_version = api_version or os.getenv("AZURE_API_VERSION")
+        self.weight = weight
+        self.limiter = RateLimiter(rpm, tpm)
+        self.breaker = CircuitBreaker(
+            int(os.getenv("AZURE_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+            float(os.getenv("AZURE_BREAKER_RESET_SECONDS", DEFAULT_RESET_TIMEOUT)),
+            name=name,
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        """Return True unless the circuit breaker is open"""
+        return self.breaker.state != "open"
+
+    @property
+    def available(self) -> bool:
+        """Return True if the circuit breaker would admit a call now"""
+        return self.breaker.wait_time() == 0
+
+    def load(self, tokens: int = 0):
+        """Return the routing key of the deployment; lower is less loaded"""
+        return (self.limiter.wait_time(tokens), self.in_flight / self.weight, self.requests / self.weight)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the deployment's counters and health"""
+        return {"requests": self.requests, "failures": self.failures, "in_flight": self.in_flight,
+                "circuit": self.breaker.state}
+
+class DeploymentPool:
+    """Routes calls to the least-loaded healthy deployment, failing over on errors"""
+
+    def __init__(self, deployments: List[PoolDeployment], policy: Optional[RetryPolicy] = None):
+        """
+        Args:
+            deployments: The pool's deployments (names must be unique)
+            policy: Retry policy across the pool; every attempt may go to a different deployment
+        """
+        if not deployments:
+            raise ValueError("A deployment pool needs at least one deployment")
+        if len({member.name for member in deployments}) != len(deployments):
+            raise ValueError("Deployment pool entries need unique names")
+        self.deployments = deployments
+        self.policy = policy or RetryPolicy.from_env()
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop_health_checks = threading.Event()
+
+    def select(self, tokens: int = 0, exclude=()) -> PoolDeployment:
+        """
+        Pick the deployment for a request and count the request as in flight on it.
+
+        Args:
+            tokens: Estimated tokens of the request
+            exclude: Deployments to avoid (e.g. the one that just failed), unless no other is available
+
+        Returns:
+            PoolDeployment: The least-loaded deployment whose circuit breaker admits a call
+
+        Raises:
+            CircuitOpenError: If no deployment's circuit breaker admits a call now
+        """
+        with self._lock:
+            available = [member for member in self.deployments if member.available]
+            if not available:
+                raise CircuitOpenError("Every deployment of the pool is unavailable")
+            candidates = [member for member in available if member not in exclude] or available
+            member = min(candidates, key=lambda candidate: candidate.load(tokens))
+            member.in_flight += 1
+            member.requests += 1
+            return member
+
+    def _release(self, member: PoolDeployment) -> None:
+        with self._lock:
+            member.in_flight -= 1
+
+    def _openings(self) -> int:
+        """Return how many times the deployments' circuits have opened in total"""
+        return sum(member.breaker.openings for member in self.deployments)
+
+    def _wait_time(self) -> float:
+        """Return the seconds until some deployment's circuit breaker may admit a call"""
+        return min(member.breaker.wait_time() for member in self.deployments) or PROBE_POLL_INTERVAL
+
+    def _failed(self, member: PoolDeployment, error: BaseException, attempt: int, throttled: bool = False) -> float:
+        """
+        Handle a failed attempt; return the delay before the next one, or re-raise if there is none.
+
+        Args:
+            member: The deployment the attempt went to
+            error: The error of the attempt
+            attempt: Failed attempts of this kind (throttled or not) so far, including this one
+            throttled: Whether the attempt was throttled
+        """
+        if not is_retryable(error):
+            # The deployment answered (e.g. a bad request), so it is not failing
+            member.breaker.record_success()
+            raise error
+        member.failures += 1
+        if is_outage(error):
+            member.breaker.record_failure()
+        if attempt >= (self.policy.max_throttled_attempts if throttled else self.policy.max_attempts):
+            raise error
+
+        requested = retry_after(error)
+        if requested is not None:
+            member.limiter.pause(requested)
+        # Fail over at once when another deployment can take the request
+        if any(other.available and other is not member for other in self.deployments):
+            delay = 0.0
+        else:
+            delay = self.policy.delay(attempt, requested)
+        record_retry()
+        logger.warning(f"LLM call to {member.name} failed ({type(error).__name__}); retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, func: Callable[[PoolDeployment], T], tokens: int = 0) -> T:
+        """
+        Call func(deployment) on the least-loaded healthy deployment, failing over on retryable errors.
+
+        Args:
+            func: Function making one API call to the given deployment
+            tokens: Estimated tokens of the request
+
+        Returns:
+            The result of the first successful call
+        """
+        failed = []
+        failures = throttles = 0
+        while True:
+            openings = self._openings()
+            try:
+                member = self.select(tokens, exclude=failed)
+            except CircuitOpenError:
+                # Queued until a deployment's cooldown ends or its probe settles
+                wait = self._wait_time()
+                time.sleep(wait)
+                record_queue_wait(wait)
+                failures = count_queued_failure("pool", self._openings() != openings, failures,
+                                                self.policy.max_attempts)
+                continue
+            probe = None
+            with span("llm.attempt", deployment=member.name, attempt=failures + throttles + 1) as attempt_span:
+                try:
+                    probe = member.breaker.before_call()
+                    waited = member.limiter.acquire(tokens)
+                    record_queue_wait(waited)
+                    attempt_span.set_attribute("queue_wait_s", round(waited, 4))
+                    result = func(member)
+                except CircuitOpenError:
+                    # Another caller took the deployment's probe after select(); pick again
+                    continue
+                except Exception as e:
+                    attempt_span.record_error(e)
+                    failed.append(member)
+                    if is_throttled(e):
+                        throttles += 1
+                        delay = self._failed(member, e, throttles, throttled=True)
+                    else:
+                        failures += 1
+                        delay = self._failed(member, e, failures)
+                else:
+                    member.breaker.record_success()
+                    return result
+                finally:
+                    # A probe interrupted by e.g. cancellation, or throttled, must not keep the circuit open
+                    member.breaker.release_probe(probe)
+                    self._release(member)
+            time.sleep(delay)
+
+    async def acall(self, func: Callable[[PoolDeployment], Awaitable[T]], tokens: int = 0) -> T:
+        """Asyncio variant of call(); func(deployment) returns the awaitable of one API call"""
+        failed = []
+        failures = throttles = 0
+        while True:
+            openings = self._openings()
+            try:
+                member = self.select(tokens, exclude=failed)
+            except CircuitOpenError:
+                wait = self._wait_time()
+                await asyncio.sleep(wait)
+                record_queue_wait(wait)
+                failures = count_queued_failure("pool", self._openings() != openings, failures,
+                                                self.policy.max_attempts)
+                continue
+            probe = None
+            with span("llm.attempt", deployment=member.name, attempt=failures + throttles + 1) as attempt_span:
+                try:
+                    probe = member.breaker.before_call()
+                    waited = await member.limiter.acquire_async(tokens)
+                    record_queue_wait(waited)
+                    attempt_span.set_attribute("queue_wait_s", round(waited, 4))
+                    result = await func(member)
+                except CircuitOpenError:
+                    continue
+                except Exception as e:
+                    attempt_span.record_error(e)
+                    failed.append(member)
+                    if is_throttled(e):
+                        throttles += 1
+                        delay = self._failed(member, e, throttles, throttled=True)
+                    else:
+                        failures += 1
+                        delay = self._failed(member, e, failures)
+                else:
+                    member.breaker.record_success()
+                    return result
+                finally:
+                    # A probe interrupted by e.g. cancellation, or throttled, must not keep the circuit open
+                    member.breaker.release_probe(probe)
+                    self._release(member)
+            await asyncio.sleep(delay)
+
+    def check_health(self, timeout: float = 10.0) -> Dict[str, bool]:
+        """
+        Probe every deployment whose circuit is not closed with a one-token completion.
+
+        A successful probe closes the deployment's circuit; a failed one keeps it open.
+
+        Args:
+            timeout: Seconds to wait for each probe
+
+        Returns:
+            Dict mapping the probed deployments' names to whether they answered
+        """
+        results = {}
+        for member in self.deployments:
+            if member.breaker.state == "closed":
+                continue
+            url = f"{member.endpoint.rstrip('/')}/openai/deployments/{member.deployment}/chat/completions"
+            try:
+                response = httpx.post(
+                    url, params={"api-version": member.api_version}, headers={"api-key": member.api_key or ""},
+                    json={"messages": [{"role": "user", "content": "ping"}], "max_tokens": 1}, timeout=timeout
+                )
+                ok = response.status_code == 200
+            except httpx.HTTPError as e:
+                logger.debug(f"Health check of {member.name} failed: {e}")
+                ok = False
+            if ok:
+                member.breaker.record_success()
+            else:
+                member.breaker.record_failure()
+            results[member.name] = ok
+        return results
+
+    def start_health_checks(self, interval: float) -> None:
+        """Probe unhealthy deployments every interval seconds on a daemon thread"""
+        if self._health_thread is not None:
+            return
+
+        def run():
+            while not self._stop_health_checks.wait(interval):
+                try:
+                    self.check_health()
+                except Exception as e:
+                    logger.warning(f"Deployment pool health check failed: {e}")
+
+        self._health_thread = threading.Thread(target=run, name="deployment-pool-health", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        """Stop the background health checks"""
+        self._stop_health_checks.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+        self._stop_health_checks.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return the counters and health of every deployment, by name"""
+        with self._lock:
+            return {member.name: member.stats() for member in self.deployments}
+
+def load_deployment_pool(config) -> DeploymentPool:
+    """
+    Build a deployment pool from its configuration.
+
+    Args:
+        config: Dict as described in the module docstring, a JSON string, or the path to a JSON file
+
+    Returns:
+        DeploymentPool: The pool, with background health checks started if configured
+    """
+    if isinstance(config, str):
+        if config.lstrip().startswith("{"):
+            config = json.loads(config)
+        else:
+            with open(config, encoding="utf-8") as f:
+                config = json.load(f)
+
+    deployments = []
+    for entry in config.get("deployments", []):
+        entry = dict(entry)
+        api_key_env = entry.pop("api_key_env", None)
+        if api_key_env and not entry.get("api_key"):
+            entry["api_key"] = os.getenv(api_key_env)
+        entry.setdefault("name", f"{entry.get('endpoint')}/{entry.get('deployment')}")
+        deployments.append(PoolDeployment(**entry))
+
+    pool = DeploymentPool(deployments)
+    interval = float(config.get("health_check_interval") or 0)
+    if interval > 0:
+        pool.start_health_checks(interval)
+    logger.info(f"Deployment pool: {', '.join(f'{member.name} (weight {member.weight:g})' for member in deployments)}")
+    return pool
+
+_POOL: Dict[str, Optional[DeploymentPool]] = {}
+_POOL_LOCK = threading.Lock()
+
+def configure_deployment_pool(config) -> Optional[DeploymentPool]:
+    """
+    Set the process-wide deployment pool, replacing any existing one.
+
+    Args:
+        config: As for load_deployment_pool(), a DeploymentPool, or None to route to the single deployment
+
+    Returns:
+        The pool now in use, or None
+    """
+    pool = config if config is None or isinstance(config, DeploymentPool) else load_deployment_pool(config)
+    with _POOL_LOCK:
+        previous = _POOL.get("pool")
+        _POOL["pool"] = pool
+    if previous is not None and previous is not pool:
+        previous.stop_health_checks()
+    return pool
+
+def get_deployment_pool() -> Optional[DeploymentPool]:
+    """
+    Get the process-wide deployment pool.
+
+    Loaded from AZURE_DEPLOYMENT_POOL on first use unless configure_deployment_pool()
+    was called.
+
+    Returns:
+        The pool, or None when calls go to the single configured deployment
+    """
+    if "pool" not in _POOL:
+        with _POOL_LOCK:
+            if "pool" not in _POOL:
+                config = os.getenv("AZURE_DEPLOYMENT_POOL")
+                _POOL["pool"] = load_deployment_pool(config) if config else None
+    return _POOL["pool"]
@@ -0,0 +1,225 @@
+"""
+Staging evidence extraction.
+
+After the cancer type is known, the note is reduced to the sentences relevant
+to staging that cancer: sentences that mention the Toronto criteria, stage
+definitions and general staging findings (metastases, nodes, margins, CSF,
+age, ...). Later nodes can be given these snippets, with their character
+offsets in the note, instead of the full note. This is configured per node
+(see get_note_context()); every node gets the full note by default.
+"""
+
+import os
+import re
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Nodes that can receive evidence snippets instead of the full note
+NOTE_CONTEXT_NODES = ("analyze_criteria", "calculate_stage", "generate_report")
+NOTE_CONTEXT_MODES = ("full", "evidence")
+# Evidence snippets are opt-in: findings the keyword scorer misses would drop out silently
+DEFAULT_NOTE_CONTEXT = "full"
+
+# Budget for the evidence given to a node, in characters of snippet text
+DEFAULT_EVIDENCE_CHARS = 3000
+# Minimum relevance score for a sentence to count as evidence
+MIN_EVIDENCE_SCORE = 2
+
+# Findings relevant to staging any cancer; each match scores STRONG_TERM_WEIGHT
+STRONG_TERM_WEIGHT = 2
+_STRONG_TERMS = re.compile(
+    r"\bstag(?:e|es|ed|ing)\b|metasta\w*|lymph\s*nodes?|lymphadenopathy|\bnodal\b|margins?\b|resect\w*|excis\w*"
+    r"|ruptur\w*|spill\w*|biops\w*|invasi\w*|invad\w*|extension|extend\w*|residual|marrow|\bCSF\b|cerebrospinal"
+    r"|\bblasts?\b|\bMIBG\b|capsul\w*|encas\w*|\bIDRFs?\b|\b[TNM][0-4x][a-c]?\b|histolog\w*|anaplas\w*"
+    r"|\b(?:age|aged)\b|\b\d+[\s-]*(?:years?|yrs?|months?|mos?|days?)(?:[\s-]*old)?\b|\d+(?:\.\d+)?\s*(?:x\s*\d+(?:\.\d+)?\s*)*cm\b",
+    re.IGNORECASE
+)
+
+# Words too common in the staging data to indicate relevance on their own
+_STOPWORDS = {
+    "about", "above", "after", "also", "among", "based", "been", "before", "being", "below", "between", "both",
+    "cases", "considered", "defined", "depending", "described", "disease", "does", "each", "either", "especially",
+    "except", "from", "have", "however", "including", "into", "least", "less", "more", "most", "must", "note",
+    "only", "other", "otherwise", "over", "patient", "patients", "present", "presence", "regardless", "same",
+    "should", "since", "some", "specific", "such", "than", "that", "their", "them", "then", "there", "these",
+    "they", "this", "those", "through", "time", "tumor", "tumors", "tumour", "type", "types", "under", "used",
+    "when", "where", "whether", "which", "while", "with", "within", "without", "would",
+}
+_WORD = re.compile(r"[A-Za-z][A-Za-z-]{3,}|\b[A-Z]{2,}\b")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+def get_note_context(config: Optional[Any] = None) -> Dict[str, str]:
+    """
+    Resolve which nodes receive the full note and which receive evidence snippets.
+
+    Args:
+        config: "full" or "evidence" for every node, a dict of node name to mode,
+            or a string like "analyze_criteria=full,generate_report=evidence";
+            defaults to STAGING_NOTE_CONTEXT
+
+    Returns:
+        Dict mapping each of NOTE_CONTEXT_NODES to "full" or "evidence"
+    """
+    if config is None:
+        config = os.getenv("STAGING_NOTE_CONTEXT", DEFAULT_NOTE_CONTEXT)
+
+    if isinstance(config, str):
+        if "=" in config:
+            config = dict(item.split("=", 1) for item in config.split(",") if item.strip())
+        else:
+            config = {node: config for node in NOTE_CONTEXT_NODES}
+
+    context = {node: DEFAULT_NOTE_CONTEXT for node in NOTE_CONTEXT_NODES}
+    for node, mode in config.items():
+        node, mode = node.strip(), mode.strip().lower()
+        if node not in NOTE_CONTEXT_NODES:
+            raise ValueError(f"Unknown node '{node}'; expected one of {', '.join(NOTE_CONTEXT_NODES)}")
+        if mode not in NOTE_CONTEXT_MODES:
+            raise ValueError(f"Unknown note context '{mode}'; expected one of {', '.join(NOTE_CONTEXT_MODES)}")
+        context[node] = mode
+    return context
+
+def iter_sentences(text: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yield the (start, end) character offsets of each sentence or line of a note.
+
+    Args:
+        text: Medical note text
+
+    Yields:
+        Tuple of start and end offsets, with surrounding whitespace excluded
+    """
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        boundaries = [0] + [match.end() for match in _SENTENCE_BREAK.finditer(line)] + [len(line)]
+        for begin, end in zip(boundaries, boundaries[1:]):
+            piece = line[begin:end]
+            stripped = piece.strip()
+            if stripped:
+                start = offset + begin + (len(piece) - len(piece.lstrip()))
+                yield start, start + len(stripped)
+        offset += len(line)
+
+def _flatten_strings(value: Any) -> Iterator[str]:
+    """Yield every string inside a nested staging data structure, including dict keys"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield key
+            yield from _flatten_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _flatten_strings(item)
+
+class EvidenceExtractor:
+    """
+    Selects the staging-relevant sentences of a note for a cancer type.
+
+    The vocabulary of each cancer type is built from its Toronto criteria,
+    stage definitions and term definitions the first time it is needed.
+    """
+
+    def __init__(self, knowledge_base):
+        """
+        Args:
+            knowledge_base: StagingKnowledgeBase providing the staging data
+        """
+        self.knowledge_base = knowledge_base
+        self._vocabularies: Dict[str, frozenset] = {}
+
+    def vocabulary(self, cancer_type: Optional[str]) -> frozenset:
+        """Return the casefolded content words of a cancer type's staging data"""
+        if cancer_type not in self._vocabularies:
+            words = set()
+            for text in _flatten_strings(self.knowledge_base.get_entry(cancer_type) if cancer_type else {}):
+                for word in _WORD.findall(text):
+                    word = word.casefold().strip("-")
+                    if word not in _STOPWORDS:
+                        words.add(word)
+            self._vocabularies[cancer_type] = frozenset(words)
+        return self._vocabularies[cancer_type]
+
+    def score(self, sentence: str, vocabulary: frozenset) -> int:
+        """Score a sentence's relevance: strong staging terms plus distinct vocabulary words"""
+        strong = len(_STRONG_TERMS.findall(sentence))
+        words = {word.casefold().strip("-") for word in _WORD.findall(sentence)}
+        return STRONG_TERM_WEIGHT * strong + len(words & vocabulary)
+
+    def extract(self, text: str, cancer_type: Optional[str], max_chars: int = DEFAULT_EVIDENCE_CHARS,
+                prefer: Optional[List[Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
+        """
+        Extract the staging-relevant snippets of a note.
+
+        The highest-scoring sentences are kept up to max_chars, then returned in
+        note order with adjacent sentences merged into one snippet.
+
+        Args:
+            text: Medical note text
+            cancer_type: Canonical Toronto cancer type
+            max_chars: Maximum total length of the snippets
+            prefer: (start, end) ranges of the note, e.g. the chunks that named the
+                diagnosis, whose sentences are kept before any others
+
+        Returns:
+            List of snippets with start, end (character offsets in the note),
+            text and score
+        """
+        vocabulary = self.vocabulary(cancer_type)
+        scored = []
+        for start, end in iter_sentences(text):
+            score = self.score(text[start:end], vocabulary)
+            if score >= MIN_EVIDENCE_SCORE:
+                scored.append((score, start, end))
+
+        # Keep the most relevant sentences within the budget, preferred ranges first
+        preferred = prefer or []
+
+        def _rank(item):
+            score, start, _ = item
+            return (not any(low <= start < high for low, high in preferred), -score, start)
+
+        selected = []
+        budget = max_chars
+        for score, start, end in sorted(scored, key=_rank):
+            if end - start > budget:
+                continue
+            selected.append((start, end, score))
+            budget -= end - start
+
+        # Merge sentences separated only by whitespace into one snippet
+        snippets: List[Dict[str, Any]] = []
+        for start, end, score in sorted(selected):
+            if snippets and not text[snippets[-1]["end"]:start].strip():
+                snippets[-1]["end"] = end
+                snippets[-1]["score"] += score
+            else:
+                snippets.append({"start": start, "end": end, "score": score})
+        for snippet in snippets:
+            snippet["text"] = text[snippet["start"]:snippet["end"]]
+
+        logger.info(f"Extracted {len(snippets)} evidence snippets ({max_chars - budget} of {len(text)} characters)")
+        return snippets
+
+def render_evidence(snippets: List[Dict[str, Any]]) -> str:
+    """
+    Render evidence snippets for a prompt, each prefixed with its character offsets.
+
+    Args:
+        snippets: Snippets from EvidenceExtractor.extract()
+
+    Returns:
+        str: One snippet per paragraph, e.g. "[1520-1610] Biopsy confirms ..."
+    """
+    return "\n\n".join(f"[{snippet['start']}-{snippet['end']}] {snippet['text']}" for snippet in snippets)
+
+_EXTRACTORS: Dict[int, EvidenceExtractor] = {}
+
+def get_evidence_extractor(knowledge_base) -> EvidenceExtractor:
+    """Get the shared evidence extractor for a knowledge base"""
+    key = id(knowledge_base)
+    if key not in _EXTRACTORS:
+        _EXTRACTORS[key] = EvidenceExtractor(knowledge_base)
+    return _EXTRACTORS[key]
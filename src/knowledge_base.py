@@ -0,0 +1,155 @@
+"""
+Pre-indexed Toronto staging knowledge base.
+
+The staging data is rendered into prompt fragments and lookup tables once,
+when the knowledge base is built, so the graph nodes fetch prebuilt strings
+instead of re-serializing the staging entry for every note.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from .cancer_mapping import CANCER_TYPE_MAPPING
+from .cancer_resolver import CancerTypeResolver
+
+logger = logging.getLogger(__name__)
+
+# The staging data shipped with the package, then the copy at the repository root
+STAGING_DATA_PATHS = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "toronto_staging.json"),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "toronto_staging.json"),
+)
+
+class StagingKnowledgeBase:
+    """
+    Read-only index over the Toronto staging data.
+
+    Holds per-cancer stage, criteria and definition lookup tables, the prompt
+    fragments built from them, and alias resolution from diagnosis labels to
+    the canonical Toronto cancer types.
+    """
+
+    def __init__(self, staging_data: Dict[str, Dict[str, Any]], alias_mapping: Optional[Dict[str, str]] = None):
+        """
+        Index the staging data.
+
+        Args:
+            staging_data: Toronto staging data keyed by cancer type, as in toronto_staging.json
+            alias_mapping: Mapping from specific diagnoses to standardized categories
+        """
+        self.staging_data = staging_data
+        self.alias_mapping = dict(alias_mapping or {})
+        self.cancer_types: List[str] = list(staging_data.keys())
+
+        # Lookup tables
+        self._stages: Dict[str, Dict[str, str]] = {}
+        self._criteria: Dict[str, List[str]] = {}
+        self._definitions: Dict[str, Dict[str, str]] = {}
+
+        # Prebuilt prompt fragments
+        self._entry_text: Dict[str, str] = {}
+        self._stage_list_text: Dict[str, str] = {}
+
+        for cancer_type, entry in staging_data.items():
+            self._stages[cancer_type] = dict(entry.get("stages", {}))
+            self._criteria[cancer_type] = list(entry.get("criteria", []))
+            self._definitions[cancer_type] = dict(entry.get("definitions", {}))
+            self._entry_text[cancer_type] = json.dumps(entry, indent=2)
+            self._stage_list_text[cancer_type] = ", ".join(self._stages[cancer_type])
+
+        self.covered_cancers_text = ", ".join(self.cancer_types)
+        self.stage_terminology_text = "".join(
+            f"{cancer_type}: {stage_list}\n" for cancer_type, stage_list in self._stage_list_text.items()
+        )
+        self.mapping_text = "".join(
+            f"- {specific} → {standard}\n" for specific, standard in self.alias_mapping.items()
+        )
+
+        # Alias resolution: canonical names, their parenthetical synonyms and mapped diagnoses
+        self.resolver = CancerTypeResolver(self.cancer_types, self.alias_mapping)
+
+        logger.info(f"Indexed {len(self.cancer_types)} cancer types and {len(self.resolver)} aliases")
+
+    def __contains__(self, cancer_type: str) -> bool:
+        return cancer_type in self.staging_data
+
+    def resolve(self, label: Optional[str]) -> Optional[str]:
+        """
+        Resolve a diagnosis or category label to its canonical Toronto cancer type.
+
+        Args:
+            label: Cancer type as named by the model or the note
+
+        Returns:
+            The canonical cancer type, or None if the label is not recognized
+        """
+        return self.resolver.resolve(label)
+
+    def get_entry(self, cancer_type: str) -> Dict[str, Any]:
+        """Return the raw staging entry for a cancer type (empty if unknown)"""
+        return self.staging_data.get(cancer_type, {})
+
+    def stages(self, cancer_type: str) -> List[str]:
+        """Return the valid stage names for a cancer type"""
+        return list(self._stages.get(cancer_type, {}))
+
+    def stage_definition(self, cancer_type: str, stage: str) -> Optional[str]:
+        """Return the definition of one stage, or None if unknown"""
+        return self._stages.get(cancer_type, {}).get(stage)
+
+    def criteria(self, cancer_type: str) -> List[str]:
+        """Return the staging criteria for a cancer type"""
+        return list(self._criteria.get(cancer_type, []))
+
+    def definitions(self, cancer_type: str) -> Dict[str, str]:
+        """Return the term definitions for a cancer type"""
+        return dict(self._definitions.get(cancer_type, {}))
+
+    def entry_text(self, cancer_type: str) -> str:
+        """Return the staging entry rendered for prompts ("{}" if unknown)"""
+        return self._entry_text.get(cancer_type, "{}")
+
+    def stage_list_text(self, cancer_type: str) -> str:
+        """Return the comma-separated valid stage names for a cancer type"""
+        return self._stage_list_text.get(cancer_type, "")
+
+_SHARED: Dict[str, Any] = {}
+_SHARED_LOCK = threading.Lock()
+
+def load_staging_data() -> Dict[str, Dict[str, Any]]:
+    """
+    Load the Toronto staging data, reading and parsing the JSON file once per process.
+
+    The CrewAI agents and the LangGraph workflow share the returned dict, so
+    callers must not modify it.
+
+    Returns:
+        Dict: Staging data keyed by cancer type (empty if no file could be read)
+    """
+    with _SHARED_LOCK:
+        if "staging_data" not in _SHARED:
+            _SHARED["staging_data"] = _read_staging_data()
+        return _SHARED["staging_data"]
+
+def _read_staging_data() -> Dict[str, Dict[str, Any]]:
+    """Read the first existing file of STAGING_DATA_PATHS"""
+    path = next((path for path in STAGING_DATA_PATHS if os.path.exists(path)), STAGING_DATA_PATHS[0])
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading Toronto staging data: {e}")
+        return {}
+    logger.info(f"Successfully loaded staging data from {path}")
+    return data
+
+def get_staging_kb() -> StagingKnowledgeBase:
+    """Get the knowledge base over the shared staging data and the standard cancer type mapping, built once"""
+    staging_data = load_staging_data()
+    with _SHARED_LOCK:
+        if "kb" not in _SHARED:
+            _SHARED["kb"] = StagingKnowledgeBase(staging_data, CANCER_TYPE_MAPPING)
+        return _SHARED["kb"]
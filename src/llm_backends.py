@@ -0,0 +1,321 @@
+"""
+LLM backends serving the staging nodes.
+
+The backend is chosen with STAGING_LLM_BACKEND:
+
+- azure: Azure OpenAI (default), configured by AZURE_API_KEY, AZURE_ENDPOINT and
+  AZURE_API_VERSION, or a deployment pool (see src.deployment_pool)
+- openai: any OpenAI-compatible HTTP server (OpenAI, vLLM, Ollama, the stub
+  server in src.stub_llm_server), configured by OPENAI_BASE_URL and OPENAI_API_KEY;
+  the deployment name is sent as the model name
+- local: the stub responder run in-process, without HTTP; canned rules, latency
+  and error rate come from STAGING_STUB_RESPONSES, STAGING_STUB_LATENCY and
+  STAGING_STUB_ERROR_RATE
+- replay: answers from exchanges recorded earlier (STAGING_LLM_REPLAY); a request
+  that was not recorded fails
+
+Setting STAGING_LLM_RECORD to a JSONL path records every exchange of any
+backend, for later replay.
+"""
+
+import os
+import abc
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKENDS = ("azure", "openai", "local", "replay")
+DEFAULT_LLM_BACKEND = "azure"
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant", "tool": "tool"}
+
+class LLMConfigurationError(RuntimeError):
+    """Raised when the selected LLM backend is missing required settings"""
+
+def get_llm_backend(backend: Optional[str] = None) -> str:
+    """
+    Resolve the LLM backend.
+
+    Args:
+        backend: One of LLM_BACKENDS, or None for STAGING_LLM_BACKEND (default: "azure")
+
+    Returns:
+        str: The validated backend
+    """
+    backend = (backend or os.getenv("STAGING_LLM_BACKEND", DEFAULT_LLM_BACKEND)).strip().lower()
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend}'; expected one of {', '.join(LLM_BACKENDS)}")
+    return backend
+
+def check_backend_config(backend: str) -> None:
+    """
+    Check that a non-Azure backend has the settings it needs.
+
+    Raises:
+        LLMConfigurationError: If a required setting is missing
+    """
+    if backend == "openai" and not (os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_KEY")):
+        raise LLMConfigurationError("The openai backend needs OPENAI_BASE_URL (for a compatible server) "
+                                    "or OPENAI_API_KEY (for the OpenAI API)")
+    if backend == "replay":
+        path = os.getenv("STAGING_LLM_REPLAY")
+        if not path or not os.path.exists(path):
+            raise LLMConfigurationError("The replay backend needs STAGING_LLM_REPLAY set to a recorded exchanges file")
+
+def _message_dict(message: BaseMessage) -> Dict[str, Any]:
+    """Convert a LangChain message to the role/content form of a chat completion request"""
+    return {"role": _ROLES.get(message.type, message.type), "content": message.content}
+
+def exchange_key(messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Identify a request for recording and replay.
+
+    Only the message roles and contents and the tool names count, so a
+    recording replays across deployments, temperatures and backends.
+
+    Returns:
+        str: Hex SHA-256 digest of the request
+    """
+    payload = {
+        "messages": [[message.get("role"), message.get("content")] for message in messages],
+        "tools": sorted(tool["function"]["name"] for tool in tools or []),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _ai_message(message: Dict[str, Any], usage: Optional[Dict[str, Any]]) -> AIMessage:
+    """Build an AIMessage from a chat completion message and its usage"""
+    tool_calls = [
+        {"name": call["function"]["name"], "args": json.loads(call["function"]["arguments"] or "{}"),
+         "id": call.get("id"), "type": "tool_call"}
+        for call in message.get("tool_calls") or []
+    ]
+    usage_metadata = None
+    if usage:
+        usage_metadata = {
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            "input_token_details": {"cache_read": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)},
+        }
+    return AIMessage(content=message.get("content") or "", tool_calls=tool_calls, usage_metadata=usage_metadata)
+
+def _status_error(status: int, headers: Dict[str, str], payload: Dict[str, Any]) -> Exception:
+    """Build the openai SDK error an HTTP backend would raise, so retries treat it the same way"""
+    import openai
+
+    response = httpx.Response(status, headers=headers, json=payload,
+                              request=httpx.Request("POST", "http://local/chat/completions"))
+    error_class = {429: openai.RateLimitError, 400: openai.BadRequestError}.get(
+        status, openai.InternalServerError if status >= 500 else openai.APIStatusError)
+    return error_class(payload.get("error", {}).get("message", "LLM request failed"), response=response, body=payload)
+
+class _ToolCallingChatModel(BaseChatModel):
+    """Chat model answering OpenAI-format request bodies in-process, with tool calling for structured output"""
+
+    model_name: str = "stub"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        formatted = [convert_to_openai_tool(tool) for tool in tools]
+        if tool_choice and tool_choice not in ("auto", "none"):
+            # "any"/"required" or a tool name: force the (first or named) tool, as function calling would
+            name = tool_choice if isinstance(tool_choice, str) and tool_choice not in ("any", "required") \
+                else formatted[0]["function"]["name"]
+            kwargs["tool_choice"] = {"type": "function", "function": {"name": name}}
+        return self.bind(tools=formatted, **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw=False, method="function_calling", **kwargs):
+        # Only function calling is supported; accept the method argument the OpenAI models take
+        return super().with_structured_output(schema, include_raw=include_raw, **kwargs)
+
+    def _body(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        body = {"model": self.model_name, "messages": [_message_dict(message) for message in messages]}
+        if kwargs.get("tools"):
+            body["tools"] = kwargs["tools"]
+            body["tool_choice"] = kwargs.get("tool_choice", "auto")
+        return body
+
+    @abc.abstractmethod
+    def _respond(self, body: Dict[str, Any]):
+        """Return (latency in seconds, AIMessage) for a request body, or raise"""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        latency, message = self._respond(self._body(messages, kwargs))
+        if latency > 0:
+            time.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        latency, message = self._respond(self._body(messages, kwargs))
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+class LocalChatModel(_ToolCallingChatModel):
+    """In-process chat model backed by the stub responder (see src.stub_llm_server)"""
+
+    responder: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-stub"
+
+    def _respond(self, body):
+        latency, status, headers, payload = self.responder.respond(body)
+        if status != 200:
+            if latency > 0:
+                time.sleep(latency)
+            raise _status_error(status, headers, payload)
+        return latency, _ai_message(payload["choices"][0]["message"], payload.get("usage"))
+
+class ReplayChatModel(_ToolCallingChatModel):
+    """Chat model answering from recorded exchanges (see ExchangeRecorder)"""
+
+    recordings: Dict[str, Dict[str, Any]]
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _respond(self, body):
+        key = exchange_key(body["messages"], body.get("tools"))
+        recorded = self.recordings.get(key)
+        if recorded is None:
+            raise KeyError(f"No recorded exchange for request {key[:12]}")
+        return 0.0, _ai_message(recorded["message"], recorded.get("usage"))
+
+def load_recordings(path: str) -> Dict[str, Dict[str, Any]]:
+    """Load recorded exchanges by key; a request recorded more than once keeps its latest answer"""
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[entry["key"]] = entry
+    return recordings
+
+class ExchangeRecorder(BaseCallbackHandler):
+    """Callback handler appending every chat model exchange to a JSONL file for replay"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSONL file the exchanges are appended to
+        """
+        self.path = path
+        self._pending: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        tools = (kwargs.get("invocation_params") or {}).get("tools")
+        with self._lock:
+            self._pending[run_id] = exchange_key([_message_dict(message) for message in messages[0]], tools)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            key = self._pending.pop(run_id, None)
+        if key is None:
+            return
+        message = response.generations[0][0].message
+        usage = message.usage_metadata or {}
+        entry = {
+            "key": key,
+            "message": {
+                "content": message.content,
+                "tool_calls": [{"id": call.get("id"), "type": "function",
+                                "function": {"name": call["name"], "arguments": json.dumps(call["args"])}}
+                               for call in message.tool_calls],
+            },
+            "usage": {
+                "prompt_tokens": usage.get("input_tokens", 0),
+                "completion_tokens": usage.get("output_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+                "prompt_tokens_details": {"cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0)},
+            },
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+_SHARED: Dict[str, Any] = {}
+_SHARED_LOCK = threading.Lock()
+
+def get_exchange_recorder() -> Optional[ExchangeRecorder]:
+    """Get the recorder for STAGING_LLM_RECORD, or None when recording is off"""
+    path = os.getenv("STAGING_LLM_RECORD")
+    if not path:
+        return None
+    with _SHARED_LOCK:
+        recorder = _SHARED.get("recorder")
+        if recorder is None or recorder.path != path:
+            recorder = _SHARED["recorder"] = ExchangeRecorder(path)
+        return recorder
+
+def get_local_responder():
+    """Get the process-wide stub responder of the local backend"""
+    from .stub_llm_server import StubResponder
+
+    with _SHARED_LOCK:
+        if "responder" not in _SHARED:
+            _SHARED["responder"] = StubResponder.from_file(
+                os.getenv("STAGING_STUB_RESPONSES"),
+                latency=os.getenv("STAGING_STUB_LATENCY"),
+                error_rate=float(os.getenv("STAGING_STUB_ERROR_RATE", 0)),
+                seed=int(os.getenv("STAGING_STUB_SEED", 0)),
+            )
+        return _SHARED["responder"]
+
+def create_chat_model(backend: str, model: str, temperature: float, http_client=None, http_async_client=None):
+    """
+    Create the chat model of a non-Azure backend (Azure models are created by src.azure_openai_config).
+
+    Args:
+        backend: "openai", "local" or "replay"
+        model: Model (deployment) name sent with the requests
+        temperature: Sampling temperature
+        http_client: Shared sync HTTP client for the openai backend
+        http_async_client: Shared async HTTP client for the openai backend
+
+    Returns:
+        A LangChain chat model
+    """
+    check_backend_config(backend)
+    recorder = get_exchange_recorder()
+    callbacks = [recorder] if recorder else None
+
+    if backend == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            # Compatible servers often need no key, but the client requires one
+            api_key=os.getenv("OPENAI_API_KEY") or "not-needed",
+            http_client=http_client,
+            http_async_client=http_async_client,
+            max_retries=0,
+            callbacks=callbacks,
+        )
+    if backend == "local":
+        return LocalChatModel(responder=get_local_responder(), model_name=model, callbacks=callbacks)
+    if backend == "replay":
+        return ReplayChatModel(recordings=load_recordings(os.getenv("STAGING_LLM_REPLAY")), model_name=model,
+                               callbacks=callbacks)
+    raise ValueError(f"create_chat_model() does not create {backend} models")
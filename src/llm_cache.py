@@ -0,0 +1,230 @@
+"""
+Persistent, content-addressed cache for LLM responses.
+
+Responses are keyed by a hash of the system prompt, the conversation messages,
+the deployment and the temperature, so re-processing a corpus only calls the
+LLM for node prompts that actually changed.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the on-disk cache
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_TTL_SECONDS = None  # Entries never expire unless a TTL is configured
+
+def make_cache_key(system_prompt: str, messages: List[Any], deployment_name: str,
+                   temperature: float, response_schema: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a content-addressed cache key for an LLM call.
+
+    Args:
+        system_prompt: The system prompt applied to the call
+        messages: The LangChain messages sent after the system prompt
+        deployment_name: The deployment that serves the call
+        temperature: The sampling temperature
+        response_schema: JSON schema of a structured-output call, if any
+
+    Returns:
+        str: Hex SHA-256 digest identifying the call
+    """
+    payload = {
+        "system_prompt": system_prompt,
+        "messages": [[message.type, message.content] for message in messages],
+        "deployment_name": deployment_name,
+        "temperature": temperature,
+    }
+    if response_schema is not None:
+        payload["response_schema"] = response_schema
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+class LLMResponseCache:
+    """
+    SQLite-backed LLM response cache with size and TTL eviction.
+
+    The cache is safe to share between threads. When it grows past max_entries,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: Path to the SQLite database file
+            max_entries: Maximum number of cached responses kept
+            ttl_seconds: Age in seconds after which an entry is ignored and evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        logger.info(f"Opened LLM response cache at {path} ({self._entries} entries)")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Cache key from make_cache_key()
+
+        Returns:
+            The cached response text, or None on a miss or expired entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._entries -= 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a response, evicting expired and least recently used entries as needed.
+
+        Args:
+            key: Cache key from make_cache_key()
+            value: The response text to cache
+        """
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            if exists is None:
+                self._entries += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries and trim to max_entries (caller holds the lock)"""
+        if self._entries <= self.max_entries:
+            return
+
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+        excess = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self) -> None:
+        """Remove every cached response and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._entries = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current number of entries"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries,
+            }
+
+    def close(self) -> None:
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+# Process-wide cache used by the LLM wrappers; configured explicitly or via STAGING_LLM_CACHE
+_ACTIVE_CACHE: Dict[str, Optional[LLMResponseCache]] = {}
+_ACTIVE_CACHE_LOCK = threading.Lock()
+
+def configure_llm_cache(path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                        ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS) -> Optional[LLMResponseCache]:
+    """
+    Enable (or disable, with path=None) the process-wide LLM response cache.
+
+    Args:
+        path: Path to the SQLite database file, or None to disable caching
+        max_entries: Maximum number of cached responses kept
+        ttl_seconds: Age in seconds after which entries expire
+
+    Returns:
+        The active cache, or None if caching is disabled
+    """
+    with _ACTIVE_CACHE_LOCK:
+        previous = _ACTIVE_CACHE.get("cache")
+        if previous is not None:
+            previous.close()
+        _ACTIVE_CACHE["cache"] = LLMResponseCache(path, max_entries, ttl_seconds) if path else None
+        return _ACTIVE_CACHE["cache"]
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    Get the active LLM response cache.
+
+    On first use, the cache is configured from STAGING_LLM_CACHE (database path),
+    STAGING_LLM_CACHE_MAX_ENTRIES and STAGING_LLM_CACHE_TTL (seconds).
+
+    Returns:
+        The active cache, or None if caching is disabled
+    """
+    if "cache" not in _ACTIVE_CACHE:
+        path = os.getenv("STAGING_LLM_CACHE")
+        max_entries = int(os.getenv("STAGING_LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        ttl = os.getenv("STAGING_LLM_CACHE_TTL")
+        with _ACTIVE_CACHE_LOCK:
+            if "cache" not in _ACTIVE_CACHE:
+                _ACTIVE_CACHE["cache"] = LLMResponseCache(
+                    path, max_entries, float(ttl) if ttl else DEFAULT_TTL_SECONDS
+                ) if path else None
+    return _ACTIVE_CACHE["cache"]
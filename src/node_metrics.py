@@ -0,0 +1,296 @@
+"""
+Per-node instrumentation of the staging graph.
+
+Every graph node runs inside node_metrics(), which times the node and collects
+what its LLM calls report through the wrappers in src.azure_openai_config:
+
+- queue_wait_s: seconds spent waiting for the deployment's rate limiter
+- llm_calls, input_tokens, cached_tokens, output_tokens: API calls and their usage
+- response_cache_hits: calls answered from the LLM response cache (src.llm_cache)
+- retries: failed attempts that were retried (src.rate_limit)
+- cost_usd: estimated cost of the calls at STAGING_TOKEN_PRICES
+
+A node's metrics are added to the graph state, so they appear in the result
+of process_medical_note() under "node_metrics", and to a process-wide registry
+that renders them in the Prometheus text format, written to a file (e.g. for
+the node_exporter textfile collector) or served over HTTP:
+
+    registry = get_metrics_registry()
+    registry.write("staging.prom")
+    server = registry.serve(9464)  # GET /metrics
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NODE_METRIC_FIELDS = ("wall_s", "queue_wait_s", "llm_calls", "input_tokens", "cached_tokens", "output_tokens",
+                      "response_cache_hits", "retries", "cost_usd")
+
+# USD per million (uncached prompt, cached prompt, completion) tokens; gpt-4o-mini list prices
+DEFAULT_TOKEN_PRICES = (0.15, 0.075, 0.60)
+
+# Upper bounds of the node wall time histogram buckets, in seconds
+WALL_TIME_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counters exported per node: (metric name, field, help text)
+_PROMETHEUS_COUNTERS = (
+    ("staging_node_queue_wait_seconds_total", "queue_wait_s", "Seconds LLM calls waited for the rate limiter"),
+    ("staging_node_llm_calls_total", "llm_calls", "LLM API calls"),
+    ("staging_node_prompt_tokens_total", "input_tokens", "Prompt tokens sent"),
+    ("staging_node_cached_prompt_tokens_total", "cached_tokens", "Prompt tokens served from the provider cache"),
+    ("staging_node_completion_tokens_total", "output_tokens", "Completion tokens received"),
+    ("staging_node_response_cache_hits_total", "response_cache_hits", "Calls answered from the LLM response cache"),
+    ("staging_node_retries_total", "retries", "Retried LLM call attempts"),
+    ("staging_node_cost_usd_total", "cost_usd", "Estimated LLM cost in USD"),
+)
+
+def get_token_prices() -> Tuple[float, float, float]:
+    """
+    Get the token prices used for cost estimates.
+
+    Set STAGING_TOKEN_PRICES to "input,cached,output" in USD per million tokens
+    for the deployed model; the default is the gpt-4o-mini list price.
+
+    Returns:
+        Tuple of (uncached prompt, cached prompt, completion) USD per million tokens
+    """
+    value = os.getenv("STAGING_TOKEN_PRICES")
+    if not value:
+        return DEFAULT_TOKEN_PRICES
+    try:
+        prices = tuple(float(price) for price in value.split(","))
+    except ValueError:
+        prices = ()
+    if len(prices) != 3 or any(price < 0 for price in prices):
+        raise ValueError(f"Invalid STAGING_TOKEN_PRICES '{value}'; expected 'input,cached,output' USD per million tokens")
+    return prices
+
+def estimate_cost(input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """Return the estimated USD cost of an API call's tokens at the configured prices"""
+    input_price, cached_price, output_price = get_token_prices()
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1_000_000
+
+class NodeMetrics:
+    """Thread-safe metrics of one node run (chunked nodes call the LLM from several threads)"""
+
+    def __init__(self, node: str):
+        self.node = node
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = dict.fromkeys(NODE_METRIC_FIELDS, 0)
+
+    def add(self, field: str, amount: float) -> None:
+        """Add to one of the NODE_METRIC_FIELDS"""
+        with self._lock:
+            self._values[field] += amount
+
+    def snapshot(self) -> Dict[str, float]:
+        """Return the metrics as a dict of NODE_METRIC_FIELDS"""
+        with self._lock:
+            values = dict(self._values)
+        values["wall_s"] = round(values["wall_s"], 4)
+        values["queue_wait_s"] = round(values["queue_wait_s"], 4)
+        values["cost_usd"] = round(values["cost_usd"], 6)
+        return values
+
+# The metrics of the node running in the current context, if any
+_CURRENT: ContextVar[Optional[NodeMetrics]] = ContextVar("staging_node_metrics", default=None)
+
+def record_queue_wait(seconds: float) -> None:
+    """Record time an LLM call of the running node waited for the rate limiter"""
+    metrics = _CURRENT.get()
+    if metrics is not None and seconds > 0:
+        metrics.add("queue_wait_s", seconds)
+
+def record_retry() -> None:
+    """Record a retried attempt of an LLM call of the running node"""
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.add("retries", 1)
+
+def record_response_cache_hit() -> None:
+    """Record an LLM call of the running node answered from the response cache"""
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.add("response_cache_hits", 1)
+
+def record_llm_usage(usage_metadata: Optional[Dict[str, Any]]) -> None:
+    """
+    Record an API call of the running node and its token usage.
+
+    Args:
+        usage_metadata: The response's usage_metadata (None if the response had no usage)
+    """
+    metrics = _CURRENT.get()
+    if metrics is None:
+        return
+    usage_metadata = usage_metadata or {}
+    input_tokens = usage_metadata.get("input_tokens", 0)
+    cached_tokens = (usage_metadata.get("input_token_details") or {}).get("cache_read") or 0
+    output_tokens = usage_metadata.get("output_tokens", 0)
+    metrics.add("llm_calls", 1)
+    metrics.add("input_tokens", input_tokens)
+    metrics.add("cached_tokens", cached_tokens)
+    metrics.add("output_tokens", output_tokens)
+    metrics.add("cost_usd", estimate_cost(input_tokens, cached_tokens, output_tokens))
+
+@contextmanager
+def node_metrics(node: str) -> Iterator[NodeMetrics]:
+    """
+    Collect the metrics of one node run.
+
+    LLM calls made inside the block (including from threads started with a copy
+    of the context) are recorded in the yielded NodeMetrics. On exit, the wall
+    time is set and the run is added to the process-wide registry.
+
+    Args:
+        node: The graph node name
+
+    Yields:
+        NodeMetrics: The run's metrics; call snapshot() after the block
+    """
+    metrics = NodeMetrics(node)
+    token = _CURRENT.set(metrics)
+    started = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add("wall_s", time.perf_counter() - started)
+        _CURRENT.reset(token)
+        _REGISTRY.observe(node, metrics.snapshot())
+
+def merge_node_metrics(left: Optional[Dict[str, Dict]], right: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """Graph state reducer: combine the per-node metrics of a run, a rerun node replacing its earlier entry"""
+    return {**(left or {}), **(right or {})}
+
+def total_node_metrics(node_metrics: Optional[Dict[str, Dict]]) -> Dict[str, float]:
+    """Sum the per-node metrics of a note over its nodes"""
+    total = dict.fromkeys(NODE_METRIC_FIELDS, 0)
+    for values in (node_metrics or {}).values():
+        for field in NODE_METRIC_FIELDS:
+            total[field] += values.get(field, 0)
+    total["wall_s"] = round(total["wall_s"], 4)
+    total["queue_wait_s"] = round(total["queue_wait_s"], 4)
+    total["cost_usd"] = round(total["cost_usd"], 6)
+    return total
+
+def _format_value(value: float) -> str:
+    """Format a sample value, keeping integers free of a decimal point"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricsRegistry:
+    """Process-wide totals of the node metrics, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets: Tuple[float, ...] = WALL_TIME_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._bucket_counts: Dict[str, list] = {}
+
+    def observe(self, node: str, values: Dict[str, float]) -> None:
+        """Add one node run's metrics"""
+        with self._lock:
+            totals = self._totals.setdefault(node, dict.fromkeys(NODE_METRIC_FIELDS + ("runs",), 0))
+            totals["runs"] += 1
+            for field in NODE_METRIC_FIELDS:
+                totals[field] += values.get(field, 0)
+            counts = self._bucket_counts.setdefault(node, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if values.get("wall_s", 0) <= bound:
+                    counts[i] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the totals per node, with the number of runs under "runs" """
+        with self._lock:
+            return {node: dict(totals) for node, totals in sorted(self._totals.items())}
+
+    def render(self) -> str:
+        """Render the totals in the Prometheus text exposition format"""
+        with self._lock:
+            totals = {node: dict(values) for node, values in sorted(self._totals.items())}
+            bucket_counts = {node: list(counts) for node, counts in self._bucket_counts.items()}
+
+        lines = [
+            "# HELP staging_node_runs_total Graph node runs",
+            "# TYPE staging_node_runs_total counter",
+        ]
+        lines += [f'staging_node_runs_total{{node="{node}"}} {_format_value(values["runs"])}'
+                  for node, values in totals.items()]
+
+        lines += [
+            "# HELP staging_node_wall_seconds Wall time of graph node runs",
+            "# TYPE staging_node_wall_seconds histogram",
+        ]
+        for node, values in totals.items():
+            for bound, count in zip(self.buckets, bucket_counts[node]):
+                lines.append(f'staging_node_wall_seconds_bucket{{node="{node}",le="{_format_value(bound)}"}} {count}')
+            lines.append(f'staging_node_wall_seconds_bucket{{node="{node}",le="+Inf"}} {_format_value(values["runs"])}')
+            lines.append(f'staging_node_wall_seconds_sum{{node="{node}"}} {_format_value(values["wall_s"])}')
+            lines.append(f'staging_node_wall_seconds_count{{node="{node}"}} {_format_value(values["runs"])}')
+
+        for name, field, help_text in _PROMETHEUS_COUNTERS:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f'{name}{{node="{node}"}} {_format_value(values[field])}' for node, values in totals.items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write the rendered metrics to a file, replacing it atomically so scrapers never see a partial file"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """
+        Serve the rendered metrics at /metrics on a daemon thread.
+
+        Args:
+            port: Port to bind (0 picks a free one)
+            host: Interface to bind
+
+        Returns:
+            ThreadingHTTPServer: The server; call shutdown() to stop it
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="staging-metrics", daemon=True).start()
+        logger.info(f"Serving node metrics at http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+    def reset(self) -> None:
+        """Clear all totals"""
+        with self._lock:
+            self._totals.clear()
+            self._bucket_counts.clear()
+
+_REGISTRY = MetricsRegistry()
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Get the process-wide node metrics registry"""
+    return _REGISTRY
@@ -0,0 +1,139 @@
+"""
+Section-aware segmentation and chunking of long medical notes.
+
+EMR bundles concatenate several documents (MDC note, radiology and pathology
+reports, first visit note), each made of clinical sections such as
+"Radiology Summary:" or "Plan:". Notes longer than the chunk budget are split
+on these section headers into contiguous chunks that can be processed in
+parallel and merged afterwards.
+"""
+
+import os
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from .evidence import iter_sentences
+
+logger = logging.getLogger(__name__)
+
+# Notes longer than this many characters are processed in chunks of at most this size
+DEFAULT_CHUNK_CHARS = 24000
+
+# Section titles recognized even without markdown formatting ("Plan: ...")
+KNOWN_SECTION_HEADERS = {
+    "action items", "assessment", "assessment and plan", "chief complaint", "clinical history",
+    "clinical summary", "comment", "comments", "diagnosis", "discussion", "discussion points",
+    "family history", "final diagnosis", "findings", "first visit note", "gross description",
+    "history of present illness", "imaging", "impression", "indication", "key findings", "laboratory",
+    "labs", "microscopic description", "multidisciplinary conference (mdc) summary", "past medical history",
+    "pathology summary", "patient information", "physical examination", "plan", "radiology summary",
+    "review of systems", "social history", "staging explanation", "staging summary",
+}
+
+_MARKDOWN_HEADING = re.compile(r"^\s*#{1,6}\s+(.+?)\s*#*\s*$")
+_BOLD_HEADING = re.compile(r"^\s*\*\*([^*]{2,80}?):?\*\*:?\s*$")
+_LABEL_HEADING = re.compile(r"^\s*([A-Za-z][A-Za-z /&()'-]{2,60}?)\s*:\s*(.*?)\s*$")
+
+def get_chunk_chars(chunk_chars: Optional[int] = None) -> int:
+    """Return the chunk budget in characters, defaulting to STAGING_CHUNK_CHARS"""
+    return chunk_chars or int(os.getenv("STAGING_CHUNK_CHARS", DEFAULT_CHUNK_CHARS))
+
+def _section_title(line: str) -> Optional[str]:
+    """Return the section title if a line starts a section, else None"""
+    match = _MARKDOWN_HEADING.match(line) or _BOLD_HEADING.match(line)
+    if match:
+        return match.group(1).strip()
+
+    match = _LABEL_HEADING.match(line)
+    if match:
+        title = match.group(1).strip()
+        if title.casefold() in KNOWN_SECTION_HEADERS:
+            return title
+        # Plain-text reports often use capitalized headers: "IMPRESSION:"
+        if title.isupper() and not match.group(2):
+            return title
+    return None
+
+def segment_note(text: str) -> List[Dict[str, Any]]:
+    """
+    Split a note into its clinical sections.
+
+    Sections start at markdown headings, bold labels alone on a line
+    ("**Radiology Summary:**") and known section labels ("Plan:"). Text before
+    the first header forms an untitled section.
+
+    Args:
+        text: Medical note text
+
+    Returns:
+        List of sections with title (None for leading text), start and end
+        character offsets, in note order; together they cover the whole note
+    """
+    sections = []
+    title, start, offset = None, 0, 0
+    for line in text.splitlines(keepends=True):
+        line_title = _section_title(line)
+        if line_title is not None and offset > start:
+            sections.append({"title": title, "start": start, "end": offset})
+            start = offset
+        if line_title is not None:
+            title = line_title
+        offset += len(line)
+    if offset > start or not sections:
+        sections.append({"title": title, "start": start, "end": offset})
+    return sections
+
+def _split_oversized(text: str, start: int, end: int, max_chars: int) -> List[Dict[str, int]]:
+    """Split text[start:end] at sentence boundaries into pieces of at most max_chars"""
+    pieces = []
+    piece_start = start
+    for sentence_start, sentence_end in iter_sentences(text[start:end]):
+        sentence_end += start
+        while sentence_end - piece_start > max_chars:
+            # Cut before this sentence if possible, otherwise hard-split the sentence
+            cut = start + sentence_start if start + sentence_start > piece_start else piece_start + max_chars
+            pieces.append({"start": piece_start, "end": cut})
+            piece_start = cut
+    pieces.append({"start": piece_start, "end": end})
+    return [piece for piece in pieces if piece["end"] > piece["start"]]
+
+def chunk_note(text: str, max_chars: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Split a note into contiguous chunks of whole sections.
+
+    Consecutive sections are packed into a chunk while it stays within
+    max_chars; a section larger than that is split at sentence boundaries.
+
+    Args:
+        text: Medical note text
+        max_chars: Maximum chunk length (defaults to get_chunk_chars())
+
+    Returns:
+        List of chunks with start, end, text and the titles of the sections they
+        contain; a note within the budget is returned as a single chunk
+    """
+    max_chars = get_chunk_chars(max_chars)
+    chunks: List[Dict[str, Any]] = []
+
+    def _add(start, end, title):
+        if chunks and end - chunks[-1]["start"] <= max_chars:
+            chunks[-1]["end"] = end
+            if title and title not in chunks[-1]["sections"]:
+                chunks[-1]["sections"].append(title)
+        else:
+            chunks.append({"start": start, "end": end, "sections": [title] if title else []})
+
+    for section in segment_note(text):
+        if section["end"] - section["start"] <= max_chars:
+            _add(section["start"], section["end"], section["title"])
+            continue
+        for piece in _split_oversized(text, section["start"], section["end"], max_chars):
+            _add(piece["start"], piece["end"], section["title"])
+
+    for chunk in chunks:
+        chunk["text"] = text[chunk["start"]:chunk["end"]]
+
+    if len(chunks) > 1:
+        logger.info(f"Split a {len(text)}-character note into {len(chunks)} chunks")
+    return chunks
@@ -0,0 +1,477 @@
+"""
+Offline rule-based cancer type pre-classifier.
+
+Most notes name their diagnosis outright ("favorable histology Wilms tumor",
+"B-ALL"). A single compiled regex over every alias of the Toronto cancer types
+finds these mentions, discards negated, hedged, family-history and past-history
+mentions, and acronyms ("ALL") without a diagnosis cue such as "Dx:" or
+"diagnosed with". It returns a label only when the remaining mentions agree on
+one cancer type and the note names no diagnosis it does not recognize (e.g.
+"hepatocellular carcinoma"). Otherwise it abstains and the LLM identifies the
+cancer as before.
+
+The classifier's agreement with LLM labels can be measured with
+preclassifier_report(), or from the command line on a batch results CSV:
+
+    python -m src.preclassifier results.csv
+"""
+
+import os
+import re
+import csv
+import sys
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .cancer_mapping import CANCER_TYPE_MAPPING
+from .cancer_resolver import CancerTypeResolver, normalize_label, label_variants
+
+logger = logging.getLogger(__name__)
+
+# Preclassifier modes: off (always ask the LLM), shadow (ask the LLM and log
+# agreement), on (skip the LLM when the classifier is confident)
+PRECLASSIFIER_MODES = ("off", "shadow", "on")
+# Shadow by default until the classifier's precision is measured on a labeled corpus
+DEFAULT_PRECLASSIFIER_MODE = "shadow"
+
+# Alias tokens that are acronyms and only count when written in capitals ("ALL", not "all")
+ACRONYM_TOKENS = {"all", "dlbcl", "pnet", "mpnst", "nrsts"}
+
+# Pediatric cancers outside the Toronto system; an affirmed mention makes the classifier abstain
+UNCOVERED_TERMS = (
+    "acute myeloid leukemia", "AML", "chronic myeloid leukemia", "CML", "juvenile myelomonocytic leukemia",
+    "JMML", "myelodysplastic syndrome", "langerhans cell histiocytosis", "nasopharyngeal carcinoma",
+    "adrenocortical carcinoma", "thyroid carcinoma", "melanoma", "craniopharyngioma",
+    "diffuse intrinsic pontine glioma", "DIPG", "diffuse midline glioma", "atypical teratoid rhabdoid tumor",
+    "AT/RT", "germinoma", "pleuropulmonary blastoma", "extrarenal rhabdoid tumor", "malignant rhabdoid tumor",
+)
+
+_NEGATION_BEFORE = re.compile(
+    r"\b(?:no|not|without|negative\s+for|denies|denied|free\s+of|absence\s+of|no\s+evidence\s+of|"
+    r"ruled\s+out|rule\s+out|r/o|excluded)\b",
+    re.IGNORECASE
+)
+_NEGATION_AFTER = re.compile(r"^[^.;\n]{0,30}?\b(?:was|is|has\s+been)?\s*(?:ruled\s+out|excluded|unlikely|less\s+likely)\b",
+                             re.IGNORECASE)
+_HEDGE_BEFORE = re.compile(
+    r"\b(?:suspected|suspicious\s+for|suspicion\s+of|possible|possibly|probable|concern\s+for|"
+    r"differential(?:\s+diagnosis)?|ddx|versus|vs\.?|evaluat\w+\s+(?:for|of)|consider|considering|question\s+of)\b"
+    r"|\?",
+    re.IGNORECASE
+)
+_FAMILY_BEFORE = re.compile(
+    r"\b(?:family\s+history|FHx|FH|mother|father|parent|sibling|brother|sister|aunt|uncle|"
+    r"grand(?:mother|father|parent)|cousin|maternal|paternal|relative)s?\b",
+    re.IGNORECASE
+)
+_HISTORY_BEFORE = re.compile(
+    r"\b(?:history\s+of|h/o|hx\s+of|previously|prior|previous|remote|former|survivor\s+of"
+    r"|in\s+remission\s+(?:from|of))\b",
+    re.IGNORECASE
+)
+_HISTORY_AFTER = re.compile(
+    r"^[^.;\n]{0,60}?\b(?:treated\s+(?:at|in|with)\b[^.;\n]{0,20}?\b(?:age|\d{4}|years?\s+ago)"
+    r"|in\s+(?:complete\s+|continued\s+)?remission|(?:completed|finished|off)\s+(?:therapy|treatment|chemo\w*)"
+    r"|\d+\s+years?\s+ago|as\s+an?\s+(?:child|infant|toddler)|survivor)\b",
+    re.IGNORECASE
+)
+# Cues that an acronym ("ALL") names the patient's diagnosis rather than being an ordinary word
+_DIAGNOSIS_CUE = re.compile(
+    r"\b(?:diagnos\w*|dx|impression|assessment|a/p|consistent\s+with|compatible\s+with|confirm\w*|known"
+    r"|newly|relapsed?|refractory|(?:very\s+)?(?:high|standard|low|intermediate)[\s-]risk|induction|consolidation"
+    r"|maintenance|(?:patient|pt|child|boy|girl|male|female|infant|toddler|adolescent|y/?o|year[\s-]old)\b"
+    r"[^.;\n]{0,30}?\bwith)\b",
+    re.IGNORECASE
+)
+# Diagnosis terms; one that no alias covers makes the classifier abstain
+_DIAGNOSIS_TERM = re.compile(
+    r"\b[\w-]*(?:carcinoma|sarcoma|blastoma|lymphoma|leuka?emia|glioma|cytoma|melanoma|germinoma|seminoma"
+    r"|teratoma|myeloma|mesothelioma)s?\b",
+    re.IGNORECASE
+)
+_SENTENCE_BREAK = re.compile(r"[.;!?\n]")
+_FAMILY_SECTIONS = ("family history", "family hx", "fhx")
+_HISTORY_SECTIONS = ("past medical", "past history", "past oncolog", "pmh", "prior history")
+_DIAGNOSIS_SECTIONS = ("diagnos", "dx", "final diagnos", "primary diagnos", "impression", "assessment")
+_SECTION_HEADER = re.compile(r"^[#*\s]*([A-Za-z][A-Za-z /&'-]{1,50}?)\s*:\**\s*(.*)$")
+_CLAUSE_BREAK = re.compile(r"[.;:!\n]|,\s+(?:but|however)\b")
+
+_TRIE_END = ""
+_TOKEN_SEPARATOR = r"[\s\-]*"
+
+def _alias_pieces(alias: str) -> List[str]:
+    """Split an alias into per-token regex pieces tolerating case, possessives and plurals"""
+    tokens = normalize_label(alias).split()
+    pieces = []
+    for position, token in enumerate(tokens):
+        if alias.isupper() or token in ACRONYM_TOKENS:
+            pieces.append(f"(?-i:{re.escape(token.upper())})")
+            continue
+        piece = re.escape(token).replace("tumor", "tumou?r").replace("leukemia", "leuka?emia")
+        if position == len(tokens) - 1 and not token.endswith("s"):
+            piece += "s?"
+        pieces.append(piece + "(?:['’]s|['’])?")
+    return pieces
+
+def _render_trie(node: Dict[str, Dict]) -> str:
+    """
+    Render a token trie as a regex alternation with shared prefixes factored out.
+
+    Regex alternation takes the first branch that matches, so pieces that
+    continue into longer aliases come before pieces that only end one: the
+    final "sarcomas?" of "clear cell sarcoma" must not stop the match before
+    "clear cell sarcoma of the kidney" is tried.
+    """
+    continued = []
+    terminal = []
+    for piece in sorted(node, key=len, reverse=True):
+        if piece == _TRIE_END:
+            continue
+        child = node[piece]
+        branches = {key: value for key, value in child.items() if key != _TRIE_END}
+        if not branches:
+            terminal.append(piece)
+            continue
+        continuation = _TOKEN_SEPARATOR + _render_trie(branches)
+        if _TRIE_END in child:
+            continuation = f"(?:{continuation})?"
+        continued.append(piece + continuation)
+    return "(?:" + "|".join(continued + terminal) + ")"
+
+class CancerPreclassifier:
+    """
+    Compiled alias matcher that labels a note with a Toronto cancer type or abstains.
+    """
+
+    def __init__(self, canonical_types: Iterable[str], alias_mapping: Optional[Dict[str, str]] = None,
+                 uncovered_terms: Iterable[str] = UNCOVERED_TERMS):
+        """
+        Compile the alias automaton.
+
+        Args:
+            canonical_types: The Toronto cancer types (keys of the staging data)
+            alias_mapping: Mapping from specific diagnoses to Toronto cancer types
+            uncovered_terms: Cancers outside the Toronto system that make the classifier abstain
+        """
+        resolver = CancerTypeResolver(canonical_types, alias_mapping)
+
+        # Every alias with the cancer type it stands for (None for uncovered cancers)
+        targets: Dict[str, Optional[str]] = {}
+        for canonical in resolver.canonical_types:
+            for variant in label_variants(canonical):
+                targets.setdefault(variant, canonical)
+        for alias in (alias_mapping or {}):
+            canonical = resolver.resolve(alias)
+            if canonical is not None:
+                targets.setdefault(alias, canonical)
+        for term in uncovered_terms:
+            targets.setdefault(term, None)
+
+        # Aliases are matched through a token trie, so the regex engine tries each
+        # shared prefix ("ovarian ...", "testicular ...") once per position
+        self._targets: Dict[str, Optional[str]] = {}
+        self._acronyms: Set[str] = set()
+        trie: Dict[str, Dict] = {}
+        for alias, canonical in targets.items():
+            pieces = _alias_pieces(alias)
+            if not pieces:
+                continue
+            key = normalize_label(alias)
+            self._targets.setdefault(key, canonical)
+            if alias.isupper() or ACRONYM_TOKENS.intersection(key.split()):
+                self._acronyms.add(key)
+            node = trie
+            for piece in pieces:
+                node = node.setdefault(piece, {})
+            node[_TRIE_END] = {}
+
+        self._pattern = re.compile(r"(?<![\w-])" + _render_trie(trie) + r"(?![\w-])", re.IGNORECASE)
+        logger.info(f"Compiled pre-classifier over {len(self._targets)} aliases")
+
+    def _alias_key(self, matched: str) -> Optional[str]:
+        """Return the alias a matched mention was written from, tolerating plurals"""
+        key = normalize_label(matched)
+        for candidate in (key, key[:-1], key + "s"):
+            if candidate in self._targets:
+                return candidate
+        return None
+
+    def _target(self, matched: str) -> Optional[str]:
+        """Return the cancer type of a matched alias (None for cancers outside the Toronto system)"""
+        key = self._alias_key(matched)
+        return self._targets[key] if key is not None else None
+
+    def find_mentions(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Find every cancer type mention in a note with its context.
+
+        Args:
+            text: Medical note text
+
+        Returns:
+            List of mentions with text, start, end, cancer_type (None for cancers
+            outside the Toronto system) and context ("affirmed", "negated",
+            "hedged", "family_history", "history" or "unconfirmed" for an
+            acronym without a diagnosis cue)
+        """
+        mentions = []
+        sections = _NoteSections(text)
+
+        for match in self._pattern.finditer(text):
+            start, end = match.span()
+            context = _mention_context(text, start, end, sections)
+            if context == "affirmed" and self._alias_key(match.group(0)) in self._acronyms:
+                sentence_start = _sentence_start(text, start)
+                if not (sections.in_diagnosis(start) or _DIAGNOSIS_CUE.search(text[sentence_start:start])):
+                    context = "unconfirmed"
+
+            mentions.append({
+                "text": match.group(0),
+                "start": start,
+                "end": end,
+                "cancer_type": self._target(match.group(0)),
+                "context": context,
+            })
+        return mentions
+
+    def find_unrecognized(self, text: str, mentions: List[Dict[str, Any]]) -> List[str]:
+        """
+        Find diagnosis terms ("hepatocellular carcinoma") that no alias covers.
+
+        Args:
+            text: Medical note text
+            mentions: The note's mentions as returned by find_mentions()
+
+        Returns:
+            List of the unrecognized terms that are not negated or family history
+        """
+        sections = _NoteSections(text)
+        unrecognized = []
+        for match in _DIAGNOSIS_TERM.finditer(text):
+            start, end = match.span()
+            if any(mention["start"] <= start and end <= mention["end"] for mention in mentions):
+                continue
+            if _mention_context(text, start, end, sections) in ("negated", "family_history"):
+                continue
+            unrecognized.append(match.group(0))
+        return unrecognized
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        """
+        Label a note with a Toronto cancer type, or abstain.
+
+        The classifier is confident only when all affirmed mentions name the same
+        Toronto cancer type, no other cancer is mentioned as past history, and the
+        note mentions no cancer outside the Toronto system and no diagnosis term
+        that the classifier does not recognize.
+
+        Args:
+            text: Medical note text
+
+        Returns:
+            Dict with confident (bool), cancer_type (canonical Toronto type or None),
+            label (the diagnosis as written in the note), mentions and reason
+        """
+        mentions = self.find_mentions(text)
+        affirmed = [mention for mention in mentions if mention["context"] == "affirmed"]
+        types = {mention["cancer_type"] for mention in affirmed}
+        considered = [mention for mention in mentions if mention["context"] not in ("negated", "family_history")]
+        history_types = {mention["cancer_type"] for mention in mentions if mention["context"] == "history"}
+
+        result = {"confident": False, "cancer_type": None, "label": None, "mentions": mentions}
+        if not affirmed:
+            result["reason"] = "no affirmed cancer mention" if mentions else "no cancer mention"
+        elif any(mention["cancer_type"] is None for mention in considered):
+            result["reason"] = "mentions a cancer outside the Toronto system"
+        elif len(types) > 1:
+            result["reason"] = f"conflicting mentions: {', '.join(sorted(types))}"
+        elif history_types - types:
+            result["reason"] = f"history of another cancer: {', '.join(sorted(history_types - types))}"
+        elif unrecognized := self.find_unrecognized(text, mentions):
+            result["reason"] = f"mentions an unrecognized diagnosis: {', '.join(sorted(set(unrecognized)))}"
+        else:
+            # The most frequent affirmed wording (then the most specific) is the diagnosis label
+            wordings = Counter(" ".join(mention["text"].split()) for mention in affirmed)
+            label = max(wordings, key=lambda wording: (wordings[wording], len(wording)))
+            result.update({
+                "confident": True,
+                "cancer_type": types.pop(),
+                "label": label,
+                "reason": f"{len(affirmed)} affirmed mention(s)",
+            })
+        return result
+
+class _NoteSections:
+    """Character ranges of the family history, past history and diagnosis sections of a note"""
+
+    def __init__(self, text: str):
+        self.family = _section_ranges(text, _FAMILY_SECTIONS)
+        self.history = _section_ranges(text, _HISTORY_SECTIONS)
+        self.diagnosis = _section_ranges(text, _DIAGNOSIS_SECTIONS)
+
+    @staticmethod
+    def _within(ranges: List[Tuple[int, int]], position: int) -> bool:
+        return any(low <= position < high for low, high in ranges)
+
+    def in_family(self, position: int) -> bool:
+        return self._within(self.family, position)
+
+    def in_history(self, position: int) -> bool:
+        return self._within(self.history, position)
+
+    def in_diagnosis(self, position: int) -> bool:
+        return self._within(self.diagnosis, position)
+
+def _mention_context(text: str, start: int, end: int, sections: _NoteSections) -> str:
+    """Classify the context of a mention as family_history, negated, hedged, history or affirmed"""
+    before = text[_clause_start(text, start):start]
+    after = text[end:end + 80]
+
+    if sections.in_family(start) or _FAMILY_BEFORE.search(before):
+        return "family_history"
+    if _NEGATION_BEFORE.search(before) or _NEGATION_AFTER.search(after):
+        return "negated"
+    if _HEDGE_BEFORE.search(before):
+        return "hedged"
+    if sections.in_history(start) or _HISTORY_BEFORE.search(before) or _HISTORY_AFTER.search(after):
+        return "history"
+    return "affirmed"
+
+def _clause_start(text: str, position: int) -> int:
+    """Return where the clause containing position starts (at most 80 characters back)"""
+    window_start = max(0, position - 80)
+    breaks = list(_CLAUSE_BREAK.finditer(text, window_start, position))
+    return breaks[-1].end() if breaks else window_start
+
+def _sentence_start(text: str, position: int) -> int:
+    """Return where the sentence containing position starts (at most 80 characters back)"""
+    window_start = max(0, position - 80)
+    breaks = list(_SENTENCE_BREAK.finditer(text, window_start, position))
+    return breaks[-1].end() if breaks else window_start
+
+def _section_ranges(text: str, prefixes: Tuple[str, ...]) -> List[Tuple[int, int]]:
+    """Return the character ranges of the note sections whose header starts with one of prefixes"""
+    ranges = []
+    section_start = None
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        header = _SECTION_HEADER.match(line)
+        # "Mother: ..." inside a family history section does not end it
+        if header and section_start is not None and _FAMILY_BEFORE.match(header.group(1)):
+            header = None
+        if header and len(header.group(1)) <= 40:
+            if section_start is not None:
+                ranges.append((section_start, offset))
+                section_start = None
+            if header.group(1).strip().lower().startswith(prefixes):
+                section_start = offset
+        offset += len(line)
+    if section_start is not None:
+        ranges.append((section_start, offset))
+    return ranges
+
+_DEFAULT_PRECLASSIFIER: Dict[str, CancerPreclassifier] = {}
+_DEFAULT_PRECLASSIFIER_LOCK = threading.Lock()
+
+def get_preclassifier(canonical_types: Iterable[str]) -> CancerPreclassifier:
+    """
+    Get the shared pre-classifier over CANCER_TYPE_MAPPING, compiling it on first use.
+
+    Args:
+        canonical_types: The Toronto cancer types; only used on the first call
+
+    Returns:
+        CancerPreclassifier: The shared classifier
+    """
+    if "default" not in _DEFAULT_PRECLASSIFIER:
+        with _DEFAULT_PRECLASSIFIER_LOCK:
+            if "default" not in _DEFAULT_PRECLASSIFIER:
+                _DEFAULT_PRECLASSIFIER["default"] = CancerPreclassifier(canonical_types, CANCER_TYPE_MAPPING)
+    return _DEFAULT_PRECLASSIFIER["default"]
+
+def get_preclassifier_mode(mode: Optional[str] = None) -> str:
+    """
+    Validate a preclassifier mode, defaulting to STAGING_PRECLASSIFIER.
+
+    Args:
+        mode: "off", "shadow" or "on", or None for the environment setting
+
+    Returns:
+        str: The preclassifier mode
+    """
+    mode = (mode or os.getenv("STAGING_PRECLASSIFIER", DEFAULT_PRECLASSIFIER_MODE)).strip().lower()
+    if mode not in PRECLASSIFIER_MODES:
+        raise ValueError(f"Unknown preclassifier mode '{mode}'; expected one of {', '.join(PRECLASSIFIER_MODES)}")
+    return mode
+
+def preclassifier_report(records: Iterable[Tuple[Optional[str], Optional[str]]]) -> Dict[str, Any]:
+    """
+    Measure pre-classifier labels against LLM labels.
+
+    Args:
+        records: (classifier cancer type or None when abstaining, LLM cancer type or
+            None when not covered) pairs, both canonical Toronto types
+
+    Returns:
+        Dict with the number of notes, coverage (share labeled by the classifier),
+        precision (share of classifier labels matching the LLM), recall (share of
+        LLM-labeled notes the classifier labeled correctly) and the disagreements
+    """
+    total = labeled = correct = llm_labeled = 0
+    disagreements: Dict[str, int] = {}
+    for predicted, expected in records:
+        total += 1
+        if expected is not None:
+            llm_labeled += 1
+        if predicted is None:
+            continue
+        labeled += 1
+        if predicted == expected:
+            correct += 1
+        else:
+            pair = f"{predicted} -> {expected}"
+            disagreements[pair] = disagreements.get(pair, 0) + 1
+
+    return {
+        "notes": total,
+        "coverage": labeled / total if total else 0.0,
+        "precision": correct / labeled if labeled else 0.0,
+        "recall": correct / llm_labeled if llm_labeled else 0.0,
+        "disagreements": disagreements,
+    }
+
+def main(argv=None):
+    """Report pre-classifier precision/recall against the LLM labels of a batch results CSV"""
+    parser = argparse.ArgumentParser(
+        description="Compare pre-classifier labels with the LLM labels in a results CSV. "
+                    "Use a CSV produced with STAGING_PRECLASSIFIER=off or shadow, so the labels come from the LLM."
+    )
+    parser.add_argument("results", help="Results CSV with 'Medical Note' and 'Standardized Category' columns")
+    args = parser.parse_args(argv)
+
+    from .knowledge_base import get_staging_kb
+    staging_kb = get_staging_kb()
+    classifier = get_preclassifier(staging_kb.cancer_types)
+
+    records = []
+    with open(args.results, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            with open(row['Medical Note'], 'r', encoding='utf-8') as note_file:
+                predicted = classifier.classify(note_file.read())["cancer_type"]
+            expected = staging_kb.resolve(row.get('Standardized Category'))
+            records.append((predicted, expected))
+
+    report = preclassifier_report(records)
+    print(f"Notes:     {report['notes']}")
+    print(f"Coverage:  {report['coverage']:.1%}")
+    print(f"Precision: {report['precision']:.1%}")
+    print(f"Recall:    {report['recall']:.1%}")
+    for pair, count in sorted(report["disagreements"].items(), key=lambda item: -item[1]):
+        print(f"  {count:>4}  {pair}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
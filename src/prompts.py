@@ -0,0 +1,133 @@
+"""
+Prompt assembly for the staging nodes.
+
+Providers cache the longest previously seen prefix of a request (the tool
+schema, then the messages in order), so prompts are laid out with the static
+content first and the note last:
+
+1. System prompt: node instructions followed by the staging reference (covered
+   cancer types, stage terminology, diagnosis mapping). Built once per node and
+   byte-identical for every note.
+2. User message: the task, then content shared by notes of the same cancer type
+   (its Toronto staging entry), then per-note content, with the note itself last.
+"""
+
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Node instructions; none of them depend on the note or its cancer type
+IDENTIFY_INSTRUCTIONS = """You are a pediatric oncologist specialized in identifying cancer types from medical notes.
+You extract information about cancer diagnoses in pediatric patients and map them to standardized categories.
+
+Always check if an identified cancer type maps to one of the standardized Toronto categories listed in the reference below.
+Set standardized_category to the matching Toronto category exactly as listed,
+and is_covered_by_toronto to false if the diagnosis does not map to any of them.
+
+ADDITIONALLY, please extract:
+1. Primary site (location) of the cancer
+2. Any mentioned sites of metastasis
+3. Any explicitly mentioned stage in the note (e.g., "Stage III")"""
+
+IDENTIFY_BATCH_INSTRUCTIONS = f"""{IDENTIFY_INSTRUCTIONS}
+
+You will receive several independent medical notes, each enclosed in <note id="..."> and </note>.
+Analyze every note on its own and return exactly one identification per note, with note_id set to the note's id."""
+
+ANALYZE_INSTRUCTIONS = """You are a pediatric oncology staging specialist.
+You analyze medical notes to identify the staging criteria of the identified cancer
+according to the Toronto Pediatric Cancer Staging System.
+
+Report the status of every Toronto criterion listed for the cancer and summarize any other
+information that can be used for staging it."""
+
+STAGE_INSTRUCTIONS = """You are a pediatric oncology staging expert specializing in the Toronto Pediatric Cancer Staging System.
+You determine the Toronto stage of a case from its criteria analysis and medical note.
+
+Use exactly one of the valid stage names of the cancer type, and explain in detail how you determined the stage."""
+
+ANALYZE_AND_STAGE_INSTRUCTIONS = """You are a pediatric oncology staging expert specializing in the Toronto Pediatric Cancer Staging System.
+You analyze medical notes to identify the staging criteria of the identified cancer, then determine its Toronto stage from them.
+
+Report the status of every Toronto criterion listed for the cancer and summarize any other
+information that can be used for staging it. Then give the stage, using exactly one of the
+valid stage names of the cancer type, and explain in detail how it follows from the criteria."""
+
+REPORT_INSTRUCTIONS = """You are a pediatric oncology report specialist.
+You create clear, professional reports on cancer staging for medical records.
+Your reports are comprehensive yet concise, focusing on the most important clinical information."""
+
+# Nodes whose system prompt ends with the staging reference
+_REFERENCE_NODES = ("identify_cancer_type", "identify_batch", "analyze_staging_criteria", "calculate_stage",
+                    "analyze_and_stage")
+
+_NODE_INSTRUCTIONS = {
+    "identify_cancer_type": IDENTIFY_INSTRUCTIONS,
+    "identify_batch": IDENTIFY_BATCH_INSTRUCTIONS,
+    "analyze_staging_criteria": ANALYZE_INSTRUCTIONS,
+    "calculate_stage": STAGE_INSTRUCTIONS,
+    "analyze_and_stage": ANALYZE_AND_STAGE_INSTRUCTIONS,
+    "generate_report": REPORT_INSTRUCTIONS,
+}
+
+class PromptBuilder:
+    """
+    Builds node prompts with a stable, cacheable prefix.
+
+    System prompts are rendered once from the knowledge base; user messages
+    place their sections from most to least shared.
+    """
+
+    def __init__(self, knowledge_base):
+        """
+        Args:
+            knowledge_base: StagingKnowledgeBase providing the prompt fragments
+        """
+        self.knowledge_base = knowledge_base
+        self.reference = (
+            "Toronto Pediatric Cancer Staging System reference\n\n"
+            f"The Toronto Pediatric Cancer Staging System ONLY covers these cancer types:\n"
+            f"{knowledge_base.covered_cancers_text}\n\n"
+            f"Valid stages by cancer type:\n{knowledge_base.stage_terminology_text}\n"
+            f"Mapping from specific diagnoses to their standardized categories:\n{knowledge_base.mapping_text}"
+        )
+        self._system_prompts: Dict[str, str] = {
+            node: f"{instructions}\n\n{self.reference}" if node in _REFERENCE_NODES else instructions
+            for node, instructions in _NODE_INSTRUCTIONS.items()
+        }
+
+    def system_prompt(self, node: str) -> str:
+        """Return the static system prompt of a node"""
+        return self._system_prompts[node]
+
+    def user_prompt(self, task: str, cancer_type: Optional[str] = None,
+                    sections: Iterable[Tuple[str, str]] = (), note: Optional[str] = None) -> str:
+        """
+        Assemble a user message, most shared content first.
+
+        Args:
+            task: Static task statement of the node
+            cancer_type: Canonical cancer type whose staging entry is included, if any
+            sections: (heading, text) pairs of per-note content, in order
+            note: The note text (or its excerpts, with their heading), always last
+
+        Returns:
+            str: The user message content
+        """
+        parts = [task]
+        if cancer_type:
+            parts.append(f"Toronto staging criteria for {cancer_type}:\n{self.knowledge_base.entry_text(cancer_type)}")
+        parts.extend(f"{heading}:\n{text}" for heading, text in sections)
+        if note:
+            parts.append(note)
+        return "\n\n".join(parts)
+
+_BUILDERS: Dict[int, PromptBuilder] = {}
+
+def get_prompt_builder(knowledge_base) -> PromptBuilder:
+    """Get the shared prompt builder for a knowledge base"""
+    key = id(knowledge_base)
+    if key not in _BUILDERS:
+        _BUILDERS[key] = PromptBuilder(knowledge_base)
+    return _BUILDERS[key]
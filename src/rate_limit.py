@@ -0,0 +1,669 @@
+"""
+Per-deployment rate limiting and retries for Azure OpenAI calls.
+
+Each deployment gets a token-bucket limiter for requests per minute (RPM) and
+tokens per minute (TPM). The same limiter serves the synchronous and asyncio
+code paths, so mixed workloads share one budget.
+
+Calls go through the deployment's RetryScheduler, which retries throttled
+(429), timed-out and server-failed requests with jittered exponential backoff.
+A Retry-After header from the service pauses the deployment's limiter, so every
+caller backs off rather than only the one that was throttled. Throttled calls
+have their own, larger retry budget. A circuit breaker per deployment stops
+sending calls after repeated outages (server errors, timeouts and connection
+failures, but not throttling); calls made meanwhile are queued until a probe
+call has shown whether the deployment recovered.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from .node_metrics import record_queue_wait, record_retry
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English clinical text
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text without a tokenizer"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+def estimate_message_tokens(messages: List, max_completion_tokens: int = 0) -> int:
+    """
+    Estimate the tokens a chat request will consume against a TPM quota.
+
+    Args:
+        messages: LangChain messages to be sent
+        max_completion_tokens: Expected completion size to reserve in addition to the prompt
+
+    Returns:
+        int: Estimated token count
+    """
+    prompt_tokens = sum(estimate_tokens(str(message.content)) + 4 for message in messages)
+    return prompt_tokens + max_completion_tokens
+
+class RateLimiter:
+    """
+    Token-bucket limiter enforcing requests-per-minute and tokens-per-minute budgets.
+
+    Callers reserve capacity up front; if a bucket is overdrawn, the caller waits
+    until the deficit has been refilled. A limit of None means unlimited.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        """
+        Initialize the limiter with full buckets.
+
+        Args:
+            requests_per_minute: Maximum requests per minute, or None for no limit
+            tokens_per_minute: Maximum tokens per minute, or None for no limit
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_balance = float(requests_per_minute or 0)
+        self._token_balance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        """Add capacity accrued since the last refill (caller holds the lock)"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_balance = min(
+                self.requests_per_minute,
+                self._request_balance + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_balance = min(
+                self.tokens_per_minute,
+                self._token_balance + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve one request and the given number of tokens.
+
+        Args:
+            tokens: Estimated tokens for the request
+
+        Returns:
+            float: Seconds the caller must wait before sending the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0.0, self._paused_until - now)
+            if self.requests_per_minute:
+                self._request_balance -= 1
+                if self._request_balance < 0:
+                    wait = max(wait, -self._request_balance * 60.0 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                # A single request larger than the whole budget still has to go through eventually
+                self._token_balance -= min(tokens, self.tokens_per_minute)
+                if self._token_balance < 0:
+                    wait = max(wait, -self._token_balance * 60.0 / self.tokens_per_minute)
+            return wait
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """
+        Return how long a request would wait for capacity, without reserving any.
+
+        Args:
+            tokens: Estimated tokens for the request
+
+        Returns:
+            float: Seconds the request would wait if reserved now
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0.0, self._paused_until - now)
+            if self.requests_per_minute and self._request_balance < 1:
+                wait = max(wait, (1 - self._request_balance) * 60.0 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                deficit = min(tokens, self.tokens_per_minute) - self._token_balance
+                if deficit > 0:
+                    wait = max(wait, deficit * 60.0 / self.tokens_per_minute)
+            return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back every request for the given time, e.g. when the service answers with Retry-After.
+
+        Args:
+            seconds: Seconds from now before the next request may be sent
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Block until the request fits within the budget.
+
+        Args:
+            tokens: Estimated tokens for the request
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """
+        Asyncio variant of acquire() that yields to the event loop while waiting.
+
+        Args:
+            tokens: Estimated tokens for the request
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+# Limiters are shared per deployment across the whole process
+_LIMITERS: Dict[str, RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def configure_rate_limits(deployment_name: str, requests_per_minute: Optional[float] = None,
+                          tokens_per_minute: Optional[float] = None) -> RateLimiter:
+    """
+    Set the RPM/TPM budget for a deployment, replacing any existing limiter.
+
+    Args:
+        deployment_name: The Azure OpenAI deployment name
+        requests_per_minute: Maximum requests per minute, or None for no limit
+        tokens_per_minute: Maximum tokens per minute, or None for no limit
+
+    Returns:
+        RateLimiter: The limiter now used for the deployment
+    """
+    with _LIMITERS_LOCK:
+        _LIMITERS[deployment_name] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _LIMITERS[deployment_name]
+
+def get_rate_limiter(deployment_name: str) -> RateLimiter:
+    """
+    Get the shared limiter for a deployment.
+
+    Deployments without an explicit configure_rate_limits() call use
+    AZURE_RPM_LIMIT and AZURE_TPM_LIMIT, or no limit if those are unset.
+
+    Args:
+        deployment_name: The Azure OpenAI deployment name
+
+    Returns:
+        RateLimiter: The deployment's limiter
+    """
+    limiter = _LIMITERS.get(deployment_name)
+    if limiter is None:
+        with _LIMITERS_LOCK:
+            limiter = _LIMITERS.get(deployment_name)
+            if limiter is None:
+                rpm = os.getenv("AZURE_RPM_LIMIT")
+                tpm = os.getenv("AZURE_TPM_LIMIT")
+                limiter = RateLimiter(float(rpm) if rpm else None, float(tpm) if tpm else None)
+                _LIMITERS[deployment_name] = limiter
+    return limiter
+
+# Retry and circuit breaker defaults (overridable with the environment variables in get_retry_scheduler())
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_MAX_THROTTLED_ATTEMPTS = 30
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# Seconds between checks of a half-open circuit by calls queued behind its probe
+PROBE_POLL_INTERVAL = 0.05
+
+# HTTP statuses worth retrying: timeout, conflict, throttling and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# HTTP status of a throttled call
+THROTTLED_STATUS_CODE = 429
+
+T = TypeVar("T")
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a deployment whose circuit breaker is open"""
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """Return the HTTP status of an API error, or None if it has none"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Return True if a failed call may succeed when repeated.
+
+    Throttling, timeouts, connection failures and server errors are retryable;
+    other client errors (bad request, authentication) are not.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # Timeouts and connection errors carry no status
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or name in (
+        "APITimeoutError", "APIConnectionError", "TimeoutException", "ConnectError", "ReadTimeout")
+
+def is_throttled(error: BaseException) -> bool:
+    """Return True if a call failed because the deployment throttled it (429)"""
+    return _status_code(error) == THROTTLED_STATUS_CODE
+
+def is_outage(error: BaseException) -> bool:
+    """
+    Return True if a failed call indicates that the deployment is down.
+
+    Server errors (5xx), timeouts and connection failures count toward the
+    circuit breaker; throttling and other client errors do not, since the
+    deployment answered.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status >= 500
+    return is_retryable(error)
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Return the delay in seconds requested by the service's Retry-After headers, if any.
+
+    Azure OpenAI sends retry-after-ms and retry-after (seconds or an HTTP date).
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000.0)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """Jittered exponential backoff ("full jitter"), never shorter than a Retry-After the service asked for"""
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, max_throttled_attempts: int = DEFAULT_MAX_THROTTLED_ATTEMPTS):
+        """
+        Args:
+            max_attempts: Failed calls (other than throttled ones) before giving up (1 disables retries)
+            base_delay: Backoff ceiling in seconds after the first failure, doubled after each further one
+            max_delay: Largest backoff ceiling in seconds
+            max_throttled_attempts: Throttled (429) calls before giving up
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_throttled_attempts = max_throttled_attempts
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        Build the policy from AZURE_MAX_ATTEMPTS, AZURE_MAX_THROTTLED_ATTEMPTS,
+        AZURE_RETRY_BASE_DELAY and AZURE_RETRY_MAX_DELAY, falling back to the module defaults.
+        """
+        return cls(
+            int(os.getenv("AZURE_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+            float(os.getenv("AZURE_RETRY_BASE_DELAY", DEFAULT_BASE_DELAY)),
+            float(os.getenv("AZURE_RETRY_MAX_DELAY", DEFAULT_MAX_DELAY)),
+            int(os.getenv("AZURE_MAX_THROTTLED_ATTEMPTS", DEFAULT_MAX_THROTTLED_ATTEMPTS)),
+        )
+
+    def delay(self, attempt: int, requested: Optional[float] = None) -> float:
+        """
+        Return the seconds to wait after a failed attempt.
+
+        Args:
+            attempt: Number of the attempt that failed, from 1
+            requested: Delay requested by the service (Retry-After), if any
+
+        Returns:
+            float: Seconds to wait before the next attempt
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = random.uniform(0, ceiling)
+        if requested is not None:
+            # Spread the callers released by the same Retry-After over a short window
+            delay = requested + random.uniform(0, min(ceiling, self.base_delay))
+        return delay
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one deployment.
+
+    After failure_threshold consecutive outages the circuit opens and no calls
+    are admitted. Once reset_timeout has passed, one probe call is let through
+    (half-open): its success closes the circuit, its failure opens it again. A
+    probe that ends without either (e.g. cancelled or throttled) must be
+    released with release_probe(), so that another call can probe.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT, name: str = ""):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before a probe call
+            name: Deployment name, for log messages
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+        self._lock = threading.Lock()
+        # Times the circuit has opened, so queued callers can tell that a probe failed
+        self.openings = 0
+
+    @property
+    def state(self) -> str:
+        """Return the circuit state: "closed", "open" or "half_open" (probe due or in flight)"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probe is not None or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def _wait_time(self, now: float) -> float:
+        """Seconds until a call may be admitted; 0 if one may be now (caller holds the lock)"""
+        if self._opened_at is None:
+            return 0.0
+        if self._probe is not None:
+            return PROBE_POLL_INTERVAL
+        return max(0.0, self._opened_at + self.reset_timeout - now)
+
+    def wait_time(self) -> float:
+        """
+        Return how long a call would wait to be admitted, without admitting it.
+
+        Returns:
+            float: 0 when the circuit is closed or a probe is due, the rest of the
+            cooldown while it is open, or a short poll interval while a probe is in flight
+        """
+        with self._lock:
+            return self._wait_time(time.monotonic())
+
+    def admit(self) -> Tuple[Optional[object], float]:
+        """
+        Admit a call if the circuit allows one now.
+
+        Returns:
+            Tuple of (probe token, wait): wait is 0 when the call may be made, and
+            the token is set if the call is the half-open probe; pass it to
+            release_probe() once the call has ended. Otherwise wait is the number
+            of seconds after which to ask again.
+        """
+        with self._lock:
+            wait = self._wait_time(time.monotonic())
+            if wait > 0 or self._opened_at is None:
+                return None, wait
+            self._probe = object()
+            logger.info(f"Circuit for deployment {self.name} half-open; sending a probe request")
+            return self._probe, 0.0
+
+    def before_call(self) -> Optional[object]:
+        """
+        Like admit(), but raise instead of returning a wait.
+
+        Returns:
+            A probe token if the call is the half-open probe, else None
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a probe already in flight
+        """
+        probe, wait = self.admit()
+        if wait > 0:
+            raise CircuitOpenError(f"Circuit for deployment {self.name} is open after repeated failures")
+        return probe
+
+    def release_probe(self, probe: Optional[object]) -> None:
+        """
+        Release a probe that ended without record_success() or record_failure().
+
+        The circuit stays open, and the next call is let through as a new probe.
+        Releasing a probe that was already settled, or None, does nothing.
+
+        Args:
+            probe: The token returned by before_call()
+        """
+        with self._lock:
+            if probe is not None and self._probe is probe:
+                logger.info(f"Probe request for deployment {self.name} ended without a result")
+                self._probe = None
+
+    def record_success(self) -> None:
+        """Record a successful call, closing the circuit"""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for deployment {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe = None
+
+    def record_failure(self) -> None:
+        """Record an outage, opening the circuit at the threshold or when a probe fails"""
+        with self._lock:
+            self._failures += 1
+            if self._probe is not None or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit for deployment {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._probe = None
+                self.openings += 1
+
+def count_queued_failure(name: str, reopened: bool, failures: int, max_attempts: int) -> int:
+    """
+    Count a probe that failed while a call was queued behind it as a failed attempt of the call.
+
+    Args:
+        name: Name of the deployment (or pool) the call waited for, for the error message
+        reopened: Whether a circuit opened again while the call was queued
+        failures: Failed attempts of the call so far
+        max_attempts: Failed attempts after which the call gives up
+
+    Returns:
+        int: The call's failed attempts
+
+    Raises:
+        CircuitOpenError: If the call has used up its attempts
+    """
+    if not reopened:
+        return failures
+    failures += 1
+    if failures >= max_attempts:
+        raise CircuitOpenError(f"Circuit for deployment {name} stayed open after repeated failures")
+    return failures
+
+class RetryScheduler:
+    """
+    Makes LLM calls for one deployment within its rate limits, retrying failures.
+
+    Every attempt reserves capacity in the limiter and is admitted by the
+    circuit breaker, waiting while the circuit is open. Retryable failures are
+    retried per the retry policy; a Retry-After from the service pauses the
+    whole deployment, and throttling does not count toward the circuit breaker.
+    Non-retryable errors are raised at once; they still count as an answer from
+    the deployment, so they settle a half-open probe.
+    """
+
+    def __init__(self, limiter: RateLimiter, breaker: Optional[CircuitBreaker] = None,
+                 policy: Optional[RetryPolicy] = None):
+        """
+        Args:
+            limiter: The deployment's rate limiter
+            breaker: The deployment's circuit breaker (a default one if None)
+            policy: Retry policy (the defaults if None)
+        """
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.policy = policy or RetryPolicy()
+
+    def _failed(self, error: BaseException, attempt: int, throttled: bool = False) -> float:
+        """
+        Handle a failed attempt; return the backoff delay, or re-raise if the call should not be retried.
+
+        Args:
+            error: The error of the attempt
+            attempt: Failed attempts of this kind (throttled or not) so far, including this one
+            throttled: Whether the attempt was throttled
+        """
+        if not is_retryable(error):
+            # The deployment answered (e.g. a bad request), so it is not failing
+            self.breaker.record_success()
+            raise error
+        if is_outage(error):
+            self.breaker.record_failure()
+        if attempt >= (self.policy.max_throttled_attempts if throttled else self.policy.max_attempts):
+            raise error
+
+        requested = retry_after(error)
+        if requested is not None:
+            self.limiter.pause(requested)
+        delay = self.policy.delay(attempt, requested)
+        record_retry()
+        logger.warning(f"LLM call to {self.breaker.name} failed ({type(error).__name__}, status "
+                       f"{_status_code(error)}); retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, func: Callable[[], T], tokens: int = 0) -> T:
+        """
+        Call func() with rate limiting and retries.
+
+        Args:
+            func: Function making one API call
+            tokens: Estimated tokens of the request
+
+        Returns:
+            The result of the first successful call
+        """
+        failures = throttles = 0
+        while True:
+            openings = self.breaker.openings
+            probe, wait = self.breaker.admit()
+            if wait > 0:
+                # Queued while the circuit is open or another call probes it
+                time.sleep(wait)
+                record_queue_wait(wait)
+                failures = count_queued_failure(self.breaker.name, self.breaker.openings != openings, failures,
+                                                self.policy.max_attempts)
+                continue
+            try:
+                attempt = failures + throttles + 1
+                with span("llm.attempt", deployment=self.breaker.name, attempt=attempt) as attempt_span:
+                    waited = self.limiter.acquire(tokens)
+                    record_queue_wait(waited)
+                    attempt_span.set_attribute("queue_wait_s", round(waited, 4))
+                    try:
+                        result = func()
+                    except Exception as e:
+                        attempt_span.record_error(e)
+                        if is_throttled(e):
+                            throttles += 1
+                            delay = self._failed(e, throttles, throttled=True)
+                        else:
+                            failures += 1
+                            delay = self._failed(e, failures)
+                    else:
+                        self.breaker.record_success()
+                        return result
+            finally:
+                # Interrupted or throttled probes must not keep the circuit open
+                self.breaker.release_probe(probe)
+            time.sleep(delay)
+
+    async def acall(self, func: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """Asyncio variant of call(); func() returns the awaitable of one API call"""
+        failures = throttles = 0
+        while True:
+            openings = self.breaker.openings
+            probe, wait = self.breaker.admit()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                record_queue_wait(wait)
+                failures = count_queued_failure(self.breaker.name, self.breaker.openings != openings, failures,
+                                                self.policy.max_attempts)
+                continue
+            try:
+                attempt = failures + throttles + 1
+                with span("llm.attempt", deployment=self.breaker.name, attempt=attempt) as attempt_span:
+                    waited = await self.limiter.acquire_async(tokens)
+                    record_queue_wait(waited)
+                    attempt_span.set_attribute("queue_wait_s", round(waited, 4))
+                    try:
+                        result = await func()
+                    except Exception as e:
+                        attempt_span.record_error(e)
+                        if is_throttled(e):
+                            throttles += 1
+                            delay = self._failed(e, throttles, throttled=True)
+                        else:
+                            failures += 1
+                            delay = self._failed(e, failures)
+                    else:
+                        self.breaker.record_success()
+                        return result
+            finally:
+                # Cancelled probes (CancelledError is not an Exception) must not keep the circuit open
+                self.breaker.release_probe(probe)
+            await asyncio.sleep(delay)
+
+_SCHEDULERS: Dict[str, RetryScheduler] = {}
+
+def get_retry_scheduler(deployment_name: str) -> RetryScheduler:
+    """
+    Get the shared retry scheduler for a deployment, using its rate limiter.
+
+    Retries are configured as in RetryPolicy.from_env(), and the circuit
+    breaker by AZURE_BREAKER_THRESHOLD and AZURE_BREAKER_RESET_SECONDS, falling
+    back to the module defaults.
+
+    Args:
+        deployment_name: The Azure OpenAI deployment name
+
+    Returns:
+        RetryScheduler: The deployment's scheduler
+    """
+    limiter = get_rate_limiter(deployment_name)
+    scheduler = _SCHEDULERS.get(deployment_name)
+    # Rebuilt when configure_rate_limits() replaced the deployment's limiter
+    if scheduler is None or scheduler.limiter is not limiter:
+        with _LIMITERS_LOCK:
+            scheduler = _SCHEDULERS.get(deployment_name)
+            if scheduler is None or scheduler.limiter is not limiter:
+                breaker = scheduler.breaker if scheduler is not None else CircuitBreaker(
+                    int(os.getenv("AZURE_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+                    float(os.getenv("AZURE_BREAKER_RESET_SECONDS", DEFAULT_RESET_TIMEOUT)),
+                    name=deployment_name,
+                )
+                scheduler = RetryScheduler(limiter, breaker, RetryPolicy.from_env())
+                _SCHEDULERS[deployment_name] = scheduler
+    return scheduler
@@ -0,0 +1,274 @@
+"""
+Report generation modes for the staging graph.
+
+The narrative staging report is the last LLM call of every note, but batch
+registry work only needs the structured fields. The report step can therefore:
+
+- llm: ask the LLM for the report (default)
+- template: render the report deterministically from the staging state
+- deferred: queue the report request in a JSONL file for later generation,
+  for every note or only for notes flagged for review
+- none: skip the report step
+
+Queued reports are generated later with:
+
+    python -m src.reports report_queue.jsonl --output reports.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from jinja2 import Environment
+
+from .prompts import REPORT_INSTRUCTIONS
+
+logger = logging.getLogger(__name__)
+
+REPORT_MODES = ("llm", "template", "deferred", "none")
+DEFAULT_REPORT_MODE = "llm"
+
+# Which notes a deferred report is queued for
+REPORT_DEFER_POLICIES = ("all", "flagged")
+DEFAULT_REPORT_DEFER = "all"
+
+DEFAULT_REPORT_QUEUE = "report_queue.jsonl"
+
+# Deterministic report; its headers match those formatted by run_example.generate_markdown_report()
+REPORT_TEMPLATE = """Cancer Staging Report
+
+Patient Information:
+- Diagnosis: {{ cancer_type or "Unknown" }}
+- Standardized Category: {{ standardized_cancer_type or "Unknown" }}
+- Primary Site: {{ primary_site or "Not specified" }}
+- Sites of Metastasis: {{ metastasis_sites or "None identified" }}
+
+Staging Summary:
+{% if is_covered_by_toronto %}
+- Toronto Stage: {{ stage or "Undetermined" }}{% if staging_method == "rules" %} (computed by deterministic staging rules){% endif %}
+
+- Stage Stated in the Note: {{ extracted_stage or "Not mentioned" }}
+{% else %}
+- This cancer type is not covered by the Toronto Pediatric Cancer Staging System.
+{% endif %}
+
+Staging Explanation:
+{{ explanation or "No explanation provided" }}
+{% if criteria %}
+
+Key Findings:
+{% for finding in criteria %}
+- {{ finding.criterion }}: {{ finding.status }}{% if finding.evidence %} ({{ finding.evidence }}){% endif %}
+
+{% endfor %}
+{% endif %}
+{% if review_reason %}
+
+Review Needed: {{ review_reason }}
+{% endif %}
+"""
+
+_TEMPLATE = Environment(trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=False).from_string(REPORT_TEMPLATE)
+
+def get_report_mode(mode: Optional[str] = None) -> str:
+    """
+    Resolve the report mode.
+
+    Args:
+        mode: One of REPORT_MODES, or None for STAGING_REPORT_MODE (default: "llm")
+
+    Returns:
+        str: The validated mode
+    """
+    mode = (mode or os.getenv("STAGING_REPORT_MODE", DEFAULT_REPORT_MODE)).strip().lower()
+    if mode not in REPORT_MODES:
+        raise ValueError(f"Unknown report mode '{mode}'; expected one of {', '.join(REPORT_MODES)}")
+    return mode
+
+def get_report_defer(policy: Optional[str] = None) -> str:
+    """
+    Resolve which notes deferred reports are queued for.
+
+    Args:
+        policy: "all" or "flagged", or None for STAGING_REPORT_DEFER (default: "all")
+
+    Returns:
+        str: The validated policy
+    """
+    policy = (policy or os.getenv("STAGING_REPORT_DEFER", DEFAULT_REPORT_DEFER)).strip().lower()
+    if policy not in REPORT_DEFER_POLICIES:
+        raise ValueError(f"Unknown report defer policy '{policy}'; expected one of {', '.join(REPORT_DEFER_POLICIES)}")
+    return policy
+
+def _stage_key(stage: Optional[str]) -> str:
+    """Normalize a stage for comparison: "Stage III" and "III" compare equal"""
+    key = (stage or "").strip().casefold()
+    return key[len("stage"):].strip() if key.startswith("stage") else key
+
+def review_reason(state: Dict[str, Any]) -> Optional[str]:
+    """
+    Return why a staged note should be reviewed by a person, or None if it need not be.
+
+    A note is flagged when a covered cancer could not be staged, when the stage
+    stated in the note differs from the calculated one, or when the rule-based
+    pre-classifier and the LLM identified different cancers.
+
+    Args:
+        state: Staging graph state
+
+    Returns:
+        The reason for review, or None
+    """
+    if state.get("is_covered_by_toronto"):
+        stage = state.get("stage")
+        if not stage or _stage_key(stage) in ("", "unknown", "undetermined", "not applicable"):
+            return "no Toronto stage could be determined"
+
+        extracted = state.get("extracted_stage")
+        if extracted and extracted != "Not mentioned" and _stage_key(extracted) != _stage_key(stage):
+            return f"the note states {extracted} but the calculated stage is {stage}"
+
+    preclassified = state.get("preclassified_cancer_type")
+    if preclassified and state.get("identification_method") != "preclassifier" \
+            and preclassified != state.get("standardized_cancer_type"):
+        return (f"the pre-classifier identified {preclassified} but the LLM identified "
+                f"{state.get('standardized_cancer_type')}")
+    return None
+
+def render_report(state: Dict[str, Any]) -> str:
+    """
+    Render the staging report deterministically from the graph state.
+
+    Args:
+        state: Staging graph state after staging
+
+    Returns:
+        str: The report text
+    """
+    criteria = (state.get("identified_criteria") or {}).get("criteria") or []
+    return _TEMPLATE.render(**{**state, "criteria": criteria, "review_reason": review_reason(state)}).strip() + "\n"
+
+class ReportQueue:
+    """
+    Append-only JSONL queue of report requests awaiting generation.
+
+    Each entry holds the note ID (hash of the note text, as in the run ledger),
+    the review reason if any, and the report prompt, so reports can be
+    generated later without the graph state. Safe to share between threads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path to the JSONL queue file (created on first enqueue)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def enqueue(self, note_id: str, user_message: str, reason: Optional[str] = None) -> None:
+        """
+        Queue a report request.
+
+        Args:
+            note_id: Identifier of the note
+            user_message: The report prompt built for the note
+            reason: Why the note was flagged for review, if it was
+        """
+        entry = {"note_id": note_id, "queued_at": time.time(), "reason": reason, "user_message": user_message}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the queued entries; a note queued more than once keeps its latest entry"""
+        if not os.path.exists(self.path):
+            return iter(())
+        entries: Dict[str, Dict[str, Any]] = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["note_id"]] = entry
+        return iter(entries.values())
+
+_QUEUES: Dict[str, ReportQueue] = {}
+_QUEUES_LOCK = threading.Lock()
+
+def get_report_queue(path: Optional[str] = None) -> ReportQueue:
+    """Get the shared report queue for a path (defaults to STAGING_REPORT_QUEUE)"""
+    path = path or os.getenv("STAGING_REPORT_QUEUE", DEFAULT_REPORT_QUEUE)
+    with _QUEUES_LOCK:
+        if path not in _QUEUES:
+            _QUEUES[path] = ReportQueue(path)
+        return _QUEUES[path]
+
+def generate_queued_reports(queue_path: str, output_path: str, deployment_name: Optional[str] = None) -> int:
+    """
+    Generate the reports of a queue with the LLM.
+
+    Reports already present in the output file are not generated again, so an
+    interrupted run can be restarted.
+
+    Args:
+        queue_path: JSONL queue written in deferred report mode
+        output_path: JSONL file the reports are appended to, one {note_id, report} per line
+        deployment_name: Azure OpenAI deployment to use
+
+    Returns:
+        int: Number of reports generated
+    """
+    from .azure_openai_config import get_llm_with_system_prompt
+    from langchain_core.messages import HumanMessage
+
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            done = {json.loads(line)["note_id"] for line in f if line.strip()}
+
+    llm = get_llm_with_system_prompt(system_prompt=REPORT_INSTRUCTIONS, deployment_name=deployment_name,
+                                     prompt_name="generate_report")
+    generated = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for entry in ReportQueue(queue_path):
+            if entry["note_id"] in done:
+                continue
+            response = llm([HumanMessage(content=entry["user_message"])])
+            out.write(json.dumps({"note_id": entry["note_id"], "report": response.content}) + "\n")
+            out.flush()
+            generated += 1
+    logger.info(f"Generated {generated} queued reports into {output_path}")
+    return generated
+
+def main(argv=None):
+    """Generate the reports queued in deferred report mode"""
+    parser = argparse.ArgumentParser(description="Generate deferred staging reports")
+    parser.add_argument("queue", help="Report queue written in deferred report mode")
+    parser.add_argument("--output", default="reports.jsonl", help="JSONL file to append the reports to")
+    parser.add_argument("--deployment", help="Azure OpenAI deployment to use")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.queue):
+        print(f"Report queue not found: {args.queue}")
+        return 1
+
+    from dotenv import load_dotenv
+    from .azure_openai_config import configure_azure_openai
+    from .llm_backends import LLMConfigurationError
+    load_dotenv()
+    try:
+        deployment_name = configure_azure_openai()
+    except LLMConfigurationError as e:
+        print(f"Error: {e}")
+        return 1
+
+    generate_queued_reports(args.queue, args.output, args.deployment or deployment_name)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
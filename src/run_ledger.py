@@ -0,0 +1,139 @@
+"""
+Run ledger for resumable batch staging.
+
+The ledger records the status of every note, keyed by a hash of the note text,
+in a SQLite database. Together with the persistent checkpointer used by the
+staging graph, a restarted batch skips finished notes and resumes partly
+finished ones from their last completed node.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+# Note statuses recorded in the ledger
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+def hash_note(note_text: str) -> str:
+    """Return the SHA-256 hex digest identifying a note's content"""
+    return hashlib.sha256(note_text.encode("utf-8")).hexdigest()
+
+class RunLedger:
+    """
+    SQLite-backed record of which notes a batch has started, finished or failed.
+
+    The ledger is safe to share between worker threads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the ledger database.
+
+        Args:
+            path: Path to the SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS staging_runs (
+                note_hash TEXT PRIMARY KEY,
+                note_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result_json TEXT,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, note_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a note's ledger entry.
+
+        Args:
+            note_hash: Hash from hash_note()
+
+        Returns:
+            Dict with note_id, status, attempts, error and result, or None if unseen
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT note_id, status, attempts, error, result_json FROM staging_runs WHERE note_hash = ?",
+                (note_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "note_id": row[0],
+            "status": row[1],
+            "attempts": row[2],
+            "error": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+        }
+
+    def is_done(self, note_hash: str) -> bool:
+        """Return True if the note already finished successfully"""
+        entry = self.get(note_hash)
+        return entry is not None and entry["status"] == STATUS_DONE
+
+    def mark_started(self, note_hash: str, note_id: str) -> None:
+        """Record that processing of a note has started (or restarted)"""
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO staging_runs (note_hash, note_id, status, attempts, updated_at)
+                VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(note_hash) DO UPDATE SET
+                    note_id = excluded.note_id, status = excluded.status,
+                    attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at""",
+                (note_hash, note_id, STATUS_RUNNING, time.time())
+            )
+            self._conn.commit()
+
+    def mark_done(self, note_hash: str, result: Dict[str, Any]) -> None:
+        """Record a finished note together with its output row"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE staging_runs SET status = ?, result_json = ?, updated_at = ? WHERE note_hash = ?",
+                (STATUS_DONE, json.dumps(result), time.time(), note_hash)
+            )
+            self._conn.commit()
+
+    def mark_failed(self, note_hash: str, error: str) -> None:
+        """Record a note that failed; it is retried on the next run"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE staging_runs SET status = ?, error = ?, updated_at = ? WHERE note_hash = ?",
+                (STATUS_FAILED, error, time.time(), note_hash)
+            )
+            self._conn.commit()
+
+    def iter_results(self) -> Iterator[Dict[str, Any]]:
+        """Yield the stored output row of every finished note, e.g. to rebuild a CSV"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result_json FROM staging_runs WHERE status = ? ORDER BY updated_at",
+                (STATUS_DONE,)
+            ).fetchall()
+        for (result_json,) in rows:
+            yield json.loads(result_json)
+
+    def summary(self) -> Dict[str, int]:
+        """Return the number of notes in each status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM staging_runs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        """Close the ledger database"""
+        with self._lock:
+            self._conn.close()
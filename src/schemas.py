@@ -0,0 +1,268 @@
+"""
+Typed schemas for the structured outputs of the staging nodes.
+
+The LLM fills these through function calling, and validation happens once
+here, so downstream code can use the fields without re-parsing or cleaning.
+"""
+
+from typing import Callable, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+# Values the model uses to mean "nothing here"; they are replaced by the field default
+PLACEHOLDER_VALUES = {"", "**", "none", "null", "n/a", "na", "unknown", "not specified", "not mentioned",
+                      "not provided", "none identified", "not applicable"}
+
+class StructuredOutputError(ValueError):
+    """Raised when the model does not return output matching the requested schema"""
+
+def _clean_text(value: Optional[str], default: Optional[str]) -> Optional[str]:
+    """Strip markdown/bracket decoration and map placeholders to the default"""
+    if value is None:
+        return default
+    cleaned = str(value).strip().strip("*[]\"' ").strip()
+    if cleaned.lower() in PLACEHOLDER_VALUES:
+        return default
+    return cleaned
+
+class CancerIdentification(BaseModel):
+    """Cancer diagnosis and related findings identified in a medical note"""
+
+    cancer_type: Optional[str] = Field(
+        None, description="The primary cancer diagnosis as stated in the note, e.g. 'Wilms tumor'")
+    standardized_category: Optional[str] = Field(
+        None, description="The Toronto category the diagnosis maps to, exactly as listed; null if not covered")
+    is_covered_by_toronto: bool = Field(
+        description="Whether the diagnosis is covered by the Toronto Pediatric Cancer Staging System")
+    primary_site: str = Field(
+        "Not specified", description="Primary site (location) of the cancer")
+    metastasis_sites: str = Field(
+        "None identified", description="Comma-separated sites of metastasis mentioned in the note")
+    extracted_stage: str = Field(
+        "Not mentioned", description="Any stage explicitly stated in the note, e.g. 'Stage III'")
+
+    @field_validator("cancer_type", "standardized_category", mode="before")
+    @classmethod
+    def _clean_optional(cls, value):
+        return _clean_text(value, None)
+
+    @field_validator("primary_site", mode="before")
+    @classmethod
+    def _clean_primary_site(cls, value):
+        return _clean_text(value, "Not specified")
+
+    @field_validator("metastasis_sites", mode="before")
+    @classmethod
+    def _clean_metastasis_sites(cls, value):
+        if isinstance(value, list):
+            value = ", ".join(str(site) for site in value)
+        return _clean_text(value, "None identified")
+
+    @field_validator("extracted_stage", mode="before")
+    @classmethod
+    def _clean_extracted_stage(cls, value):
+        return _clean_text(value, "Not mentioned")
+
+class NoteIdentification(CancerIdentification):
+    """Identification of one note in a batched identification request"""
+
+    note_id: str = Field(description="The id attribute of the <note> the identification is for")
+
+    @field_validator("note_id", mode="before")
+    @classmethod
+    def _clean_note_id(cls, value):
+        return str(value).strip().strip("\"'") if value is not None else ""
+
+class BatchIdentification(BaseModel):
+    """Identifications of every note in a batched identification request"""
+
+    notes: List[NoteIdentification] = Field(
+        default_factory=list, description="One identification per <note>, in any order")
+
+class CriterionFinding(BaseModel):
+    """Whether one Toronto staging criterion is met according to the note"""
+
+    criterion: str = Field(description="The staging criterion, as listed in the Toronto criteria")
+    status: Literal["present", "absent", "unknown"] = Field(
+        description="present if clearly indicated, absent if clearly excluded, unknown otherwise")
+    evidence: str = Field("", description="Short quote or paraphrase from the note supporting the status")
+
+    @field_validator("status", mode="before")
+    @classmethod
+    def _normalize_status(cls, value):
+        return str(value).strip().lower() if value is not None else "unknown"
+
+class StagingCriteriaAnalysis(BaseModel):
+    """Staging criteria found in a note for the identified cancer"""
+
+    criteria: List[CriterionFinding] = Field(
+        default_factory=list, description="One entry per Toronto staging criterion")
+    summary: str = Field("", description="Other staging-relevant findings not captured by the criteria")
+    primary_site: Optional[str] = Field(
+        None, description="Primary site (location) of the cancer; only when requested")
+    metastasis_sites: Optional[str] = Field(
+        None, description="Comma-separated sites of metastasis; only when requested")
+    extracted_stage: Optional[str] = Field(
+        None, description="Any stage explicitly stated in the note; only when requested")
+
+    @field_validator("metastasis_sites", mode="before")
+    @classmethod
+    def _join_metastasis_sites(cls, value):
+        if isinstance(value, list):
+            value = ", ".join(str(site) for site in value)
+        return value
+
+    def to_text(self) -> str:
+        """Render the analysis as text for prompts and reports"""
+        lines = [
+            f"- {finding.criterion}: {finding.status}" + (f" ({finding.evidence})" if finding.evidence else "")
+            for finding in self.criteria
+        ]
+        if self.summary:
+            lines.append(f"Summary: {self.summary}")
+        return "\n".join(lines)
+
+def _clean_stage_value(value: Optional[str]) -> Optional[str]:
+    """Clean a stage value, dropping a leading "Stage:" label"""
+    value = _clean_text(value, None)
+    if value and value.lower().startswith("stage:"):
+        value = value[len("stage:"):].strip()
+    return value
+
+class StageAssignment(BaseModel):
+    """Toronto stage determined for a case"""
+
+    stage: Optional[str] = Field(
+        None, description="The Toronto stage, using exactly one of the valid stage names; null if undeterminable")
+    explanation: str = Field(description="Detailed explanation of how the stage was determined")
+
+    @field_validator("stage", mode="before")
+    @classmethod
+    def _clean_stage(cls, value):
+        return _clean_stage_value(value)
+
+class StagingDetermination(StagingCriteriaAnalysis):
+    """Staging criteria found in a note and the Toronto stage they determine, from one call"""
+
+    stage: Optional[str] = Field(
+        None, description="The Toronto stage, using exactly one of the valid stage names; null if undeterminable")
+    explanation: str = Field(description="Detailed explanation of how the stage follows from the criteria")
+
+    @field_validator("stage", mode="before")
+    @classmethod
+    def _clean_stage(cls, value):
+        return _clean_stage_value(value)
+
+    def criteria_analysis(self) -> StagingCriteriaAnalysis:
+        """Return the criteria analysis part of the determination"""
+        return StagingCriteriaAnalysis(**self.model_dump(include=set(StagingCriteriaAnalysis.model_fields)))
+
+    def stage_assignment(self) -> StageAssignment:
+        """Return the stage assignment part of the determination"""
+        return StageAssignment(stage=self.stage, explanation=self.explanation)
+
+def normalize_stage(stage: Optional[str], valid_stages: List[str]) -> Optional[str]:
+    """
+    Map a stage to the canonical spelling of one of the valid stage names.
+
+    Args:
+        stage: The stage returned by the model
+        valid_stages: Valid stage names for the cancer type
+
+    Returns:
+        The matching valid stage name, or the stage unchanged if none matches
+    """
+    if not stage:
+        return stage
+    key = stage.strip().lower()
+    for valid in valid_stages:
+        if valid.lower() == key or valid.lower() == f"stage {key}":
+            return valid
+    return stage
+
+def _split_sites(sites: str) -> List[str]:
+    """Split a comma-separated list of sites, dropping placeholders"""
+    return [site.strip() for site in sites.split(",") if _clean_text(site, None)]
+
+def select_identifications(identifications: List[CancerIdentification],
+                           resolve: Callable[[Optional[str]], Optional[str]]) -> List[int]:
+    """
+    Pick the diagnosis of a note from the identifications made on its chunks.
+
+    Identifications are grouped by cancer type (the canonical Toronto type, or
+    the label of an uncovered cancer). The type named by the most chunks wins;
+    a tie goes to a Toronto-covered type, then to the earliest chunk. A type
+    mentioned in one chunk therefore does not outrank one found in most chunks.
+
+    Args:
+        identifications: Per-chunk identifications, in note order
+        resolve: Resolves a label to its canonical Toronto cancer type (None if not covered)
+
+    Returns:
+        Indexes of the identifications naming the chosen type, in note order;
+        empty if no chunk named a cancer type
+    """
+    def _key(identification):
+        canonical = resolve(identification.standardized_category) or resolve(identification.cancer_type)
+        if canonical and identification.is_covered_by_toronto:
+            return canonical
+        return identification.cancer_type.casefold() if identification.cancer_type else None
+
+    keys = [_key(identification) for identification in identifications]
+    votes: Dict[str, int] = {}
+    for key in keys:
+        if key is not None:
+            votes[key] = votes.get(key, 0) + 1
+    if not votes:
+        return []
+
+    covered = {key for key, identification in zip(keys, identifications)
+               if key is not None and identification.is_covered_by_toronto and resolve(key) == key}
+    winner = max(votes, key=lambda key: (votes[key], key in covered, -keys.index(key)))
+    return [index for index, key in enumerate(keys) if key == winner]
+
+def merge_identifications(identifications: List[CancerIdentification],
+                          resolve: Callable[[Optional[str]], Optional[str]]) -> CancerIdentification:
+    """
+    Merge the identifications made on the chunks of one note.
+
+    The merge only depends on the findings and their chunk order: the cancer
+    type is chosen by select_identifications(), and only the chunks naming it
+    contribute. The primary site and stage come from the earliest of them that
+    states them, and their metastasis sites are combined in order; sites from
+    chunks about another cancer are left out.
+
+    Args:
+        identifications: Per-chunk identifications, in note order
+        resolve: Resolves a label to its canonical Toronto cancer type (None if not covered)
+
+    Returns:
+        CancerIdentification: The merged identification
+    """
+    selected = select_identifications(identifications, resolve)
+    if not selected:
+        return identifications[0]
+    agreeing = [identifications[index] for index in selected]
+    first = agreeing[0]
+
+    def _first_stated(field, default):
+        for identification in agreeing:
+            value = getattr(identification, field)
+            if value != default:
+                return value
+        return default
+
+    sites: List[str] = []
+    for identification in agreeing:
+        for site in _split_sites(identification.metastasis_sites):
+            if site.casefold() not in (existing.casefold() for existing in sites):
+                sites.append(site)
+
+    return CancerIdentification(
+        cancer_type=first.cancer_type,
+        standardized_category=first.standardized_category,
+        is_covered_by_toronto=first.is_covered_by_toronto,
+        primary_site=_first_stated("primary_site", "Not specified"),
+        metastasis_sites=", ".join(sites),
+        extracted_stage=_first_stated("extracted_stage", "Not mentioned"),
+    )
@@ -2,15 +2,15 @@ import json
 import os
 import csv
 from typing import Dict, Any, List, Optional, Tuple
-import pandas as pd
 from pathlib import Path
 from crewai import Agent, Task, Crew, Process
-from langchain_openai import AzureChatOpenAI
 from dotenv import load_dotenv
 import logging
 
 from .agents import CancerStagingAgents
 from .tasks import CancerStagingTasks
+from .knowledge_base import STAGING_DATA_PATHS, load_staging_data
+from .tracing import span, trace_llm_callbacks
 
 # Load environment variables
 load_dotenv()
@@ -67,10 +67,13 @@ class PediatricCancerStaging:
         """
         self.model = model
         
-        # Load the staging data
+        # Load the staging data, sharing the already parsed copy for the bundled file
         try:
-            with open(staging_data_path, 'r') as f:
-                self.staging_data = json.load(f)
+            if os.path.abspath(staging_data_path) in STAGING_DATA_PATHS:
+                self.staging_data = load_staging_data()
+            else:
+                with open(staging_data_path, 'r') as f:
+                    self.staging_data = json.load(f)
             print(f"Successfully loaded staging data from {staging_data_path}")
         except Exception as e:
             print(f"Error loading staging data: {e}")
@@ -163,16 +166,59 @@ class PediatricCancerStaging:
             print(f"Error reading medical note: {e}")
             raise
             
+    def _run_step(self, step: str, agent: Agent, task: Task, cancer_type: Optional[str] = None) -> str:
+        """
+        Run one task with its agent as a single-agent crew, in a tracing span.
+        
+        Args:
+            step: Step name, matching the LangGraph node names
+            agent: The agent performing the task
+            task: The task to run
+            cancer_type: Cancer type identified so far, as a span attribute
+            
+        Returns:
+            str: The raw output of the crew
+        """
+        crew = Crew(
+            agents=[agent],
+            tasks=[task],
+            verbose=True,
+            process=Process.sequential,
+            manager_llm=f"{self.model}"
+        )
+        
+        with span(step, pipeline="crewai", cancer_type=cancer_type) as step_span:
+            with trace_llm_callbacks():
+                result = crew.kickoff()
+            # Token usage of the crew's LLM calls, when the CrewAI version reports it
+            usage = getattr(result, "token_usage", None)
+            if usage is not None:
+                step_span.set_attributes(
+                    input_tokens=getattr(usage, "prompt_tokens", None),
+                    output_tokens=getattr(usage, "completion_tokens", None),
+                    llm_calls=getattr(usage, "successful_requests", None),
+                )
+        return result.raw
+    
     def process_medical_note(self, note_path: str) -> Tuple[str, str, str, str]:
         """
         Process a medical note and determine the cancer staging.
         
+        The note and each of its steps are traced as spans (see src/tracing.py).
+        
         Args:
             note_path: Path to the medical note file
             
         Returns:
             Tuple: (file_name, emr_stage, calculated_stage, explanation)
         """
+        with span("note", pipeline="crewai", note_path=note_path) as note_span:
+            file_name, emr_stage, calculated_stage, explanation, cancer_type = self._stage_note(note_path)
+            note_span.set_attributes(cancer_type=cancer_type, stage=calculated_stage)
+        return file_name, emr_stage, calculated_stage, explanation
+    
+    def _stage_note(self, note_path: str) -> Tuple[str, str, str, str, str]:
+        """Run the staging crews on a note; returns process_medical_note()'s tuple plus the cancer type"""
         # Read the medical note
         medical_note = self._read_medical_note(note_path)
         file_name = os.path.basename(note_path)
@@ -189,16 +235,7 @@ class PediatricCancerStaging:
         )
         
         # Execute identification task
-        crew = Crew(
-            agents=[identifier_agent],
-            tasks=[identify_task],
-            verbose=True,
-            process=Process.sequential,
-            manager_llm=f"{self.model}"
-        )
-        
-        result = crew.kickoff()
-        identification_result = result.raw
+        identification_result = self._run_step("identify_cancer", identifier_agent, identify_task)
         
         # Parse the identification results
         cancer_type_line = next((line for line in identification_result.split('\n') 
@@ -214,32 +251,14 @@ class PediatricCancerStaging:
             criteria_agent, medical_note, cancer_type, self.staging_data
         )
         
-        crew = Crew(
-            agents=[criteria_agent],
-            tasks=[criteria_task],
-            verbose=True,
-            process=Process.sequential,
-            manager_llm=f"{self.model}"
-        )
-        
-        result = crew.kickoff()
-        criteria_analysis = result.raw
+        criteria_analysis = self._run_step("analyze_criteria", criteria_agent, criteria_task, cancer_type)
         
         # Execute stage calculation task
         calculate_task = CancerStagingTasks.calculate_stage(
             calculator_agent, medical_note, cancer_type, criteria_analysis, self.staging_data
         )
         
-        crew = Crew(
-            agents=[calculator_agent],
-            tasks=[calculate_task],
-            verbose=True,
-            process=Process.sequential,
-            manager_llm=f"{self.model}"
-        )
-        
-        result = crew.kickoff()
-        calculation_result = result.raw
+        calculation_result = self._run_step("calculate_stage", calculator_agent, calculate_task, cancer_type)
         
         # Parse the calculation results
         stage_line = next((line for line in calculation_result.split('\n') 
@@ -257,16 +276,7 @@ class PediatricCancerStaging:
             criteria_analysis, calculated_stage, explanation
         )
         
-        crew = Crew(
-            agents=[reporter_agent],
-            tasks=[report_task],
-            verbose=True,
-            process=Process.sequential,
-            manager_llm=f"{self.model}"
-        )
-        
-        result = crew.kickoff()
-        report = result.raw
+        report = self._run_step("generate_report", reporter_agent, report_task, cancer_type)
         
         # Extract the CSV line from the report
         csv_line = next((line for line in report.split('\n') 
@@ -280,7 +290,7 @@ class PediatricCancerStaging:
                 calculated_stage = parts[2]
                 explanation = ','.join(parts[3:])  # Explanation might contain commas
         
-        return file_name, emr_stage, calculated_stage, explanation
+        return file_name, emr_stage, calculated_stage, explanation, cancer_type
     
     def process_multiple_notes(self, note_dir: str, output_csv: str) -> None:
         """
@@ -313,6 +323,8 @@ class PediatricCancerStaging:
         
         # Save results to CSV
         if results:
+            import pandas as pd
+            
             df = pd.DataFrame(results)
             df.to_csv(output_csv, index=False)
             print(f"Results saved to {output_csv}")
@@ -0,0 +1,266 @@
+"""
+Deterministic staging rules for Toronto stages with computable criteria.
+
+Some Toronto stages are defined entirely by numeric findings, e.g. the CNS
+status of acute lymphoblastic leukemia (CNS1/CNS2/CNS3) depends only on
+clinical CNS signs, blasts in the CSF and CSF/blood cell counts. For these
+cancers the stage is computed from values extracted from the note, and the
+LLM is only consulted when the rules cannot reach a definitive answer.
+"""
+
+import re
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Thresholds from the Toronto ALL CNS status definitions
+CSF_WBC_THRESHOLD = 5       # cells/µL
+CSF_RBC_THRESHOLD = 10      # cells/µL
+TRAUMATIC_TAP_RATIO = 2.0   # CSF WBC/RBC ratio vs. blood WBC/RBC ratio
+
+_NUMBER = r"(\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)"
+_LINK = r"(?:\s*(?:count|ct))?\s*(?:in\s+(?:the\s+)?CSF\s*)?(?:of|was|were|is|=|:|-)?\s*(?:approximately|approx\.?|~)?\s*"
+
+_WBC_PATTERN = re.compile(
+    r"(?:\bWBCs?\b|white\s+(?:blood\s+)?cells?|leukocytes?|nucleated\s+cells?)" + _LINK + _NUMBER
+    + r"\s*(x\s*10\^?\s*9\s*/\s*L|×\s*10\^?\s*9\s*/\s*L|10\^9/L|K/[uµμ]L|k/mm3|x\s*10\^?3/[uµμ]L)?",
+    re.IGNORECASE
+)
+_RBC_PATTERN = re.compile(
+    r"(?:\bRBCs?\b|red\s+(?:blood\s+)?cells?|erythrocytes?)" + _LINK + _NUMBER
+    + r"\s*(x\s*10\^?\s*12\s*/\s*L|×\s*10\^?\s*12\s*/\s*L|10\^12/L|M/[uµμ]L|x\s*10\^?6/[uµμ]L)?",
+    re.IGNORECASE
+)
+
+_CSF_CONTEXT = re.compile(r"\bCSF\b|cerebrospinal|lumbar\s+puncture|\bLP\b|cytospin", re.IGNORECASE)
+_BLOOD_CONTEXT = re.compile(r"\bCBC\b|peripheral|\bblood\b|hemoglobin|haemoglobin|platelets?|\bHgb\b", re.IGNORECASE)
+
+_NEGATION = re.compile(
+    r"\b(?:no|not|without|negative\s+for|absence\s+of|absent|denies|free\s+of|none)\b",
+    re.IGNORECASE
+)
+_BLASTS = re.compile(r"\bblasts?\b|lymphoblasts?|leukemic\s+cells", re.IGNORECASE)
+_BLASTS_ABSENT = re.compile(
+    r"(?:\b(?:no|without|negative\s+for|absence\s+of|free\s+of)\b[^.;\n]{0,40}?(?:blasts?|leukemic\s+cells))"
+    r"|(?:blasts?\s*(?::|-)?\s*(?:none|not\s+(?:seen|identified|present|detected)|absent|negative))",
+    re.IGNORECASE
+)
+# Only concrete clinical or imaging findings count; generic mentions such as
+# "CNS involvement" or "CNS disease" are usually work-up or risk discussions
+_CNS_SIGNS = re.compile(
+    r"(?:cranial\s+nerve|\bCN)\s+(?:(?:[IVX]{1,4}|\d{1,2})\s+)?(?:palsy|palsies|deficits?)"
+    r"|\b(?:third|fourth|sixth|seventh)\s+(?:cranial\s+)?nerve\s+(?:palsy|palsies)"
+    r"|facial\s+(?:nerve\s+)?(?:palsy|weakness|droop)|ptosis|hypothalamic\s+syndrome"
+    r"|(?:brain|intracranial|CNS|meningeal|leptomeningeal|parenchymal)\s+(?:mass(?:es)?|infiltrat\w*|enhancement|deposits?)",
+    re.IGNORECASE
+)
+# Contexts in which a CNS sign is mentioned without being affirmed
+_UNCERTAIN = re.compile(
+    r"\b(?:rule\s+out|r/o|to\s+exclude|assess\w*|evaluat\w*|work[\s-]?up|risk|pending|suspect\w*|suspicious"
+    r"|possible|possibly|probable|likely|concern(?:ing)?\s+for|question(?:able)?|query|versus|vs\.?"
+    r"|cannot\s+be\s+(?:excluded|ruled\s+out)|if\s+present|monitor\w*|screen\w*)\b|\?",
+    re.IGNORECASE
+)
+
+def _split_segments(text: str) -> List[str]:
+    """Split text into sentences/lines, the unit within which findings are attributed"""
+    return [segment.strip() for segment in re.split(r"(?<=[.;])\s+|\n+", text) if segment.strip()]
+
+def _to_number(value: str) -> float:
+    """Parse a number that may contain thousands separators"""
+    return float(value.replace(",", ""))
+
+def _blood_wbc_per_ul(value: float, unit: Optional[str]) -> float:
+    """Convert a peripheral blood WBC count to cells/µL"""
+    if unit or value < 1000:
+        # x10^9/L, K/µL or an unlabeled value in thousands
+        return value * 1000
+    return value
+
+def _blood_rbc_per_ul(value: float, unit: Optional[str]) -> float:
+    """Convert a peripheral blood RBC count to cells/µL"""
+    if unit or value < 100:
+        # x10^12/L, M/µL or an unlabeled value in millions
+        return value * 1000000
+    return value
+
+def _is_negated(segment: str, start: int) -> bool:
+    """Return True if a finding at position start is preceded by a negation in its clause"""
+    clause_start = max(segment.rfind(",", 0, start), segment.rfind(":", 0, start), 0)
+    return _NEGATION.search(segment[clause_start:start]) is not None
+
+def extract_all_cns_values(text: str) -> Dict[str, Any]:
+    """
+    Extract the findings that determine ALL CNS status from note text.
+
+    Args:
+        text: Medical note (or any free text) to scan
+
+    Returns:
+        Dict with csf_examined (a CSF finding was reported), csf_blasts
+        (True/False/None), csf_wbc, csf_rbc, blood_wbc, blood_rbc (cells/µL)
+        and clinical_cns_signs (True/False/None); missing values are None.
+        cns_signs_uncertain is True when a CNS sign was mentioned without
+        being clearly affirmed or negated (e.g. "rule out", "suspected")
+    """
+    values = {
+        "csf_examined": False,
+        "csf_blasts": None,
+        "csf_wbc": None,
+        "csf_rbc": None,
+        "blood_wbc": None,
+        "blood_rbc": None,
+        "clinical_cns_signs": None,
+        "cns_signs_uncertain": False,
+    }
+
+    for segment in _split_segments(text):
+        if _CSF_CONTEXT.search(segment):
+            if values["csf_wbc"] is None and (match := _WBC_PATTERN.search(segment)):
+                values["csf_wbc"] = _to_number(match.group(1))
+            if values["csf_rbc"] is None and (match := _RBC_PATTERN.search(segment)):
+                values["csf_rbc"] = _to_number(match.group(1))
+
+            if _BLASTS_ABSENT.search(segment):
+                if values["csf_blasts"] is None:
+                    values["csf_blasts"] = False
+            elif (match := _BLASTS.search(segment)) and not _is_negated(segment, match.start()):
+                values["csf_blasts"] = True
+
+        elif _BLOOD_CONTEXT.search(segment) or _WBC_PATTERN.search(segment) or _RBC_PATTERN.search(segment):
+            if values["blood_wbc"] is None and (match := _WBC_PATTERN.search(segment)):
+                values["blood_wbc"] = _blood_wbc_per_ul(_to_number(match.group(1)), match.group(2))
+            if values["blood_rbc"] is None and (match := _RBC_PATTERN.search(segment)):
+                values["blood_rbc"] = _blood_rbc_per_ul(_to_number(match.group(1)), match.group(2))
+
+        for match in _CNS_SIGNS.finditer(segment):
+            if _UNCERTAIN.search(segment):
+                values["cns_signs_uncertain"] = True
+            elif _is_negated(segment, match.start()):
+                if values["clinical_cns_signs"] is None:
+                    values["clinical_cns_signs"] = False
+            else:
+                values["clinical_cns_signs"] = True
+
+    # A CSF exam counts as documented only when it reported a finding ("LP pending" does not)
+    values["csf_examined"] = any(
+        values[key] is not None for key in ("csf_blasts", "csf_wbc", "csf_rbc")
+    )
+    return values
+
+def evaluate_all_cns_status(values: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Compute the Toronto CNS status for acute lymphoblastic leukemia.
+
+    Args:
+        values: Findings as returned by extract_all_cns_values()
+
+    Returns:
+        Dict with stage and explanation, or None if the findings are not sufficient
+        for a definitive answer
+    """
+    if values.get("clinical_cns_signs"):
+        return {
+            "stage": "CNS3",
+            "explanation": "Clinical signs of CNS involvement are documented, which defines CNS3 "
+                           "regardless of CSF findings."
+        }
+
+    # A sign that is only suspected or being worked up may still turn out to be CNS3
+    if not values.get("csf_examined") or values.get("cns_signs_uncertain"):
+        return None
+
+    signs_note = ("Clinical signs of CNS disease are documented as absent."
+                  if values.get("clinical_cns_signs") is False
+                  else "No clinical signs of CNS disease are documented.")
+
+    # Per the Toronto definitions, blasts not mentioned in the CSF are assumed absent
+    if not values.get("csf_blasts"):
+        return {
+            "stage": "CNS1",
+            "explanation": f"{signs_note} No blasts are reported in the CSF, so there is no CNS involvement (CNS1)."
+        }
+
+    csf_wbc = values.get("csf_wbc")
+    if csf_wbc is None:
+        return None
+
+    if csf_wbc < CSF_WBC_THRESHOLD:
+        return {
+            "stage": "CNS2",
+            "explanation": f"{signs_note} Blasts are present in the CSF with CSF WBC {csf_wbc:g}/µL "
+                           f"(<{CSF_WBC_THRESHOLD}/µL), which defines CNS2."
+        }
+
+    csf_rbc = values.get("csf_rbc")
+    if csf_rbc is None:
+        return None
+
+    if csf_rbc < CSF_RBC_THRESHOLD:
+        return {
+            "stage": "CNS3",
+            "explanation": f"{signs_note} Blasts are present in the CSF with CSF WBC {csf_wbc:g}/µL "
+                           f"(≥{CSF_WBC_THRESHOLD}/µL) and CSF RBC {csf_rbc:g}/µL (<{CSF_RBC_THRESHOLD}/µL, "
+                           f"not a traumatic tap), which defines CNS3."
+        }
+
+    # Traumatic tap: compare the CSF WBC/RBC ratio with the peripheral blood ratio
+    blood_wbc = values.get("blood_wbc")
+    blood_rbc = values.get("blood_rbc")
+    if not blood_wbc or not blood_rbc or not csf_rbc:
+        return None
+
+    csf_ratio = csf_wbc / csf_rbc
+    blood_ratio = blood_wbc / blood_rbc
+    comparison = (f"CSF WBC {csf_wbc:g}/µL and RBC {csf_rbc:g}/µL give a CSF WBC/RBC ratio of {csf_ratio:.4g}, "
+                  f"versus a blood WBC/RBC ratio of {blood_ratio:.4g}")
+    if csf_ratio <= TRAUMATIC_TAP_RATIO * blood_ratio:
+        return {
+            "stage": "CNS2",
+            "explanation": f"{signs_note} Blasts are present in a traumatic tap: {comparison} "
+                           f"(≤{TRAUMATIC_TAP_RATIO:g}× the blood ratio), which defines CNS2."
+        }
+    return {
+        "stage": "CNS3",
+        "explanation": f"{signs_note} Blasts are present in the CSF: {comparison} "
+                       f"(>{TRAUMATIC_TAP_RATIO:g}× the blood ratio), which defines CNS3."
+    }
+
+# Cancers whose Toronto stage can be computed: (value extractor, stage evaluator)
+STAGE_RULES: Dict[str, Tuple[Callable[[str], Dict[str, Any]], Callable[[Dict[str, Any]], Optional[Dict[str, str]]]]] = {
+    "Acute Lymphoblastic Leukemia": (extract_all_cns_values, evaluate_all_cns_status),
+}
+
+def has_stage_rules(cancer_type: Optional[str]) -> bool:
+    """Return True if the cancer type has deterministic staging rules"""
+    return cancer_type in STAGE_RULES
+
+def evaluate_stage(cancer_type: Optional[str], text: str,
+                   values: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Compute the Toronto stage with deterministic rules, if possible.
+
+    Args:
+        cancer_type: Standardized Toronto cancer type
+        text: Note text to extract findings from (ignored when values are given)
+        values: Pre-extracted findings, e.g. from a structured LLM extraction
+
+    Returns:
+        Dict with stage, explanation and the values used, or None when the cancer
+        has no rules or the findings are not sufficient for a definitive stage
+    """
+    if cancer_type not in STAGE_RULES:
+        return None
+
+    extract, evaluate = STAGE_RULES[cancer_type]
+    if values is None:
+        values = extract(text)
+
+    result = evaluate(values)
+    if result is None:
+        logger.info(f"Staging rules for {cancer_type} were not definitive; falling back to the LLM")
+        return None
+
+    logger.info(f"Staging rules assigned {result['stage']} for {cancer_type}")
+    return {**result, "values": values}
@@ -0,0 +1,336 @@
+"""
+Deterministic OpenAI-compatible stub LLM server for offline testing and benchmarking.
+
+The stub answers chat completion requests at /v1/chat/completions,
+/chat/completions and the Azure path /openai/deployments/<name>/chat/completions,
+so the openai, Azure and pooled backends can all be pointed at it. Responses are:
+
+- canned: rules in a JSON file, each {"tool": ..., "match": ..., "arguments": {...}}
+  for tool (structured output) calls or {"match": ..., "content": "..."} for text
+  calls, where match is a regular expression searched in the last user message
+- synthesized: tool calls without a matching rule get arguments generated from
+  the tool's JSON schema (defaults, first enum values, placeholders)
+
+Latency is drawn from a configurable distribution, a configurable fraction of
+requests fails with 429 (with Retry-After) or 500, and usage reports prompt
+tokens estimated from the request, with system prompts seen before counted as
+cached, the way Azure's prompt cache would. Runs are reproducible for a given seed.
+
+Usage:
+
+    python -m src.stub_llm_server --port 8000 --latency lognormal:0.8,0.4 --error-rate 0.02
+    STAGING_LLM_BACKEND=openai OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python run_example.py
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio, as in src.rate_limit
+CHARS_PER_TOKEN = 4
+# Azure caches prompt prefixes of at least 1024 tokens, in 128-token increments
+MIN_CACHED_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+def parse_latency(spec: Optional[str]) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec: "fixed:S", "uniform:A,B", "normal:MEAN,SD", "lognormal:MEDIAN,SIGMA"
+            or "exponential:MEAN", in seconds; None or "" for no latency
+
+    Returns:
+        Function drawing a latency in seconds from a random generator
+    """
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",")] if params else []
+        if kind == "fixed" and len(values) == 1:
+            return lambda rng: values[0]
+        if kind == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        if kind == "normal" and len(values) == 2:
+            return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+        if kind == "lognormal" and len(values) == 2:
+            return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+        if kind == "exponential" and len(values) == 1:
+            return lambda rng: rng.expovariate(1.0 / values[0])
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency distribution '{spec}'; expected e.g. fixed:0.5, uniform:0.2,1.0, "
+                     "normal:0.8,0.2, lognormal:0.8,0.4 or exponential:0.8")
+
+def _resolve(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """Follow a local $ref in a JSON schema"""
+    while "$ref" in schema:
+        path = schema["$ref"].lstrip("#/").split("/")
+        target = root
+        for part in path:
+            target = target[part]
+        schema = target
+    return schema
+
+def synthesize(schema: Dict[str, Any], root: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Generate a value that validates against a JSON schema.
+
+    Defaults are used where given, then the first enum value or a type placeholder.
+
+    Args:
+        schema: The JSON schema
+        root: The schema holding $defs for references (defaults to schema)
+
+    Returns:
+        A value of the schema's type
+    """
+    root = root if root is not None else schema
+    schema = _resolve(schema, root)
+    if "default" in schema:
+        return schema["default"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [_resolve(option, root) for option in schema[key]]
+            non_null = [option for option in options if option.get("type") != "null"]
+            return synthesize((non_null or options)[0], root)
+
+    kind = schema.get("type")
+    if kind == "object" or "properties" in schema:
+        return {name: synthesize(prop, root) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [synthesize(schema["items"], root)] if "items" in schema else []
+    if kind == "boolean":
+        return True
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.0
+    if kind == "null":
+        return None
+    return "stub"
+
+class StubResponder:
+    """
+    Produces chat completion responses, latencies and simulated failures for the stub.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None, latency: Optional[str] = None,
+                 error_rate: float = 0.0, error_status: int = 429, retry_after: float = 1.0, seed: int = 0):
+        """
+        Args:
+            rules: Canned response rules (see the module docstring), tried in order
+            latency: Latency distribution (see parse_latency())
+            error_rate: Fraction of requests that fail
+            error_status: HTTP status of the failures (429 adds a Retry-After header)
+            retry_after: Retry-After seconds sent with 429 failures
+            seed: Seed of the random generator
+        """
+        self.rules = [{**rule, "pattern": re.compile(rule.get("match", ""), re.IGNORECASE)} for rule in rules or []]
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    @classmethod
+    def from_file(cls, path: Optional[str], **kwargs) -> "StubResponder":
+        """Create a responder with the rules in a JSON file (a list of rules, or {"rules": [...]})"""
+        rules = None
+        if path:
+            with open(path, encoding="utf-8") as f:
+                rules = json.load(f)
+            if isinstance(rules, dict):
+                rules = rules.get("rules", [])
+        return cls(rules, **kwargs)
+
+    def _match(self, tool_name: Optional[str], text: str) -> Optional[Dict[str, Any]]:
+        for rule in self.rules:
+            if rule.get("tool") == tool_name and rule["pattern"].search(text):
+                return rule
+        return None
+
+    def _usage(self, body: Dict[str, Any], completion: str) -> Dict[str, Any]:
+        """Estimate the usage of a request, counting a previously seen system prompt as cached"""
+        messages = body.get("messages", [])
+        tools = json.dumps(body.get("tools", []))
+        prompt_tokens = sum(len(str(message.get("content") or "")) // CHARS_PER_TOKEN + 4 for message in messages)
+        prompt_tokens += len(tools) // CHARS_PER_TOKEN if body.get("tools") else 0
+
+        prefix = tools + "".join(str(message.get("content") or "") for message in messages
+                                 if message.get("role") == "system")
+        prefix_tokens = len(prefix) // CHARS_PER_TOKEN
+        cached = 0
+        with self._lock:
+            if prefix in self._seen_prefixes and prefix_tokens >= MIN_CACHED_TOKENS:
+                cached = prefix_tokens - prefix_tokens % CACHE_INCREMENT
+            self._seen_prefixes.add(prefix)
+        completion_tokens = max(1, len(completion) // CHARS_PER_TOKEN)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the chat completion for a request body, without latency or failures.
+
+        Args:
+            body: Chat completion request body in the OpenAI format
+
+        Returns:
+            Dict: Chat completion response body
+        """
+        messages = body.get("messages", [])
+        user_text = next((str(message.get("content") or "") for message in reversed(messages)
+                          if message.get("role") == "user"), "")
+
+        tools = body.get("tools") or []
+        if tools:
+            function = tools[0]["function"]
+            choice = body.get("tool_choice")
+            if isinstance(choice, dict):
+                function = next((tool["function"] for tool in tools
+                                 if tool["function"]["name"] == choice["function"]["name"]), function)
+            rule = self._match(function["name"], user_text)
+            arguments = rule["arguments"] if rule else synthesize(function.get("parameters", {}))
+            serialized = json.dumps(arguments)
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{self.requests}", "type": "function",
+                "function": {"name": function["name"], "arguments": serialized}}]}
+            finish_reason = "tool_calls"
+        else:
+            rule = self._match(None, user_text)
+            serialized = rule["content"] if rule else "Stub response."
+            message = {"role": "assistant", "content": serialized}
+            finish_reason = "stop"
+
+        return {
+            "id": f"chatcmpl-stub-{self.requests}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(body, serialized),
+        }
+
+    def respond(self, body: Dict[str, Any]) -> Tuple[float, int, Dict[str, str], Dict[str, Any]]:
+        """
+        Answer a request.
+
+        Args:
+            body: Chat completion request body
+
+        Returns:
+            Tuple of (latency in seconds, HTTP status, extra headers, response body)
+        """
+        with self._lock:
+            self.requests += 1
+            latency = self.latency(self._rng)
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            headers = {"retry-after": f"{self.retry_after:g}"} if self.error_status == 429 else {}
+            return latency, self.error_status, headers, {"error": {"code": str(self.error_status),
+                                                                   "message": "Simulated failure from the stub LLM"}}
+        return latency, 200, {}, self.completion(body)
+
+_COMPLETION_PATH = re.compile(r"^(/v1)?(/openai/deployments/[^/]+)?/chat/completions$")
+
+def make_server(responder: StubResponder, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Create the stub HTTP server (not yet serving).
+
+    Args:
+        responder: Responder answering the requests
+        host: Interface to bind
+        port: Port to bind (0 picks a free one)
+
+    Returns:
+        ThreadingHTTPServer: The server; server.server_address holds the bound port
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send(self, status, headers, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not _COMPLETION_PATH.match(self.path.split("?", 1)[0]):
+                self._send(404, {}, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            latency, status, headers, payload = responder.respond(body)
+            if latency > 0:
+                time.sleep(latency)
+            self._send(status, headers, payload)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+def serve_in_thread(responder: Optional[StubResponder] = None, host: str = "127.0.0.1",
+                    port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the stub server on a daemon thread, e.g. for tests and benchmarks.
+
+    Returns:
+        Tuple of (server, base URL); call server.shutdown() to stop it. Point the
+        openai backend at "<base URL>/v1" or an Azure endpoint at the base URL.
+    """
+    server = make_server(responder or StubResponder(), host, port)
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main(argv=None):
+    """Run the stub LLM server in the foreground"""
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--responses", help="JSON file of canned response rules")
+    parser.add_argument("--latency", help="Latency distribution, e.g. fixed:0.5 or lognormal:0.8,0.4 (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of the failures")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429 failures")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    responder = StubResponder.from_file(args.responses, latency=args.latency, error_rate=args.error_rate,
+                                        error_status=args.error_status, retry_after=args.retry_after, seed=args.seed)
+    server = make_server(responder, args.host, args.port)
+    logger.info(f"Stub LLM server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
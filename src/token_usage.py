@@ -0,0 +1,106 @@
+"""
+Prompt token accounting, split into cached and uncached prompt tokens.
+
+Azure OpenAI reports the part of each prompt served from its prompt cache
+(usage prompt_tokens_details.cached_tokens, exposed by LangChain as
+usage_metadata["input_token_details"]["cache_read"]). The LLM wrappers record
+the usage of every API call here, per node prompt, so a batch can report how
+much of its prompt volume hit the provider cache.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from .node_metrics import record_llm_usage
+from .tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS = ("calls", "input_tokens", "cached_tokens", "output_tokens")
+
+def _summarize(counts: Dict[str, int]) -> Dict[str, Any]:
+    """Add the uncached token count and cached ratio to a set of counters"""
+    input_tokens = counts["input_tokens"]
+    return {
+        **counts,
+        "uncached_tokens": input_tokens - counts["cached_tokens"],
+        "cached_ratio": counts["cached_tokens"] / input_tokens if input_tokens else 0.0,
+    }
+
+class TokenUsageTracker:
+    """Thread-safe counters of prompt, cached prompt and completion tokens per prompt name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, prompt_name: Optional[str], usage_metadata: Optional[Dict[str, Any]]) -> None:
+        """
+        Record the usage of one API call.
+
+        Args:
+            prompt_name: Node or prompt the call was made for (None counts as "other")
+            usage_metadata: The response's usage_metadata; calls without usage are ignored
+        """
+        if not usage_metadata:
+            return
+        cached = (usage_metadata.get("input_token_details") or {}).get("cache_read") or 0
+        with self._lock:
+            counts = self._counts.setdefault(prompt_name or "other", dict.fromkeys(_COUNTERS, 0))
+            counts["calls"] += 1
+            counts["input_tokens"] += usage_metadata.get("input_tokens", 0)
+            counts["cached_tokens"] += cached
+            counts["output_tokens"] += usage_metadata.get("output_tokens", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the token counters.
+
+        Returns:
+            Dict with "total" and "by_prompt" entries, each holding calls,
+            input_tokens, cached_tokens, uncached_tokens, output_tokens and cached_ratio
+        """
+        with self._lock:
+            by_prompt = {name: dict(counts) for name, counts in self._counts.items()}
+        total = dict.fromkeys(_COUNTERS, 0)
+        for counts in by_prompt.values():
+            for counter in _COUNTERS:
+                total[counter] += counts[counter]
+        return {
+            "total": _summarize(total),
+            "by_prompt": {name: _summarize(counts) for name, counts in sorted(by_prompt.items())},
+        }
+
+    def summary(self) -> str:
+        """Return a one-line summary of the prompt tokens, e.g. for logging at the end of a run"""
+        total = self.stats()["total"]
+        return (f"{total['calls']} LLM calls, {total['input_tokens']} prompt tokens "
+                f"({total['cached_tokens']} cached, {total['cached_ratio']:.0%}), "
+                f"{total['output_tokens']} completion tokens")
+
+    def reset(self) -> None:
+        """Clear all counters"""
+        with self._lock:
+            self._counts.clear()
+
+_TRACKER = TokenUsageTracker()
+
+def get_token_usage_tracker() -> TokenUsageTracker:
+    """Get the process-wide token usage tracker"""
+    return _TRACKER
+
+def record_token_usage(prompt_name: Optional[str], response: Any) -> None:
+    """
+    Record the usage of an API response (an AIMessage) in the process-wide tracker,
+    the running node's metrics and the current tracing span.
+    """
+    usage_metadata = getattr(response, "usage_metadata", None)
+    _TRACKER.record(prompt_name, usage_metadata)
+    record_llm_usage(usage_metadata)
+    if usage_metadata:
+        current_span().add_to_attributes(
+            input_tokens=usage_metadata.get("input_tokens", 0),
+            cached_tokens=(usage_metadata.get("input_token_details") or {}).get("cache_read") or 0,
+            output_tokens=usage_metadata.get("output_tokens", 0),
+        )
@@ -0,0 +1,534 @@
+"""
+Tracing spans across the staging pipelines, in the OpenTelemetry data model.
+
+Each staged note gets a trace of nested spans:
+
+- note: one note through the LangGraph or CrewAI pipeline, with its cancer
+  type and stage
+- <node>: a graph node (identify_cancer, analyze_and_stage, ...) or CrewAI
+  step, with its token counts and cost
+- llm.request: one LLM call of a node, with its prompt name, tokens and
+  whether it was answered from the response cache
+- llm.attempt: one attempt of the call through the rate limiter, with its
+  queue wait and, for failed attempts, the error (attempts after the first
+  are retries)
+
+Tracing is off unless an exporter is configured:
+
+- STAGING_TRACE_FILE: append finished spans to a JSONL file
+- STAGING_TRACE_OTLP_ENDPOINT: post them as OTLP/HTTP JSON to a collector
+  (e.g. http://localhost:4318)
+
+For local use without an OpenTelemetry collector, a stand-in collector
+receives OTLP/HTTP JSON and writes the spans as JSONL, and the slowest traces
+of a JSONL file can be shown as span trees:
+
+    python -m src.tracing collect --port 4318 --output spans.jsonl
+    python -m src.tracing show spans.jsonl --slowest 5
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "childhood-cancer-staging"
+# Spans buffered by the OTLP exporter before they are posted
+DEFAULT_OTLP_BATCH_SIZE = 64
+OTLP_TRACES_PATH = "/v1/traces"
+
+class Span:
+    """A timed operation with attributes; finished spans are passed to the tracer's exporters"""
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.attributes: Dict[str, Any] = {}
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self._lock = threading.Lock()
+        self.set_attributes(**(attributes or {}))
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Set an attribute; None values are skipped"""
+        if value is not None:
+            with self._lock:
+                self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        """Set several attributes; None values are skipped"""
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_to_attributes(self, **amounts: float) -> None:
+        """Add to numeric attributes, e.g. the token counts of several calls"""
+        with self._lock:
+            for key, amount in amounts.items():
+                self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_error(self, error: BaseException) -> None:
+        """Mark the span as failed with the given exception"""
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        """Set the end time"""
+        self.end_time_ns = time.time_ns()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the span as a flat JSON-serializable record"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_ns,
+            "end_time_unix_nano": self.end_time_ns,
+            "duration_ms": round((self.end_time_ns - self.start_time_ns) / 1e6, 3) if self.end_time_ns else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": dict(self.attributes),
+        }
+
+class _NoopSpan(Span):
+    """Span handed out while tracing is off; records nothing"""
+
+    def __init__(self):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add_to_attributes(self, **amounts):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class JsonlSpanExporter:
+    """Appends each finished span to a JSONL file as one flat record"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def flush(self) -> None:
+        pass
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _from_otlp_value(value: Dict[str, Any]) -> Any:
+    """Decode an OTLP AnyValue"""
+    if "intValue" in value:
+        return int(value["intValue"])
+    for kind in ("boolValue", "doubleValue", "stringValue"):
+        if kind in value:
+            return value[kind]
+    return None
+
+def to_otlp_span(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a flat span record to an OTLP/JSON span"""
+    span = {
+        "traceId": record["trace_id"],
+        "spanId": record["span_id"],
+        "name": record["name"],
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(record["start_time_unix_nano"]),
+        "endTimeUnixNano": str(record["end_time_unix_nano"]),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+        "status": {"code": 2, "message": record["error"]} if record["status"] == "error" else {"code": 1},
+    }
+    if record.get("parent_span_id"):
+        span["parentSpanId"] = record["parent_span_id"]
+    return span
+
+def from_otlp_span(span: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an OTLP/JSON span to a flat span record"""
+    start, end = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+    status = span.get("status") or {}
+    return {
+        "trace_id": span["traceId"],
+        "span_id": span["spanId"],
+        "parent_span_id": span.get("parentSpanId") or None,
+        "name": span["name"],
+        "start_time_unix_nano": start,
+        "end_time_unix_nano": end,
+        "duration_ms": round((end - start) / 1e6, 3),
+        "status": "error" if status.get("code") == 2 else "ok",
+        "error": status.get("message"),
+        "attributes": {attribute["key"]: _from_otlp_value(attribute["value"])
+                       for attribute in span.get("attributes", [])},
+    }
+
+class OtlpHttpSpanExporter:
+    """Posts finished spans in batches to an OTLP/HTTP collector as JSON"""
+
+    def __init__(self, endpoint: str, batch_size: int = DEFAULT_OTLP_BATCH_SIZE, timeout: float = 10.0):
+        """
+        Args:
+            endpoint: Collector base URL; spans are posted to <endpoint>/v1/traces
+            batch_size: Spans buffered before a post
+            timeout: Seconds to wait for the collector
+        """
+        self.url = endpoint.rstrip("/") + OTLP_TRACES_PATH
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._buffer.append(to_otlp_span(span.to_dict()))
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        self._post(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._post(batch)
+
+    def _post(self, spans: List[Dict[str, Any]]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+        try:
+            response = httpx.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            # Tracing must never fail a staging run; the batch is dropped
+            logger.warning(f"Could not export {len(spans)} spans to {self.url}: {e}")
+
+class Tracer:
+    """Creates spans and hands finished ones to its exporters"""
+
+    def __init__(self, exporters: List[Any]):
+        self.exporters = exporters
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """Start a span, in the parent's trace or a new one"""
+        if parent is None or parent is NOOP_SPAN:
+            return Span(name, os.urandom(16).hex(), attributes=attributes)
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    def finish(self, span: Span) -> None:
+        """End a span and export it"""
+        span.end()
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"Span export failed: {e}")
+
+    def flush(self) -> None:
+        """Send any spans buffered by the exporters"""
+        for exporter in self.exporters:
+            exporter.flush()
+
+_CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("staging_current_span", default=None)
+
+_TRACER: Dict[str, Any] = {}
+_TRACER_LOCK = threading.Lock()
+
+def configure_tracing(exporters: Optional[List[Any]]) -> Optional[Tracer]:
+    """
+    Set the exporters spans are sent to, overriding STAGING_TRACE_FILE and STAGING_TRACE_OTLP_ENDPOINT.
+
+    Args:
+        exporters: Span exporters (objects with export(span) and flush()), or None
+            to fall back to the environment settings; an empty list turns tracing off
+
+    Returns:
+        The tracer in use, or None when tracing is off
+    """
+    with _TRACER_LOCK:
+        previous = _TRACER.pop("tracer", None)
+        _TRACER.pop("settings", None)
+        if exporters is not None:
+            _TRACER["tracer"] = Tracer(exporters) if exporters else None
+            _TRACER["settings"] = "configured"
+    if previous is not None:
+        previous.flush()
+    return get_tracer()
+
+def get_tracer() -> Optional[Tracer]:
+    """Get the tracer for the configured exporters, or None when tracing is off"""
+    if _TRACER.get("settings") == "configured":
+        return _TRACER.get("tracer")
+    settings = (os.getenv("STAGING_TRACE_FILE"), os.getenv("STAGING_TRACE_OTLP_ENDPOINT"))
+    if _TRACER.get("settings") == settings:
+        return _TRACER.get("tracer")
+
+    with _TRACER_LOCK:
+        if _TRACER.get("settings") != settings:
+            trace_file, endpoint = settings
+            exporters = []
+            if trace_file:
+                exporters.append(JsonlSpanExporter(trace_file))
+            if endpoint:
+                exporters.append(OtlpHttpSpanExporter(endpoint))
+            previous = _TRACER.get("tracer")
+            if previous is not None:
+                previous.flush()
+            _TRACER["tracer"] = Tracer(exporters) if exporters else None
+            _TRACER["settings"] = settings
+        return _TRACER["tracer"]
+
+def flush_tracing() -> None:
+    """Send any buffered spans, e.g. before the process exits"""
+    tracer = _TRACER.get("tracer")
+    if tracer is not None:
+        tracer.flush()
+
+atexit.register(flush_tracing)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Run the block in a span, nested under the current span of this context.
+
+    An exception leaving the block marks the span as failed. While tracing is
+    off the block gets NOOP_SPAN, so instrumented code costs next to nothing.
+
+    Args:
+        name: Span name
+        **attributes: Initial attributes (None values are skipped)
+
+    Yields:
+        Span: The span, for setting further attributes
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+
+    current = tracer.start_span(name, _CURRENT_SPAN.get(), **attributes)
+    token = _CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        tracer.finish(current)
+
+def current_span() -> Span:
+    """Get the span of this context (NOOP_SPAN if there is none)"""
+    return _CURRENT_SPAN.get() or NOOP_SPAN
+
+class LLMSpanHandler(BaseCallbackHandler):
+    """
+    Callback handler opening an llm.request span for every chat model call.
+
+    Used on the CrewAI path, where the LLM calls are made by the agents rather
+    than the wrappers in src.azure_openai_config.
+    """
+
+    def __init__(self, tracer: Tracer, parent: Span):
+        self.tracer = tracer
+        self.parent = parent
+        self._spans: Dict[Any, Span] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model") or (kwargs.get("metadata") or {}).get("ls_model_name")
+        started = self.tracer.start_span("llm.request", self.parent, model=model)
+        with self._lock:
+            self._spans[run_id] = started
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            finished = self._spans.pop(run_id, None)
+        if finished is None:
+            return
+        message = getattr(response.generations[0][0], "message", None)
+        usage = getattr(message, "usage_metadata", None) or {}
+        finished.set_attributes(
+            input_tokens=usage.get("input_tokens"),
+            cached_tokens=(usage.get("input_token_details") or {}).get("cache_read"),
+            output_tokens=usage.get("output_tokens"),
+        )
+        self.tracer.finish(finished)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            finished = self._spans.pop(run_id, None)
+        if finished is not None:
+            finished.record_error(error)
+            self.tracer.finish(finished)
+
+_LLM_SPAN_HANDLER: ContextVar[Optional[LLMSpanHandler]] = ContextVar("staging_llm_span_handler", default=None)
+register_configure_hook(_LLM_SPAN_HANDLER, inheritable=True)
+
+@contextmanager
+def trace_llm_callbacks() -> Iterator[None]:
+    """Open llm.request spans under the current span for the LangChain chat model calls made in the block"""
+    tracer = get_tracer()
+    if tracer is None or _CURRENT_SPAN.get() is None:
+        yield
+        return
+    token = _LLM_SPAN_HANDLER.set(LLMSpanHandler(tracer, _CURRENT_SPAN.get()))
+    try:
+        yield
+    finally:
+        _LLM_SPAN_HANDLER.reset(token)
+
+def make_collector(output: str, host: str = "127.0.0.1", port: int = 4318) -> ThreadingHTTPServer:
+    """
+    Create a stand-in OTLP/HTTP collector (not yet serving) that writes received spans as JSONL.
+
+    Only JSON-encoded trace exports are accepted.
+
+    Args:
+        output: JSONL file the spans are appended to
+        host: Interface to bind
+        port: Port to bind (0 picks a free one)
+
+    Returns:
+        ThreadingHTTPServer: The server
+    """
+    exporter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != OTLP_TRACES_PATH:
+                self.send_error(404)
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                records = [from_otlp_span(span)
+                           for resource_spans in payload.get("resourceSpans", [])
+                           for scope_spans in resource_spans.get("scopeSpans", [])
+                           for span in scope_spans.get("spans", [])]
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error(400, f"Invalid OTLP/JSON payload: {e}")
+                return
+            with exporter_lock:
+                with open(output, "a", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            data = b"{}"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+def load_spans(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Load span records from a JSONL file, grouped by trace ID"""
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+def format_trace(records: List[Dict[str, Any]]) -> str:
+    """Render one trace as an indented span tree with durations and key attributes"""
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    span_ids = {record["span_id"] for record in records}
+    for record in sorted(records, key=lambda record: record["start_time_unix_nano"]):
+        parent = record["parent_span_id"] if record["parent_span_id"] in span_ids else None
+        children.setdefault(parent, []).append(record)
+
+    lines = []
+
+    def render(record, depth):
+        attributes = ", ".join(f"{key}={value}" for key, value in record["attributes"].items())
+        error = f" ERROR {record['error']}" if record["status"] == "error" else ""
+        lines.append(f"{'  ' * depth}{record['name']} {record['duration_ms']:.1f}ms"
+                     f"{f' ({attributes})' if attributes else ''}{error}")
+        for child in children.get(record["span_id"], []):
+            render(child, depth + 1)
+
+    for root in children.get(None, []):
+        render(root, 0)
+    return "\n".join(lines)
+
+def main(argv=None):
+    """Run the stand-in collector, or show the slowest traces of a JSONL span file"""
+    parser = argparse.ArgumentParser(description="Staging trace tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    collect = subparsers.add_parser("collect", help="Receive OTLP/HTTP JSON spans and write them as JSONL")
+    collect.add_argument("--host", default="127.0.0.1")
+    collect.add_argument("--port", type=int, default=4318)
+    collect.add_argument("--output", default="spans.jsonl", help="JSONL file the spans are appended to")
+    show = subparsers.add_parser("show", help="Print the span trees of the slowest traces")
+    show.add_argument("path", help="JSONL span file")
+    show.add_argument("--slowest", type=int, default=5, help="Number of traces to show")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "collect":
+        server = make_collector(args.output, args.host, args.port)
+        logger.info(f"Collecting spans at http://{args.host}:{server.server_address[1]}{OTLP_TRACES_PATH} into {args.output}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    def trace_duration(records):
+        return max(record["end_time_unix_nano"] for record in records) - min(record["start_time_unix_nano"] for record in records)
+
+    traces = sorted(load_spans(args.path).values(), key=trace_duration, reverse=True)
+    for records in traces[:args.slowest]:
+        print(format_trace(records))
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
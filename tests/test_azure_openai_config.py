@@ -0,0 +1,54 @@
+"""Tests for the pooled LLM and HTTP clients"""
+
+import asyncio
+
+import pytest
+
+from src import azure_openai_config
+from src.azure_openai_config import ashutdown_llm_clients, get_azure_openai_llm, shutdown_llm_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    shutdown_llm_clients()
+    yield
+    shutdown_llm_clients()
+
+
+def make_llm(api_key="key-1"):
+    return get_azure_openai_llm("gpt", endpoint="https://example.invalid/", api_key=api_key,
+                                api_version="2024-06-01")
+
+
+def test_same_settings_reuse_the_client():
+    assert make_llm() is make_llm()
+
+
+def test_rotated_key_gets_a_new_client():
+    assert make_llm("key-1") is not make_llm("key-2")
+
+
+def test_pool_keys_do_not_hold_the_key():
+    make_llm("secret-key")
+    assert all("secret-key" not in key for key in azure_openai_config._CLIENT_POOL)
+
+
+def test_each_event_loop_gets_its_own_async_client():
+    async def build():
+        llm = make_llm()
+        assert llm.http_async_client is azure_openai_config._LOOP_CLIENTS[asyncio.get_running_loop()]["async"]
+        return llm
+
+    first, second = asyncio.run(build()), asyncio.run(build())
+    assert first is not second
+    assert first.http_async_client is not second.http_async_client
+    assert first.http_client is second.http_client
+
+
+def test_async_shutdown_closes_the_loop_client():
+    async def build_and_close():
+        client = make_llm().http_async_client
+        await ashutdown_llm_clients()
+        return client
+
+    assert asyncio.run(build_and_close()).is_closed
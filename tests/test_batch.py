@@ -0,0 +1,114 @@
+"""Tests for note discovery, streaming CSV output and the batch worker pool"""
+
+import csv
+import os
+import threading
+import time
+
+import pytest
+
+from src.batch import StreamingCsvWriter, iter_note_paths, run_batch
+
+
+def write(path, text=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return str(path)
+
+
+def read_rows(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))
+
+
+@pytest.fixture
+def notes_dir(tmp_path):
+    for name in ("b.txt", "a.TXT", "skip.pdf", "sub/c.txt", "sub/deeper/d.txt"):
+        write(tmp_path / "notes" / name, name)
+    return tmp_path / "notes"
+
+
+def test_directory_yields_text_files_in_sorted_order(notes_dir):
+    paths = [os.path.relpath(path, notes_dir) for path in iter_note_paths(str(notes_dir))]
+    assert paths == ["a.TXT", "b.txt", os.path.join("sub", "c.txt"), os.path.join("sub", "deeper", "d.txt")]
+
+
+def test_glob_pattern_is_recursive_with_double_star(notes_dir):
+    paths = {os.path.basename(path) for path in iter_note_paths(str(notes_dir / "**" / "*.txt"))}
+    assert paths == {"b.txt", "c.txt", "d.txt"}
+
+
+def test_text_manifest_resolves_against_its_directory(notes_dir, tmp_path):
+    absolute = str(notes_dir / "b.txt")
+    manifest = write(tmp_path / "lists" / "notes.lst", f"# reviewed notes\n\n../notes/a.TXT\n{absolute}\n")
+    assert list(iter_note_paths(manifest)) == [os.path.join(str(tmp_path / "lists"), "../notes/a.TXT"), absolute]
+
+
+@pytest.mark.parametrize("header, column", [("id,path", 1), ("note_file,id", 0)])
+def test_csv_manifest_reads_the_path_column(tmp_path, header, column):
+    entries = ["x.txt", "y.txt"]
+    rows = [[entry, str(index)] if column == 0 else [str(index), entry] for index, entry in enumerate(entries)]
+    manifest = write(tmp_path / "manifest.csv", "\n".join([header] + [",".join(row) for row in rows]) + "\n")
+    assert list(iter_note_paths(manifest)) == [os.path.join(str(tmp_path), entry) for entry in entries]
+
+
+def test_missing_source_is_reported(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(iter_note_paths(str(tmp_path / "missing")))
+
+
+def test_rows_are_on_disk_before_the_writer_closes(tmp_path):
+    path = str(tmp_path / "results.csv")
+    writer = StreamingCsvWriter(path, ["note", "stage"])
+    writer.write_row({"note": "a.txt", "stage": "Stage I", "extra": "ignored"})
+    assert read_rows(path) == [["note", "stage"], ["a.txt", "Stage I"]]
+    writer.close()
+
+
+def test_appending_writes_the_header_once(tmp_path):
+    path = str(tmp_path / "results.csv")
+    for stage in ("Stage I", "Stage II"):
+        with StreamingCsvWriter(path, ["note", "stage"]) as writer:
+            writer.write_row({"note": "a.txt", "stage": stage})
+    assert read_rows(path) == [["note", "stage"], ["a.txt", "Stage I"], ["a.txt", "Stage II"]]
+
+
+def test_batch_counts_processed_skipped_and_failed_notes(tmp_path):
+    def process_note(path):
+        if path.startswith("bad"):
+            raise ValueError("unreadable note")
+        if path.startswith("done"):
+            return None
+        return {"note": path, "stage": "Stage I"}
+
+    paths = ["a", "bad1", "done1", "b", "c", "bad2"]
+    output = str(tmp_path / "results.csv")
+    with StreamingCsvWriter(output, ["note", "stage"]) as writer:
+        counts = run_batch(paths, process_note, writer, workers=3)
+    assert counts == {"processed": 3, "skipped": 1, "failed": 2}
+    assert sorted(row[0] for row in read_rows(output)[1:]) == ["a", "b", "c"]
+
+
+def test_batch_pulls_note_paths_lazily(tmp_path):
+    release = threading.Event()
+    pulled = []
+
+    def note_paths():
+        for index in range(50):
+            pulled.append(index)
+            yield f"note{index}"
+
+    def process_note(path):
+        release.wait()
+        return {"note": path}
+
+    with StreamingCsvWriter(str(tmp_path / "results.csv"), ["note"]) as writer:
+        runner = threading.Thread(target=lambda: pulled.append(run_batch(note_paths(), process_note, writer, 2)))
+        runner.start()
+        time.sleep(0.2)
+        # Two workers keep at most four notes in flight and pull one more while waiting
+        assert len(pulled) == 5
+        release.set()
+        runner.join()
+    assert pulled[-1] == {"processed": 50, "skipped": 0, "failed": 0}
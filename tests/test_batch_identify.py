@@ -0,0 +1,48 @@
+"""Tests for the fallback of batched identification to single-note identification"""
+
+import asyncio
+
+import pytest
+
+from src import batch_identify
+from src.schemas import BatchIdentification, NoteIdentification, StructuredOutputError
+
+NOTES = [(1, "Diagnosis: Wilms tumor."), (2, "Diagnosis: neuroblastoma."), (3, "Diagnosis: osteosarcoma.")]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+@pytest.mark.parametrize("error", [StructuredOutputError("bad json"), RateLimitError("throttled"),
+                                   ConnectionError("reset")])
+def test_failed_batch_leaves_notes_to_the_graph(monkeypatch, error):
+    def llm_factory(**kwargs):
+        def llm(messages):
+            raise error
+        return llm
+
+    monkeypatch.setattr(batch_identify, "get_structured_llm_with_system_prompt", llm_factory)
+    assert batch_identify.identify_notes(NOTES, batch_size=3, preclassifier_mode="off") == {}
+
+
+def test_failed_async_batch_does_not_fail_the_others(monkeypatch):
+    calls = []
+
+    def llm_factory(**kwargs):
+        async def llm(messages):
+            calls.append(messages)
+            if len(calls) == 1:
+                raise RateLimitError("throttled")
+            return BatchIdentification(notes=[
+                NoteIdentification(note_id=str(number), cancer_type="Hepatoblastoma",
+                                   standardized_category="Hepatoblastoma", is_covered_by_toronto=True)
+                for number in (1, 2)
+            ])
+        return llm
+
+    monkeypatch.setattr(batch_identify, "get_async_structured_llm_with_system_prompt", llm_factory)
+    notes = NOTES + [(4, "Diagnosis: hepatoblastoma.")]
+    result = asyncio.run(batch_identify.aidentify_notes(notes, batch_size=2, preclassifier_mode="off"))
+    assert set(result) == {3, 4}
+    assert len(calls) == 2
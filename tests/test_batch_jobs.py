@@ -0,0 +1,118 @@
+"""Tests for the offline batch job runner"""
+
+import os
+
+import pytest
+
+from src.batch_jobs import BatchJobRunner, LocalFileBackend
+from src.stub_llm_server import StubResponder
+
+NOTE = ("Diagnosis: Wilms tumor of the left kidney. CT shows a 10 cm renal mass confined to the kidney; "
+        "no lung nodules. Nephrectomy planned.")
+
+RULES = [
+    {"tool": "CancerIdentification", "match": "Wilms", "arguments": {
+        "cancer_type": "Wilms tumor", "standardized_category": "Wilms Tumor (Renal Tumors)",
+        "is_covered_by_toronto": True, "primary_site": "left kidney", "metastasis_sites": "None identified",
+        "extracted_stage": "Not mentioned"}},
+    {"tool": "StagingCriteriaAnalysis", "match": "", "arguments": {
+        "criteria": [{"criterion": "Tumor confined to the kidney", "status": "present", "evidence": "confined"}],
+        "summary": "Localized renal tumor"}},
+    {"tool": "StageAssignment", "match": "", "arguments": {"stage": "Stage I", "explanation": "Localized"}},
+    {"tool": "StagingDetermination", "match": "", "arguments": {
+        "criteria": [{"criterion": "Tumor confined to the kidney", "status": "present", "evidence": "confined"}],
+        "stage": "Stage I", "explanation": "Localized"}},
+    {"match": "", "content": "Staging report."},
+]
+
+
+def make_runner(tmp_path, backend=None, mode="audit"):
+    backend = backend or LocalFileBackend(str(tmp_path / "local-jobs"), StubResponder(RULES).completion)
+    return BatchJobRunner(str(tmp_path / mode), backend, deployment_name="gpt", mode=mode, preclassifier_mode="off",
+                          report_mode="llm")
+
+
+@pytest.mark.parametrize("mode", ["audit", "fast"])
+def test_notes_are_staged_through_jobs(tmp_path, mode):
+    runner = make_runner(tmp_path, mode=mode)
+    assert runner.add_notes([("a", NOTE), ("b", NOTE)]) == 2
+    assert runner.add_notes([("a", NOTE)]) == 0
+
+    assert runner.run(poll_interval=0) == {"done/pending": 2}
+    results = {note_id: (result, error) for note_id, result, error in runner.results()}
+    assert set(results) == {"a", "b"}
+    for result, error in results.values():
+        assert error is None
+        assert result["standardized_cancer_type"] == "Wilms Tumor (Renal Tumors)"
+        assert result["report"] == "Staging report."
+        assert result["stage"] == "Stage I"
+    runner.close()
+
+
+class FailingBackend(LocalFileBackend):
+    """Backend whose job never produces output and is reported failed"""
+
+    def submit(self, input_path):
+        job_id = super().submit(input_path)
+        open(os.path.join(self.directory, job_id, "failed"), "w").close()
+        return job_id
+
+
+def test_failed_job_fails_its_notes_until_retried(tmp_path):
+    runner = make_runner(tmp_path, FailingBackend(str(tmp_path / "local-jobs")))
+    runner.add_notes([("a", NOTE)])
+
+    assert runner.step() == "submitted"
+    assert runner.step() == "advanced"
+    assert runner.status() == {"identify/failed": 1}
+    assert runner.finished()
+    assert next(runner.results())[2].startswith("Batch job")
+
+    runner.backend = LocalFileBackend(str(tmp_path / "local-jobs"), StubResponder(RULES).completion)
+    assert runner.retry_failed() == 1
+    assert runner.run(poll_interval=0) == {"done/pending": 1}
+    runner.close()
+
+
+class UnreachableBackend(LocalFileBackend):
+    """Backend whose upload fails"""
+
+    def submit(self, input_path):
+        raise ConnectionError("upload failed")
+
+
+def test_failed_submission_leaves_notes_pending(tmp_path):
+    runner = make_runner(tmp_path, UnreachableBackend(str(tmp_path / "local-jobs")))
+    runner.add_notes([("a", NOTE)])
+
+    with pytest.raises(ConnectionError):
+        runner.step()
+    assert runner.status() == {"identify/pending": 1}
+    assert not runner.finished()
+
+    runner.backend = LocalFileBackend(str(tmp_path / "local-jobs"), StubResponder(RULES).completion)
+    assert runner.run(poll_interval=0) == {"done/pending": 1}
+    runner.close()
+
+
+def test_orphaned_submitted_notes_are_resubmitted(tmp_path):
+    runner = make_runner(tmp_path)
+    runner.add_notes([("a", NOTE)])
+    # As left by a process that crashed between marking the notes and recording the job
+    runner._conn.execute("UPDATE notes SET status = 'submitted'")
+    runner._conn.commit()
+
+    assert runner.step() == "submitted"
+    assert runner.run(poll_interval=0) == {"done/pending": 1}
+    runner.close()
+
+
+def test_request_files_do_not_collide(tmp_path):
+    runner = make_runner(tmp_path, FailingBackend(str(tmp_path / "local-jobs")))
+    runner.add_notes([("a", NOTE)])
+    for _ in range(3):
+        runner.step()
+        runner.step()
+        runner.retry_failed()
+    assert len([name for name in os.listdir(runner.job_dir) if name.endswith(".jsonl")]) == 3
+    runner.close()
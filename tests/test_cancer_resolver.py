@@ -0,0 +1,62 @@
+"""Tests for resolving free-text cancer labels to Toronto cancer types"""
+
+import pytest
+
+from src.cancer_mapping import CANCER_TYPE_MAPPING
+from src.cancer_resolver import CancerTypeResolver
+from src.knowledge_base import load_staging_data
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return CancerTypeResolver(load_staging_data().keys(), CANCER_TYPE_MAPPING)
+
+
+@pytest.mark.parametrize("label", [
+    "extrarenal rhabdoid tumor",
+    "Extra-renal rhabdoid tumour",
+    "malignant rhabdoid tumor of the liver",
+    "atypical teratoid rhabdoid tumor",
+    "hepatocellular carcinoma",
+    "acute myeloid leukemia",
+    "rhabdoid tumor",
+    "Wilms tumor and neuroblastoma",
+])
+def test_uncovered_cancers_stay_unresolved(resolver, label):
+    assert resolver.resolve(label) is None
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("renal rhabdoid tumour", "Wilms Tumor (Renal Tumors)"),
+    ("rhabdoid tumor of the kidney", "Wilms Tumor (Renal Tumors)"),
+    ("Stage III nephroblastoma", "Wilms Tumor (Renal Tumors)"),
+    ("Non-Hodgkin's lymphoma", "Non-Hodgkin Lymphoma"),
+    ("clear cell sarcoma", "Non-Rhabdo Soft Tissue Sarcoma"),
+    ("PNET", "Bone Tumors"),
+])
+def test_covered_labels_resolve(resolver, label, expected):
+    assert resolver.resolve(label) == expected
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("nephroblastma", "Wilms Tumor (Renal Tumors)"),
+    ("Burkitt lymphma", "Non-Hodgkin Lymphoma"),
+    ("Ewing's sarcma", "Bone Tumors"),
+    ("pilocytic astrocytma", "Astrocytoma"),
+])
+def test_typos_resolve_by_fuzzy_match(resolver, label, expected):
+    assert resolver.resolve(label) == expected
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("clear cell sarcoma of the kidney", "Wilms Tumor (Renal Tumors)"),
+    ("clear cell sarcoma of kidney", "Wilms Tumor (Renal Tumors)"),
+    ("clear cell sarcoma (kidney)", "Wilms Tumor (Renal Tumors)"),
+    ("rhabdoid tumor (kidney)", "Wilms Tumor (Renal Tumors)"),
+    ("malignant rhabdoid tumor of the kidney", "Wilms Tumor (Renal Tumors)"),
+    ("CNS PNET", "Medulloblastoma (CNS Embryonal Tumors)"),
+    ("PNET of the brain", "Medulloblastoma (CNS Embryonal Tumors)"),
+    ("PNET (brain)", "Medulloblastoma (CNS Embryonal Tumors)"),
+])
+def test_site_qualified_labels_win_over_the_bare_histology(resolver, label, expected):
+    assert resolver.resolve(label) == expected
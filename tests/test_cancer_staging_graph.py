@@ -0,0 +1,167 @@
+"""Tests for the LangGraph staging workflow"""
+
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src import cancer_staging_graph, llm_backends
+from src.azure_openai_config import shutdown_llm_clients
+from src.cancer_staging_graph import aprocess_medical_note, astage_corpus, clear_graph_registry, process_medical_note
+from src.stub_llm_server import StubResponder
+from src.tracing import JsonlSpanExporter, configure_tracing, load_spans
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NOTE = ("Diagnosis: Wilms tumor of the left kidney. CT shows a 10 cm renal mass confined to the kidney; "
+        "no lung nodules. Nephrectomy planned.")
+
+RULES = [
+    {"tool": "CancerIdentification", "match": "Wilms", "arguments": {
+        "cancer_type": "Wilms tumor", "standardized_category": "Wilms Tumor (Renal Tumors)",
+        "is_covered_by_toronto": True, "primary_site": "left kidney", "metastasis_sites": "None identified",
+        "extracted_stage": "Not mentioned"}},
+    {"tool": "StagingCriteriaAnalysis", "match": "", "arguments": {
+        "criteria": [{"criterion": "Tumor confined to the kidney", "status": "present", "evidence": "confined"}],
+        "summary": "Localized renal tumor"}},
+    {"tool": "StageAssignment", "match": "", "arguments": {"stage": "Stage I", "explanation": "Localized"}},
+    {"match": "", "content": "Staging report."},
+]
+
+
+@pytest.fixture
+def local_llm(monkeypatch):
+    """Stage notes with the in-process stub LLM; returns the stub responder"""
+    for name, value in {"STAGING_LLM_BACKEND": "local", "STAGING_PRECLASSIFIER": "off", "STAGING_GRAPH_MODE": "audit",
+                        "STAGING_REPORT_MODE": "llm", "STAGING_NOTE_CONTEXT": "full"}.items():
+        monkeypatch.setenv(name, value)
+    for name in ("STAGING_LLM_CACHE", "STAGING_LLM_RECORD"):
+        monkeypatch.delenv(name, raising=False)
+    responder = StubResponder(RULES, latency="fixed:0.01")
+    monkeypatch.setitem(llm_backends._SHARED, "responder", responder)
+    shutdown_llm_clients()
+    clear_graph_registry()
+    yield responder
+    clear_graph_registry()
+    shutdown_llm_clients()
+
+
+def staged(result):
+    return result["standardized_cancer_type"], result["stage"], result["report"]
+
+
+def test_importing_the_workflow_does_not_load_the_staging_data():
+    script = ("import src.cancer_staging_graph as graph, src.knowledge_base as kb\n"
+              "assert not kb._SHARED, kb._SHARED\n"
+              "assert graph.STAGING_KB is kb.get_staging_kb()\n"
+              "assert graph.TORONTO_COVERED_CANCERS == list(kb.load_staging_data())\n")
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=REPO_ROOT)
+    assert result.returncode == 0, result.stderr
+
+
+def test_async_pipeline_matches_the_sync_one(local_llm):
+    expected = ("Wilms Tumor (Renal Tumors)", "Stage I", "Staging report.")
+    assert staged(process_medical_note(NOTE, thread_id="sync", verbose=False)) == expected
+    assert staged(asyncio.run(aprocess_medical_note(NOTE, thread_id="async"))) == expected
+
+
+def test_corpus_stays_within_the_concurrency_bound(local_llm, monkeypatch):
+    in_flight = []
+    peak = []
+    pulled = []
+
+    async def counted(note_text, **kwargs):
+        in_flight.append(note_text)
+        peak.append(len(in_flight))
+        try:
+            return await aprocess_medical_note(note_text, **kwargs)
+        finally:
+            in_flight.remove(note_text)
+
+    def notes():
+        for index in range(12):
+            pulled.append(index)
+            yield index, NOTE
+
+    async def stage():
+        results = []
+        async for note_id, result, error in astage_corpus(notes(), max_concurrency=3):
+            # Notes are pulled only as slots free up, not all at once
+            results.append((note_id, len(pulled)))
+            assert error is None and staged(result)[1] == "Stage I"
+        return results
+
+    monkeypatch.setattr(cancer_staging_graph, "aprocess_medical_note", counted)
+    results = asyncio.run(stage())
+    assert sorted(note_id for note_id, _ in results) == list(range(12))
+    assert max(peak) == 3
+    assert results[0][1] <= 4
+
+
+def test_failed_note_does_not_stop_the_corpus(local_llm, monkeypatch):
+    async def flaky(note_text, **kwargs):
+        if note_text == "boom":
+            raise RuntimeError("LLM unavailable")
+        return await aprocess_medical_note(note_text, **kwargs)
+
+    async def stage():
+        notes = [("a", NOTE), ("b", "boom"), ("c", NOTE)]
+        return {note_id: (result, error) async for note_id, result, error in astage_corpus(notes, max_concurrency=2)}
+
+    monkeypatch.setattr(cancer_staging_graph, "aprocess_medical_note", flaky)
+    results = asyncio.run(stage())
+    assert str(results["b"][1]) == "LLM unavailable" and results["b"][0] is None
+    assert staged(results["a"][0])[1] == staged(results["c"][0])[1] == "Stage I"
+
+
+def test_interrupted_note_resumes_from_its_checkpoint(local_llm, monkeypatch, tmp_path):
+    requests = []
+    respond = local_llm.respond
+
+    def interrupted_once(body):
+        tool = body["tools"][0]["function"]["name"] if body.get("tools") else "text"
+        requests.append(tool)
+        if tool == "StageAssignment" and requests.count(tool) == 1:
+            raise RuntimeError("worker killed")
+        return respond(body)
+
+    monkeypatch.setattr(local_llm, "respond", interrupted_once)
+    checkpoint_path = str(tmp_path / "checkpoints.db")
+    with pytest.raises(RuntimeError):
+        process_medical_note(NOTE, thread_id="note", verbose=False, checkpoint_path=checkpoint_path)
+    assert requests == ["CancerIdentification", "StagingCriteriaAnalysis", "StageAssignment"]
+
+    # A new process picks the thread up at the stage, without repeating the finished nodes
+    clear_graph_registry()
+    result = process_medical_note(NOTE, thread_id="note", verbose=False, checkpoint_path=checkpoint_path)
+    assert staged(result) == ("Wilms Tumor (Renal Tumors)", "Stage I", "Staging report.")
+    assert requests[3:] == ["StageAssignment", "text"]
+
+    # A finished thread returns its checkpointed result without calling the LLM
+    assert process_medical_note(NOTE, thread_id="note", verbose=False, checkpoint_path=checkpoint_path) == result
+    assert len(requests) == 5
+
+
+def test_note_trace_nests_nodes_requests_and_attempts(local_llm, tmp_path):
+    path = str(tmp_path / "spans.jsonl")
+    configure_tracing([JsonlSpanExporter(path)])
+    try:
+        process_medical_note(NOTE, thread_id="traced", verbose=False)
+    finally:
+        configure_tracing(None)
+
+    (records,) = load_spans(path).values()
+    spans = {record["span_id"]: record for record in records}
+    (note,) = [record for record in records if record["name"] == "note"]
+    nodes = [record for record in records if record["parent_span_id"] == note["span_id"]]
+    requests = [record for record in records if record["name"] == "llm.request"]
+    attempts = [record for record in records if record["name"] == "llm.attempt"]
+    assert [node["name"] for node in sorted(nodes, key=lambda record: record["start_time_unix_nano"])] == [
+        "identify_cancer", "extract_evidence", "analyze_criteria", "calculate_stage", "generate_report"]
+    assert len(requests) == len(attempts) == 4
+    assert {spans[request["parent_span_id"]]["parent_span_id"] for request in requests} == {note["span_id"]}
+    assert {spans[attempt["parent_span_id"]]["name"] for attempt in attempts} == {"llm.request"}
+    assert note["attributes"]["stage"] == "Stage I"
+    assert note["attributes"]["input_tokens"] == sum(request["attributes"]["input_tokens"] for request in requests)
@@ -0,0 +1,157 @@
+"""Tests for routing and failover in the deployment pool"""
+
+import asyncio
+from collections import Counter
+
+import pytest
+
+from src.azure_openai_config import get_azure_openai_llm, shutdown_llm_clients
+from src.deployment_pool import DeploymentPool, PoolDeployment
+from src.rate_limit import RetryPolicy
+from src.stub_llm_server import StubResponder, serve_in_thread
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def make_pool(*weights, max_attempts=3):
+    members = [PoolDeployment(f"d{index}", "https://example.invalid/", "gpt", api_key="key", weight=weight)
+               for index, weight in enumerate(weights)]
+    return DeploymentPool(members, RetryPolicy(max_attempts=max_attempts, base_delay=0.0))
+
+
+def test_sequential_traffic_follows_weights():
+    pool = make_pool(2, 1, 1)
+    served = Counter(pool.call(lambda member: member.name) for _ in range(40))
+    assert served == {"d0": 20, "d1": 10, "d2": 10}
+
+
+def test_equal_weights_alternate():
+    pool = make_pool(1, 1)
+    assert [pool.call(lambda member: member.name) for _ in range(4)] == ["d0", "d1", "d0", "d1"]
+
+
+def test_in_flight_requests_steer_away():
+    pool = make_pool(1, 1)
+    busy = pool.select()
+    assert pool.select() is not busy
+
+
+def test_throttled_call_fails_over():
+    pool = make_pool(1, 1)
+
+    def call(member):
+        if member.name == "d0":
+            raise APIError(429)
+        return member.name
+
+    assert pool.call(call) == "d1"
+    assert pool.deployments[0].failures == 1
+
+
+def open_member(pool, index=0):
+    """Open a member's circuit with a probe due at once"""
+    breaker = pool.deployments[index].breaker
+    breaker.reset_timeout = 0.0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_non_retryable_probe_closes_the_circuit():
+    pool = make_pool(1)
+    breaker = open_member(pool)
+
+    def bad_request(member):
+        raise APIError(400)
+
+    with pytest.raises(APIError):
+        pool.call(bad_request)
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_is_released():
+    pool = make_pool(1)
+    breaker = open_member(pool)
+
+    async def cancelled(member):
+        raise asyncio.CancelledError
+
+    async def succeed(member):
+        return member.name
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(pool.acall(cancelled))
+    assert asyncio.run(pool.acall(succeed)) == "d0"
+    assert breaker.state == "closed"
+    assert pool.deployments[0].in_flight == 0
+
+
+@pytest.fixture
+def stub_servers():
+    """Start stub LLM servers on demand and stop them after the test"""
+    servers = []
+
+    def start(**kwargs):
+        server, url = serve_in_thread(StubResponder(**kwargs))
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    shutdown_llm_clients()
+
+
+def stub_pool(urls):
+    members = [PoolDeployment(name, url, "gpt", api_key="key", api_version="2024-06-01")
+               for name, url in urls.items()]
+    return DeploymentPool(members, RetryPolicy(base_delay=0.0))
+
+
+def complete(member):
+    llm = get_azure_openai_llm(member.deployment, endpoint=member.endpoint, api_key=member.api_key,
+                               api_version=member.api_version)
+    return member.name if llm.invoke("ping").content else None
+
+
+def test_failing_server_is_failed_over_and_marked_unhealthy(stub_servers):
+    _, bad_url = stub_servers(error_rate=1.0, error_status=500)
+    _, good_url = stub_servers()
+    pool = stub_pool({"bad": bad_url, "good": good_url})
+
+    served = Counter(pool.call(complete) for _ in range(10))
+    assert served == {"good": 10}
+    assert not pool.deployments[0].healthy
+    assert pool.stats()["bad"]["circuit"] == "open"
+    # Once open, the bad deployment gets no more requests
+    requests = pool.stats()["bad"]["requests"]
+    pool.call(complete)
+    assert pool.stats()["bad"]["requests"] == requests
+
+
+def test_throttling_server_is_failed_over_but_stays_healthy(stub_servers):
+    _, throttled_url = stub_servers(error_rate=1.0, error_status=429, retry_after=0.2)
+    _, good_url = stub_servers()
+    pool = stub_pool({"throttled": throttled_url, "good": good_url})
+
+    served = Counter(pool.call(complete) for _ in range(10))
+    assert served == {"good": 10}
+    assert pool.deployments[0].healthy
+    assert pool.stats()["throttled"]["circuit"] == "closed"
+
+
+def test_single_throttled_deployment_does_not_fail_notes(stub_servers):
+    _, url = stub_servers(error_rate=0.6, error_status=429, retry_after=0.01, seed=1)
+    pool = stub_pool({"only": url})
+
+    async def run():
+        return await asyncio.gather(*(pool.acall(lambda member: asyncio.to_thread(complete, member))
+                                      for _ in range(12)))
+
+    assert asyncio.run(run()) == ["only"] * 12
+    assert pool.stats()["only"]["circuit"] == "closed"
@@ -0,0 +1,20 @@
+"""Tests for the per-node note context settings"""
+
+import pytest
+
+from src.evidence import NOTE_CONTEXT_NODES, get_note_context
+
+
+def test_full_note_by_default(monkeypatch):
+    monkeypatch.delenv("STAGING_NOTE_CONTEXT", raising=False)
+    assert get_note_context() == {node: "full" for node in NOTE_CONTEXT_NODES}
+
+
+def test_evidence_is_opt_in_per_node():
+    context = get_note_context("calculate_stage=evidence")
+    assert context == {"analyze_criteria": "full", "calculate_stage": "evidence", "generate_report": "full"}
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        get_note_context("excerpt")
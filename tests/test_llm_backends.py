@@ -0,0 +1,114 @@
+"""Tests for the offline LLM backends, the stub server and record/replay"""
+
+import json
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.azure_openai_config import configure_azure_openai
+from src.deployment_pool import configure_deployment_pool
+from src.llm_backends import (ExchangeRecorder, LLMConfigurationError, LocalChatModel, ReplayChatModel,
+                              _ToolCallingChatModel, check_backend_config, get_llm_backend, load_recordings)
+from src.rate_limit import is_throttled, retry_after
+from src.schemas import CancerIdentification, StageAssignment
+from src.stub_llm_server import StubResponder, serve_in_thread
+
+RULES = [
+    {"tool": "StageAssignment", "match": "Wilms", "arguments": {"stage": "Stage II", "explanation": "Canned"}},
+    {"match": "report", "content": "Canned report."},
+]
+
+MESSAGES = [SystemMessage(content="You stage pediatric cancers."), HumanMessage(content="Wilms tumor, stage it.")]
+
+
+def request_body(content, tool=None):
+    body = {"model": "gpt", "messages": [{"role": "user", "content": content}]}
+    if tool is not None:
+        body["tools"] = [{"type": "function", "function": {"name": tool, "parameters": {}}}]
+    return body
+
+
+def test_responder_answers_from_canned_rules():
+    responder = StubResponder(RULES)
+    tool_call = responder.completion(request_body("Wilms tumor", "StageAssignment"))["choices"][0]["message"]
+    assert json.loads(tool_call["tool_calls"][0]["function"]["arguments"])["stage"] == "Stage II"
+    text = responder.completion(request_body("write the report"))["choices"][0]["message"]
+    assert text["content"] == "Canned report."
+
+
+def test_responder_synthesizes_schema_valid_arguments():
+    model = LocalChatModel(responder=StubResponder())
+    result = model.with_structured_output(CancerIdentification).invoke(MESSAGES)
+    assert isinstance(result, CancerIdentification)
+
+
+def test_responder_failures_are_throttling_errors():
+    model = LocalChatModel(responder=StubResponder(error_rate=1.0, retry_after=2.0))
+    with pytest.raises(openai.RateLimitError) as error:
+        model.invoke(MESSAGES)
+    assert is_throttled(error.value)
+    assert retry_after(error.value) == 2.0
+
+
+def test_tool_calling_models_must_answer_requests():
+    with pytest.raises(TypeError):
+        type("Incomplete", (_ToolCallingChatModel,), {"_llm_type": "incomplete"})()
+
+
+@pytest.fixture
+def stub_url():
+    server, url = serve_in_thread(StubResponder(RULES))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("path", ["/v1/chat/completions", "/chat/completions",
+                                  "/openai/deployments/gpt/chat/completions?api-version=2024-06-01"])
+def test_stub_server_serves_completions(stub_url, path):
+    response = httpx.post(stub_url + path, json=request_body("write the report"))
+    assert response.status_code == 200
+    assert response.json()["choices"][0]["message"]["content"] == "Canned report."
+
+
+def test_stub_server_rejects_unknown_paths(stub_url):
+    assert httpx.post(stub_url + "/v1/embeddings", json={}).status_code == 404
+
+
+def test_recorded_exchanges_replay(tmp_path):
+    path = str(tmp_path / "exchanges.jsonl")
+    live = LocalChatModel(responder=StubResponder(RULES), callbacks=[ExchangeRecorder(path)])
+    recorded = live.with_structured_output(StageAssignment).invoke(MESSAGES)
+    assert recorded.stage == "Stage II"
+
+    replay = ReplayChatModel(recordings=load_recordings(path))
+    assert replay.with_structured_output(StageAssignment).invoke(MESSAGES) == recorded
+    with pytest.raises(KeyError):
+        replay.invoke([HumanMessage(content="A request that was never recorded")])
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        get_llm_backend("bedrock")
+
+
+def test_missing_backend_settings_raise(monkeypatch, tmp_path):
+    for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY"):
+        monkeypatch.delenv(name, raising=False)
+    with pytest.raises(LLMConfigurationError):
+        check_backend_config("openai")
+
+    monkeypatch.setenv("STAGING_LLM_REPLAY", str(tmp_path / "missing.jsonl"))
+    with pytest.raises(LLMConfigurationError):
+        check_backend_config("replay")
+
+
+def test_missing_azure_settings_raise_instead_of_exiting(monkeypatch):
+    monkeypatch.setenv("STAGING_LLM_BACKEND", "azure")
+    for name in ("AZURE_API_KEY", "AZURE_ENDPOINT", "AZURE_API_VERSION"):
+        monkeypatch.delenv(name, raising=False)
+    configure_deployment_pool(None)
+    with pytest.raises(LLMConfigurationError):
+        configure_azure_openai()
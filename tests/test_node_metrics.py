@@ -0,0 +1,104 @@
+"""Tests for the per-node metrics and their Prometheus rendering"""
+
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+
+from src import node_metrics as metrics_module
+from src.node_metrics import (MetricsRegistry, estimate_cost, merge_node_metrics, node_metrics, record_llm_usage,
+                              record_retry, total_node_metrics)
+
+USAGE = {"input_tokens": 1000, "output_tokens": 100, "input_token_details": {"cache_read": 400}}
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A fresh registry in place of the process-wide one"""
+    registry = MetricsRegistry(buckets=(0.5, 1))
+    monkeypatch.setattr(metrics_module, "_REGISTRY", registry)
+    return registry
+
+
+def test_cost_uses_the_configured_prices(monkeypatch):
+    monkeypatch.setenv("STAGING_TOKEN_PRICES", "1,0.5,2")
+    assert estimate_cost(1000, 400, 100) == pytest.approx((600 * 1 + 400 * 0.5 + 100 * 2) / 1_000_000)
+    monkeypatch.setenv("STAGING_TOKEN_PRICES", "1,2")
+    with pytest.raises(ValueError):
+        estimate_cost(1000, 400, 100)
+
+
+def test_calls_are_recorded_on_the_running_node(registry, monkeypatch):
+    monkeypatch.setenv("STAGING_TOKEN_PRICES", "1,0.5,2")
+    record_llm_usage(USAGE)  # outside any node: ignored
+    with node_metrics("calculate_stage") as metrics:
+        record_llm_usage(USAGE)
+        record_retry()
+    values = metrics.snapshot()
+    assert {field: values[field] for field in ("llm_calls", "input_tokens", "cached_tokens", "output_tokens",
+                                               "retries")} == {"llm_calls": 1, "input_tokens": 1000,
+                                                               "cached_tokens": 400, "output_tokens": 100,
+                                                               "retries": 1}
+    assert values["cost_usd"] == 0.001
+    assert registry.stats()["calculate_stage"]["runs"] == 1
+
+
+def test_threads_with_a_copied_context_record_on_the_node(registry):
+    with node_metrics("identify_cancer_type") as metrics:
+        contexts = [copy_context() for _ in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda context: context.run(record_llm_usage, USAGE), contexts))
+        # A thread started without the context is not attributed to the node
+        thread = threading.Thread(target=record_llm_usage, args=(USAGE,))
+        thread.start()
+        thread.join()
+    assert metrics.snapshot()["llm_calls"] == 4
+    assert metrics.snapshot()["input_tokens"] == 4000
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry(buckets=(0.5, 1))
+    registry.observe("generate_report", {"wall_s": 0.25, "llm_calls": 1, "cost_usd": 0.0005})
+    registry.observe("generate_report", {"wall_s": 0.75, "llm_calls": 2, "retries": 1})
+    lines = registry.render().splitlines()
+    for line in ('staging_node_runs_total{node="generate_report"} 2',
+                 'staging_node_wall_seconds_bucket{node="generate_report",le="0.5"} 1',
+                 'staging_node_wall_seconds_bucket{node="generate_report",le="1"} 2',
+                 'staging_node_wall_seconds_bucket{node="generate_report",le="+Inf"} 2',
+                 'staging_node_wall_seconds_sum{node="generate_report"} 1',
+                 'staging_node_wall_seconds_count{node="generate_report"} 2',
+                 'staging_node_llm_calls_total{node="generate_report"} 3',
+                 'staging_node_retries_total{node="generate_report"} 1',
+                 'staging_node_cost_usd_total{node="generate_report"} 0.0005',
+                 "# TYPE staging_node_wall_seconds histogram"):
+        assert line in lines
+
+
+def test_registry_is_written_and_served(tmp_path):
+    registry = MetricsRegistry()
+    registry.observe("calculate_stage", {"wall_s": 0.1, "llm_calls": 1})
+    path = str(tmp_path / "staging.prom")
+    registry.write(path)
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == registry.render()
+    assert os.listdir(tmp_path) == ["staging.prom"]
+
+    server = registry.serve(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.read().decode("utf-8") == registry.render()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_rerun_node_replaces_its_metrics_in_the_total():
+    merged = merge_node_metrics({"identify": {"llm_calls": 2}, "stage": {"llm_calls": 1}}, {"stage": {"llm_calls": 3}})
+    assert total_node_metrics(merged)["llm_calls"] == 5
@@ -0,0 +1,101 @@
+"""Tests for the rule-based cancer type pre-classifier"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src import preclassifier
+from src.cancer_mapping import CANCER_TYPE_MAPPING
+from src.cancer_resolver import CancerTypeResolver, normalize_label
+from src.knowledge_base import load_staging_data
+from src.preclassifier import (ACRONYM_TOKENS, DEFAULT_PRECLASSIFIER_MODE, CancerPreclassifier, get_preclassifier,
+                               get_preclassifier_mode)
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return CancerPreclassifier(load_staging_data().keys(), CANCER_TYPE_MAPPING)
+
+
+def test_default_mode_is_shadow(monkeypatch):
+    monkeypatch.delenv("STAGING_PRECLASSIFIER", raising=False)
+    assert DEFAULT_PRECLASSIFIER_MODE == "shadow"
+    assert get_preclassifier_mode() == "shadow"
+
+
+def test_shouted_all_is_not_a_diagnosis(classifier):
+    note = ("HISTORY: 3 year old with hepatocellular carcinoma of the right hepatic lobe.\n"
+            "REVIEW OF SYSTEMS: ALL OTHER SYSTEMS NEGATIVE.")
+    result = classifier.classify(note)
+    assert not result["confident"]
+    assert [mention["context"] for mention in result["mentions"]] == ["unconfirmed"]
+
+
+@pytest.mark.parametrize("note", [
+    "Diagnosis: B-ALL, standard risk.",
+    "Dx: ALL",
+    "5 year old boy with ALL presenting for induction.",
+    "Newly diagnosed ALL with CSF WBC 2.",
+])
+def test_acronym_with_diagnosis_cue(classifier, note):
+    result = classifier.classify(note)
+    assert result["confident"]
+    assert result["cancer_type"] == "Acute Lymphoblastic Leukemia"
+
+
+@pytest.mark.parametrize("note", [
+    "Past medical history: neuroblastoma treated at age 2. Now with new thyroid nodule",
+    "She has a history of Wilms tumor, in remission for 5 years. Now presents with a thyroid nodule.",
+    "Hodgkin lymphoma, completed therapy in 2019. Here for a new neck mass.",
+])
+def test_past_history_is_not_the_current_diagnosis(classifier, note):
+    result = classifier.classify(note)
+    assert not result["confident"]
+    assert {mention["context"] for mention in result["mentions"]} == {"history"}
+
+
+def test_history_of_another_cancer_abstains(classifier):
+    result = classifier.classify("Patient with neuroblastoma. Prior history of hepatoblastoma treated in 2015.")
+    assert not result["confident"]
+
+
+@pytest.mark.parametrize("note", [
+    "Biopsy: hepatocellular carcinoma, fibrolamellar variant. Hepatoblastoma component not identified.",
+    "Final pathology: hepatoblastoma with areas of hepatocellular carcinoma.",
+    "Diagnosis: papillary thyroid carcinoma in a survivor of Wilms tumor.",
+])
+def test_unrecognized_diagnosis_abstains(classifier, note):
+    assert not classifier.classify(note)["confident"]
+
+
+def test_clear_diagnosis_is_labeled(classifier):
+    result = classifier.classify("7 yo girl with favorable histology Wilms tumor of the left kidney, no metastases.")
+    assert result["confident"]
+    assert result["cancer_type"] == "Wilms Tumor (Renal Tumors)"
+
+
+def test_negated_unrecognized_diagnosis_does_not_abstain(classifier):
+    result = classifier.classify("Diagnosis: medulloblastoma. No evidence of germinoma or pineoblastoma.")
+    assert result["confident"]
+    assert result["cancer_type"] == "Medulloblastoma (CNS Embryonal Tumors)"
+
+
+def _as_written(alias):
+    """Write an alias the way a note would, with acronyms ("ALL") in capitals"""
+    return alias.upper() if ACRONYM_TOKENS.intersection(normalize_label(alias).split()) else alias
+
+
+@pytest.mark.parametrize("alias", sorted(CANCER_TYPE_MAPPING))
+def test_every_alias_is_labeled_with_its_own_type(classifier, alias):
+    resolver = CancerTypeResolver(load_staging_data().keys(), CANCER_TYPE_MAPPING)
+    result = classifier.classify(f"Diagnosis: {_as_written(alias)}.")
+    assert result["cancer_type"] == resolver.resolve(alias)
+    assert result["confident"] == (resolver.resolve(alias) is not None)
+
+
+def test_shared_classifier_is_compiled_once(monkeypatch):
+    monkeypatch.setattr(preclassifier, "_DEFAULT_PRECLASSIFIER", {})
+    types = list(load_staging_data().keys())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        classifiers = list(executor.map(lambda _: get_preclassifier(types), range(8)))
+    assert all(shared is classifiers[0] for shared in classifiers)
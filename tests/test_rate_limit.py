@@ -0,0 +1,174 @@
+"""Tests for the circuit breaker and retry scheduler"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.rate_limit import (CircuitBreaker, CircuitOpenError, RateLimiter, RetryPolicy, RetryScheduler,
+                            count_queued_failure)
+
+
+class Response:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class APIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = Response(status_code, {"retry-after-ms": str(retry_after * 1000)} if retry_after else {})
+
+
+def fail(status_code):
+    def call():
+        raise APIError(status_code)
+    return call
+
+
+def throttled(times, retry_after=0.01):
+    """A call that is throttled the given number of times, then succeeds"""
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) <= times:
+            raise APIError(429, retry_after)
+        return "ok"
+    return call
+
+
+def default_scheduler():
+    """A scheduler with the default retry budget and breaker threshold, without backoff"""
+    return RetryScheduler(RateLimiter(), CircuitBreaker(name="test"), RetryPolicy(base_delay=0.0))
+
+
+def open_scheduler():
+    """A scheduler whose circuit has just opened and is due for a probe"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0, name="test")
+    scheduler = RetryScheduler(RateLimiter(), breaker, RetryPolicy(max_attempts=1, base_delay=0.0))
+    with pytest.raises(APIError):
+        scheduler.call(fail(503))
+    assert breaker.state == "half_open"
+    return scheduler
+
+
+def test_non_retryable_probe_closes_the_circuit():
+    scheduler = open_scheduler()
+    with pytest.raises(APIError):
+        scheduler.call(fail(400))
+    assert scheduler.breaker.state == "closed"
+    assert scheduler.call(lambda: "ok") == "ok"
+
+
+def test_failed_probe_reopens_the_circuit():
+    scheduler = open_scheduler()
+    with pytest.raises(APIError):
+        scheduler.call(fail(503))
+    scheduler.breaker.reset_timeout = 60.0
+    assert scheduler.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        scheduler.breaker.before_call()
+
+
+def test_throttled_probe_is_released():
+    scheduler = open_scheduler()
+    with pytest.raises(APIError):
+        scheduler.call(fail(429))
+    assert scheduler.breaker.state == "half_open"
+    assert scheduler.call(lambda: "ok") == "ok"
+    assert scheduler.breaker.state == "closed"
+
+
+def test_interrupted_probe_is_released():
+    scheduler = open_scheduler()
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call(interrupted)
+    assert scheduler.call(lambda: "ok") == "ok"
+    assert scheduler.breaker.state == "closed"
+
+
+def test_cancelled_async_probe_is_released():
+    scheduler = open_scheduler()
+
+    async def cancelled():
+        raise asyncio.CancelledError
+
+    async def succeed():
+        return "ok"
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(scheduler.acall(cancelled))
+    assert asyncio.run(scheduler.acall(succeed)) == "ok"
+    assert scheduler.breaker.state == "closed"
+
+
+def test_stale_probe_release_does_not_clear_a_new_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    first = breaker.before_call()
+    breaker.record_failure()
+    second = breaker.before_call()
+    breaker.release_probe(first)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.release_probe(second)
+    assert breaker.before_call() is not None
+
+
+def test_throttling_does_not_open_the_circuit():
+    scheduler = default_scheduler()
+    assert scheduler.call(throttled(8)) == "ok"
+    assert scheduler.breaker.state == "closed"
+
+
+def test_throttled_budget_is_separate_from_the_attempts():
+    scheduler = RetryScheduler(RateLimiter(), CircuitBreaker(name="test"),
+                               RetryPolicy(max_attempts=2, base_delay=0.0, max_throttled_attempts=3))
+    assert scheduler.call(throttled(2)) == "ok"
+    with pytest.raises(APIError):
+        scheduler.call(throttled(3))
+
+
+def test_one_throttled_note_does_not_fail_the_others():
+    scheduler = default_scheduler()
+    results = {}
+
+    def run(name, func):
+        try:
+            results[name] = scheduler.call(func)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=run, args=("throttled", throttled(8)))]
+    threads += [threading.Thread(target=run, args=(f"note{index}", lambda: "ok")) for index in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {name: "ok" for name in results} and len(results) == 6
+
+
+def test_calls_queue_while_the_circuit_is_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2, name="test")
+    scheduler = RetryScheduler(RateLimiter(), breaker, RetryPolicy(max_attempts=1, base_delay=0.0))
+    with pytest.raises(APIError):
+        scheduler.call(fail(503))
+    started = time.monotonic()
+    assert scheduler.call(lambda: "ok") == "ok"
+    assert time.monotonic() - started >= 0.15
+    assert breaker.state == "closed"
+
+
+def test_queued_call_gives_up_when_probes_keep_failing():
+    assert count_queued_failure("test", False, 0, max_attempts=2) == 0
+    assert count_queued_failure("test", True, 0, max_attempts=2) == 1
+    with pytest.raises(CircuitOpenError):
+        count_queued_failure("test", True, 1, max_attempts=2)
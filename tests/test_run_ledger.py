@@ -0,0 +1,51 @@
+"""Tests for the run ledger of resumable batches"""
+
+import pytest
+
+from src.run_ledger import RunLedger, hash_note
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "run.db")
+
+
+def test_notes_are_identified_by_content():
+    assert hash_note("Wilms tumor.") == hash_note("Wilms tumor.")
+    assert hash_note("Wilms tumor.") != hash_note("Wilms tumor")
+
+
+def test_failed_note_is_retried_with_a_new_attempt(ledger_path):
+    ledger = RunLedger(ledger_path)
+    note_hash = hash_note("Diagnosis: neuroblastoma.")
+    assert ledger.get(note_hash) is None
+
+    ledger.mark_started(note_hash, "a.txt")
+    ledger.mark_failed(note_hash, "HTTP 500")
+    assert ledger.get(note_hash) == {"note_id": "a.txt", "status": "failed", "attempts": 1, "error": "HTTP 500",
+                                     "result": None}
+    assert not ledger.is_done(note_hash)
+
+    ledger.mark_started(note_hash, "renamed/a.txt")
+    assert ledger.get(note_hash)["attempts"] == 2
+    assert ledger.get(note_hash)["error"] is None
+    ledger.mark_done(note_hash, {"Medical Note": "renamed/a.txt", "Calculated Stage": "L1"})
+    assert ledger.is_done(note_hash)
+    ledger.close()
+
+
+def test_restarted_run_skips_finished_notes(ledger_path):
+    notes = {"a.txt": "Diagnosis: Wilms tumor.", "b.txt": "Diagnosis: hepatoblastoma.", "c.txt": "Diagnosis: ALL."}
+    ledger = RunLedger(ledger_path)
+    for note_id in ("a.txt", "b.txt", "c.txt"):
+        ledger.mark_started(hash_note(notes[note_id]), note_id)
+    ledger.mark_done(hash_note(notes["a.txt"]), {"Medical Note": "a.txt"})
+    ledger.mark_failed(hash_note(notes["b.txt"]), "timeout")
+    # c.txt was in flight when the run was killed
+    ledger.close()
+
+    ledger = RunLedger(ledger_path)
+    assert ledger.summary() == {"done": 1, "failed": 1, "running": 1}
+    assert [note_id for note_id, text in notes.items() if not ledger.is_done(hash_note(text))] == ["b.txt", "c.txt"]
+    assert list(ledger.iter_results()) == [{"Medical Note": "a.txt"}]
+    ledger.close()
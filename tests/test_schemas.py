@@ -0,0 +1,53 @@
+"""Tests for merging the identifications made on the chunks of a long note"""
+
+from src.schemas import CancerIdentification, merge_identifications, select_identifications
+
+COVERED = {"wilms tumor": "Wilms Tumor (Renal Tumors)", "neuroblastoma": "Neuroblastoma"}
+
+
+def resolve(label):
+    return COVERED.get(label.casefold()) if label else None
+
+
+def identification(cancer_type=None, covered=True, metastasis_sites="None identified", **fields):
+    return CancerIdentification(cancer_type=cancer_type, standardized_category=resolve(cancer_type),
+                                is_covered_by_toronto=covered and resolve(cancer_type) is not None,
+                                metastasis_sites=metastasis_sites, **fields)
+
+
+def test_majority_uncovered_type_beats_covered_passing_mention():
+    chunks = [
+        identification("Hepatocellular carcinoma", covered=False, metastasis_sites="lung"),
+        identification("Wilms tumor", metastasis_sites="liver"),
+        identification("Hepatocellular carcinoma", covered=False, metastasis_sites="bone"),
+    ]
+    assert select_identifications(chunks, resolve) == [0, 2]
+    merged = merge_identifications(chunks, resolve)
+    assert merged.cancer_type == "Hepatocellular carcinoma"
+    assert not merged.is_covered_by_toronto
+    assert merged.metastasis_sites == "lung, bone"
+
+
+def test_tie_goes_to_covered_type():
+    chunks = [identification("Hepatocellular carcinoma", covered=False), identification("Neuroblastoma")]
+    assert merge_identifications(chunks, resolve).standardized_category == "Neuroblastoma"
+
+
+def test_sites_only_from_chunks_about_the_diagnosis():
+    chunks = [
+        identification("Wilms tumor", primary_site="Left kidney", metastasis_sites="lung"),
+        identification(),
+        identification("Neuroblastoma", metastasis_sites="bone marrow"),
+        identification("Wilms tumor", metastasis_sites="Lung, liver", extracted_stage="Stage IV"),
+    ]
+    merged = merge_identifications(chunks, resolve)
+    assert merged.standardized_category == "Wilms Tumor (Renal Tumors)"
+    assert merged.primary_site == "Left kidney"
+    assert merged.metastasis_sites == "lung, liver"
+    assert merged.extracted_stage == "Stage IV"
+
+
+def test_no_diagnosis_in_any_chunk():
+    chunks = [identification(), identification()]
+    assert select_identifications(chunks, resolve) == []
+    assert merge_identifications(chunks, resolve) is chunks[0]
@@ -0,0 +1,134 @@
+"""Tests for tracing spans, the OTLP/HTTP exporter and the stand-in collector"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+
+from src.tracing import (NOOP_SPAN, OtlpHttpSpanExporter, configure_tracing, current_span, format_trace,
+                         from_otlp_span, load_spans, make_collector, span, to_otlp_span)
+
+
+class ListExporter:
+    """Keeps the finished spans as flat records"""
+
+    def __init__(self):
+        self.records = []
+
+    def export(self, finished):
+        self.records.append(finished.to_dict())
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    """Trace into a list of span records"""
+    monkeypatch.delenv("STAGING_TRACE_FILE", raising=False)
+    monkeypatch.delenv("STAGING_TRACE_OTLP_ENDPOINT", raising=False)
+    exporter = ListExporter()
+    configure_tracing([exporter])
+    yield exporter.records
+    configure_tracing(None)
+
+
+def by_name(records):
+    return {record["name"]: record for record in records}
+
+
+def test_spans_nest_within_one_trace(exported):
+    with span("note", thread_id="a.txt") as note:
+        with span("identify_cancer", skipped=None):
+            with span("llm.request", prompt_name="identify_cancer_type") as request:
+                assert current_span() is request
+                request.add_to_attributes(input_tokens=100)
+                request.add_to_attributes(input_tokens=50)
+        with pytest.raises(ValueError):
+            with span("calculate_stage"):
+                raise ValueError("no stage")
+        assert current_span() is note
+    assert current_span() is NOOP_SPAN
+
+    spans = by_name(exported)
+    assert [record["name"] for record in exported] == ["llm.request", "identify_cancer", "calculate_stage", "note"]
+    assert {record["trace_id"] for record in exported} == {spans["note"]["trace_id"]}
+    assert spans["note"]["parent_span_id"] is None
+    assert spans["identify_cancer"]["parent_span_id"] == spans["note"]["span_id"]
+    assert spans["llm.request"]["parent_span_id"] == spans["identify_cancer"]["span_id"]
+    assert spans["calculate_stage"]["parent_span_id"] == spans["note"]["span_id"]
+    assert spans["identify_cancer"]["attributes"] == {}
+    assert spans["llm.request"]["attributes"]["input_tokens"] == 150
+    assert spans["calculate_stage"]["status"] == "error"
+    assert spans["calculate_stage"]["error"] == "ValueError: no stage"
+
+
+def test_threads_with_a_copied_context_nest_under_the_node(exported):
+    def request(index):
+        with span("llm.request", chunk=index):
+            pass
+
+    with span("note"):
+        with span("identify_cancer") as node:
+            contexts = [copy_context() for _ in range(3)]
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                list(executor.map(lambda pair: pair[0].run(request, pair[1]), zip(contexts, range(3))))
+    requests = [record for record in exported if record["name"] == "llm.request"]
+    assert sorted(record["attributes"]["chunk"] for record in requests) == [0, 1, 2]
+    assert {record["parent_span_id"] for record in requests} == {node.span_id}
+
+    # Each note started outside a span gets a trace of its own
+    with span("note"):
+        pass
+    assert len({record["trace_id"] for record in exported if record["name"] == "note"}) == 2
+
+
+def test_tracing_off_hands_out_the_noop_span(monkeypatch):
+    monkeypatch.delenv("STAGING_TRACE_FILE", raising=False)
+    monkeypatch.delenv("STAGING_TRACE_OTLP_ENDPOINT", raising=False)
+    configure_tracing([])
+    try:
+        with span("note", thread_id="a.txt") as note:
+            assert note is NOOP_SPAN
+            assert current_span() is NOOP_SPAN
+    finally:
+        configure_tracing(None)
+
+
+def test_otlp_encoding_round_trips(exported):
+    with span("note", cancer_type="Wilms Tumor", covered=True, chunks=3, cost_usd=0.0012):
+        with pytest.raises(RuntimeError):
+            with span("llm.attempt", attempt=2):
+                raise RuntimeError("HTTP 503")
+    for record in exported:
+        assert from_otlp_span(to_otlp_span(record)) == record
+
+
+def test_spans_reach_the_collector_over_otlp_http(tmp_path, monkeypatch):
+    monkeypatch.delenv("STAGING_TRACE_FILE", raising=False)
+    monkeypatch.delenv("STAGING_TRACE_OTLP_ENDPOINT", raising=False)
+    output = str(tmp_path / "spans.jsonl")
+    collector = make_collector(output, port=0)
+    threading.Thread(target=collector.serve_forever, daemon=True).start()
+    local = ListExporter()
+    try:
+        endpoint = f"http://127.0.0.1:{collector.server_address[1]}"
+        configure_tracing([local, OtlpHttpSpanExporter(endpoint, batch_size=2)])
+        with span("note", thread_id="a.txt"):
+            with span("calculate_stage", llm_calls=1):
+                pass
+            with span("generate_report"):
+                pass
+        # The last span is still buffered until the exporter is flushed
+        assert sum(len(records) for records in load_spans(output).values()) == 2
+        configure_tracing(None)
+    finally:
+        collector.shutdown()
+        collector.server_close()
+
+    (trace,) = load_spans(output).values()
+    assert sorted(trace, key=lambda record: record["name"]) == sorted(local.records, key=lambda record: record["name"])
+    lines = format_trace(trace).splitlines()
+    assert [line.split()[0] for line in lines] == ["note", "calculate_stage", "generate_report"]
+    assert lines[1].startswith("  calculate_stage") and "(llm_calls=1)" in lines[1]